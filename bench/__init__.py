@@ -0,0 +1,3 @@
+""" Benchmarks
+    * 基准测试结果输出为JSON，用于跨版本对比性能回退
+"""
@@ -0,0 +1,149 @@
+""" Model memory / throughput benchmark
+    * 对比__slots__版本的Order/Trade/OrderLevel/Ticker与等价的__dict__版本
+    * __dict__版本由同一个类的方法生成，只去掉__slots__，保证行为一致
+    * 统计每个实例的内存(tracemalloc)、构造、属性读写和to_dict的ops/sec
+    * 结果输出为JSON，用于跨版本对比
+
+    python -m bench.model_bench --output bench_model.json
+    python -m bench.model_bench --count 20000
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, List
+
+from src.engine.types.types import Order, Trade, OrderLevel, Ticker, OrderSide, OrderType, OrderTimeInForce
+
+
+def without_slots(cls):
+    """ 与cls相同的方法，但实例使用__dict__ """
+    namespace = {k: v for k, v in cls.__dict__.items() if k not in cls.__slots__ and k not in ('__slots__', '__dict__', '__weakref__')}
+    return type(f"Dict{cls.__name__}", (), namespace)
+
+
+def _order_args(i: int):
+    return ('10000001', '90000001', OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 1_000 + i, 500_000 + i)
+
+
+def _trade_args(i: int):
+    return (str(i), '10000001', '10000002', '90000001', 500_000 + i, 1_000, 'b', 's', True)
+
+
+def _touch_order(order):
+    # 与撮合路径类似：读取剩余数量，更新成交数量
+    order.filled_quantity = order.quantity - order.filled_quantity - 1
+    return order.price
+
+
+def _touch_trade(trade):
+    return trade.price * trade.quantity
+
+
+def _touch_level(level):
+    level.quantity += 1
+    return level.price
+
+
+MODELS = {
+    # name -> (类, 构造参数, 属性读写)
+    'Order': (Order, _order_args, _touch_order),
+    'Trade': (Trade, _trade_args, _touch_trade),
+    'OrderLevel': (OrderLevel, lambda i: (500_000 + i, 1_000), _touch_level),
+    'Ticker': (Ticker, lambda i: ('90000001', 500_000 + i, 1_000), _touch_level),
+}
+
+
+def timed(func: Callable, items: List, repeat: int = 3) -> float:
+    """ 返回ops/sec，取repeat次中最快的一次 """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter_ns()
+            for item in items:
+                func(item)
+            elapsed = time.perf_counter_ns() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return len(items) / (best / 1e9) if best else 0
+
+
+def measure(cls, make_args: Callable, touch: Callable, count: int) -> dict:
+    args = [make_args(i) for i in range(count)]
+
+    gc.collect()
+    tracemalloc.start()
+    instances = [cls(*a) for a in args]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # 减去保存实例的list本身
+    bytes_per_instance = (current - sys.getsizeof(instances)) / count
+
+    return {
+        'bytes_per_instance': bytes_per_instance,
+        'construct_per_sec': timed(lambda a: cls(*a), args),
+        'access_per_sec': timed(touch, instances),
+        'to_dict_per_sec': timed(cls.to_dict, instances),
+    }
+
+
+def run(models: List[str], count: int = 100_000) -> dict:
+    results = []
+    for name in models:
+        cls, make_args, touch = MODELS[name]
+        slots = measure(cls, make_args, touch, count)
+        dicts = measure(without_slots(cls), make_args, touch, count)
+        results.append({
+            'model': name,
+            'count': count,
+            'slots': slots,
+            'dict': dicts,
+            'memory_ratio': slots['bytes_per_instance'] / dicts['bytes_per_instance'],
+            'access_speedup': slots['access_per_sec'] / dicts['access_per_sec'],
+        })
+    return {
+        'benchmark': 'model',
+        'timestamp': int(time.time() * 1000),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def format_table(report: dict) -> str:
+    lines = [f"{'model':<11} {'slots B/obj':>12} {'dict B/obj':>11} {'mem ratio':>10} {'construct x':>12} {'access x':>9}"]
+    for r in report['results']:
+        slots, dicts = r['slots'], r['dict']
+        lines.append(
+            f"{r['model']:<11} {slots['bytes_per_instance']:>12,.0f} {dicts['bytes_per_instance']:>11,.0f} "
+            f"{r['memory_ratio']:>10.2f} {slots['construct_per_sec'] / dicts['construct_per_sec']:>12.2f} "
+            f"{r['access_speedup']:>9.2f}"
+        )
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Model memory / throughput benchmark')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--count', type=int, default=100_000, help='number of instances of each model')
+    parser.add_argument('--output', help='write JSON result to this file, default stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args.models, args.count)
+    print(format_table(report), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
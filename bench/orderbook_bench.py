@@ -0,0 +1,256 @@
+""" Order book microbenchmark
+    * 对所有order book backend回放相同的合成负载，订单在计时前生成
+    * 统计ops/sec、单次操作p50/p99延迟(us)和峰值内存(tracemalloc)
+    * 峰值内存从构造order book开始统计(包括预分配的内存和setup挂好的订单)，计时操作期间的内存增长单独输出
+    * 峰值内存单独跑一遍，避免tracemalloc影响计时
+    * 结果输出为JSON，用于跨版本对比
+
+    python -m bench.orderbook_bench --output bench_orderbook.json
+    python -m bench.orderbook_bench --backends sll ladder --workloads mm_churn --scale 0.1
+"""
+import argparse
+import gc
+import importlib
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from src.engine.orderbook.registry import ORDER_BOOK_BACKENDS
+from src.engine.types.types import Order, OrderSide, OrderType, OrderTimeInForce
+
+SYMBOL = 'BTCUSDT'
+MID_PRICE = 1_000_000
+
+# 基准测试的backend，包括未注册的rsl_orderbook
+BENCH_BACKENDS = dict(ORDER_BOOK_BACKENDS, rsl='src.engine.orderbook.rsl_orderbook')
+
+
+def make_order(rng: random.Random, side: str, price: int, uid: str = 'bench') -> Order:
+    return Order(uid, SYMBOL, side, OrderType.LIMIT, OrderTimeInForce.GTC, rng.randint(1, 1_000), price)
+
+
+# ============================================================
+# Workloads
+# 每个负载返回 (setup, ops)，setup在计时前执行，ops为待计时的操作列表
+# ============================================================
+
+def mm_churn(rng: random.Random, n: int):
+    """ 做市商报价/撤单：在中间价附近挂单，超过报价数量后撤掉最早的报价 """
+    quotes = 50
+    orders = []
+    for i in range(n):
+        side = OrderSide.BUY if i % 2 == 0 else OrderSide.SELL
+        offset = rng.randint(1, 20)
+        price = MID_PRICE - offset if side == OrderSide.BUY else MID_PRICE + offset
+        orders.append(make_order(rng, side, price))
+
+    def build(book):
+        live = []
+        ops = []
+        for order in orders:
+            ops.append(lambda o=order: book.add_order(o))
+            live.append(order.order_id)
+            if len(live) > quotes:
+                ops.append(lambda oid=live.pop(0): book.remove_order(oid))
+        return ops
+    return None, build
+
+
+def deep_book(rng: random.Random, n: int):
+    """ 深度被动挂单：在很宽的价格区间挂单，然后反复读取深度 """
+    orders = []
+    for i in range(n):
+        side = OrderSide.BUY if i % 2 == 0 else OrderSide.SELL
+        offset = rng.randint(1, 2_000)
+        price = MID_PRICE - offset if side == OrderSide.BUY else MID_PRICE + offset
+        orders.append(make_order(rng, side, price))
+
+    def build(book):
+        ops = [lambda o=order: book.add_order(o) for order in orders]
+        ops.extend(lambda: book.get_order_book(30) for _ in range(max(1, n // 10)))
+        return ops
+    return None, build
+
+
+def sweep(rng: random.Random, n: int):
+    """ 吃单为主：预先挂满卖单，taker按最优价逐笔成交，与matching的maker成交路径相同 """
+    makers = [make_order(rng, OrderSide.SELL, MID_PRICE + rng.randint(0, 500)) for _ in range(n)]
+    takers = [rng.randint(500, 5_000) for _ in range(max(1, n // 5))]
+
+    def setup(book):
+        for order in makers:
+            book.add_order(order)
+
+    def take(book, quantity):
+        while quantity > 0:
+            best = book.get_best_ask()
+            if not best:
+                return
+            match_quantity = min(quantity, best.quantity - best.filled_quantity)
+            book.update_order(best.order_id, best.filled_quantity + match_quantity)
+            quantity -= match_quantity
+
+    def build(book):
+        return [lambda q=q: take(book, q) for q in takers]
+    return setup, build
+
+
+def batch_insert(rng: random.Random, n: int):
+    """ 批量挂单：按100个一批调用batch_add_orders """
+    batch_size = 100
+    batches = []
+    for i in range(0, n, batch_size):
+        side = OrderSide.BUY if (i // batch_size) % 2 == 0 else OrderSide.SELL
+        sign = -1 if side == OrderSide.BUY else 1
+        orders = [make_order(rng, side, MID_PRICE + sign * rng.randint(1, 500)) for _ in range(batch_size)]
+        # batch_add_orders要求订单已按价格优先排序
+        orders.sort(key=lambda o: o.price, reverse=side == OrderSide.BUY)
+        batches.append((side, orders))
+
+    def build(book):
+        return [lambda s=side, b=orders: book.batch_add_orders(s, b) for side, orders in batches]
+    return None, build
+
+
+WORKLOADS: Dict[str, Tuple[Callable, int]] = {
+    # name -> (负载, 默认订单数)
+    'mm_churn': (mm_churn, 20_000),
+    'deep_book': (deep_book, 10_000),
+    'sweep': (sweep, 10_000),
+    'batch_insert': (batch_insert, 10_000),
+}
+
+
+# ============================================================
+# Runner
+# ============================================================
+
+def percentile(sorted_values: List[int], p: float) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def load_backend(name: str):
+    return importlib.import_module(BENCH_BACKENDS[name]).OrderBook
+
+
+def run_once(backend_cls, workload: Callable, n: int, seed: int, measure_memory: bool) -> dict:
+    rng = random.Random(seed)
+    setup, build = workload(rng, n)
+    if measure_memory:
+        # 订单已经生成，从构造order book开始统计，包括预分配的内存和setup挂好的订单
+        tracemalloc.start()
+    try:
+        book = backend_cls(SYMBOL)
+        if setup:
+            setup(book)
+        ops = build(book)
+
+        gc.collect()
+        gc.disable()
+        try:
+            if measure_memory:
+                before, build_peak = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                for op in ops:
+                    op()
+                _, ops_peak = tracemalloc.get_traced_memory()
+                return {'peak_memory_bytes': max(build_peak, ops_peak), 'ops_peak_memory_bytes': ops_peak - before}
+
+            latencies = [0] * len(ops)
+            clock = time.perf_counter_ns
+            start = clock()
+            for i, op in enumerate(ops):
+                t0 = clock()
+                op()
+                latencies[i] = clock() - t0
+            elapsed = clock() - start
+        finally:
+            gc.enable()
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'ops': len(ops),
+        'elapsed_ms': elapsed / 1e6,
+        'ops_per_sec': len(ops) / (elapsed / 1e9) if elapsed else 0,
+        'p50_us': percentile(latencies, 0.50) / 1e3,
+        'p99_us': percentile(latencies, 0.99) / 1e3,
+        'max_us': latencies[-1] / 1e3 if latencies else 0,
+    }
+
+
+def run(backends: List[str], workloads: List[str], scale: float = 1.0, seed: int = 42) -> dict:
+    results = []
+    for backend in backends:
+        try:
+            backend_cls = load_backend(backend)
+        except Exception as e:
+            # backend无法加载（如rsl_orderbook尚未完成），记录原因后跳过
+            for workload in workloads:
+                results.append({'backend': backend, 'workload': workload, 'error': f"{type(e).__name__}: {e}"})
+            continue
+
+        for workload in workloads:
+            func, default_n = WORKLOADS[workload]
+            n = max(100, int(default_n * scale))
+            result = {'backend': backend, 'workload': workload, 'orders': n}
+            try:
+                result.update(run_once(backend_cls, func, n, seed, measure_memory=False))
+                result.update(run_once(backend_cls, func, n, seed, measure_memory=True))
+            except Exception as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+            results.append(result)
+
+    return {
+        'benchmark': 'orderbook',
+        'timestamp': int(time.time() * 1000),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'seed': seed,
+        'scale': scale,
+        'results': results,
+    }
+
+
+def format_table(report: dict) -> str:
+    lines = [f"{'backend':<8} {'workload':<13} {'ops/sec':>12} {'p50(us)':>9} {'p99(us)':>9} {'peak mem':>12} {'ops mem':>10}"]
+    for r in report['results']:
+        if 'error' in r:
+            lines.append(f"{r['backend']:<8} {r['workload']:<13} error: {r['error']}")
+            continue
+        lines.append(
+            f"{r['backend']:<8} {r['workload']:<13} {r['ops_per_sec']:>12,.0f} {r['p50_us']:>9.2f} "
+            f"{r['p99_us']:>9.2f} {r['peak_memory_bytes']:>12,} {r['ops_peak_memory_bytes']:>10,}"
+        )
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Order book microbenchmark')
+    parser.add_argument('--backends', nargs='+', default=sorted(BENCH_BACKENDS), choices=sorted(BENCH_BACKENDS))
+    parser.add_argument('--workloads', nargs='+', default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument('--scale', type=float, default=1.0, help='scale factor of the number of orders')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write JSON result to this file, default stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args.backends, args.workloads, args.scale, args.seed)
+    print(format_table(report), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+""" End-to-end order pipeline benchmark
+    * 进程内压测 Funding.put_spot_order -> FUNDING_MATCH_MQ -> MatchingEngine.run_forever
+      -> MATCH_FUNDING_MQ -> Funding.run_forever
+    * 每个订单记录三个时间点：提交、撮合完成、资金结算完成
+    * 输出提交到撮合、提交到结算的延迟分布(p50/p90/p99/p999/max，对数直方图)和持续吞吐
+    * 结果输出为JSON，用于验证每次链路改动
+
+    python -m bench.pipeline_bench --orders 2000 --output bench_pipeline.json
+    python -m bench.pipeline_bench --orders 5000 --rate 10000
+    python -m bench.pipeline_bench --orders 5000 --transport binary
+    python -m bench.pipeline_bench --orders 5000 --journal /tmp/bench.journal
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from typing import Dict, List
+
+from src.common.config.metadata import price_to_ticks, qty_to_lots
+from src.common.mmq import FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, MMQTopic, DEFAULT_TRANSPORT
+from src.common.mmq.journal import Journal
+from src.engine.funding.funding import Funding
+from src.engine.matching.matching import MatchingEngine
+from src.engine.recovery.recovery import attach_journal
+from src.engine.types.codec import CODECS
+from src.engine.types.account_types import UniMarginAccount
+from src.engine.types.types import Order, OrderSide, OrderType, OrderTimeInForce
+
+SYMBOL = '90000001'
+MAKER_UID = 'bench_maker'
+TAKER_UID = 'bench_taker'
+MID_PRICE = 50_000.0
+
+
+class PipelineRecorder:
+    """ order_id -> 各阶段时间(ns) """
+    def __init__(self):
+        self.submitted: Dict[str, int] = {}
+        self.matched: Dict[str, int] = {}
+        self.settled: Dict[str, int] = {}
+
+
+class InstrumentedMatchingEngine(MatchingEngine):
+    """ 撮合完成时记录时间 """
+    def __init__(self, recorder: PipelineRecorder):
+        super().__init__()
+        self.recorder = recorder
+
+    def on_order(self, order: Order):
+        super().on_order(order)
+        self.recorder.matched[order.order_id] = time.perf_counter_ns()
+
+    def on_orders(self, orders: List[Order]):
+        super().on_orders(orders)
+        now = time.perf_counter_ns()
+        for order in orders:
+            self.recorder.matched[order.order_id] = now
+
+
+class InstrumentedFunding(Funding):
+    """ 资金结算完成时记录时间，on_spot_order在同一条消息的成交结算之后调用 """
+    def __init__(self, accounts: List[UniMarginAccount], recorder: PipelineRecorder):
+        super().__init__(accounts)
+        self.recorder = recorder
+
+    def on_spot_order(self, order: Order):
+        super().on_spot_order(order)
+        self.recorder.settled[order.order_id] = time.perf_counter_ns()
+
+    def on_spot_orders(self, orders: List[Order]):
+        super().on_spot_orders(orders)
+        now = time.perf_counter_ns()
+        for order in orders:
+            self.recorder.settled[order.order_id] = now
+
+
+def latency_summary(latencies_ns: List[int]) -> dict:
+    """ 延迟分布，单位us，直方图按2的幂分桶 """
+    if not latencies_ns:
+        return {'count': 0}
+    values = sorted(latencies_ns)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(len(values) * p))] / 1e3
+
+    histogram = {}
+    for v in values:
+        bucket = 1 << max(0, int(v / 1e3)).bit_length()
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+    return {
+        'count': len(values),
+        'mean_us': sum(values) / len(values) / 1e3,
+        'p50_us': pct(0.50),
+        'p90_us': pct(0.90),
+        'p99_us': pct(0.99),
+        'p999_us': pct(0.999),
+        'max_us': values[-1] / 1e3,
+        # 桶上界(us) -> 订单数
+        'histogram_us': {str(k): histogram[k] for k in sorted(histogram)},
+    }
+
+
+def make_params(rng: random.Random, n: int) -> List[dict]:
+    """ taker订单在中间价附近随机买卖，约一半订单可以立即成交 """
+    params = []
+    for i in range(n):
+        side = OrderSide.BUY if i % 2 == 0 else OrderSide.SELL
+        offset = rng.randint(-10, 10) * 0.5
+        params.append({
+            'side': side,
+            'price': price_to_ticks(SYMBOL, MID_PRICE + offset if side == OrderSide.BUY else MID_PRICE - offset),
+            'quantity': qty_to_lots(SYMBOL, rng.randint(1, 100) / 1_000),
+        })
+    return params
+
+
+def maker_quotes(levels: int) -> List[dict]:
+    """ 做市商初始挂单，每侧levels档 """
+    quotes = []
+    for i in range(1, levels + 1):
+        for side, sign in [(OrderSide.BUY, -1), (OrderSide.SELL, 1)]:
+            quotes.append({
+                'symbol': SYMBOL,
+                'side': side,
+                'type': OrderType.LIMIT,
+                'time_in_force': OrderTimeInForce.GTC,
+                'price': price_to_ticks(SYMBOL, MID_PRICE + sign * (5 + i * 0.5)),
+                'quantity': qty_to_lots(SYMBOL, 1.0),
+            })
+    return quotes
+
+
+async def run_pipeline(orders: int, rate: float, maker_levels: int, seed: int, timeout: float) -> dict:
+    recorder = PipelineRecorder()
+    engine = InstrumentedMatchingEngine(recorder)
+    funding = InstrumentedFunding([
+        UniMarginAccount(MAKER_UID, is_inner_maker=True),
+        UniMarginAccount(TAKER_UID),
+    ], recorder)
+
+    tasks = [
+        asyncio.create_task(engine.run_forever([MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL])),
+        asyncio.create_task(funding.run_forever([MMQTopic.SPOT_MATCH_OUT])),
+    ]
+
+    rng = random.Random(seed)
+    params = make_params(rng, orders)
+    rejected = 0
+    try:
+        funding.put_spot_orders(MAKER_UID, maker_quotes(maker_levels))
+
+        interval = 1 / rate if rate else 0
+        start = time.perf_counter()
+        for i, param in enumerate(params):
+            if interval:
+                # 按目标速率提交，落后时不等待
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 100 == 0:
+                await asyncio.sleep(0)
+
+            submit = time.perf_counter_ns()
+            result, order = funding.put_spot_order(
+                TAKER_UID, SYMBOL, param['side'], OrderType.LIMIT, OrderTimeInForce.GTC,
+                param['quantity'], param['price'])
+            if result:
+                recorder.submitted[order.order_id] = submit
+            else:
+                rejected += 1
+
+        # 等待所有订单结算完成
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline and not recorder.submitted.keys() <= recorder.settled.keys():
+            await asyncio.sleep(0.001)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    submitted = recorder.submitted
+    settled_ids = [oid for oid in submitted if oid in recorder.settled]
+    first_submit = min(submitted.values()) if submitted else 0
+    last_settled = max((recorder.settled[oid] for oid in settled_ids), default=first_submit)
+    elapsed = (last_settled - first_submit) / 1e9
+    return {
+        'submitted': len(submitted),
+        'rejected': rejected,
+        'settled': len(settled_ids),
+        'elapsed_sec': elapsed,
+        'throughput_orders_per_sec': len(settled_ids) / elapsed if elapsed > 0 else 0,
+        'submit_to_matched': latency_summary([recorder.matched[oid] - submitted[oid] for oid in settled_ids if oid in recorder.matched]),
+        'submit_to_settled': latency_summary([recorder.settled[oid] - submitted[oid] for oid in settled_ids]),
+        # 压测结束时各topic的保留窗口和consumer group的lag/丢失消息数
+        'mq': {'funding_match': FUNDING_MATCH_MQ.metrics(), 'match_funding': MATCH_FUNDING_MQ.metrics()},
+    }
+
+
+def run(orders: int = 2_000, rate: float = 0, maker_levels: int = 20, seed: int = 42, timeout: float = 300,
+        transport: str = DEFAULT_TRANSPORT, journal_path: str = None) -> dict:
+    transports = FUNDING_MATCH_MQ.transport, MATCH_FUNDING_MQ.transport
+    FUNDING_MATCH_MQ.transport = MATCH_FUNDING_MQ.transport = transport
+    journal = None
+    if journal_path:
+        # 每次压测使用新的journal文件
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        journal = Journal(journal_path)
+        attach_journal(journal)
+    try:
+        result = asyncio.run(run_pipeline(orders, rate, maker_levels, seed, timeout))
+    finally:
+        FUNDING_MATCH_MQ.transport, MATCH_FUNDING_MQ.transport = transports
+        if journal:
+            attach_journal(None)
+            journal.close()
+    return {
+        'benchmark': 'pipeline',
+        'timestamp': int(time.time() * 1000),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'seed': seed,
+        'orders': orders,
+        'rate': rate,
+        'transport': transport,
+        'journal': bool(journal_path),
+        **result,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end order pipeline benchmark')
+    parser.add_argument('--orders', type=int, default=2_000)
+    parser.add_argument('--rate', type=float, default=0, help='target submit rate (orders/sec), 0 means as fast as possible')
+    parser.add_argument('--maker-levels', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--transport', default=DEFAULT_TRANSPORT, choices=sorted(CODECS), help='MMQ transport')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for settlement after the last submit')
+    parser.add_argument('--journal', help='write the MMQ journal to this file (group-commit fsync) during the run')
+    parser.add_argument('--output', help='write JSON result to this file, default stdout')
+    args = parser.parse_args(argv)
+
+    report = run(args.orders, args.rate, args.maker_levels, args.seed, args.timeout, args.transport, args.journal)
+    settled = report['submit_to_settled']
+    print(
+        f"settled {report['settled']}/{report['submitted']} orders in {report['elapsed_sec']:.3f}s, "
+        f"{report['throughput_orders_per_sec']:,.0f} orders/sec, "
+        f"p50 {settled.get('p50_us', 0):,.0f}us p99 {settled.get('p99_us', 0):,.0f}us",
+        file=sys.stderr,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
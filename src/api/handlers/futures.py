@@ -1,13 +1,15 @@
 from flask import jsonify, current_app
 import time
 from src.engine.matching.matching import global_futures_engine
+from src.common.config.metadata import (
+    price_to_ticks, ticks_to_price, qty_to_lots, lots_to_qty,
+    order_lots_to_qty, depth_to_float, kline_to_float, parse_order_values
+)
+from src.engine.types.ids import format_id, parse_id
+from src.engine.kline.kline import KLINE_INTERVALS
 
 # Map interval to milliseconds
-interval_map = {
-    '1m': 60 * 1000,
-    '1h': 60 * 60 * 1000,
-    '1d': 24 * 60 * 60 * 1000,
-}
+interval_map = KLINE_INTERVALS
 
 class FuturesHandler:
 
@@ -24,15 +26,19 @@ class FuturesHandler:
             uid = data.get('uid')
             if not uid:
                 return jsonify({"code": 400, "msg": "uid is required"}), 400
-            
+            try:
+                quantity, price = parse_order_values(symbol, data.get('type'), data.get('side'), data.get('quantity'), data.get('price'))
+            except ValueError as e:
+                return jsonify({"code": 400, "msg": str(e)}), 400
+
             trades, order = global_futures_engine.create_order(
                 uid=uid,
                 symbol=symbol,
                 side=data.get('side'),
                 order_type=data.get('type'),
                 time_in_force=data.get('time_in_force'),
-                quantity=float(data.get('quantity')),
-                price=float(data.get('price')) if data.get('price') else None,
+                quantity=quantity,
+                price=price,
                 is_futures=True
             )
             if order:
@@ -41,13 +47,13 @@ class FuturesHandler:
                     "data": {
                         "uid": uid,
                         "symbol": order.symbol,
-                        "orderId": order.order_id,
+                        "orderId": format_id(order.order_id),
                         "timeInForce": order.time_in_force,
                         "clientOrderId": order.client_order_id,
                         "transactTime": order.timestamp,
-                        "price": order.price,
-                        "origQty": order.quantity,
-                        "executedQty": order.filled_quantity,
+                        "price": ticks_to_price(order.symbol, order.price),
+                        "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                        "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                         "status": order.status,
                         "type": order.type,
                         "side": order.side
@@ -59,7 +65,15 @@ class FuturesHandler:
 
     def new_batch_order(self, data):
         try:
-            params = data.get('batchOrders', [])
+            # 价格/数量转换为引擎内部的整数tick/lot
+            params = []
+            for i, param in enumerate(data.get('batchOrders', [])):
+                try:
+                    quantity, price = parse_order_values(param.get('symbol'), param.get('type'), param.get('side'),
+                                                         param.get('quantity'), param.get('price'))
+                except ValueError as e:
+                    return jsonify({"code": 400, "msg": f"batchOrders[{i}]: {e}"}), 400
+                params.append(dict(param, quantity=quantity, price=price or 0))
             uid = data.get('uid')
             if not uid:
                 return jsonify({"code": 400, "msg": "uid is required"}), 400
@@ -67,13 +81,13 @@ class FuturesHandler:
             results = [{
                 "uid": uid,
                 "symbol": order.symbol,
-                "orderId": order.order_id,
+                "orderId": format_id(order.order_id),
                 "clientOrderId": order.client_order_id,
                 "timeInForce": order.time_in_force,
                 "transactTime": order.timestamp,
-                "price": order.price,
-                "origQty": order.quantity,
-                "executedQty": order.filled_quantity,
+                "price": ticks_to_price(order.symbol, order.price),
+                "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                 "status": order.status,
                 "type": order.type,
                 "side": order.side
@@ -93,6 +107,11 @@ class FuturesHandler:
 
             if not uid:
                 return jsonify({"code": 400, "msg": "uid is required"}), 400
+
+            try:
+                order_ids = [parse_id(order_id) for order_id in order_ids]
+            except ValueError:
+                return jsonify({"code": 400, "msg": f"Invalid orderIds {order_ids}"}), 400
             
             results = []
             for order_id in order_ids:
@@ -101,13 +120,13 @@ class FuturesHandler:
                     results.append({
                         "uid": uid,
                         "symbol": cancelled.symbol,
-                        "orderId": cancelled.order_id,
+                        "orderId": format_id(cancelled.order_id),
                         "clientOrderId": cancelled.client_order_id,
                         "timeInForce": cancelled.time_in_force,
                         "transactTime": cancelled.timestamp,
-                        "price": cancelled.price,
-                        "origQty": cancelled.quantity,
-                        "executedQty": cancelled.filled_quantity,
+                        "price": ticks_to_price(cancelled.symbol, cancelled.price),
+                        "origQty": order_lots_to_qty(cancelled.symbol, cancelled.type, cancelled.side, cancelled.quantity),
+                        "executedQty": order_lots_to_qty(cancelled.symbol, cancelled.type, cancelled.side, cancelled.filled_quantity),
                         "status": cancelled.status,
                         "type": cancelled.type,
                         "side": cancelled.side
@@ -134,12 +153,12 @@ class FuturesHandler:
                 {
                     "uid": uid,
                     "symbol": order.symbol,
-                    "orderId": order.order_id,
+                    "orderId": format_id(order.order_id),
                     "clientOrderId": order.client_order_id,
                     "timeInForce": order.time_in_force,
-                    "price": order.price,
-                    "origQty": order.quantity,
-                    "executedQty": order.filled_quantity,
+                    "price": ticks_to_price(order.symbol, order.price),
+                    "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                    "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                     "status": order.status,
                     "type": order.type,
                     "side": order.side
@@ -162,8 +181,10 @@ class FuturesHandler:
         if not side or not price or not quantity:
             return jsonify({'code': 500, 'data': "invalid parameter"})
 
-        global_futures_engine.append_trade(uid, symbol, float(price), float(quantity))
-        global_futures_engine.update_klines(symbol, float(price), float(quantity))
+        price_ticks = price_to_ticks(symbol, float(price))
+        quantity_lots = qty_to_lots(symbol, float(quantity))
+        global_futures_engine.append_trade(uid, symbol, price_ticks, quantity_lots)
+        global_futures_engine.update_klines(symbol, price_ticks, quantity_lots)
         return jsonify({
             "code": 200,
             "data": {
@@ -188,8 +209,8 @@ class FuturesHandler:
             "data": {
                 "symbol": symbol,
                 "lastUpdateId": int(time.time() * 1000),
-                "bids": depth.bids,
-                "asks": depth.asks
+                "bids": depth_to_float(symbol, depth.bids),
+                "asks": depth_to_float(symbol, depth.asks)
             }
         })
 
@@ -207,8 +228,8 @@ class FuturesHandler:
             "code": 200,
             "data": {
                 "symbol": symbol,
-                "price": str(ticker.price),
-                "quantity": str(ticker.quantity)
+                "price": str(ticks_to_price(symbol, ticker.price)),
+                "quantity": str(lots_to_qty(symbol, ticker.quantity))
             }
         })
 
@@ -222,7 +243,12 @@ class FuturesHandler:
             return jsonify({"code": 400, "msg": f"Interval {interval} is not traded"}), 400
 
         limit = int(args.get('limit', 50))
-        kline_data = global_futures_engine.get_klines(symbol, interval, limit)
+        try:
+            start_time = int(args['startTime']) if args.get('startTime') else None
+            end_time = int(args['endTime']) if args.get('endTime') else None
+        except ValueError:
+            return jsonify({"code": 400, "msg": "Invalid startTime or endTime"}), 400
+        kline_data = global_futures_engine.get_klines(symbol, interval, limit, start_time, end_time)
 
         klines = [{
                 "ot": bar[0],                  # Open time
@@ -233,7 +259,7 @@ class FuturesHandler:
                 "v": str(bar[5]),                       # Volume
                 "ct": bar[6],  # Close time
                 "a": str(bar[7])  # Quote asset volume 
-            } for bar in kline_data]
+            } for bar in map(lambda bar: kline_to_float(symbol, bar), kline_data)]
 
         return jsonify({
             "code": 200,
@@ -250,18 +276,18 @@ class FuturesHandler:
             return jsonify({"code": 400, "msg": "uid is required"}), 400
         
         limit = int(args.get('limit', 50))
-        trades = global_futures_engine.get_trades(uid, symbol, limit)
+        trades = global_futures_engine.get_user_trades(uid, symbol, limit)
         return jsonify({
             "code": 200,
             "data": [
                 {
                     "uid": uid,
                     "symbol": symbol,
-                    "id": trade.trade_id,
-                    "price": str(trade.price),
-                    "quantity": str(trade.quantity),
+                    "id": format_id(trade.trade_id),
+                    "price": str(ticks_to_price(symbol, trade.price)),
+                    "quantity": str(lots_to_qty(symbol, trade.quantity)),
                     "time": trade.timestamp,
-                    "isBuyerMaker": False  # True if maker is buyer
+                    "isBuyerMaker": not trade.is_taker_buyer  # True if maker is buyer
                 }
                 for trade in trades
             ]
@@ -282,6 +308,11 @@ class FuturesHandler:
         if not self._validate_symbol(symbol):
             return jsonify({"code": 400, "msg": f"Symbol {symbol} is not allowed"}), 400
 
+        try:
+            order_id = parse_id(order_id)
+        except ValueError:
+            return jsonify({"code": 400, "msg": f"Invalid orderId {order_id}"}), 400
+
         order = global_futures_engine.get_order(uid, symbol, order_id)
         if not order:
             return jsonify({"code": 404, "msg": "Order not found"}), 404
@@ -291,11 +322,11 @@ class FuturesHandler:
             "data": {
                 "uid": uid,
                 "symbol": order.symbol,
-                "orderId": order.order_id,
+                "orderId": format_id(order.order_id),
                 "clientOrderId": order.client_order_id,
-                "price": order.price,
-                "origQty": order.quantity,
-                "executedQty": order.filled_quantity,
+                "price": ticks_to_price(order.symbol, order.price),
+                "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                 "status": order.status,
                 "type": order.type,
                 "side": order.side
@@ -3,16 +3,18 @@ from flask import jsonify, current_app
 import time
 from src.engine.matching.matching import global_spot_engine
 from src.engine.funding.funding import SPOT_FUNDING
+from src.common.config.metadata import (
+    price_to_ticks, ticks_to_price, qty_to_lots, lots_to_qty,
+    order_lots_to_qty, depth_to_float, kline_to_float, parse_order_values
+)
+from src.engine.types.ids import format_id, parse_id
+from src.engine.kline.kline import KLINE_INTERVALS
 import traceback
 
 logger = logging.getLogger(__name__)
 
 # Map interval to milliseconds
-interval_map = {
-    '1m': 60 * 1000,
-    '1h': 60 * 60 * 1000,
-    '1d': 24 * 60 * 60 * 1000,
-}
+interval_map = KLINE_INTERVALS
 
 class SpotHandler:
     def _validate_symbol(self, symbol):
@@ -29,6 +31,10 @@ class SpotHandler:
                 return jsonify({"code": 400, "msg": f"Symbol {symbol} is not allowed"}), 400
             if not data.get('uid'):
                 return jsonify({"code": 400, "msg": "uid is required"}), 400
+            try:
+                quantity, price = parse_order_values(symbol, data.get('type'), data.get('side'), data.get('quantity'), data.get('price'))
+            except ValueError as e:
+                return jsonify({"code": 400, "msg": str(e)}), 400
 
             logger.debug(f"Calling create_order with order_type={data.get('type')}, client_order_id={data.get('client_order_id')}")
             # trades, order = global_spot_engine.create_order(
@@ -38,8 +44,8 @@ class SpotHandler:
                 side=data.get('side'),
                 order_type=data.get('type'),
                 time_in_force=data.get('time_in_force'),
-                quantity=float(data.get('quantity')),
-                price=float(data.get('price')) if data.get('price') else 0,
+                quantity=quantity,
+                price=price or 0,
                 client_order_id=data.get('client_order_id')
             )
             if result:
@@ -48,14 +54,14 @@ class SpotHandler:
                     "data": {
                         "uid": order.uid,
                         "symbol": order.symbol,
-                        "orderId": order.order_id,
+                        "orderId": format_id(order.order_id),
                         "clientOrderId": order.client_order_id,
                         "type": order.type,
                         "timeInForce": order.time_in_force,
                         "transactTime": order.timestamp,
-                        "price": order.price,
-                        "origQty": order.quantity,
-                        "executedQty": order.filled_quantity,
+                        "price": ticks_to_price(order.symbol, order.price),
+                        "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                        "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                         "status": order.status,
                         "type": order.type,
                         "side": order.side
@@ -73,7 +79,15 @@ class SpotHandler:
             if not data.get('uid'):
                 return jsonify({"code": 400, "msg": "uid is required"}), 400
 
-            params = data.get('batchOrders', [])
+            # 价格/数量转换为引擎内部的整数tick/lot
+            params = []
+            for i, param in enumerate(data.get('batchOrders', [])):
+                try:
+                    quantity, price = parse_order_values(param.get('symbol'), param.get('type'), param.get('side'),
+                                                         param.get('quantity'), param.get('price'))
+                except ValueError as e:
+                    return jsonify({"code": 400, "msg": f"batchOrders[{i}]: {e}"}), 400
+                params.append(dict(param, quantity=quantity, price=price or 0))
             #_, orders = global_spot_engine.create_orders(
             result, orders = SPOT_FUNDING.put_spot_orders(
                 uid=data['uid'],
@@ -84,13 +98,13 @@ class SpotHandler:
                     "code": 200,
                     "data": [{
                         "symbol": order.symbol,
-                        "orderId": order.order_id,
+                        "orderId": format_id(order.order_id),
                         "clientOrderId": order.client_order_id,
                         "timeInForce": order.time_in_force,
                         "transactTime": order.timestamp,
-                        "price": order.price,
-                        "origQty": order.quantity,
-                        "executedQty": order.filled_quantity,
+                        "price": ticks_to_price(order.symbol, order.price),
+                        "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                        "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                         "status": order.status,
                         "type": order.type,
                         "side": order.side
@@ -109,6 +123,11 @@ class SpotHandler:
             if not self._validate_symbol(symbol):
                 return jsonify({"code": 400, "msg": f"Symbol {symbol} is not allowed"}), 400
 
+            try:
+                order_ids = [parse_id(order_id) for order_id in order_ids]
+            except ValueError:
+                return jsonify({"code": 400, "msg": f"Invalid orderIds {order_ids}"}), 400
+
             # results = global_spot_engine.cancel_orders(
             result, orders = SPOT_FUNDING.cancel_spot_orders(
                 uid=uid,
@@ -121,7 +140,7 @@ class SpotHandler:
                     "data": [{
                         "uid": cancelled.uid,
                         "symbol": cancelled.symbol,
-                        "orderId": cancelled.order_id,
+                        "orderId": format_id(cancelled.order_id),
                         "status": cancelled.status,
                     } for cancelled in orders]
                 })
@@ -146,13 +165,13 @@ class SpotHandler:
                 {
                     "uid": order.uid,
                     "symbol": order.symbol,
-                    "orderId": order.order_id,
+                    "orderId": format_id(order.order_id),
                     "clientOrderId": order.client_order_id,
                     "timeInForce": order.time_in_force,
                     "transactTime": order.timestamp,
-                    "price": order.price,
-                    "origQty": order.quantity,
-                    "executedQty": order.filled_quantity,
+                    "price": ticks_to_price(order.symbol, order.price),
+                    "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                    "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                     "status": order.status,
                     "type": order.type,
                     "side": order.side
@@ -175,8 +194,10 @@ class SpotHandler:
         if not side or not price or not quantity:
             return jsonify({'code': 500, 'data': "invalid parameter"})
 
-        global_spot_engine.append_trade(uid=args['uid'], symbol=symbol, price=float(price), quantity=float(quantity))
-        global_spot_engine.update_klines(symbol, float(price), float(quantity))
+        price_ticks = price_to_ticks(symbol, float(price))
+        quantity_lots = qty_to_lots(symbol, float(quantity))
+        global_spot_engine.append_trade(uid=args['uid'], symbol=symbol, price=price_ticks, quantity=quantity_lots)
+        global_spot_engine.update_klines(symbol, price_ticks, quantity_lots)
         return jsonify({
             "code": 200,
             "data": {
@@ -200,8 +221,8 @@ class SpotHandler:
             "code": 200,
             "data": {
                 "lastUpdateId": int(time.time() * 1000),
-                "bids": depth.bids,
-                "asks": depth.asks
+                "bids": depth_to_float(symbol, depth.bids),
+                "asks": depth_to_float(symbol, depth.asks)
             }
         })
 
@@ -219,8 +240,8 @@ class SpotHandler:
             "code": 200,
             "data": {
                 "symbol": symbol,
-                "price": str(ticker.price),
-                "quantity": str(ticker.quantity)
+                "price": str(ticks_to_price(symbol, ticker.price)),
+                "quantity": str(lots_to_qty(symbol, ticker.quantity))
             }
         })
 
@@ -234,7 +255,12 @@ class SpotHandler:
             return jsonify({"code": 400, "msg": f"Interval {interval} is not allowed"}), 400
 
         limit = int(args.get('limit', 50))
-        kline_data = global_spot_engine.get_klines(symbol, interval, limit)
+        try:
+            start_time = int(args['startTime']) if args.get('startTime') else None
+            end_time = int(args['endTime']) if args.get('endTime') else None
+        except ValueError:
+            return jsonify({"code": 400, "msg": "Invalid startTime or endTime"}), 400
+        kline_data = global_spot_engine.get_klines(symbol, interval, limit, start_time, end_time)
 
         klines = [{
                 "ot": bar[0],                  # Open time
@@ -245,7 +271,7 @@ class SpotHandler:
                 "v": str(bar[5]),                       # Volume
                 "ct": bar[6],  # Close time
                 "a": str(bar[7])  # Quote asset volume 
-            } for bar in kline_data]
+            } for bar in map(lambda bar: kline_to_float(symbol, bar), kline_data)]
 
         return jsonify({
             "code": 200,
@@ -262,17 +288,17 @@ class SpotHandler:
             return jsonify({"code": 400, "msg": "uid is required"}), 400
 
         limit = int(args.get('limit', 50))
-        trades = global_spot_engine.get_trades(uid, symbol, limit)
+        trades = global_spot_engine.get_user_trades(uid, symbol, limit)
         return jsonify({
             "code": 200,
             "data": [
                 {
                     "uid": uid,
-                    "id": trade.trade_id,
-                    "price": str(trade.price),
-                    "quantity": str(trade.quantity),
+                    "id": format_id(trade.trade_id),
+                    "price": str(ticks_to_price(symbol, trade.price)),
+                    "quantity": str(lots_to_qty(symbol, trade.quantity)),
                     "time": trade.timestamp,
-                    "isBuyerMaker": False  # True if maker is buyer
+                    "isBuyerMaker": not trade.is_taker_buyer  # True if maker is buyer
                 }
                 for trade in trades
             ]
@@ -294,6 +320,11 @@ class SpotHandler:
         if not self._validate_symbol(symbol):
             return jsonify({"code": 400, "msg": f"Symbol {symbol} is not allowed"}), 400
 
+        try:
+            order_id = parse_id(order_id)
+        except ValueError:
+            return jsonify({"code": 400, "msg": f"Invalid orderId {order_id}"}), 400
+
         order = global_spot_engine.get_order(uid, symbol, order_id)
         if not order:
             return jsonify({"code": 404, "msg": "Order not found"}), 404
@@ -303,11 +334,11 @@ class SpotHandler:
             "data": {
                 "uid": uid,
                 "symbol": order.symbol,
-                "orderId": order.order_id,
+                "orderId": format_id(order.order_id),
                 "clientOrderId": order.client_order_id,
-                "price": order.price,
-                "origQty": order.quantity,
-                "executedQty": order.filled_quantity,
+                "price": ticks_to_price(order.symbol, order.price),
+                "origQty": order_lots_to_qty(order.symbol, order.type, order.side, order.quantity),
+                "executedQty": order_lots_to_qty(order.symbol, order.type, order.side, order.filled_quantity),
                 "status": order.status,
                 "type": order.type,
                 "side": order.side
@@ -1,30 +1,25 @@
 import asyncio
+import atexit
 import threading
 import sys
 import os
 import logging
-from logging.handlers import RotatingFileHandler
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.common.utils.log import setup_logging
 
 # Create logs directory if it doesn't exist
 log_dir = os.path.join(os.path.dirname(__file__), '..', 'logs')
 os.makedirs(log_dir, exist_ok=True)
 
-# Configure logging
+# Configure logging, file I/O is done in the background thread of the queue listener
 log_file = os.path.join(log_dir, 'app.log')
-handler = RotatingFileHandler(log_file, maxBytes=1073741824, backupCount=1)  # 1GB limit
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-handler.setLevel(logging.DEBUG)
-
-root_logger = logging.getLogger()
-root_logger.setLevel(logging.DEBUG)
-root_logger.addHandler(handler)
+log_listener = setup_logging(log_file)
 
 logger = logging.getLogger(__name__)
 
-# Add the project root to Python path
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-
 # Define allowed symbols
 ALLOWED_SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'JPMUSDT']
 ALLOWED_SYMBOLS = ['90000001', '90000002', '90000003']
@@ -56,19 +51,69 @@ def start_flask():
 
 async def main():
     from src.engine.matching.matching import global_spot_engine, global_futures_engine
+    from src.engine.matching.router import SPOT_ROUTER
     from src.engine.funding.funding import SPOT_FUNDING
-    from src.common.mmq import MMQTopic
+    from src.common.mmq import MMQTopic, MMQ_SHM_PREFIX
+
+    history_dir = os.environ.get('HISTORY_DIR')
+    if history_dir:
+        # 成交和K线历史保存在mmap的列文件中，在重放journal之前设置，重放时补齐崩溃前没有写入的历史
+        from src.engine.history.history import HistoryStore
+        history = HistoryStore(history_dir)
+        global_spot_engine.set_history(history)
+        atexit.register(history.close)
+
+    journal_path = os.environ.get('JOURNAL_PATH')
+    snapshot_dir = os.environ.get('SNAPSHOT_DIR')
+    snapshotter = None
+    spot_view = None
+    if journal_path:
+        if MMQ_SHM_PREFIX or SPOT_ROUTER.sharded:
+            logger.warning("JOURNAL_PATH is only supported by the single process deployment, journal is disabled")
+        else:
+            # 加载最新的快照并重放之后的journal恢复order book和账户，之后的撮合输入和结果继续写入journal
+            from src.engine.recovery.recovery import recover
+            journal = recover(journal_path, global_spot_engine, SPOT_FUNDING, snapshot_dir=snapshot_dir)
+            atexit.register(journal.close)
+            if snapshot_dir:
+                from src.engine.recovery.snapshot import Snapshotter
+                snapshotter = Snapshotter(snapshot_dir, global_spot_engine, SPOT_FUNDING, journal)
+
+    if MMQ_SHM_PREFIX:
+        # 多进程部署(src/deploy.py): 撮合在独立的进程中，本进程从撮合结果和深度快照维护只读副本
+        from src.engine.matching.view import MatchingView
+        spot_matching = MatchingView(global_spot_engine).run_forever()
+    elif SPOT_ROUTER.sharded:
+        # 每个分片一个撮合进程，order book在分片进程中，与多进程部署一样由分片发布深度快照，
+        # 本进程的MatchingView维护深度、挂单和成交的只读副本供REST/WS查询
+        from src.deploy import SNAPSHOT_DEPTH
+        from src.engine.matching.sharding import ShardedMatchingEngine
+        from src.engine.matching.view import MatchingView
+        sharded_engine = ShardedMatchingEngine(SPOT_ROUTER, snapshot_depth=SNAPSHOT_DEPTH)
+        atexit.register(sharded_engine.stop)
+        spot_matching = sharded_engine.run_forever()
+        spot_view = MatchingView(global_spot_engine).run_forever()
+    else:
+        spot_matching = global_spot_engine.run_forever([MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL])
 
     tasks = [
         # Start WebSocket server
         asyncio.create_task(start_websocket_server()),
-        asyncio.create_task(global_spot_engine.run_forever([MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL])),
-        asyncio.create_task(global_futures_engine.run_forever([MMQTopic.FUNDING_NEW, MMQTopic.FUNDING_CANCEL])),
-        asyncio.create_task(SPOT_FUNDING.run_forever([MMQTopic.SPOT_MATCH_OUT]))
+        asyncio.create_task(spot_matching),
+        asyncio.create_task(SPOT_FUNDING.run_forever([MMQTopic.SPOT_MATCH_OUT])),
+        # K线作为独立的consumer group消费撮合结果
+        asyncio.create_task(global_spot_engine.klines.run_forever([MMQTopic.SPOT_MATCH_OUT]))
     ]
+    if spot_view:
+        tasks.append(asyncio.create_task(spot_view))
+    if snapshotter:
+        tasks.append(asyncio.create_task(snapshotter.run_forever()))
+    if not MMQ_SHM_PREFIX:
+        # 多进程部署时共享内存MMQ中没有合约的topic，合约只通过RPC接口撮合
+        tasks.append(asyncio.create_task(global_futures_engine.run_forever([MMQTopic.FUNDING_NEW, MMQTopic.FUNDING_CANCEL])))
     await asyncio.gather(*tasks)
 
-if __name__ == "__main__":
+def run():
     # Start Flask server in a separate thread
     flask_thread = threading.Thread(target=start_flask)
     flask_thread.daemon = True
@@ -76,3 +121,6 @@ if __name__ == "__main__":
 
     asyncio.run(main())
 
+if __name__ == "__main__":
+    run()
+
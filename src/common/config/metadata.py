@@ -1,8 +1,37 @@
-from typing import Tuple
-from src.engine.types.types import Market
+from decimal import Decimal, InvalidOperation
+from typing import Tuple, List, Optional
+import json
+import os
+from src.engine.types.types import Market, OrderType, OrderSide
 
 FEE_DECIMAL = 5
 
+# 交易对精度：(价格小数位, 数量小数位)
+# 引擎内部价格使用整数tick，数量使用整数lot，金额(price * quantity)使用整数tick * lot，只在API/WS边界转换
+SYMBOL_PRECISION = {
+    '90000001': (2, 6),
+    '90000002': (2, 5),
+    '90000003': (2, 2),
+}
+DEFAULT_PRECISION = (2, 6)
+
+# symbol -> (价格倍数, 数量倍数)
+_SYMBOL_SCALE = {}
+
+# 交易对使用的order book backend及参数，未配置的交易对使用默认的skip list order book
+# backend见 src.engine.orderbook.registry.ORDER_BOOK_BACKENDS
+# * ladder: 价格阶梯数组，适用于tick固定、价格在中间价附近有界波动的交易对
+#   e.g. '90000003': ('ladder', {})，价格区间由SYMBOL_PRICE_RANGE确定，也可以用max_price_level/base_price指定
+# 可以通过环境变量ORDER_BOOK_CONFIG覆盖，JSON格式：{"90000003": ["ladder", {"max_price_level": 20000}], "90000001": "rb"}
+SYMBOL_ORDER_BOOK = {}
+DEFAULT_ORDER_BOOK = ('sll', {})
+
+# 交易对的有效价格范围(最低价, 最高价)，ladder order book按该范围预分配价格挡位
+# 未配置的交易对使用以首个订单价格为中心的默认区间
+SYMBOL_PRICE_RANGE = {
+    '90000003': (50.0, 500.0),
+}
+
 def get_base_quote(symbol: str) -> Tuple[str, str]:
     """ 获取交易对的基币和引币 """
     if symbol == '90000001':
@@ -27,3 +56,127 @@ def get_collateral_rate() -> dict:
         '90000002': 0.8,
         '90000003': 0.5,
         }
+
+
+def get_order_book_config(symbol: str) -> Tuple[str, dict]:
+    """ 获取交易对的order book类型和参数 """
+    return SYMBOL_ORDER_BOOK.get(symbol, DEFAULT_ORDER_BOOK)
+
+def set_order_book_config(symbol: str, backend: str, params: dict = None):
+    """ 设置交易对的order book类型和参数 """
+    SYMBOL_ORDER_BOOK[symbol] = (backend, params or {})
+
+def load_order_book_config(config: str):
+    """ 从JSON加载交易对的order book配置，值为backend名字或[backend, 参数] """
+    for symbol, value in json.loads(config).items():
+        if isinstance(value, str):
+            set_order_book_config(symbol, value)
+        else:
+            set_order_book_config(symbol, value[0], value[1] if len(value) > 1 else None)
+
+if os.environ.get('ORDER_BOOK_CONFIG'):
+    load_order_book_config(os.environ['ORDER_BOOK_CONFIG'])
+
+def get_symbol_price_range(symbol: str) -> Optional[Tuple[float, float]]:
+    """ 获取交易对的有效价格范围，未配置时返回None """
+    return SYMBOL_PRICE_RANGE.get(symbol)
+
+def get_symbol_precision(symbol: str) -> Tuple[int, int]:
+    """ 获取交易对的价格和数量小数位 """
+    return SYMBOL_PRECISION.get(symbol, DEFAULT_PRECISION)
+
+def get_symbol_scale(symbol: str) -> Tuple[int, int]:
+    """ 获取交易对的价格和数量倍数，即1个价格单位包含的tick数和1个数量单位包含的lot数 """
+    scale = _SYMBOL_SCALE.get(symbol)
+    if scale is None:
+        price_decimal, qty_decimal = get_symbol_precision(symbol)
+        scale = _SYMBOL_SCALE[symbol] = (10 ** price_decimal, 10 ** qty_decimal)
+    return scale
+
+def price_to_ticks(symbol: str, price: float) -> int:
+    """ 价格转换为整数tick，四舍五入到最近的tick，API传入的价格使用parse_order_values校验 """
+    return round(price * get_symbol_scale(symbol)[0])
+
+def ticks_to_price(symbol: str, ticks: int) -> float:
+    """ 整数tick转换为价格 """
+    return ticks / get_symbol_scale(symbol)[0]
+
+def qty_to_lots(symbol: str, quantity: float) -> int:
+    """ 数量转换为整数lot，四舍五入到最近的lot，API传入的数量使用parse_order_values校验 """
+    return round(quantity * get_symbol_scale(symbol)[1])
+
+def lots_to_qty(symbol: str, lots: int) -> float:
+    """ 整数lot转换为数量 """
+    return lots / get_symbol_scale(symbol)[1]
+
+def amount_to_units(symbol: str, amount: float) -> int:
+    """ 报价货币金额转换为整数 tick * lot """
+    price_scale, qty_scale = get_symbol_scale(symbol)
+    return round(amount * price_scale * qty_scale)
+
+def units_to_amount(symbol: str, units: int) -> float:
+    """ 整数 tick * lot 转换为报价货币金额 """
+    price_scale, qty_scale = get_symbol_scale(symbol)
+    return units / (price_scale * qty_scale)
+
+def order_qty_to_lots(symbol: str, order_type: str, side: str, quantity: float) -> int:
+    """ 订单数量转换为整数，市价买单的数量是报价货币金额 """
+    if order_type == OrderType.MARKET and side == OrderSide.BUY:
+        return amount_to_units(symbol, quantity)
+    return qty_to_lots(symbol, quantity)
+
+def _exact_units(name: str, value, scale: int) -> int:
+    """ value转换为1/scale的整数倍，不是整数倍或不大于0时抛出ValueError """
+    try:
+        units = Decimal(str(value)) * scale
+    except InvalidOperation:
+        raise ValueError(f"Invalid {name} {value}")
+    if not units.is_finite() or units != units.to_integral_value():
+        raise ValueError(f"{name} {value} is not a multiple of {1 / Decimal(scale)}")
+    if units <= 0:
+        raise ValueError(f"{name} {value} must be positive")
+    return int(units)
+
+def parse_order_values(symbol: str, order_type: str, side: str, quantity, price=None) -> Tuple[int, Optional[int]]:
+    """ API传入的订单数量和价格转换为整数 (lot, tick)，不做舍入
+        * 数量/价格不是整数个lot/tick，或者不大于0时抛出ValueError
+        * 市价买单的数量是报价货币金额，按 tick * lot 校验
+        * 没有给出价格时返回的价格为None，限价单必须给出价格
+    """
+    price_scale, qty_scale = get_symbol_scale(symbol)
+    if quantity is None or quantity == '':
+        raise ValueError("quantity is required")
+    if order_type == OrderType.MARKET and side == OrderSide.BUY:
+        lots = _exact_units('quantity', quantity, price_scale * qty_scale)
+    else:
+        lots = _exact_units('quantity', quantity, qty_scale)
+    if price is None or price == '':
+        if order_type == OrderType.LIMIT:
+            raise ValueError("price is required for LIMIT orders")
+        return lots, None
+    return lots, _exact_units('price', price, price_scale)
+
+def order_lots_to_qty(symbol: str, order_type: str, side: str, lots: int) -> float:
+    """ 订单整数数量转换为浮点数，市价买单的数量是报价货币金额 """
+    if order_type == OrderType.MARKET and side == OrderSide.BUY:
+        return units_to_amount(symbol, lots)
+    return lots_to_qty(symbol, lots)
+
+def depth_to_float(symbol: str, levels: List[Tuple[int, int]]) -> List[Tuple[float, float]]:
+    """ 深度挡位 (tick, lot) 转换为 (价格, 数量) """
+    price_scale, qty_scale = get_symbol_scale(symbol)
+    return [(price / price_scale, qty / qty_scale) for price, qty in levels]
+
+def kline_to_float(symbol: str, bar: list) -> list:
+    """ K线 [开盘时间, 开, 高, 低, 收, 成交量, 收盘时间, 成交额] 转换为浮点数 """
+    price_scale, qty_scale = get_symbol_scale(symbol)
+    return [
+        bar[0],
+        bar[1] / price_scale,
+        bar[2] / price_scale,
+        bar[3] / price_scale,
+        bar[4] / price_scale,
+        bar[5] / qty_scale,
+        bar[6],
+        bar[7] / (price_scale * qty_scale),
+    ]
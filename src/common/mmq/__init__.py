@@ -1,11 +1,38 @@
 """ Memory Message Queue just for prototype
+    * 每个topic是固定容量的环形缓冲区，offset为绝对offset，写满后覆盖最早的消息
+    * 支持多个consumer group，每个group在每个topic上有独立的offset
+    * consumer落后超过保留窗口时记录丢失的消息数并告警；lag超过高水位时标记back-pressure，
+      生产者可以通过is_backpressured拒绝新的请求，而不是静默丢消息
+    * 消费者通过wait等待新消息，produce时立即唤醒，不再轮询
+    * produce可能来自其他线程（如API线程），通过call_soon_threadsafe唤醒消费者所在的event loop
+    * transport决定消息的编码方式，MMQ本身不关心消息内容:
+        inproc  同一进程内直接传递对象引用，不做序列化（默认）
+        binary  二进制编码，用于跨进程部署
+      可以通过环境变量MMQ_TRANSPORT设置
+    * set_journal之后指定topic的消息在produce时追加到write-ahead journal(见journal.py)，用于崩溃恢复
+    * 多进程部署(src/deploy.py)时设置环境变量MMQ_SHM_PREFIX，FUNDING_MATCH_MQ/MATCH_FUNDING_MQ
+      连接到启动进程创建的共享内存MMQ(见shm.py)
 """
 
-from typing import Tuple
+from typing import Tuple, List, Dict
+import asyncio
+import logging
+import os
 import threading
 
 
+logger = logging.getLogger(__name__)
+
+# capacity of the ring buffer of each topic
 MAX_MESSAGES = 10_000
+# max number of messages returned by one consume_batch call
+MAX_BATCH_MESSAGES = 1_000
+# lag / capacity above which a topic is back-pressured
+HIGH_WATERMARK = 0.8
+
+TRANSPORT_INPROC = "inproc"
+TRANSPORT_BINARY = "binary"
+DEFAULT_TRANSPORT = os.environ.get('MMQ_TRANSPORT', TRANSPORT_INPROC)
 
 class MMQTopic:
     MATCH_IN_SPOT_NEW = "spot_new"
@@ -14,45 +41,276 @@ class MMQTopic:
     FUNDING_CANCEL = "funding_cancel"
 
     SPOT_MATCH_OUT = "spot_match_out"
+    # 撮合进程发布的深度快照，供API/WS进程读取
+    SPOT_SNAPSHOT = "spot_snapshot"
+
+
+class RingBuffer:
+    """ 固定容量的环形缓冲区，绝对offset为o的消息保存在slots[o % capacity]
+        head是下一条消息的offset，保留的消息为[oldest, head)
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0
+
+    @property
+    def oldest(self) -> int:
+        return max(0, self.head - self.capacity)
+
+    def append(self, message: str) -> int:
+        offset = self.head
+        self.slots[offset % self.capacity] = message
+        self.head = offset + 1
+        return offset
+
+    def read(self, offset: int, max_messages: int) -> List[str]:
+        """ 读取[offset, offset + max_messages)内已保留的消息，offset必须不早于oldest """
+        end = min(self.head, offset + max_messages)
+        if offset >= end:
+            return []
+        start_index = offset % self.capacity
+        end_index = start_index + end - offset
+        if end_index <= self.capacity:
+            return self.slots[start_index:end_index]
+        # 跨过缓冲区末尾时分两段读取
+        return self.slots[start_index:] + self.slots[:end_index - self.capacity]
+
 
 class MMQ:
-    """ store messages in memory, clear half of messages when it's full
+    """ store messages of each topic in a fixed-capacity ring buffer
     """
-    def __init__(self):
+    def __init__(self, capacity: int = MAX_MESSAGES, high_watermark: float = HIGH_WATERMARK, transport: str = DEFAULT_TRANSPORT):
         self.lock = threading.Lock()
+        self.capacity = capacity
+        self.high_watermark = high_watermark
+        self.transport = transport
+
+        # topic -> RingBuffer
+        self.topics: Dict[str, RingBuffer] = {}
+        # group -> {topic: offset}
+        self.group_offsets: Dict[str, Dict[str, int]] = {}
+        # group -> {topic: number of messages overwritten before the group consumed them}
+        self.group_dropped: Dict[str, Dict[str, int]] = {}
+        # topics which are currently back-pressured, only used to log once per transition
+        self.backpressured = set()
+
+        # waiting consumers: (event loop, asyncio.Event, topics)
+        self.waiters = []
+
+        # write-ahead journal of the messages of journal_topics, see set_journal
+        self.journal = None
+        self.journal_topics = frozenset()
+        self.journal_encode = None
 
-        self.messages = {}
-        # current offset = base + offset
-        self.messages_base = {}
-        self.messages_offset = {}
-        
-    def produce(self, topic: str, message: str):
-        if topic not in self.messages:
-            self.messages[topic] = []
-            self.messages_base[topic] = 0
-            self.messages_offset[topic] = 0
+    def _get_topic(self, topic: str) -> RingBuffer:
+        ring = self.topics.get(topic)
+        if ring is None:
+            ring = self.topics[topic] = RingBuffer(self.capacity)
+        return ring
 
+    def set_journal(self, journal, topics: List[str], encode=None):
+        """ 把topics的消息追加到journal，encode把消息转换为bytes(inproc transport)，journal为None时取消 """
         with self.lock:
-            self.messages[topic].append(message)
-            if len(self.messages[topic]) >= MAX_MESSAGES:
-                size = int(0.5 * MAX_MESSAGES)
-                self.messages[topic] = self.messages[topic][size:]
-                self.messages_base[topic] += size
+            self.journal = journal
+            self.journal_topics = frozenset(topics) if journal else frozenset()
+            self.journal_encode = encode
+
+    def produce(self, topic: str, message) -> int:
+        """ 写入消息，返回消息的绝对offset """
+        with self.lock:
+            ring = self._get_topic(topic)
+            offset = ring.append(message)
+            if topic in self.journal_topics:
+                # 在锁内追加，journal中的顺序与offset的顺序一致
+                self.journal.append(topic, message, self.journal_encode)
+            waiters = [w for w in self.waiters if topic in w[2]]
+            backpressured = self._max_lag(topic) >= self.high_watermark * self.capacity
+
+        if backpressured != (topic in self.backpressured):
+            if backpressured:
+                self.backpressured.add(topic)
+                logger.warning("MMQ topic %s is back-pressured, lag of the slowest consumer group >= %s", topic, int(self.high_watermark * self.capacity))
+            else:
+                self.backpressured.discard(topic)
+
+        for loop, event, _ in waiters:
+            self._notify(loop, event)
+        return offset
+
+    @staticmethod
+    def _notify(loop: asyncio.AbstractEventLoop, event: asyncio.Event):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            event.set()
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(event.set)
+
+    def oldest_offset(self, topic: str) -> int:
+        """ 最早保留的消息的绝对offset """
+        ring = self.topics.get(topic)
+        return ring.oldest if ring else 0
+
+    def has_message(self, topic: str, offset: int = 0) -> bool:
+        """ 绝对offset处是否有消息可以消费，offset早于已保留的消息时从最早的消息开始
+        """
+        ring = self.topics.get(topic)
+        if ring is None:
+            return False
+
+        with self.lock:
+            return offset < ring.head
+
+    async def wait(self, offsets: Dict[str, int], timeout: float = None):
+        """ 等待任一topic在对应offset处有新消息
+            * 已有消息时只让出一次event loop，保证同一loop内的其他消费者可以运行
+            * timeout为None时一直等待
+        """
+        if any(self.has_message(topic, offset) for topic, offset in offsets.items()):
+            await asyncio.sleep(0)
+            return
+
+        waiter = (asyncio.get_running_loop(), asyncio.Event(), set(offsets))
+        with self.lock:
+            self.waiters.append(waiter)
+        try:
+            # 注册后再检查一次，避免检查和注册之间其他线程produce的消息丢失唤醒
+            if any(self.has_message(topic, offset) for topic, offset in offsets.items()):
+                await asyncio.sleep(0)
+                return
+            if timeout is None:
+                await waiter[1].wait()
+            else:
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.lock:
+                self.waiters.remove(waiter)
 
     def consume(self, topic: str, offset: int = 0) -> Tuple[int, str]:
+        """ 返回绝对offset处的一条消息 (offset, message)，没有消息时message为空
+            offset早于已保留的消息时返回最早的消息
         """
+        offset, messages = self.consume_batch(topic, offset, 1)
+        if not messages:
+            return offset, ""
+        return offset - 1, messages[0]
+
+    def consume_batch(self, topic: str, offset: int = 0, max_messages: int = MAX_BATCH_MESSAGES) -> Tuple[int, List[str]]:
+        """ 一次加锁返回从绝对offset开始的连续消息，最多max_messages条
+            返回 (下一次消费的offset, 消息列表)，offset早于已保留的消息时从最早的消息开始
+        """
+        ring = self.topics.get(topic)
+        if ring is None:
+            return offset, []
+
+        with self.lock:
+            offset = max(offset, ring.oldest)
+            messages = ring.read(offset, max_messages)
+            return offset + len(messages), messages
+
+    ### consumer group
+    def subscribe(self, group: str, topics: List[str], from_latest: bool = False) -> Dict[str, int]:
+        """ 注册consumer group，已注册的topic保留原offset
+            新topic默认从最早保留的消息开始，from_latest为True时只消费之后的新消息
+            返回group在这些topic上的offset，可直接用于wait
+        """
+        with self.lock:
+            offsets = self.group_offsets.setdefault(group, {})
+            dropped = self.group_dropped.setdefault(group, {})
+            for topic in topics:
+                if topic not in offsets:
+                    ring = self._get_topic(topic)
+                    offsets[topic] = ring.head if from_latest else ring.oldest
+                    dropped[topic] = 0
+            return {topic: offsets[topic] for topic in topics}
+
+    def committed(self, group: str, topics: List[str]) -> Dict[str, int]:
+        """ group在这些topic上已提交的offset """
+        with self.lock:
+            offsets = self.group_offsets[group]
+            return {topic: offsets[topic] for topic in topics}
+
+    def unsubscribe(self, group: str):
+        """ 删除consumer group，不再计入lag和back-pressure """
+        with self.lock:
+            self.group_offsets.pop(group, None)
+            self.group_dropped.pop(group, None)
+
+    def poll(self, group: str, topic: str, max_messages: int = MAX_BATCH_MESSAGES) -> List[str]:
+        """ 按group的offset消费消息并提交offset
+            group落后超过保留窗口时，被覆盖的消息计入dropped并告警
         """
-        if topic not in self.messages:
-            return 0, ""
+        with self.lock:
+            offsets = self.group_offsets[group]
+            ring = self._get_topic(topic)
+            offset = offsets[topic]
+            if offset < ring.oldest:
+                lost = ring.oldest - offset
+                self.group_dropped[group][topic] += lost
+                logger.warning("MMQ consumer group %s fell behind topic %s, %s messages were overwritten", group, topic, lost)
+                offset = ring.oldest
+            messages = ring.read(offset, max_messages)
+            offsets[topic] = offset + len(messages)
+            return messages
 
+    def lag(self, group: str, topic: str) -> int:
+        """ group在topic上未消费的消息数，包括已经被覆盖的消息 """
         with self.lock:
-            if offset and offset >= self.messages_base[topic]:
-                relative_offset = offset - self.messages_base[topic]
-                self.messages_offset[topic] = relative_offset
-            relative_offset = self.messages_offset[topic]
-            if relative_offset >= len(self.messages[topic]):
-                return offset, ""
-            return offset, self.messages[topic][relative_offset]
+            return self._get_topic(topic).head - self.group_offsets[group][topic]
+
+    def _max_lag(self, topic: str) -> int:
+        head = self.topics[topic].head
+        return max((head - offsets[topic] for offsets in self.group_offsets.values() if topic in offsets), default=0)
+
+    def is_backpressured(self, topic: str) -> bool:
+        """ 最慢的consumer group的lag超过高水位 """
+        if topic not in self.topics:
+            return False
+        with self.lock:
+            return self._max_lag(topic) >= self.high_watermark * self.capacity
+
+    def metrics(self) -> Dict[str, dict]:
+        """ 每个topic的保留窗口，以及每个consumer group的offset/lag/丢失消息数 """
+        with self.lock:
+            result = {}
+            for topic, ring in self.topics.items():
+                groups = {}
+                for group, offsets in self.group_offsets.items():
+                    if topic not in offsets:
+                        continue
+                    lag = ring.head - offsets[topic]
+                    groups[group] = {
+                        'offset': offsets[topic],
+                        'lag': lag,
+                        # 当前已经被覆盖、还未计入dropped的消息
+                        'overrun': max(0, ring.oldest - offsets[topic]),
+                        'dropped': self.group_dropped[group][topic],
+                    }
+                max_lag = max((g['lag'] for g in groups.values()), default=0)
+                result[topic] = {
+                    'capacity': ring.capacity,
+                    'head': ring.head,
+                    'oldest': ring.oldest,
+                    'size': ring.head - ring.oldest,
+                    'max_lag': max_lag,
+                    'backpressure': max_lag >= self.high_watermark * self.capacity,
+                    'groups': groups,
+                }
+            return result
+
+# 共享内存的名字: <MMQ_SHM_PREFIX>_funding_match, <MMQ_SHM_PREFIX>_match_funding
+MMQ_SHM_PREFIX = os.environ.get('MMQ_SHM_PREFIX')
 
-FUNDING_MATCH_MQ = MMQ()
-MATCH_FUNDING_MQ = MMQ()
\ No newline at end of file
+if MMQ_SHM_PREFIX:
+    from src.common.mmq.shm import SharedMMQ
+    FUNDING_MATCH_MQ = SharedMMQ.attach(f"{MMQ_SHM_PREFIX}_funding_match")
+    MATCH_FUNDING_MQ = SharedMMQ.attach(f"{MMQ_SHM_PREFIX}_match_funding")
+else:
+    FUNDING_MATCH_MQ = MMQ()
+    MATCH_FUNDING_MQ = MMQ()
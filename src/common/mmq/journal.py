@@ -0,0 +1,175 @@
+""" Write-ahead journal of MMQ messages
+    * MMQ.set_journal之后，指定topic的每条消息在produce时按顺序追加到journal，用于崩溃恢复和确定性重放
+    * group commit: produce只把消息放入内存缓冲区，后台线程每FLUSH_INTERVAL秒(或缓冲区超过MAX_BUFFER_RECORDS条)
+      把积累的记录一次write + 一次fsync，fsync的开销由一批消息分摊，不阻塞撮合/资金的event loop
+    * inproc消息中的Order会在撮合时被修改，append时立即转换为bytes；记录的组帧和crc在后台线程中完成
+    * 崩溃时最多丢失最近一个flush周期内的消息，需要确认落盘的调用方使用sync()
+    * 记录格式(小端):
+        4字节payload长度, 4字节crc32(topic + payload), 1字节topic长度, topic, payload
+      文件头为MAGIC + 4字节版本号
+    * 读取时遇到不完整或crc不一致的记录即停止(崩溃时写了一半的尾部)，重新打开时截断该尾部
+
+    JOURNAL_FLUSH_INTERVAL  group commit间隔(秒)，默认0.002
+"""
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MMQJ"
+VERSION = 1
+_FILE_HEADER = struct.Struct('<4sI')
+_RECORD = struct.Struct('<IIB')
+
+FLUSH_INTERVAL = float(os.environ.get('JOURNAL_FLUSH_INTERVAL', 0.002))
+MAX_BUFFER_RECORDS = 10_000
+
+
+def read_records(path: str, start: int = 0) -> Iterator[Tuple[int, str, bytes]]:
+    """ 按写入顺序读取journal中完整的记录，返回 (记录之后的文件位置, topic, payload)
+        start为之前读取到的文件位置，0表示从头读取
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        header = f.read(_FILE_HEADER.size)
+        if len(header) < _FILE_HEADER.size:
+            return
+        magic, version = _FILE_HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a MMQ journal of version {VERSION}")
+        # 只读取start之后的部分(快照之后的尾部)
+        base = max(start, _FILE_HEADER.size)
+        f.seek(base)
+        data = f.read()
+    pos, end = 0, len(data)
+    while pos + _RECORD.size <= end:
+        size, crc, topic_size = _RECORD.unpack_from(data, pos)
+        body_start = pos + _RECORD.size
+        body_end = body_start + topic_size + size
+        if body_end > end:
+            break
+        body = data[body_start:body_end]
+        if zlib.crc32(body) != crc:
+            logger.warning("Journal %s has a corrupted record at %s, ignore the rest of %s bytes", path, base + pos, end - pos)
+            break
+        pos = body_end
+        yield base + pos, body[:topic_size].decode(), body[topic_size:]
+
+
+def encode_record(topic: str, payload: bytes) -> bytes:
+    topic_bytes = topic.encode()
+    body = topic_bytes + payload
+    return _RECORD.pack(len(payload), zlib.crc32(body), len(topic_bytes)) + body
+
+
+class Journal:
+    """ 追加写的journal，append线程安全，记录的顺序即append的顺序 """
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL, fsync: bool = True, start: int = 0):
+        """ start为已经读取过的完整记录之后的文件位置(如恢复时重放到的位置)，只检查之后的尾部 """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.cond = threading.Condition()
+        # (topic, payload)
+        self.buffer = []
+        # append的记录数 / 已经落盘的记录数
+        self.appended = 0
+        self.synced = 0
+        self.sync_requested = False
+        self.closed = False
+
+        # 截断崩溃时写了一半的尾部
+        position = max(start, _FILE_HEADER.size)
+        for position, _, _ in read_records(path, start):
+            pass
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self.file.fileno()).st_size < _FILE_HEADER.size:
+            self.file.truncate(0)
+            self.file.write(_FILE_HEADER.pack(MAGIC, VERSION))
+        else:
+            self.file.truncate(position)
+        self.file.seek(0, os.SEEK_END)
+        self._sync_file()
+        # 已经落盘的文件位置
+        self.position = self.file.tell()
+
+        self.writer = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self.writer.start()
+
+    def _sync_file(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def append(self, topic: str, payload, encode=None) -> int:
+        """ 追加一条记录，返回记录的序号(从1开始)，记录由后台线程批量落盘
+            encode不为None时payload经encode转换为bytes
+        """
+        if encode is not None:
+            payload = encode(payload)
+        with self.cond:
+            if self.closed:
+                raise ValueError(f"Journal {self.path} is closed")
+            self.buffer.append((topic, payload))
+            self.appended += 1
+            seq = self.appended
+            if len(self.buffer) == 1 or len(self.buffer) >= MAX_BUFFER_RECORDS:
+                self.cond.notify_all()
+        return seq
+
+    def sync(self, seq: int = None):
+        """ 等待序号seq(默认为当前已append的全部记录)落盘 """
+        with self.cond:
+            seq = self.appended if seq is None else seq
+            if self.synced >= seq:
+                return
+            self.sync_requested = True
+            self.cond.notify_all()
+            while self.synced < seq and not self.closed:
+                self.cond.wait()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.buffer and not self.closed:
+                    self.cond.wait()
+                if not self.buffer:
+                    return
+                # group commit: 等待flush_interval积累更多记录，缓冲区过大或有人等待sync时立即落盘
+                if not self.sync_requested and not self.closed and len(self.buffer) < MAX_BUFFER_RECORDS:
+                    self.cond.wait(self.flush_interval)
+                batch, self.buffer = self.buffer, []
+                seq = self.appended
+                self.sync_requested = False
+
+            try:
+                self.file.write(b''.join([encode_record(topic, payload) for topic, payload in batch]))
+                self._sync_file()
+            except OSError:
+                # 不能保证持久化时停止接收新消息，而不是静默丢失
+                logger.exception("Failed to write %s records to journal %s, journal is closed", len(batch), self.path)
+                with self.cond:
+                    self.closed = True
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.synced = seq
+                self.position = self.file.tell()
+                self.cond.notify_all()
+            logger.debug("Journal %s committed %s records", self.path, len(batch))
+
+    def close(self):
+        """ 落盘所有记录并关闭文件，重复调用无效 """
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        self.writer.join()
+        self.file.close()
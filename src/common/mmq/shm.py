@@ -0,0 +1,337 @@
+""" Shared-memory MMQ for multi-process deployment
+    * 与MMQ相同的produce/consume/consumer group接口，消息保存在multiprocessing.shared_memory中，
+      撮合、资金/API可以运行在不同的进程中，不再共享一个GIL
+    * 一个MMQ对应一块共享内存，由启动进程按声明的topic和consumer group创建(create)，其他进程按名字attach，
+      运行中不能增加topic和group，避免跨进程分配的竞争
+    * 每个topic: 控制字(head, write_pos, oldest) + 消息索引环(capacity个(位置, 长度)) + 数据环(data_size字节)
+      + 每个consumer group的offset/dropped/是否订阅
+    * 每个topic只能有一个生产进程(进程内多线程生产用锁保护)；每个consumer group只能有一个消费进程
+    * 生产者先推进oldest再覆盖数据，消费者复制消息后重新检查oldest，被覆盖的消息计入dropped，不会读到写了一半的消息
+    * 消息必须是bytes，transport固定为binary
+    * 跨进程没有唤醒机制，wait按指数退避轮询(WAIT_MIN_INTERVAL ~ WAIT_MAX_INTERVAL)
+
+    layout:
+        header  magic, num_topics, num_groups, capacity, data_size      (u64)
+        names   topic名字, group名字                                    (NAME_SIZE字节)
+        topic   head, write_pos, oldest                                (u64)
+                index[capacity * 2]                                    (u64, 消息的绝对字节位置和长度)
+                group_offsets[num_groups], group_dropped[num_groups], group_subscribed[num_groups]  (u64)
+                data[data_size]
+"""
+import asyncio
+import atexit
+import logging
+import threading
+from array import array
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+
+from src.common.mmq import MAX_MESSAGES, MAX_BATCH_MESSAGES, HIGH_WATERMARK, TRANSPORT_BINARY
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x31304D48534D4D51  # "QMMSHM01"
+NAME_SIZE = 32
+HEADER_WORDS = 5
+CONTROL_WORDS = 3
+# 每个topic的数据环大小
+DATA_SIZE = 16 * 1024 * 1024
+# wait轮询间隔(秒)
+WAIT_MIN_INTERVAL = 0.00005
+WAIT_MAX_INTERVAL = 0.002
+
+
+def _topic_size(capacity: int, num_groups: int, data_size: int) -> int:
+    return 8 * (CONTROL_WORDS + 2 * capacity + 3 * num_groups) + data_size
+
+
+class _TopicView:
+    """ 一个topic在共享内存中的各个区域 """
+    __slots__ = ('control', 'index', 'offsets', 'dropped', 'subscribed', 'data')
+
+    def __init__(self, buf: memoryview, start: int, capacity: int, num_groups: int, data_size: int):
+        words = CONTROL_WORDS + 2 * capacity + 3 * num_groups
+        u64 = buf[start:start + 8 * words].cast('Q')
+        pos = CONTROL_WORDS
+        self.control = u64[:pos]
+        self.index = u64[pos:pos + 2 * capacity]
+        pos += 2 * capacity
+        self.offsets = u64[pos:pos + num_groups]
+        self.dropped = u64[pos + num_groups:pos + 2 * num_groups]
+        self.subscribed = u64[pos + 2 * num_groups:pos + 3 * num_groups]
+        data_start = start + 8 * words
+        self.data = buf[data_start:data_start + data_size]
+
+    @property
+    def head(self) -> int:
+        return self.control[0]
+
+    @property
+    def oldest(self) -> int:
+        return self.control[2]
+
+    def release(self):
+        for view in (self.control, self.index, self.offsets, self.dropped, self.subscribed, self.data):
+            view.release()
+
+
+class SharedMMQ:
+    """ 共享内存中的MMQ，create创建，attach连接 """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False, high_watermark: float = HIGH_WATERMARK):
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self.lock = threading.Lock()
+        self.high_watermark = high_watermark
+        self.transport = TRANSPORT_BINARY
+        self.backpressured = set()
+
+        buf = shm.buf
+        header = buf[:8 * HEADER_WORDS].cast('Q')
+        magic, num_topics, num_groups, self.capacity, self.data_size = header
+        header.release()
+        if magic != MAGIC:
+            raise ValueError(f"Shared memory {shm.name} is not a MMQ")
+
+        pos = 8 * HEADER_WORDS
+        names = []
+        for _ in range(num_topics + num_groups):
+            names.append(bytes(buf[pos:pos + NAME_SIZE]).rstrip(b'\0').decode())
+            pos += NAME_SIZE
+        self.group_names = names[num_topics:]
+        # group -> 在group区域中的下标
+        self.groups: Dict[str, int] = {group: i for i, group in enumerate(self.group_names)}
+        self.topics: Dict[str, _TopicView] = {}
+        size = _topic_size(self.capacity, num_groups, self.data_size)
+        for topic in names[:num_topics]:
+            self.topics[topic] = _TopicView(buf, pos, self.capacity, num_groups, self.data_size)
+            pos += size
+
+    @classmethod
+    def create(cls, name: str, topics: List[str], groups: List[str], capacity: int = MAX_MESSAGES,
+               data_size: int = DATA_SIZE, high_watermark: float = HIGH_WATERMARK) -> 'SharedMMQ':
+        """ 创建共享内存并初始化，进程退出前由创建者unlink """
+        for value in list(topics) + list(groups):
+            if len(value.encode()) > NAME_SIZE:
+                raise ValueError(f"Topic/group name {value} is longer than {NAME_SIZE} bytes")
+        data_size = (data_size + 7) // 8 * 8
+        size = 8 * HEADER_WORDS + NAME_SIZE * (len(topics) + len(groups)) + len(topics) * _topic_size(capacity, len(groups), data_size)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        buf = shm.buf
+        buf[:size] = bytes(size)
+        header = buf[:8 * HEADER_WORDS].cast('Q')
+        header[:] = array('Q', [MAGIC, len(topics), len(groups), capacity, data_size])
+        header.release()
+        pos = 8 * HEADER_WORDS
+        for value in list(topics) + list(groups):
+            encoded = value.encode()
+            buf[pos:pos + len(encoded)] = encoded
+            pos += NAME_SIZE
+        return cls(shm, owner=True, high_watermark=high_watermark)
+
+    @classmethod
+    def attach(cls, name: str, high_watermark: float = HIGH_WATERMARK) -> 'SharedMMQ':
+        mq = cls(shared_memory.SharedMemory(name=name), high_watermark=high_watermark)
+        # 模块级的MMQ在解释器退出前释放映射，否则SharedMemory.__del__因为还有导出的memoryview而报错
+        atexit.register(mq.close)
+        return mq
+
+    def close(self, unlink: bool = None):
+        """ 释放映射，创建者默认同时unlink，重复调用无效 """
+        if self.shm is None:
+            return
+        for view in self.topics.values():
+            view.release()
+        self.topics = {}
+        self.shm.close()
+        if self.owner if unlink is None else unlink:
+            self.shm.unlink()
+        self.shm = None
+
+    def _get_topic(self, topic: str) -> _TopicView:
+        view = self.topics.get(topic)
+        if view is None:
+            raise ValueError(f"Topic {topic} is not declared in shared MMQ {self.name}")
+        return view
+
+    def _group_index(self, group: str) -> int:
+        index = self.groups.get(group)
+        if index is None:
+            raise ValueError(f"Consumer group {group} is not declared in shared MMQ {self.name}")
+        return index
+
+    ### producer
+    def produce(self, topic: str, message: bytes) -> int:
+        """ 写入消息，返回消息的绝对offset """
+        view = self._get_topic(topic)
+        size = len(message)
+        if size > self.data_size:
+            raise ValueError(f"Message of {size} bytes is larger than the data ring of topic {topic}")
+        capacity, data_size = self.capacity, self.data_size
+        control, index, data = view.control, view.index, view.data
+        with self.lock:
+            head, write_pos, oldest = control[0], control[1], control[2]
+            end_pos = write_pos + size
+            # 先推进oldest，再覆盖索引和数据
+            oldest = max(oldest, head + 1 - capacity)
+            while oldest < head and index[2 * (oldest % capacity)] < end_pos - data_size:
+                oldest += 1
+            control[2] = oldest
+
+            start = write_pos % data_size
+            if start + size <= data_size:
+                data[start:start + size] = message
+            else:
+                first = data_size - start
+                data[start:] = message[:first]
+                data[:size - first] = message[first:]
+            slot = 2 * (head % capacity)
+            index[slot] = write_pos
+            index[slot + 1] = size
+            control[1] = end_pos
+            control[0] = head + 1
+            backpressured = self._max_lag(view) >= self.high_watermark * capacity
+
+        if backpressured != (topic in self.backpressured):
+            if backpressured:
+                self.backpressured.add(topic)
+                logger.warning("Shared MMQ topic %s is back-pressured, lag of the slowest consumer group >= %s", topic, int(self.high_watermark * capacity))
+            else:
+                self.backpressured.discard(topic)
+        return head
+
+    ### consumer
+    def _read(self, view: _TopicView, offset: int, max_messages: int) -> Tuple[int, List[bytes]]:
+        """ 返回 (第一条消息的offset, 消息列表)，offset早于已保留的消息时从最早的消息开始 """
+        capacity, data_size = self.capacity, self.data_size
+        index, data = view.index, view.data
+        offset = max(offset, view.oldest)
+        end = min(view.head, offset + max_messages)
+        messages = []
+        for o in range(offset, end):
+            slot = 2 * (o % capacity)
+            start, size = index[slot] % data_size, index[slot + 1]
+            if start + size <= data_size:
+                messages.append(bytes(data[start:start + size]))
+            else:
+                messages.append(bytes(data[start:]) + bytes(data[:start + size - data_size]))
+        # 复制期间被生产者覆盖的消息丢弃
+        oldest = view.oldest
+        if oldest > offset:
+            skip = min(oldest - offset, len(messages))
+            messages = messages[skip:]
+            offset += skip
+        return offset, messages
+
+    def oldest_offset(self, topic: str) -> int:
+        view = self.topics.get(topic)
+        return view.oldest if view else 0
+
+    def has_message(self, topic: str, offset: int = 0) -> bool:
+        view = self.topics.get(topic)
+        return view is not None and offset < view.head
+
+    async def wait(self, offsets: Dict[str, int], timeout: float = None):
+        """ 等待任一topic在对应offset处有新消息，跨进程没有通知，按指数退避轮询 """
+        if any(self.has_message(topic, offset) for topic, offset in offsets.items()):
+            await asyncio.sleep(0)
+            return
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        interval = WAIT_MIN_INTERVAL
+        while not any(self.has_message(topic, offset) for topic, offset in offsets.items()):
+            if deadline is not None and loop.time() >= deadline:
+                return
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, WAIT_MAX_INTERVAL)
+
+    def consume(self, topic: str, offset: int = 0) -> Tuple[int, bytes]:
+        offset, messages = self.consume_batch(topic, offset, 1)
+        if not messages:
+            return offset, b""
+        return offset - 1, messages[0]
+
+    def consume_batch(self, topic: str, offset: int = 0, max_messages: int = MAX_BATCH_MESSAGES) -> Tuple[int, List[bytes]]:
+        view = self.topics.get(topic)
+        if view is None:
+            return offset, []
+        offset, messages = self._read(view, offset, max_messages)
+        return offset + len(messages), messages
+
+    ### consumer group
+    def subscribe(self, group: str, topics: List[str], from_latest: bool = False) -> Dict[str, int]:
+        """ 已订阅的topic保留共享内存中的offset，消费进程重启后从上次的位置继续 """
+        index = self._group_index(group)
+        with self.lock:
+            for topic in topics:
+                view = self._get_topic(topic)
+                if not view.subscribed[index]:
+                    view.offsets[index] = view.head if from_latest else view.oldest
+                    view.dropped[index] = 0
+                    view.subscribed[index] = 1
+            return {topic: self.topics[topic].offsets[index] for topic in topics}
+
+    def committed(self, group: str, topics: List[str]) -> Dict[str, int]:
+        index = self._group_index(group)
+        return {topic: self._get_topic(topic).offsets[index] for topic in topics}
+
+    def unsubscribe(self, group: str):
+        index = self._group_index(group)
+        with self.lock:
+            for view in self.topics.values():
+                view.subscribed[index] = 0
+
+    def poll(self, group: str, topic: str, max_messages: int = MAX_BATCH_MESSAGES) -> List[bytes]:
+        index = self._group_index(group)
+        view = self._get_topic(topic)
+        with self.lock:
+            offset = view.offsets[index]
+            start, messages = self._read(view, offset, max_messages)
+            if start > offset:
+                lost = start - offset
+                view.dropped[index] += lost
+                logger.warning("Shared MMQ consumer group %s fell behind topic %s, %s messages were overwritten", group, topic, lost)
+            view.offsets[index] = start + len(messages)
+            return messages
+
+    def lag(self, group: str, topic: str) -> int:
+        view = self._get_topic(topic)
+        return view.head - view.offsets[self._group_index(group)]
+
+    def _max_lag(self, view: _TopicView) -> int:
+        head = view.head
+        return max((head - view.offsets[i] for i in range(len(self.group_names)) if view.subscribed[i]), default=0)
+
+    def is_backpressured(self, topic: str) -> bool:
+        view = self.topics.get(topic)
+        if view is None:
+            return False
+        return self._max_lag(view) >= self.high_watermark * self.capacity
+
+    def metrics(self) -> Dict[str, dict]:
+        result = {}
+        for topic, view in self.topics.items():
+            head, oldest = view.head, view.oldest
+            groups = {}
+            for group, i in self.groups.items():
+                if not view.subscribed[i]:
+                    continue
+                offset = view.offsets[i]
+                groups[group] = {
+                    'offset': offset,
+                    'lag': head - offset,
+                    'overrun': max(0, oldest - offset),
+                    'dropped': view.dropped[i],
+                }
+            max_lag = max((g['lag'] for g in groups.values()), default=0)
+            result[topic] = {
+                'capacity': self.capacity,
+                'head': head,
+                'oldest': oldest,
+                'size': head - oldest,
+                'max_lag': max_lag,
+                'backpressure': max_lag >= self.high_watermark * self.capacity,
+                'groups': groups,
+            }
+        return result
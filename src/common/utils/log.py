@@ -0,0 +1,65 @@
+""" Logging setup
+    * 日志记录通过QueueHandler放入队列，由QueueListener的后台线程写文件，
+      撮合/资金的event loop线程不做文件I/O
+    * 热路径(撮合、资金、MMQ、order book)的logger单独设置级别，生产环境默认INFO，
+      热路径上的debug日志使用%格式延迟格式化，开销较大的参数用isEnabledFor判断
+
+    LOG_LEVEL           根logger级别，默认DEBUG
+    HOT_PATH_LOG_LEVEL  热路径logger级别，默认INFO
+"""
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+HOT_PATH_LOGGERS = (
+    'src.engine.matching',
+    'src.engine.funding',
+    'src.engine.orderbook',
+    'src.common.mmq',
+)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class LogListener(QueueListener):
+    """ 记录是否已经启动，stop可以重复调用: 手动stop过的listener在进程退出时不再重复stop """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = False
+
+    def start(self):
+        super().start()
+        self.started = True
+
+    def stop(self):
+        if self.started:
+            self.started = False
+            super().stop()
+
+
+def setup_logging(log_file: str, level: str = None, hot_path_level: str = None,
+                  max_bytes: int = 1073741824, backup_count: int = 1) -> LogListener:
+    """ 根logger只挂一个QueueHandler，文件写入在QueueListener线程中完成
+        返回已启动的QueueListener，进程退出时自动stop并刷新剩余日志
+    """
+    level = level or os.environ.get('LOG_LEVEL', 'DEBUG')
+    hot_path_level = hot_path_level or os.environ.get('HOT_PATH_LOG_LEVEL', 'INFO')
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = LogListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+    for name in HOT_PATH_LOGGERS:
+        logging.getLogger(name).setLevel(hot_path_level)
+    return listener
@@ -0,0 +1,113 @@
+""" Multi-process deployment
+    * 单进程部署(src/app.py)时撮合、资金结算、REST、行情推送共享一个GIL，只能使用一个核
+    * 启动进程创建两块共享内存MMQ(见src/common/mmq/shm.py)，然后启动两个进程:
+        matching  撮合进程，消费spot_new/spot_cancel(分片时为每个分片的topic)，输出撮合结果和深度快照
+        gateway   src/app.py: REST(Flask) + WebSocket + Funding + K线 + MatchingView(深度、挂单、成交的只读副本)
+    * 两块共享内存:
+        <prefix>_funding_match  Funding -> 撮合    consumer group: matching (分片时 matching.<shard>)
+        <prefix>_match_funding  撮合 -> 消费者     consumer group: funding, kline, view
+    * 子进程通过环境变量MMQ_SHM_PREFIX连接共享内存，任一进程退出时停止所有进程并删除共享内存
+    * 合约仍然通过RPC接口在gateway进程中撮合
+
+    python src/deploy.py
+    MATCHING_SHARDS=4 python src/deploy.py
+
+    SNAPSHOT_DEPTH  撮合进程发布的深度快照档位数，默认50
+"""
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.common.mmq import MMQTopic
+from src.common.mmq.shm import SharedMMQ
+from src.engine.matching.router import ShardRouter, SPOT_ROUTER
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DEPTH = int(os.environ.get('SNAPSHOT_DEPTH', 50))
+LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs')
+
+
+def create_queues(prefix: str, router: ShardRouter = SPOT_ROUTER) -> Tuple[SharedMMQ, SharedMMQ]:
+    """ 按部署的topic和consumer group创建两块共享内存MMQ """
+    if router.sharded:
+        in_topics = [topic for shard in range(router.num_shards) for topic in router.topics(shard)]
+        in_groups = [f"matching.{shard}" for shard in range(router.num_shards)]
+    else:
+        in_topics = [MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL]
+        in_groups = ["matching"]
+    funding_match = SharedMMQ.create(f"{prefix}_funding_match", in_topics, in_groups)
+    try:
+        match_funding = SharedMMQ.create(f"{prefix}_match_funding", [MMQTopic.SPOT_MATCH_OUT, MMQTopic.SPOT_SNAPSHOT],
+                                         ["funding", "kline", "view"])
+    except Exception:
+        funding_match.close()
+        raise
+    return funding_match, match_funding
+
+
+def run_matching():
+    """ 撮合进程入口 """
+    from src.common.utils.log import setup_logging
+    setup_logging(os.path.join(LOG_DIR, 'matching.log'))
+
+    from src.engine.matching.matching import global_spot_engine
+    if SPOT_ROUTER.sharded:
+        from src.engine.matching.sharding import ShardedMatchingEngine
+        engine = ShardedMatchingEngine(SPOT_ROUTER, snapshot_depth=SNAPSHOT_DEPTH)
+        try:
+            asyncio.run(engine.run_forever())
+        finally:
+            engine.stop()
+    else:
+        global_spot_engine.snapshot_depth = SNAPSHOT_DEPTH
+        asyncio.run(global_spot_engine.run_forever([MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL]))
+
+
+def run_gateway():
+    """ API/WS进程入口 """
+    from src import app
+    app.run()
+
+
+def main(prefix: str = None):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    prefix = prefix or f"mmq{os.getpid()}"
+    queues = create_queues(prefix)
+    # 子进程在导入src.common.mmq时连接共享内存
+    os.environ['MMQ_SHM_PREFIX'] = prefix
+    # SIGTERM时同样停止子进程并删除共享内存
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    context = multiprocessing.get_context('spawn')
+    processes: List[multiprocessing.Process] = [
+        context.Process(target=run_matching, name="matching"),
+        context.Process(target=run_gateway, name="gateway"),
+    ]
+    try:
+        for process in processes:
+            process.start()
+        # 任一进程退出时停止整个部署
+        multiprocessing.connection.wait([process.sentinel for process in processes])
+        for process in processes:
+            if process.exitcode is not None:
+                logger.error("Process %s exited with code %s", process.name, process.exitcode)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        for queue in queues:
+            queue.close()
+
+
+if __name__ == "__main__":
+    main()
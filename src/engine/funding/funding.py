@@ -1,24 +1,63 @@
+from decimal import ROUND_HALF_UP, Decimal
 from rbloom import Bloom
 from typing import Tuple, List
-import time
-import json
-import asyncio
 import logging
+import threading
+from contextlib import contextmanager
 
 from src.engine.types.types import Market, OrderType, OrderSide, Order, Trade, OrderTimeInForce, OrderStatus
-from src.engine.types.account_types import UniMarginAccount
-from src.common.config.metadata import get_base_quote, get_fee_rate, get_collateral_rate
+from src.engine.types.account_types import MarginMode, UniMarginAccount
+from src.common.config.metadata import (
+    get_base_quote, get_fee_rate, get_collateral_rate, lots_to_qty, units_to_amount, ticks_to_price
+)
 from src.common.oracle import get_latest_index_price, update_index_price
+from src.engine.types.codec import get_codec
+from src.engine.types.clock import now_ms
 from src.common.mmq import FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, MMQTopic
+from src.engine.matching.router import ShardRouter, SPOT_ROUTER
 #from src.engine.matching.matching import global_spot_engine
 
 logger = logging.getLogger(__name__)
 
+
+def split_fee(quantity: float, fee_rate: float, fee_decimal: int) -> Tuple[float, float]:
+    """ 成交所得资产扣除手续费，手续费四舍五入(half-up)到fee_decimal位小数，返回 (扣费后的数量, 手续费) """
+    quantity = Decimal(str(quantity))
+    fee = (quantity * Decimal(str(fee_rate))).quantize(Decimal(1).scaleb(-fee_decimal), ROUND_HALF_UP)
+    return float(quantity - fee), float(fee)
+
+
 class Funding:
-    def __init__(self, accounts: List[UniMarginAccount]):
+    def __init__(self, accounts: List[UniMarginAccount], router: ShardRouter = SPOT_ROUTER):
         self.accounts = {account.uid: account for account in accounts}
+        # 按交易对路由到撮合分片的输入topic
+        self.router = router
         self.exist_order_ids = Bloom(1_000_000, 0.01)
         #self.cancelled_order_ids = Bloom()
+        # 冻结/解冻资产与发送到撮合的消息在同一个锁内完成
+        self.lock = threading.Lock()
+        # 快照(见src/engine/recovery/snapshot.py)期间关闭，新的下单/撤单在获取锁之前等待，
+        # 此时账户状态与journal中的消息一致，快照不需要在等待consumer时持有锁
+        self.produce_gate = threading.Event()
+        self.produce_gate.set()
+
+    @contextmanager
+    def _producing(self):
+        """ 持有锁冻结/解冻资产并发送到撮合，gate关闭时等待 """
+        while True:
+            self.produce_gate.wait()
+            with self.lock:
+                if self.produce_gate.is_set():
+                    yield
+                    return
+
+    def pause_producing(self):
+        """ 关闭gate，返回时正在处理的下单/撤单已经写入MMQ，之后的等待resume_producing """
+        with self.lock:
+            self.produce_gate.clear()
+
+    def resume_producing(self):
+        self.produce_gate.set()
 
     ### settlement for spot trades
     def _settlement_spot_new(self, account: UniMarginAccount, order: Order) -> Tuple[bool, str]:
@@ -27,6 +66,7 @@ class Funding:
         2. 若余额充足，立即冻结订单全额对应的资产（买入冻结报价货币USDT，卖出冻结基础货币BTC）
         3. 市价单卖出，传入参数为基础货币数量，并冻结相应基础货币；市价单买入，传入参数为报价货币数量，并冻结相应报价货币
         4. 买入时：从买入的资产（如BTC）中扣手续费，卖出时：从得到的资产（如USDT）中扣手续费
+        5. 订单价格/数量为整数tick/lot，账户余额为资产数量，冻结时换算
         """
         # deduplicate
         if order.order_id in account.frozen_balances:
@@ -34,20 +74,21 @@ class Funding:
 
         base, quote = get_base_quote(order.symbol)
         if order.side == OrderSide.BUY:
-            if order.order_type == OrderType.MARKET:
+            if order.type == OrderType.MARKET:
                 # for market buy: quantity is the amount of quote currency to buy
-                amount = order.quantity
+                amount = units_to_amount(order.symbol, order.quantity)
             else:
-                amount = order.price * order.quantity
+                amount = units_to_amount(order.symbol, order.price * order.quantity)
 
             if amount > account.balances[quote]:
                 return False, f"Insufficient {quote} balance"
             account.add_frozen_balance(order.order_id, quote, amount)
         else:
-            if order.quantity > account.balances[base]:
+            quantity = lots_to_qty(order.symbol, order.quantity)
+            if quantity > account.balances[base]:
                 return False, f"Insufficient {base} balance"
 
-            account.add_frozen_balance(order.order_id, base, order.quantity)
+            account.add_frozen_balance(order.order_id, base, quantity)
 
         account.version += 1
         return True, ""
@@ -72,74 +113,72 @@ class Funding:
         account.version += 1
         return True, ""
 
+    def _release_frozen_balance(self, account: UniMarginAccount, order_id: str, asset: str, amount: float):
+        """ 成交后扣减订单冻结的资产，冻结资产用完即订单完全成交时释放
+            内部做市商下单时不冻结资产，直接从余额中扣减
+        """
+        if account.is_inner_maker:
+            account.sub_balance(asset, amount)
+            return
+
+        account.sub_frozen_balance(order_id, asset, amount)
+        if account.frozen_balances[order_id][asset] <= 0:
+            # full filled
+            account.free_frozen_balance(order_id)
+
     def _settlement_spot_trade(self, trade: Trade) -> bool:
         """ 订单成交后，冻结资产划转至对方账户，用户收到对应资产
             现货交易费用基于挂单者（Maker）/吃单者（Taker）角色收取，两者费率不同。
             - 手续费在订单成交时即时扣除，从成交所得资产中直接扣除
             - 买入时：从报价货币（如USDT）中扣手续费
             - 卖出时：从收到的报价货币中扣手续费
+            - 手续费按资产数量计算，四舍五入(half-up)到fee_decimal位小数
         """
         base, quote = get_base_quote(trade.symbol)
 
         taker = self.accounts.get(trade.taker_uid)
         maker = self.accounts.get(trade.maker_uid)
         if not taker and not maker:
-            logger.error(f"Taker {trade.taker_uid} and Maker {trade.maker_uid} is not found of Trade {trade.to_dict()}")
+            logger.error("Taker %s and Maker %s is not found of Trade %s", trade.taker_uid, trade.maker_uid, trade.to_dict())
             return False
 
+        quantity = lots_to_qty(trade.symbol, trade.quantity)
+        amount = units_to_amount(trade.symbol, trade.quantity * trade.price)
         if trade.is_taker_buyer:
             # taker买入，USDT划转到maker账户，base coin反之，taker得到base coin，所以taker的fee从base coin中收取
-            amount = trade.quantity * trade.price
             if taker: # buyer
-                taker.sub_frozen_balance(trade.buy_order_id, quote, amount)
-                if taker.frozen_balances[quote] <= 0:
-                    # full filled
-                    taker.free_frozen_balance(trade.buy_order_id)
+                self._release_frozen_balance(taker, trade.buy_order_id, quote, amount)
 
-                fee_rate, fee_decimal = get_fee_rate(Market.SPOT, trade.symbol, False, trade.taker_uid)
-                fee = round(trade.quantity * fee_rate, fee_decimal)
-                taker.add_balance(base, trade.quantity - fee)
+                received, fee = split_fee(quantity, *get_fee_rate(Market.SPOT, trade.symbol, False, trade.taker_uid))
+                taker.add_balance(base, received)
 
                 FEE_ACCOUNT.add_balance(base, fee)
             if maker: # seller
-                maker.sub_frozen_balance(trade.sell_order_id, base, trade.quantity)
-                if maker.frozen_balances[base] <= 0:
-                    # full filled
-                    maker.free_frozen_balance(trade.sell_order_id)
+                self._release_frozen_balance(maker, trade.sell_order_id, base, quantity)
 
-                fee_rate, fee_decimal = get_fee_rate(Market.SPOT, trade.symbol, True, trade.maker_uid)
-                fee = round(amount * fee_rate, fee_decimal)
-                maker.add_balance(quote, amount - fee)
+                received, fee = split_fee(amount, *get_fee_rate(Market.SPOT, trade.symbol, True, trade.maker_uid))
+                maker.add_balance(quote, received)
 
                 FEE_ACCOUNT.add_balance(quote, fee)
         else:
             # taker是卖方，base转入maker账户，得到quote，fee也从quote中扣除
-            amount = trade.quantity * trade.price
             if taker:
-                taker.sub_frozen_balance(trade.sell_order_id, base, trade.quantity)
-                if taker.frozen_balances[base] <= 0:
-                    # full filled
-                    taker.free_frozen_balance(trade.sell_order_id)
+                self._release_frozen_balance(taker, trade.sell_order_id, base, quantity)
 
-                fee_rate, fee_decimal = get_fee_rate(Market.SPOT, trade.symbol, False, trade.taker_uid)
-                fee = round(amount * fee_rate, fee_decimal)
-                taker.add_balance(quote, amount - fee)
+                received, fee = split_fee(amount, *get_fee_rate(Market.SPOT, trade.symbol, False, trade.taker_uid))
+                taker.add_balance(quote, received)
 
                 FEE_ACCOUNT.add_balance(quote, fee)
             if maker:
-                maker.sub_frozen_balance(trade.buy_order_id, quote, amount)
-                if maker.frozen_balances[quote] <= 0:
-                    # full filled
-                    maker.free_frozen_balance(trade.buy_order_id)
+                self._release_frozen_balance(maker, trade.buy_order_id, quote, amount)
 
-                fee_rate, fee_decimal = get_fee_rate(Market.SPOT, trade.symbol, True, trade.maker_uid)
-                fee = round(trade.quantity * fee_rate, fee_decimal)
-                maker.add_balance(base, trade.quantity - fee)
+                received, fee = split_fee(quantity, *get_fee_rate(Market.SPOT, trade.symbol, True, trade.maker_uid))
+                maker.add_balance(base, received)
 
                 FEE_ACCOUNT.add_balance(base, fee)
         
         # 更新指数价格
-        update_index_price(trade.symbol, trade.price)
+        update_index_price(trade.symbol, ticks_to_price(trade.symbol, trade.price))
 
         return True
 
@@ -180,29 +219,30 @@ class Funding:
         is_isolated = account.get_margin_mode() == MarginMode.ISOLATED
         # 所有币对的最新价格(指数价格)
         full_symbol_price = get_latest_index_price()
-        symbol_price = {order.symbol: full_symbol_price[order.symbol]} if is_isolated else full_symbol_price
+        symbol_price = {order.symbol: full_symbol_price.get(order.symbol, 0)} if is_isolated else full_symbol_price
         collateral_rate = {} if is_isolated else get_collateral_rate()
-        max_borrow_amount = account.max_borrow_amount(symbol_price, collateral_rate)
+        max_borrow_amount = account.max_borrow_amount(symbol_price, collateral_rate, order.symbol)
 
         
 
         base, quote = get_base_quote(order.symbol)
         if order.side == OrderSide.BUY:
-            if order.order_type == OrderType.MARKET:
+            if order.type == OrderType.MARKET:
                 # for market buy: quantity is the amount of quote currency to buy
-                amount = order.quantity
+                amount = units_to_amount(order.symbol, order.quantity)
             else:
-                amount = order.price * order.quantity
+                amount = units_to_amount(order.symbol, order.price * order.quantity)
 
             if amount > max_borrow_amount:
                 return False, f"Insufficient {quote} balance"
             account.borrow(order.symbol, OrderSide.BUY, amount)
         else:
             price = symbol_price.get(order.symbol, 0)
-            if order.quantity * price > max_borrow_amount:
+            quantity = lots_to_qty(order.symbol, order.quantity)
+            if quantity * price > max_borrow_amount:
                 return False, f"Insufficient {base} balance"
 
-            account.borrow(order.symbol, OrderSide.SELL, order.quantity)
+            account.borrow(order.symbol, OrderSide.SELL, quantity)
 
         account.version += 1
         return True, ""
@@ -228,23 +268,29 @@ class Funding:
         price=None, client_order_id=None, is_futures=False
     ) -> Tuple[bool, Order]:
         """ RPC interface for spot order
+            price is in ticks, quantity is in lots (in units of tick * lot for market buy)
         """
         if uid not in self.accounts:
             return False, f"Account {uid} is not found"
         
+        topic = self.router.new_topic(symbol)
+        if FUNDING_MATCH_MQ.is_backpressured(topic):
+            return False, "Matching engine is busy, please retry later"
+
         account = self.accounts[uid]
         order = Order(uid,
             symbol=symbol, side=side, order_type=order_type,
             time_in_force=time_in_force, quantity=quantity, price=price,
             client_order_id=client_order_id,
             is_futures=is_futures)
-        if not account.is_inner_maker:
-            result, msg = self._settlement_spot_new(account, order)
-            if not result:
-                return False, msg
+        with self._producing():
+            if not account.is_inner_maker:
+                result, msg = self._settlement_spot_new(account, order)
+                if not result:
+                    return False, msg
 
-        # produce spot new order to match engine
-        FUNDING_MATCH_MQ.produce(MMQTopic.MATCH_IN_SPOT_NEW, json.dumps(order.to_dict()))
+            # produce spot new order to the matching shard of the symbol
+            FUNDING_MATCH_MQ.produce(topic, get_codec(FUNDING_MATCH_MQ.transport).encode_order(order))
         return True, order
 
     def put_spot_orders(self, uid: str, params: list) -> Tuple[bool, List[Order]]:
@@ -259,19 +305,28 @@ class Funding:
         account = self.accounts[uid]
         if not account.is_inner_maker:
             return False, f"Account {uid} is not internal market maker, batch API is not allowed"
+        topics = {self.router.new_topic(param.get('symbol')) for param in params}
+        if any(FUNDING_MATCH_MQ.is_backpressured(topic) for topic in topics):
+            return False, "Matching engine is busy, please retry later"
 
         orders = [Order(uid,
             symbol=param.get('symbol'),
-            client_order_id=param.get('client_order_id') or str(int(time.time() * 1000)),
+            client_order_id=param.get('client_order_id') or str(now_ms()),
             side=param.get('side'),
             order_type=param.get('type'),
             time_in_force=param.get('time_in_force'),
-            quantity=float(param.get('quantity')),
-            price=float(param.get('price')) if param.get('price') else 0,
+            quantity=int(param.get('quantity')),
+            price=int(param.get('price')) if param.get('price') else 0,
         ) for param in params if param.get('type') == OrderType.LIMIT and param.get('time_in_force') not in [OrderTimeInForce.FOK, OrderTimeInForce.IOC]]
         
-        # produce spot new orders to match engine
-        FUNDING_MATCH_MQ.produce(MMQTopic.MATCH_IN_SPOT_NEW, json.dumps([order.to_dict() for order in orders]))
+        # produce spot new orders to match engine, one batch per symbol
+        by_symbol = {}
+        for order in orders:
+            by_symbol.setdefault(order.symbol, []).append(order)
+        codec = get_codec(FUNDING_MATCH_MQ.transport)
+        with self._producing():
+            for symbol, symbol_orders in by_symbol.items():
+                FUNDING_MATCH_MQ.produce(self.router.new_topic(symbol), codec.encode_orders(symbol_orders))
         return True, orders
 
     def put_leverage_spot_order(
@@ -286,18 +341,22 @@ class Funding:
         account = self.accounts[uid]
         if account.is_inner_maker:
             return False, f"Account {uid} is an internal market maker, leverage API is not allowed"
+        topic = self.router.new_topic(symbol)
+        if FUNDING_MATCH_MQ.is_backpressured(topic):
+            return False, "Matching engine is busy, please retry later"
 
         order = Order(uid,
             symbol=symbol, side=side, order_type=order_type,
             time_in_force=time_in_force, quantity=quantity, price=price,
             client_order_id=client_order_id,
         )
-        result, msg = self._settlement_leverage_new(account, order)
-        if not result:
-            return False, msg
+        with self._producing():
+            result, msg = self._settlement_leverage_new(account, order)
+            if not result:
+                return False, msg
 
-        # produce spot new order to match engine
-        FUNDING_MATCH_MQ.produce(MMQTopic.MATCH_IN_SPOT_NEW, json.dumps(order.to_dict()))
+            # 撮合与普通订单相同，journal恢复时按杠杆订单重放资金
+            FUNDING_MATCH_MQ.produce(topic, get_codec(FUNDING_MATCH_MQ.transport).encode_leverage_order(order))
         return True, order
 
 
@@ -320,8 +379,8 @@ class Funding:
                 time_in_force='',
                 quantity=0,
                 price=None,
+                order_id=oid,
                 )
-            order.order_id = oid
             order.status = OrderStatus.CANCELLING
             orders.append(order)
             
@@ -331,13 +390,14 @@ class Funding:
             valid_order_ids.append(oid)
 
         if valid_order_ids:
-            if not account.is_inner_maker:
-                for order in orders:
-                    if order.order_id in valid_order_ids:
-                        result, msg = self._settlement_spot_cancel(account, order)
-                        if not result:
-                            return False, msg
-            FUNDING_MATCH_MQ.produce(MMQTopic.MATCH_IN_SPOT_CANCEL, json.dumps({'uid': uid, 'symbol': symbol, 'order_ids': valid_order_ids}))
+            with self._producing():
+                if not account.is_inner_maker:
+                    for order in orders:
+                        if order.order_id in valid_order_ids:
+                            result, msg = self._settlement_spot_cancel(account, order)
+                            if not result:
+                                return False, msg
+                FUNDING_MATCH_MQ.produce(self.router.cancel_topic(symbol), get_codec(FUNDING_MATCH_MQ.transport).encode_cancel(uid, symbol, valid_order_ids))
         return True, orders
 
 
@@ -370,39 +430,66 @@ class Funding:
             if account and not account.is_inner_maker and order.filled_quantity < order.quantity:
                 self._settlement_spot_cancel(account, order)
 
-    async def run_forever(self, topics: List[MMQTopic]):
+    def on_match_out(self, data: dict):
+        """ 处理一条撮合结果 """
+        if 'trades' in data:
+            self.on_spot_trades(data['trades'])
+
+        if 'orders' in data:
+            # batch put orders
+            self.on_spot_orders(data['orders'])
+        elif 'order' in data:
+            # put single order for normal users
+            self.on_spot_order(data['order'])
+        if 'removed_orders' in data:
+            self.on_removed_orders(data['removed_orders'])
+
+    ### Journal replay
+    def replay_spot_new(self, order: Order):
+        """ 重放journal中的新订单: 重新冻结非做市商订单的资产，与put_spot_order一致 """
+        account = self.accounts.get(order.uid)
+        if account and not account.is_inner_maker:
+            result, msg = self._settlement_spot_new(account, order)
+            if not result:
+                logger.warning("Replay of order %s failed: %s", order.order_id, msg)
+
+    def replay_leverage_new(self, order: Order):
+        """ 重放journal中的杠杆订单: 重新借款，与put_leverage_spot_order一致 """
+        account = self.accounts.get(order.uid)
+        if account and not account.is_inner_maker:
+            result, msg = self._settlement_leverage_new(account, order)
+            if not result:
+                logger.warning("Replay of leverage order %s failed: %s", order.order_id, msg)
+
+    def replay_spot_cancel(self, uid: str, symbol: str, order_ids: List[int]):
+        """ 重放journal中的撤单: 解冻非做市商订单的资产，与cancel_spot_orders一致 """
+        account = self.accounts.get(uid)
+        if not account or account.is_inner_maker:
+            return
+        for oid in order_ids:
+            order = Order(uid, symbol=symbol, side='', order_type='', time_in_force='', quantity=0, price=None, order_id=oid)
+            result, msg = self._settlement_spot_cancel(account, order)
+            if not result:
+                logger.warning("Replay of cancel %s failed: %s", oid, msg)
+
+    async def run_forever(self, topics: List[MMQTopic], group: str = "funding"):
         """ run funding engine forever
+            drain all available messages as consumer group `group`, then wait until the next message is produced
         """
-        prev_topic_offsets = {
-            topic: 0 for topic in topics
-        }
+        MATCH_FUNDING_MQ.subscribe(group, topics)
+        decode_message = get_codec(MATCH_FUNDING_MQ.transport).decode_message
         while True:
-            has_message = False
             for topic in topics:
-                prev_offset = prev_topic_offsets[topic]
-                queue_offset, message = MATCH_FUNDING_MQ.consume(topic, prev_offset)
-                logger.debug(f"Consumed message from {topic} offset={queue_offset}: {message}")
-                if message:
-                    prev_topic_offsets[topic] = queue_offset + 1
-                    data = json.loads(message)
-                    if 'trades' in data:
-                        self.on_spot_trades([Trade.from_dict(trade) for trade in data['trades']])
-
-                    if 'orders' in data:
-                        # batch put orders
-                        self.on_spot_orders([Order.from_dict(order) for order in data['orders']])
-                    elif 'order' in data:
-                        # put single order for normal users
-                        self.on_spot_order(Order.from_dict(data['order']))
-                    if 'removed_orders' in data:
-                        self.on_removed_orders([Order.from_dict(oid) for oid in data['removed_orders']])
-                        
-                    has_message = True
-
-            if has_message:
-                await asyncio.sleep(0.05)
-            else:
-                await asyncio.sleep(0.1)
+                while True:
+                    messages = MATCH_FUNDING_MQ.poll(group, topic)
+                    if not messages:
+                        break
+                    logger.debug("Consumed %s messages from %s", len(messages), topic)
+                    for message in messages:
+                        _, data = decode_message(message)
+                        self.on_match_out(data)
+
+            await MATCH_FUNDING_MQ.wait(MATCH_FUNDING_MQ.committed(group, topics))
 
 
 FEE_ACCOUNT = UniMarginAccount("60000000")
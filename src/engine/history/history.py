@@ -0,0 +1,263 @@
+""" Market data history store
+    * 内存中每个交易对只保留最近的成交(TradeHistory)和每个周期最近的K线(KlineAggregator)，重启后丢失
+    * HistoryStore把每个交易对的成交和已经结束的K线按列追加写入定长记录的文件，通过mmap读取:
+        <root>/<symbol>/trades.<列>         timestamp, trade_id, price, quantity, quote_volume, is_taker_buyer
+        <root>/<symbol>/kline_<周期>.<列>   open_time, open, high, low, close, volume, quote_volume
+      每列是int64数组，第一列(时间)递增，按时间的范围查询是在mmap的时间列上二分查找
+    * 由KlineAggregator在消费成交流时写入，重放journal时已经写入的成交(trade_id)和K线(开盘时间)被跳过
+    * 缺少的K线(如新增的周期)由rebuild_klines从保存的成交批量计算
+    * 时间回拨的成交按上一笔成交的时间保存，保持时间列递增
+    * 追加写入不fsync，行数由最短的列决定，崩溃时写了一半的行在打开时截断
+    * 查询结果与内存中的格式一致: 成交为Trade(不包括uid和订单ID)，K线为API格式的list
+
+    HISTORY_DIR=/data/history python src/app.py
+"""
+import bisect
+import logging
+import mmap
+import os
+import threading
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.engine.kline.kline import COLUMNS as KLINE_COLUMNS, KLINE_INTERVALS, KLINE_OFFSETS
+from src.engine.kline.rebuild import trade_bars
+from src.engine.types.types import Trade
+
+logger = logging.getLogger(__name__)
+
+TRADE_COLUMNS = ('timestamp', 'trade_id', 'price', 'quantity', 'quote_volume', 'is_taker_buyer')
+_ITEM_SIZE = array('q').itemsize
+
+
+class ColumnTable:
+    """ 一组等长的int64列文件，第一列递增，单线程追加，多线程读取 """
+
+    def __init__(self, directory: str, name: str, columns: Sequence[str]):
+        os.makedirs(directory, exist_ok=True)
+        self.columns = tuple(columns)
+        self.paths = [os.path.join(directory, f"{name}.{column}") for column in columns]
+        self.fds = [os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644) for path in self.paths]
+        self.length = min(os.fstat(fd).st_size for fd in self.fds) // _ITEM_SIZE
+        for fd in self.fds:
+            # 截断崩溃时写了一半的行
+            if os.fstat(fd).st_size != self.length * _ITEM_SIZE:
+                os.ftruncate(fd, self.length * _ITEM_SIZE)
+        # 已经映射的行数和各列的mmap，追加之后读取时重新映射
+        self.mapped = 0
+        self.maps: List[mmap.mmap] = []
+        self.views: List[memoryview] = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.length
+
+    def last(self, column: int = 0) -> Optional[int]:
+        """ 最后一行column列的值 """
+        if not self.length:
+            return None
+        data = os.pread(self.fds[column], _ITEM_SIZE, (self.length - 1) * _ITEM_SIZE)
+        return array('q', data)[0]
+
+    def append(self, rows: List[Tuple[int, ...]]):
+        if rows:
+            self.append_columns([array('q', column) for column in zip(*rows)])
+
+    def append_columns(self, columns: List[array]):
+        """ 按列追加，各列等长 """
+        if not len(columns[0]):
+            return
+        with self.lock:
+            for fd, column in zip(self.fds, columns):
+                view = memoryview(column).cast('B')
+                while view:
+                    view = view[os.write(fd, view):]
+            self.length += len(columns[0])
+
+    def _remap(self):
+        if self.mapped == self.length:
+            return
+        self._unmap()
+        size = self.length * _ITEM_SIZE
+        self.maps = [mmap.mmap(fd, size, access=mmap.ACCESS_READ) for fd in self.fds]
+        self.views = [memoryview(m).cast('q') for m in self.maps]
+        self.mapped = self.length
+
+    def _unmap(self):
+        for view in self.views:
+            view.release()
+        for m in self.maps:
+            m.close()
+        self.maps, self.views, self.mapped = [], [], 0
+
+    def search(self, value: int, column: int = 0) -> int:
+        """ 第一行column列 >= value 的行号，column列必须递增 """
+        with self.lock:
+            self._remap()
+            if not self.mapped:
+                return 0
+            return bisect.bisect_left(self.views[column], value)
+
+    def read(self, lo: int, hi: int) -> List[Tuple[int, ...]]:
+        """ [lo, hi)行 """
+        with self.lock:
+            self._remap()
+            hi = min(hi, self.mapped)
+            if lo >= hi:
+                return []
+            return list(zip(*[view[lo:hi].tolist() for view in self.views]))
+
+    def read_columns(self, lo: int, hi: int, columns: Sequence[int]) -> List[array]:
+        """ [lo, hi)行的columns列，复制为array """
+        with self.lock:
+            self._remap()
+            hi = max(lo, min(hi, self.mapped))
+            result = []
+            for column in columns:
+                values = array('q')
+                if hi > lo:
+                    values.frombytes(self.views[column][lo:hi].cast('B'))
+                result.append(values)
+            return result
+
+    def range(self, limit: int, start: int = None, end: int = None, column: int = 0, stop: int = None) -> List[Tuple[int, ...]]:
+        """ column列在[start, end]内的行，给出start时返回从start开始的limit行，否则返回最近的limit行
+            stop为行号的上限
+        """
+        lo = 0 if start is None else self.search(start, column)
+        hi = len(self) if end is None else self.search(end + 1, column)
+        if stop is not None:
+            hi = min(hi, stop)
+        if start is None:
+            lo = max(lo, hi - limit)
+        else:
+            hi = min(hi, lo + limit)
+        return self.read(lo, hi)
+
+    def close(self):
+        with self.lock:
+            self._unmap()
+            for fd in self.fds:
+                os.close(fd)
+            self.fds = []
+
+
+class HistoryStore:
+    """ 每个交易对的成交和K线历史 """
+
+    def __init__(self, root: str):
+        self.root = root
+        # (symbol, table name) -> ColumnTable
+        self.tables: Dict[Tuple[str, str], ColumnTable] = {}
+        # 每个交易对已经写入的最后一笔成交的 (trade_id, 时间)
+        self.last_trades: Dict[str, Tuple[int, int]] = {}
+        self.lock = threading.Lock()
+
+    def _table(self, symbol: str, name: str, columns: Sequence[str]) -> ColumnTable:
+        key = (symbol, name)
+        table = self.tables.get(key)
+        if table is None:
+            with self.lock:
+                table = self.tables.get(key)
+                if table is None:
+                    table = self.tables[key] = ColumnTable(os.path.join(self.root, symbol), name, columns)
+        return table
+
+    def _trades(self, symbol: str) -> ColumnTable:
+        return self._table(symbol, 'trades', TRADE_COLUMNS)
+
+    def _klines(self, symbol: str, interval: str) -> ColumnTable:
+        if interval not in KLINE_INTERVALS:
+            raise ValueError(f"Unknown kline interval {interval}")
+        return self._table(symbol, f'kline_{interval}', KLINE_COLUMNS)
+
+    def append_trades(self, trades: List[Trade]):
+        """ 追加成交，trade_id不大于已经写入的成交被跳过 """
+        by_symbol: Dict[str, List[Trade]] = {}
+        for trade in trades:
+            by_symbol.setdefault(trade.symbol, []).append(trade)
+        for symbol, symbol_trades in by_symbol.items():
+            table = self._trades(symbol)
+            last = self.last_trades.get(symbol)
+            if last is None:
+                last = (-1, 0) if not len(table) else (table.last(TRADE_COLUMNS.index('trade_id')), table.last())
+            last_id, last_time = last
+            rows = []
+            for trade in symbol_trades:
+                if trade.trade_id <= last_id:
+                    continue
+                last_id = trade.trade_id
+                last_time = max(last_time, trade.timestamp)
+                rows.append((last_time, trade.trade_id, trade.price, trade.quantity,
+                             trade.price * trade.quantity, int(trade.is_taker_buyer)))
+            table.append(rows)
+            self.last_trades[symbol] = (last_id, last_time)
+
+    def append_bars(self, symbol: str, interval: str, bars: List[list]):
+        """ 追加已经结束的K线，开盘时间不晚于已经写入的K线被跳过 """
+        table = self._klines(symbol, interval)
+        last_time = table.last()
+        rows = []
+        for bar in bars:
+            if last_time is not None and bar[0] <= last_time:
+                continue
+            last_time = bar[0]
+            rows.append((bar[0], bar[1], bar[2], bar[3], bar[4], bar[5], bar[7]))
+        table.append(rows)
+
+    def append_bar_columns(self, symbol: str, interval: str, columns: List[array]):
+        """ 按列(KLINE_COLUMNS)追加已经结束的K线，开盘时间不晚于已经写入的K线被跳过，返回写入的K线数 """
+        table = self._klines(symbol, interval)
+        last_time = table.last()
+        skip = 0 if last_time is None else bisect.bisect_right(columns[0], last_time)
+        if skip:
+            columns = [column[skip:] for column in columns]
+        table.append_columns(columns)
+        return len(columns[0])
+
+    def trade_columns(self, symbol: str, start_time: int = None, end_time: int = None) -> List[array]:
+        """ 时间在[start_time, end_time]内的成交的 时间, 价格, 数量 三列 """
+        table = self._trades(symbol)
+        lo = 0 if start_time is None else table.search(start_time)
+        hi = len(table) if end_time is None else table.search(end_time + 1)
+        return table.read_columns(lo, hi, [TRADE_COLUMNS.index(name) for name in ('timestamp', 'price', 'quantity')])
+
+    def rebuild_klines(self, symbol: str, interval: str, start_time: int = None) -> int:
+        """ 从开盘时间start_time开始的成交重建interval周期的K线，写入还没有写入的已经结束的K线，返回写入的K线数
+            最后一根K线可能还没有结束，不写入
+        """
+        table = self._klines(symbol, interval)
+        interval_ms, offset_ms = KLINE_INTERVALS[interval], KLINE_OFFSETS.get(interval, 0)
+        if start_time is None:
+            last_time = table.last()
+            # 从最后一根已经写入的K线之后开始
+            start_time = None if last_time is None else last_time + interval_ms
+        else:
+            start_time = (start_time - offset_ms) // interval_ms * interval_ms + offset_ms
+        columns = trade_bars(*self.trade_columns(symbol, start_time), interval)
+        return self.append_bar_columns(symbol, interval, [column[:-1] for column in columns])
+
+    def get_trades(self, symbol: str, limit: int = 50, start_time: int = None, end_time: int = None,
+                   before_id: int = None) -> List[Trade]:
+        """ 时间在[start_time, end_time]内、trade_id小于before_id的成交，按时间递增
+            给出start_time时返回从start_time开始的limit笔，否则返回最近的limit笔
+        """
+        table = self._trades(symbol)
+        stop = None if before_id is None else table.search(before_id, TRADE_COLUMNS.index('trade_id'))
+        return [Trade(trade_id, "", "", symbol, price, quantity, 0, 0, bool(is_taker_buyer), timestamp)
+                for timestamp, trade_id, price, quantity, _, is_taker_buyer
+                in table.range(limit, start_time, end_time, stop=stop)]
+
+    def get_klines(self, symbol: str, interval: str, limit: int = 50,
+                   start_time: int = None, end_time: int = None) -> List[list]:
+        """ 开盘时间在[start_time, end_time]内的K线，格式和查询方式与KlineAggregator.get_klines一致 """
+        interval_ms = KLINE_INTERVALS[interval]
+        return [[open_time, open_, high, low, close, volume, open_time + interval_ms, quote_volume]
+                for open_time, open_, high, low, close, volume, quote_volume
+                in self._klines(symbol, interval).range(limit, start_time, end_time)]
+
+    def close(self):
+        with self.lock:
+            for table in self.tables.values():
+                table.close()
+            self.tables.clear()
@@ -0,0 +1,332 @@
+""" Kline aggregation
+    * 每个交易对、每个周期的K线按列存储在预分配的array('q')环形缓冲中，写满后覆盖最旧的K线
+    * 成交只更新最小周期(base，默认1s)的当前K线；一根K线结束时才合并到由它派生的更高周期，
+      例如 1s -> 1m -> 3m/5m，5m -> 15m -> 30m -> 1h -> 2h/4h/6h/12h，1d -> 3d/1w
+    * 查询时把派生链上尚未合并的当前K线合并进结果，所以各周期的最新K线总是包含最新成交
+    * 通过独立的consumer group从MATCH_FUNDING_MQ的成交流异步更新，不在撮合循环中计算
+    * 设置history(见src/engine/history)时，成交和每个周期已经结束的K线同时写入history
+    * 缺少K线时(重启后、新增周期)由src/engine/kline/rebuild从成交批量重建
+
+    K线格式与API一致: [开盘时间, 开, 高, 低, 收, 成交量, 收盘时间, 成交额]，价格为tick，数量为lot
+"""
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+from src.common.mmq import MATCH_FUNDING_MQ, MMQTopic
+from src.engine.types.clock import now_ms
+from src.engine.types.codec import MSG_MATCH_OUT, get_codec
+
+logger = logging.getLogger(__name__)
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+
+# 周期 -> 毫秒
+KLINE_INTERVALS = {
+    '1s': 1000,
+    '1m': MINUTE_MS,
+    '3m': 3 * MINUTE_MS,
+    '5m': 5 * MINUTE_MS,
+    '15m': 15 * MINUTE_MS,
+    '30m': 30 * MINUTE_MS,
+    '1h': HOUR_MS,
+    '2h': 2 * HOUR_MS,
+    '4h': 4 * HOUR_MS,
+    '6h': 6 * HOUR_MS,
+    '8h': 8 * HOUR_MS,
+    '12h': 12 * HOUR_MS,
+    '1d': DAY_MS,
+    '3d': 3 * DAY_MS,
+    '1w': 7 * DAY_MS,
+}
+
+# 周K线从周一开始，1970-01-05是周一
+KLINE_OFFSETS = {
+    '1w': 4 * DAY_MS,
+}
+
+# 每个周期保留的K线数
+KLINE_CAPACITY = 1000
+
+# KlineSeries的列
+COLUMNS = ('open_time', 'open', 'high', 'low', 'close', 'volume', 'quote_volume')
+
+
+class KlineSeries:
+    """ 单个交易对、单个周期的K线，列式环形缓冲
+        count为写入过的K线总数，第i根(逻辑序号)K线保存在i % capacity
+    """
+    __slots__ = ('interval_ms', 'offset_ms', 'capacity', 'count',
+                 'open_time', 'open', 'high', 'low', 'close', 'volume', 'quote_volume')
+
+    def __init__(self, interval_ms: int, offset_ms: int = 0, capacity: int = KLINE_CAPACITY):
+        if capacity < 2:
+            raise ValueError(f"Kline capacity must be at least 2, got {capacity}")
+        self.interval_ms = interval_ms
+        self.offset_ms = offset_ms
+        self.capacity = capacity
+        self.count = 0
+        self.open_time = array('q', bytes(8 * capacity))
+        self.open = array('q', bytes(8 * capacity))
+        self.high = array('q', bytes(8 * capacity))
+        self.low = array('q', bytes(8 * capacity))
+        self.close = array('q', bytes(8 * capacity))
+        self.volume = array('q', bytes(8 * capacity))
+        self.quote_volume = array('q', bytes(8 * capacity))
+
+    def align(self, timestamp: int) -> int:
+        """ timestamp所在K线的开盘时间 """
+        return (timestamp - self.offset_ms) // self.interval_ms * self.interval_ms + self.offset_ms
+
+    @property
+    def first(self) -> int:
+        """ 仍然保留的最旧K线的逻辑序号 """
+        return max(0, self.count - self.capacity)
+
+    def last_open_time(self) -> int:
+        return self.open_time[(self.count - 1) % self.capacity]
+
+    def append(self, open_time, open_, high, low, close, volume, quote_volume):
+        slot = self.count % self.capacity
+        self.open_time[slot] = open_time
+        self.open[slot] = open_
+        self.high[slot] = high
+        self.low[slot] = low
+        self.close[slot] = close
+        self.volume[slot] = volume
+        self.quote_volume[slot] = quote_volume
+        self.count += 1
+
+    def merge_last(self, high, low, close, volume, quote_volume):
+        """ 合并到最新的K线，开盘价不变 """
+        slot = (self.count - 1) % self.capacity
+        if high > self.high[slot]:
+            self.high[slot] = high
+        if low < self.low[slot]:
+            self.low[slot] = low
+        self.close[slot] = close
+        self.volume[slot] += volume
+        self.quote_volume[slot] += quote_volume
+
+    def bar(self, index: int) -> list:
+        slot = index % self.capacity
+        open_time = self.open_time[slot]
+        return [open_time, self.open[slot], self.high[slot], self.low[slot], self.close[slot],
+                self.volume[slot], open_time + self.interval_ms, self.quote_volume[slot]]
+
+    def columns(self) -> List[array]:
+        """ 保留的K线的各列(COLUMNS)，按时间从早到晚 """
+        n = min(self.count, self.capacity)
+        start = self.count % self.capacity if self.count > self.capacity else 0
+        return [column[start:n] + column[:start] for column in (getattr(self, name) for name in COLUMNS)]
+
+    def load_columns(self, columns: List[array]):
+        """ 用columns()的结果替换保存的K线，超过capacity时只保留最新的 """
+        n = len(columns[0])
+        keep = min(n, self.capacity)
+        for name, column in zip(COLUMNS, columns):
+            getattr(self, name)[:keep] = column[n - keep:]
+        self.count = keep
+
+    def search(self, timestamp: int) -> int:
+        """ 第一根开盘时间 >= timestamp 的K线的逻辑序号，K线按开盘时间递增 """
+        lo, hi = self.first, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.open_time[mid % self.capacity] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+def _merge_bar(bar: list, other: list):
+    """ 把时间上更晚的other合并到bar """
+    if other[2] > bar[2]:
+        bar[2] = other[2]
+    if other[3] < bar[3]:
+        bar[3] = other[3]
+    bar[4] = other[4]
+    bar[5] += other[5]
+    bar[7] += other[7]
+
+
+class KlineAggregator:
+    """ 多个交易对、多个周期的K线聚合 """
+
+    def __init__(self, intervals: List[str] = tuple(KLINE_INTERVALS), capacity: int = KLINE_CAPACITY):
+        unknown = [name for name in intervals if name not in KLINE_INTERVALS]
+        if unknown:
+            raise ValueError(f"Unknown kline intervals {unknown}")
+        # 按周期从小到大排序，最小的周期直接由成交更新
+        self.intervals = sorted(set(intervals), key=lambda name: KLINE_INTERVALS[name])
+        self.capacity = capacity
+        self.base = self.intervals[0]
+        # 每个周期由能整除它(且对齐)的最大的更小周期派生
+        self.sources: Dict[str, Optional[str]] = {self.base: None}
+        self.children: Dict[str, List[str]] = {name: [] for name in self.intervals}
+        for i, name in enumerate(self.intervals[1:], 1):
+            ms, offset = KLINE_INTERVALS[name], KLINE_OFFSETS.get(name, 0)
+            source = next((src for src in reversed(self.intervals[:i])
+                           if ms % KLINE_INTERVALS[src] == 0
+                           and (offset - KLINE_OFFSETS.get(src, 0)) % KLINE_INTERVALS[src] == 0), None)
+            if source is None:
+                raise ValueError(f"Kline interval {name} can not be derived from {self.intervals[:i]}")
+            self.sources[name] = source
+            self.children[source].append(name)
+        # symbol -> interval -> KlineSeries
+        self.series: Dict[str, Dict[str, KlineSeries]] = {}
+        self.lock = threading.Lock()
+        # HistoryStore，为None时不保存历史
+        self.history = None
+        # 已经结束、还没有写入history的K线: (symbol, 周期, K线)
+        self.closed_bars = []
+
+    def new_series(self, interval: str) -> KlineSeries:
+        return KlineSeries(KLINE_INTERVALS[interval], KLINE_OFFSETS.get(interval, 0), self.capacity)
+
+    def _get_series(self, symbol: str) -> Dict[str, KlineSeries]:
+        series = self.series.get(symbol)
+        if series is None:
+            series = self.series[symbol] = {name: self.new_series(name) for name in self.intervals}
+        return series
+
+    def _fold(self, symbol: str, series: Dict[str, KlineSeries], name: str):
+        """ name周期最新的K线已经结束，合并到由它派生的周期 """
+        src = series[name]
+        if self.history is not None:
+            self.closed_bars.append((symbol, name, src.bar(src.count - 1)))
+        slot = (src.count - 1) % src.capacity
+        open_time = src.open_time[slot]
+        for child_name in self.children[name]:
+            child = series[child_name]
+            child_open_time = child.align(open_time)
+            if child.count and child_open_time <= child.last_open_time():
+                child.merge_last(src.high[slot], src.low[slot], src.close[slot], src.volume[slot], src.quote_volume[slot])
+            else:
+                if child.count:
+                    self._fold(symbol, series, child_name)
+                child.append(child_open_time, src.open[slot], src.high[slot], src.low[slot], src.close[slot],
+                             src.volume[slot], src.quote_volume[slot])
+
+    def _add_trade(self, symbol: str, series: Dict[str, KlineSeries], price: int, quantity: int, timestamp: int):
+        base = series[self.base]
+        open_time = base.align(timestamp)
+        # 时间回拨的成交计入当前K线
+        if base.count and open_time <= base.last_open_time():
+            base.merge_last(price, price, price, quantity, price * quantity)
+        else:
+            if base.count:
+                self._fold(symbol, series, self.base)
+            base.append(open_time, price, price, price, price, quantity, price * quantity)
+
+    def add_trade(self, symbol: str, price: int, quantity: int, timestamp: int = None):
+        if timestamp is None:
+            timestamp = now_ms()
+        with self.lock:
+            self._add_trade(symbol, self._get_series(symbol), price, quantity, timestamp)
+            if self.closed_bars:
+                self._write_closed_bars()
+
+    def on_trades(self, trades):
+        """ 一批成交，通常来自同一条撮合结果消息 """
+        if not trades:
+            return
+        with self.lock:
+            for trade in trades:
+                self._add_trade(trade.symbol, self._get_series(trade.symbol), trade.price, trade.quantity, trade.timestamp)
+            if self.history is not None:
+                self.history.append_trades(trades)
+            if self.closed_bars:
+                self._write_closed_bars()
+
+    def _write_closed_bars(self):
+        """ 持有self.lock时调用，按交易对和周期批量写入history """
+        closed, self.closed_bars = self.closed_bars, []
+        by_interval: Dict[tuple, List[list]] = {}
+        for symbol, name, bar in closed:
+            by_interval.setdefault((symbol, name), []).append(bar)
+        for (symbol, name), bars in by_interval.items():
+            self.history.append_bars(symbol, name, bars)
+
+    def oldest_open_time(self, symbol: str, interval: str) -> Optional[int]:
+        """ 内存中最早的interval周期K线的开盘时间，没有K线时返回None """
+        with self.lock:
+            series = self.series.get(symbol)
+            if series is None or interval not in series:
+                return None
+            target = series[interval]
+            if target.count:
+                return target.open_time[target.first % target.capacity]
+            pending = self._pending_bars(series, interval)
+            return pending[0][0] if pending else None
+
+    def _pending_bars(self, series: Dict[str, KlineSeries], interval: str) -> List[list]:
+        """ 派生链上还没有合并到interval的当前K线，按interval对齐后合并，时间从早到晚 """
+        target = series[interval]
+        pending = []
+        name = self.sources[interval]
+        while name is not None:
+            src = series[name]
+            if src.count:
+                bar = src.bar(src.count - 1)
+                bar[0] = target.align(bar[0])
+                bar[6] = bar[0] + target.interval_ms
+                if pending and pending[-1][0] == bar[0]:
+                    _merge_bar(pending[-1], bar)
+                else:
+                    pending.append(bar)
+            name = self.sources[name]
+        return pending
+
+    def get_klines(self, symbol: str, interval: str, limit: int = 50,
+                   start_time: int = None, end_time: int = None) -> List[list]:
+        """ 开盘时间在[start_time, end_time]内的K线，按时间递增
+            给出start_time时返回从start_time开始的limit根，否则返回最近的limit根
+        """
+        if interval not in self.children:
+            raise ValueError(f"Kline interval {interval} is not aggregated")
+        with self.lock:
+            series = self.series.get(symbol)
+            if series is None:
+                return []
+            target = series[interval]
+            pending = self._pending_bars(series, interval)
+
+            lo = target.first if start_time is None else target.search(start_time)
+            hi = target.count if end_time is None else target.search(end_time + 1)
+            if start_time is None:
+                # 最新的K线可能与pending合并，多取一根
+                lo = max(lo, hi - limit - 1)
+            else:
+                hi = min(hi, lo + limit)
+            bars = [target.bar(i) for i in range(lo, hi)]
+
+            if pending and target.count and pending[0][0] == target.last_open_time():
+                # 存储的最新K线与pending的第一根属于同一周期
+                last = pending.pop(0)
+                if hi == target.count and bars:
+                    _merge_bar(bars[-1], last)
+            bars.extend(bar for bar in pending
+                        if (start_time is None or bar[0] >= start_time) and (end_time is None or bar[0] <= end_time))
+        return bars[:limit] if start_time is not None else bars[-limit:]
+
+    async def run_forever(self, topics: List[MMQTopic], group: str = "kline"):
+        """ 作为consumer group `group`消费撮合结果，只处理其中的成交 """
+        MATCH_FUNDING_MQ.subscribe(group, topics)
+        decode_message = get_codec(MATCH_FUNDING_MQ.transport).decode_message
+        while True:
+            for topic in topics:
+                while True:
+                    messages = MATCH_FUNDING_MQ.poll(group, topic)
+                    if not messages:
+                        break
+                    for message in messages:
+                        kind, data = decode_message(message)
+                        if kind == MSG_MATCH_OUT:
+                            self.on_trades(data.get('trades'))
+
+            await MATCH_FUNDING_MQ.wait(MATCH_FUNDING_MQ.committed(group, topics))
@@ -0,0 +1,104 @@
+""" Batch kline rebuild
+    * 从一段成交的列(时间、价格、数量)一次计算任意周期的K线，用于重启后或新增周期时补齐缺少的K线，
+      不经过KlineAggregator逐笔更新
+    * 成交按时间分桶，桶边界处分组: 开/收为组内第一/最后一笔，高/低为组内最大/最小，量和额求和
+    * 安装numpy(pip install -r requirements-perf.txt)时分组由numpy的reduceat完成，否则使用等价的纯Python实现
+    * 时间回拨的成交与KlineAggregator一致，计入当前K线
+    * 更高的周期由它的来源周期已经结束的K线合并，与KlineAggregator中的派生关系一致
+"""
+from array import array
+from typing import List, Sequence
+
+from src.engine.kline.kline import COLUMNS, KLINE_INTERVALS, KLINE_OFFSETS, KlineAggregator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _to_array(values) -> array:
+    column = array('q')
+    column.frombytes(values.astype(np.int64).tobytes())
+    return column
+
+
+def _group_numpy(open_time, opens, highs, lows, closes, volumes, quote_volumes,
+                 interval_ms: int, offset_ms: int) -> List[array]:
+    if not len(open_time):
+        return [array('q') for _ in COLUMNS]
+    # 时间回拨时按之前的最大时间分桶
+    open_time = np.maximum.accumulate(open_time)
+    buckets = (open_time - offset_ms) // interval_ms * interval_ms + offset_ms
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.append(starts[1:], len(buckets)) - 1
+    return [_to_array(column) for column in (
+        buckets[starts], opens[starts], np.maximum.reduceat(highs, starts), np.minimum.reduceat(lows, starts),
+        closes[ends], np.add.reduceat(volumes, starts), np.add.reduceat(quote_volumes, starts))]
+
+
+def _group_python(rows, interval_ms: int, offset_ms: int) -> List[array]:
+    columns = [array('q') for _ in COLUMNS]
+    bucket_open, bucket_o, bucket_h, bucket_l, bucket_c, bucket_v, bucket_q = columns
+    for timestamp, open_, high, low, close, volume, quote_volume in rows:
+        bucket = (timestamp - offset_ms) // interval_ms * interval_ms + offset_ms
+        if bucket_open and bucket <= bucket_open[-1]:
+            if high > bucket_h[-1]:
+                bucket_h[-1] = high
+            if low < bucket_l[-1]:
+                bucket_l[-1] = low
+            bucket_c[-1] = close
+            bucket_v[-1] += volume
+            bucket_q[-1] += quote_volume
+        else:
+            bucket_open.append(bucket)
+            bucket_o.append(open_)
+            bucket_h.append(high)
+            bucket_l.append(low)
+            bucket_c.append(close)
+            bucket_v.append(volume)
+            bucket_q.append(quote_volume)
+    return columns
+
+
+def trade_bars(timestamps: Sequence[int], prices: Sequence[int], quantities: Sequence[int],
+               interval: str) -> List[array]:
+    """ 按时间排列的成交在interval周期的K线，返回COLUMNS顺序的列，最后一根K线可能还没有结束 """
+    interval_ms, offset_ms = KLINE_INTERVALS[interval], KLINE_OFFSETS.get(interval, 0)
+    if np is not None:
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.int64)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        return _group_numpy(timestamps, prices, prices, prices, prices, quantities, prices * quantities,
+                            interval_ms, offset_ms)
+    return _group_python(((timestamp, price, price, price, price, quantity, price * quantity)
+                          for timestamp, price, quantity in zip(timestamps, prices, quantities)),
+                         interval_ms, offset_ms)
+
+
+def merge_bars(columns: Sequence[Sequence[int]], interval: str) -> List[array]:
+    """ 把按时间排列的K线(COLUMNS顺序的列)合并为更高的interval周期 """
+    interval_ms, offset_ms = KLINE_INTERVALS[interval], KLINE_OFFSETS.get(interval, 0)
+    if np is not None:
+        return _group_numpy(*[np.asarray(column, dtype=np.int64) for column in columns], interval_ms, offset_ms)
+    return _group_python(zip(*columns), interval_ms, offset_ms)
+
+
+def rebuild_series(aggregator: KlineAggregator, symbol: str, timestamps: Sequence[int],
+                   prices: Sequence[int], quantities: Sequence[int]):
+    """ 用symbol的全部成交重建aggregator中它的各周期K线，替换已有的K线，不写入history
+        结果与把这些成交逐笔交给aggregator相同，调用方持有aggregator.lock
+    """
+    series = aggregator.series[symbol] = {}
+    built = {}
+    for name in aggregator.intervals:
+        source = aggregator.sources[name]
+        if source is None:
+            columns = trade_bars(timestamps, prices, quantities, name)
+        else:
+            # 来源周期最新的K线还没有结束，没有合并到name
+            columns = merge_bars([column[:-1] for column in built[source]], name)
+        built[name] = columns
+        series[name] = aggregator.new_series(name)
+        if columns[0]:
+            series[name].load_columns(columns)
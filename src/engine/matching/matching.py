@@ -1,52 +1,93 @@
 import logging
-#from src.engine.orderbook.orderbook import OrderBook
-from src.engine.orderbook.sll_orderbook import OrderBook
+from src.engine.orderbook.ob_interface import OrderBookInterface, new_lock
+from src.engine.orderbook.registry import create_order_book
 from src.engine.types.types import (
     Order,
     OrderTimeInForce,
     OrderType, OrderSide, OrderStatus, new_trade, empty_order
 )
-from src.common.mmq import FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, MMQTopic
+from src.engine.types.codec import MSG_CANCEL, MSG_ORDERS, get_codec
+from src.engine.types.clock import now_ms
+from src.engine.kline.kline import KlineAggregator
+from src.engine.kline.rebuild import rebuild_series
+from src.engine.matching.trade_history import TradeHistory
+from src.common.mmq import MMQ, FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, MMQTopic
+from src.common.config.metadata import amount_to_units
 from typing import List, Dict
-import asyncio
-import threading
-import time
-import json
 
 logger = logging.getLogger(__name__)
 
 MIN_MATCH_AMOUNT = 2 # USDDT
 
+# 引擎内部价格为整数tick，数量为整数lot，成交金额为 tick * lot，浮点数只在API/WS边界转换
+
 class MatchingEngine:
-    def __init__(self):
+    def __init__(self, in_mq: MMQ = FUNDING_MATCH_MQ, out_mq: MMQ = MATCH_FUNDING_MQ, lock_free: bool = False, snapshot_depth: int = 0):
+        """ lock_free为True时引擎和order book都不加锁，只能由单个线程访问(撮合分片)
+            snapshot_depth > 0时，每轮处理完输入消息后把有变化的交易对的深度快照发布到SPOT_SNAPSHOT，
+            供其他进程的API/WS读取(多进程部署)
+        """
+        self.in_mq = in_mq
+        self.out_mq = out_mq
+        # 传给order book backend的公共参数
+        self.book_params = {'lock_free': True} if lock_free else {}
         self.order_books = {}
-        self.lock = threading.RLock()
-        # Store trades by symbol
-        self.trades = {}
+        self.lock = new_lock(lock_free, reentrant=True)
+        # Recent trades by symbol and by user
+        self.trades = TradeHistory()
         # WebSocket clients for trade updates
         self.ws_clients = []
 
-        self.max_kline_size = 200
-        self.klines = {}
+        # K线由成交流异步更新，不在撮合循环中计算
+        self.klines = KlineAggregator()
+        # 成交和K线的历史(HistoryStore)，内存中的最近成交和K线不够时查询
+        self.history = None
+
+        self.snapshot_depth = snapshot_depth
+        # 上次发布快照后有变化的交易对
+        self.dirty_symbols = set()
 
 
     ### RPC interface
-    def get_order_book(self, symbol) -> OrderBook:
+    def get_order_book(self, symbol) -> OrderBookInterface:
         with self.lock:
             if symbol not in self.order_books:
-                self.order_books[symbol] = OrderBook(symbol)
+                # backend由metadata中交易对的order book配置决定
+                self.order_books[symbol] = create_order_book(symbol, **self.book_params)
             return self.order_books[symbol]
 
-    def process_order(self, order):
+    def switch_order_book(self, symbol, backend, **params) -> OrderBookInterface:
+        """ 切换交易对的order book backend，挂单按原有时间顺序迁移到新order book
+            新order book不能容纳全部挂单时(如超出ladder的价格区间)抛出ValueError，继续使用原order book
+        """
+        with self.lock:
+            new_book = create_order_book(symbol, backend, **self.book_params, **params)
+            old_book = self.order_books.get(symbol)
+            if old_book:
+                # orders按加入order book的顺序保存
+                orders = list(old_book.orders.values())
+                rejected = [order.order_id for order in orders if new_book.add_order(order) is None]
+                # 超过订单数限制时新order book可能淘汰已经加入的挂单
+                if rejected or len(new_book.orders) != len(orders):
+                    raise ValueError(f"Order book {backend} of {symbol} can not hold {len(orders)} resting orders, "
+                                     f"rejected {rejected[:10]}")
+            self.order_books[symbol] = new_book
+            return new_book
+
+    def process_order(self, order, timestamp=None):
+        """ timestamp为消息的时间戳(ms)，本次撮合的成交和K线更新都使用这个时间
+        """
         trades = []
         order_book = self.get_order_book(order.symbol)
+        if timestamp is None:
+            timestamp = now_ms()
         
         # Process market order
         if order.type == OrderType.MARKET:
-            trades = self._process_market_order(order_book, order)
+            trades = self._process_market_order(order_book, order, timestamp)
         # Process limit order
         else:
-            trades = self._process_limit_order(order_book, order)
+            trades = self._process_limit_order(order_book, order, timestamp)
 
         # Store trades and notify WebSocket clients
         if trades:
@@ -54,7 +95,15 @@ class MatchingEngine:
         
         return trades
 
-    def _process_limit_order(self, order_book, order):
+    def _rest_order(self, order_book, order):
+        """ 未完全成交的限价单加入order book
+            order book拒绝时(如超出ladder的价格区间)撤销剩余数量，撮合结果中作为removed_orders发送，由资金解冻
+        """
+        if order_book.add_order(order) is None:
+            logger.warning("Order %s at price %s is rejected by the order book of %s", order.order_id, order.price, order.symbol)
+            order.status = OrderStatus.CANCELLED
+
+    def _process_limit_order(self, order_book, order, timestamp):
         trades = []
 
         if order.side == OrderSide.BUY:
@@ -78,20 +127,19 @@ class MatchingEngine:
                     quantity=match_quantity,
                     buy_order_id=order.order_id,
                     sell_order_id=best_ask.order_id,
-                    is_taker_buyer=True
+                    is_taker_buyer=True,
+                    timestamp=timestamp
                 )
                 trades.append(trade)
-                self.update_klines(order.symbol, best_ask.price, match_quantity)
                 
-                # Update order filled quantity
+                # Update order filled quantity, fully filled maker is removed by order book
                 order.filled_quantity += match_quantity
-                best_ask.filled_quantity += match_quantity
+                order_book.update_order(best_ask.order_id, best_ask.filled_quantity + match_quantity)
                 best_ask.trade_num += 1
 
                 # Check if sell order is fully filled
                 if best_ask.filled_quantity >= best_ask.quantity:
                     best_ask.status = OrderStatus.FILLED
-                    order_book.remove_order(best_ask.order_id)
                 else:
                     best_ask.status = OrderStatus.PARTIALLY_FILLED
 
@@ -107,7 +155,7 @@ class MatchingEngine:
                     order.trade_num += 1
                 else:
                     order.status = OrderStatus.NEW
-                order_book.add_order(order)
+                self._rest_order(order_book, order)
             else:
                 # full filled
                 order.trade_num += 1
@@ -133,20 +181,19 @@ class MatchingEngine:
                     quantity=match_quantity,
                     buy_order_id=best_bid.order_id,
                     sell_order_id=order.order_id,
-                    is_taker_buyer=False
+                    is_taker_buyer=False,
+                    timestamp=timestamp
                 )
                 trades.append(trade)
-                self.update_klines(order.symbol, best_bid.price, match_quantity)
 
-                # Update order filled quantity
+                # Update order filled quantity, fully filled maker is removed by order book
                 order.filled_quantity += match_quantity
-                best_bid.filled_quantity += match_quantity
+                order_book.update_order(best_bid.order_id, best_bid.filled_quantity + match_quantity)
                 best_bid.trade_num += 1
 
                 # Check if buy order is fully filled
                 if best_bid.filled_quantity >= best_bid.quantity:
                     best_bid.status = OrderStatus.FILLED
-                    order_book.remove_order(best_bid.uid, best_bid.order_id)
                 else:
                     best_bid.status = OrderStatus.PARTIALLY_FILLED
 
@@ -162,22 +209,23 @@ class MatchingEngine:
                     order.trade_num += 1
                 else:
                     order.status = OrderStatus.NEW
-                order_book.add_order(order)
+                self._rest_order(order_book, order)
             else:
                 # full filled
                 order.trade_num += 1
 
         return trades
 
-    def _process_market_order(self, order_book, order):
+    def _process_market_order(self, order_book, order, timestamp):
         """ 处理市场订单
-            order.quantity is the amount of quote for market buy
+            order.quantity is the amount of quote for market buy, in units of tick * lot
         """
         trades = []
 
         if order.side == OrderSide.BUY:
             # Market buy order matches all sell orders, at least 2U for each trade
-            while order.filled_quantity + MIN_MATCH_AMOUNT < order.quantity:
+            min_match_amount = amount_to_units(order.symbol, MIN_MATCH_AMOUNT)
+            while order.filled_quantity + min_match_amount < order.quantity:
                 best_ask = order_book.get_best_ask()
                 if not best_ask:
                     break
@@ -188,8 +236,10 @@ class MatchingEngine:
                     # maker order is full filled
                     match_quantity = best_ask.quantity - best_ask.filled_quantity
                 else:
-                    # market taker is full filled
-                    match_quantity = taker_amount / best_ask.price
+                    # market taker is full filled, rounded down to whole lots
+                    match_quantity = taker_amount // best_ask.price
+                    if match_quantity <= 0:
+                        break
 
                 # Generate trade
                 trade = new_trade(
@@ -200,20 +250,19 @@ class MatchingEngine:
                     quantity=match_quantity,
                     buy_order_id=order.order_id,
                     sell_order_id=best_ask.order_id,
-                    is_taker_buyer=True
+                    is_taker_buyer=True,
+                    timestamp=timestamp
                 )
                 trades.append(trade)
-                self.update_klines(order.symbol, best_ask.price, match_quantity)
 
-                # Update order filled quantity
+                # Update order filled quantity, fully filled maker is removed by order book
                 order.filled_quantity += match_quantity * best_ask.price
-                best_ask.filled_quantity += match_quantity
+                order_book.update_order(best_ask.order_id, best_ask.filled_quantity + match_quantity)
                 best_ask.trade_num += 1
 
                 # Check if sell order is fully filled
                 if best_ask.filled_quantity >= best_ask.quantity:
                     best_ask.status = OrderStatus.FILLED
-                    order_book.remove_order(best_ask.uid, best_ask.order_id)
                 else:
                     best_ask.status = OrderStatus.PARTIALLY_FILLED
 
@@ -238,19 +287,18 @@ class MatchingEngine:
                     quantity=match_quantity,
                     buy_order_id=best_bid.order_id,
                     sell_order_id=order.order_id,
-                    is_taker_buyer=False
+                    is_taker_buyer=False,
+                    timestamp=timestamp
                 )
                 trades.append(trade)
-                self.update_klines(order.symbol, best_bid.price, match_quantity)
                 
-                # Update order filled quantity
+                # Update order filled quantity, fully filled maker is removed by order book
                 order.filled_quantity += match_quantity
-                best_bid.filled_quantity += match_quantity
+                order_book.update_order(best_bid.order_id, best_bid.filled_quantity + match_quantity)
 
                 # Check if buy order is fully filled
                 if best_bid.filled_quantity >= best_bid.quantity:
                     best_bid.status = OrderStatus.FILLED
-                    order_book.remove_order(best_bid.uid, best_bid.order_id)
                 else:
                     best_bid.status = OrderStatus.PARTIALLY_FILLED
 
@@ -269,8 +317,8 @@ class MatchingEngine:
             cancel single order
         """
         order_book = self.get_order_book(symbol)
-        order = order_book.remove_order(uid, order_id)
-        if order and order.uid == uid:
+        order = order_book.get_order(uid, order_id)
+        if order and order_book.remove_order(order_id):
             order.status = OrderStatus.CANCELLED
         else:
             # If the order doesn't exist, return an empty order with canceled status
@@ -291,50 +339,53 @@ class MatchingEngine:
     def create_order(self, uid, symbol, side, order_type, time_in_force, quantity, price=None, client_order_id=None, is_futures=False):
         """ RPC interface
         """
-        logger.debug(f"create_order called with: symbol={symbol}, side={side}, order_type={order_type}, quantity={quantity}, price={price}, client_order_id={client_order_id}, is_futures={is_futures}")
+        logger.debug("create_order called with: symbol=%s, side=%s, order_type=%s, quantity=%s, price=%s, client_order_id=%s, is_futures=%s", symbol, side, order_type, quantity, price, client_order_id, is_futures)
         try:
-            logger.debug(f"About to create Order with order_type={order_type}")
+            logger.debug("About to create Order with order_type=%s", order_type)
             order = Order(uid, symbol, side, order_type, time_in_force, quantity, price, client_order_id, is_futures)
-            logger.debug(f"Order created successfully: {order.order_id} - {order.client_order_id}")
+            logger.debug("Order created successfully: %s - %s", order.order_id, order.client_order_id)
         except Exception as e:
             import traceback
-            logger.debug(f"Error creating order: {e}")
+            logger.debug("Error creating order: %s", e)
             traceback.print_exc()
             raise
 
         trades = self.process_order(order)
+        self.klines.on_trades(trades)
         return trades, order
 
     def create_orders(self, uid, params, is_futures=False):
         """ RPC interface
             batch create orders, discard market orders and IOC/FOK orders
         """
-        logger.debug(f"Creating orders with params: {params}")
+        logger.debug("Creating orders with params: %s", params)
         buy_orders = [Order(uid,
                 symbol=param.get('symbol'),
-                client_order_id=param.get('client_order_id') or str(int(time.time() * 1000)),
+                client_order_id=param.get('client_order_id') or str(now_ms()),
                 side=param.get('side'),
                 order_type=param.get('type'),
                 time_in_force=param.get('time_in_force'),
-                quantity=float(param.get('quantity')),
-                price=float(param.get('price')) if param.get('price') else 0,
+                quantity=int(param.get('quantity')),
+                price=int(param.get('price')) if param.get('price') else 0,
                 is_futures=is_futures
             ) for param in params if param.get('side') == OrderSide.BUY and param.get('type') == OrderType.LIMIT and param.get('time_in_force') != OrderTimeInForce.IOC and param.get('time_in_force') != OrderTimeInForce.FOK]
         buy_orders.sort(key=lambda x: x.price, reverse=True)
 
         sell_orders = [Order(uid,
                 symbol=param.get('symbol'),
-                client_order_id=param.get('client_order_id') or str(int(time.time() * 1000)),
+                client_order_id=param.get('client_order_id') or str(now_ms()),
                 side=param.get('side'),
                 order_type=param.get('type'),
                 time_in_force=param.get('time_in_force'),
-                quantity=float(param.get('quantity')),
-                price=float(param.get('price')) if param.get('price') else 0,
+                quantity=int(param.get('quantity')),
+                price=int(param.get('price')) if param.get('price') else 0,
                 is_futures=is_futures
             ) for param in params if param.get('side') == OrderSide.SELL and param.get('type') == OrderType.LIMIT and param.get('time_in_force') != OrderTimeInForce.IOC and param.get('time_in_force') != OrderTimeInForce.FOK]
         sell_orders.sort(key=lambda x: x.price)
  
         order_book = self.get_order_book(buy_orders[0].symbol if buy_orders else sell_orders[0].symbol)
+        # 同一批次使用同一个时间戳
+        timestamp = now_ms()
 
         total_trades = []
         for idx, order in enumerate(sell_orders):
@@ -342,7 +393,7 @@ class MatchingEngine:
             best_bid = order_book.get_best_bid()
             if best_bid and best_bid.price >= order.price:
                 if order.time_in_force == OrderTimeInForce.GTC and order.is_selftrade:
-                    trades = self.process_order(order)
+                    trades = self.process_order(order, timestamp)
                     total_trades.extend(trades)
                 continue
 
@@ -354,13 +405,14 @@ class MatchingEngine:
             best_ask = order_book.get_best_ask()
             if best_ask and best_ask.price <= order.price:
                 if order.time_in_force == OrderTimeInForce.GTC and order.is_selftrade:
-                    trades = self.process_order(order)
+                    trades = self.process_order(order, timestamp)
                     total_trades.extend(trades)
                 continue
 
             order_book.batch_add_orders(OrderSide.BUY, buy_orders[idx:])
             break
 
+        self.klines.on_trades(total_trades)
         return total_trades, buy_orders + sell_orders
 
     def cancel_orders(self, uid, symbol, order_ids):
@@ -369,160 +421,109 @@ class MatchingEngine:
         return order_book.batch_remove_orders(uid, order_ids)
 
     def get_open_orders(self, uid, symbol=None):
-        order_book = self.get_order_book(symbol)
-        return order_book.pending_orders(uid)
+        """ RPC interface
+            symbol为空时返回用户在所有交易对上的挂单
+        """
+        if symbol:
+            return self.get_order_book(symbol).pending_orders(uid)
+        with self.lock:
+            order_books = list(self.order_books.values())
+        orders = []
+        for order_book in order_books:
+            orders.extend(order_book.pending_orders(uid))
+        return orders
 
     def _store_trades(self, symbol, trades):
         with self.lock:
-            if symbol not in self.trades:
-                self.trades[symbol] = []
-            # Store last 1000 trades per symbol
-            self.trades[symbol].extend(trades)
-            if len(self.trades[symbol]) > 1000:
-                self.trades[symbol] = self.trades[symbol][-1000:]
+            self.trades.add(symbol, trades)
+
+    def set_history(self, history):
+        """ K线聚合时把成交和已经结束的K线写入history(见src/engine/history)，get_trades/get_klines从history补充更早的数据 """
+        self.history = history
+        self.klines.history = history
 
     def get_trades(self, symbol, limit=50):
+        """ 交易对最近的成交 """
+        with self.lock:
+            trades = self.trades.recent(symbol, limit)
+        if self.history is not None and len(trades) < limit:
+            # 内存中最早的成交之前的成交从history查询
+            before_id = trades[0].trade_id if trades else None
+            trades = self.history.get_trades(symbol, limit - len(trades), before_id=before_id) + trades
+        return trades
+
+    def get_user_trades(self, uid, symbol, limit=50):
+        """ 用户在交易对上最近的成交，包括taker和maker """
         with self.lock:
-            if symbol not in self.trades:
-                return []
-            return self.trades[symbol][-limit:]
+            return self.trades.user_trades(uid, symbol, limit)
 
     def append_trade(self, uid, symbol, price, quantity):
-        if symbol not in self.trades:
-            self.trades[symbol] = []
         trade = new_trade(
             uid,
             uid,
             symbol,
             price,
             quantity,
-            int(time.time() * 1000),
-            int(time.time() * 1000),
+            now_ms(),
+            now_ms(),
             True
         )
-        with self.lock:
-            self.trades[symbol].append(trade)
-
-    def update_klines(self, symbol, price, quantity):
-        # Update klines for the given symbol with the latest trade price and quantity
-        if symbol not in self.klines:
-            self.klines[symbol] = {
-                '1m': [],
-                '1h': [],
-                '1d': [],
-                'prev_update_minute': 0,
-                'prev_update_hour': 0,
-                'prev_update_day': 0,
-            }
-
-        klines = self.klines[symbol]
-        minute = time.time() // 60
-        logger.debug(f"Updating klines for {symbol} at minute={minute}, prev_update_minute={klines['prev_update_minute']}")
-        logger.debug(f"previous klines: {klines['1m']}")
-        if klines['prev_update_minute'] != minute:
-            ts = int(time.time() * 1000)
-            klines['1m'].append([
-                ts,      # Open time
-                price,        # Open price
-                price,        # High price
-                price,        # Low price
-                price,        # Close price
-                quantity,      # Volume
-                ts + 60 * 1000,        # Close time
-                quantity * price # Quote asset volume
-            ])
-
-            if len(klines['1m']) > self.max_kline_size * 2:
-                klines['1m'] = klines['1m'][-self.max_kline_size:]
-        else:
-            # update latest bar
-            latest_bar = klines['1m'][-1]
-            latest_bar[2] = max(price, latest_bar[2])  # High price
-            latest_bar[3] = min(price, latest_bar[3])  # Low price
-            latest_bar[4] = price  # Close price
-            latest_bar[5] += quantity  # Volume
-            latest_bar[7] += quantity * price  # Quote asset volume
-        logger.debug(f"updated klines: {klines['1m']}")
-
-        hour = minute // 60
-        logger.debug(f"Updating klines for {symbol} at hour={hour}, prev_update_hour={klines['prev_update_hour']}")
-        if klines['prev_update_hour'] == hour:
-            # update latest bar
-            latest_bar = klines['1h'][-1]
-            latest_bar[2] = max(price, latest_bar[2])  # High price
-            latest_bar[3] = min(price, latest_bar[3])  # Low price
-            latest_bar[4] = price  # Close price
-            latest_bar[5] += quantity  # Volume
-            latest_bar[7] += quantity * price  # Quote asset volume
-        else:
-            ts = int(time.time() * 1000)
-            klines['1h'].append([
-                ts,           # Open time
-                price,        # Open price
-                price,        # High price
-                price,        # Low price
-                price,        # Close price
-                quantity,     # Volume
-                ts + 3600 * 1000,        # Close time
-                quantity * price # Quote asset volume
-            ])
-
-            if len(klines['1h']) > self.max_kline_size * 1.5:
-                klines['1h'] = klines['1h'][-self.max_kline_size:]
-
-
-        day = hour // 24
-        logger.debug(f"Updating klines for {symbol} at day={day}, prev_update_day={klines['prev_update_day']}")
-        if klines['prev_update_day'] == day:
-            # update latest bar
-            latest_bar = klines['1d'][-1]
-            latest_bar[2] = max(price, latest_bar[2])  # High price
-            latest_bar[3] = min(price, latest_bar[3])  # Low price
-            latest_bar[4] = price  # Close price
-            latest_bar[5] += quantity  # Volume
-            latest_bar[7] += quantity * price  # Quote asset volume
-        else:
-            ts = int(time.time() * 1000)
-            klines['1d'].append([
-                ts,      # Open time
-                price,        # Open price
-                price,        # High price
-                price,        # Low price
-                price,        # Close price
-                quantity,      # Volume
-                ts + 24 * 3600 * 1000,        # Close time
-                quantity * price # Quote asset volume
-            ])
-
-            if len(klines['1d']) > self.max_kline_size * 1.2:
-                klines['1d'] = klines['1d'][-self.max_kline_size:]
-        
-        klines['prev_update_minute'] = minute
-        klines['prev_update_hour'] = hour
-        klines['prev_update_day'] = day
-
-    def get_klines(self, symbol, interval, limit=50):
-        with self.lock:
-            if symbol not in self.klines:
-                return []
-            return self.klines[symbol][interval][-limit:]
+        self._store_trades(symbol, [trade])
 
+    def update_klines(self, symbol, price, quantity, timestamp=None):
+        self.klines.add_trade(symbol, price, quantity, timestamp)
 
+    def rebuild_klines(self, symbol, intervals=None):
+        """ 从history中保存的成交批量重建K线(重启后、新增周期)
+            history中写入缺少的已经结束的K线，内存中没有该交易对的K线时同时重建内存中的各周期K线
+            返回每个周期写入history的K线数
+        """
+        if self.history is None:
+            raise ValueError("Rebuilding klines requires a history store")
+        intervals = self.klines.intervals if intervals is None else intervals
+        written = {interval: self.history.rebuild_klines(symbol, interval) for interval in intervals}
+        with self.klines.lock:
+            if symbol not in self.klines.series:
+                rebuild_series(self.klines, symbol, *self.history.trade_columns(symbol))
+        return written
+
+    def get_klines(self, symbol, interval, limit=50, start_time=None, end_time=None):
+        if self.history is not None and interval not in self.klines.children:
+            # 内存中不聚合的周期只从history查询
+            return self.history.get_klines(symbol, interval, limit, start_time, end_time)
+        bars = self.klines.get_klines(symbol, interval, limit, start_time, end_time)
+        if self.history is None:
+            return bars
+        # 内存中最早的K线之前的K线从history查询
+        oldest = self.klines.oldest_open_time(symbol, interval)
+        if oldest is None:
+            return self.history.get_klines(symbol, interval, limit, start_time, end_time)
+        end = oldest - 1 if end_time is None else min(end_time, oldest - 1)
+        if start_time is None:
+            if len(bars) < limit:
+                bars = self.history.get_klines(symbol, interval, limit - len(bars), end_time=end) + bars
+        elif start_time < oldest:
+            bars = (self.history.get_klines(symbol, interval, limit, start_time, end) + bars)[:limit]
+        return bars
 
     ### MMQ interface
     def on_order(self, order: Order):
         """ MQ interface
             process single order
         """
-        logger.debug(f"on_order called with: {order.to_dict()}")
-        trades = self.process_order(order)
-        MATCH_FUNDING_MQ.produce(MMQTopic.SPOT_MATCH_OUT, json.dumps({'trades': [tr.to_dict() for tr in trades], 'order': order.to_dict()}))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("on_order called with: %s", order.to_dict())
+        trades = self.process_order(order, now_ms())
+        self.dirty_symbols.add(order.symbol)
+        removed_orders = [order] if order.status == OrderStatus.CANCELLED else None
+        self.out_mq.produce(MMQTopic.SPOT_MATCH_OUT, get_codec(self.out_mq.transport).encode_match_out(
+            trades=trades, order=order, removed_orders=removed_orders))
 
     def on_orders(self, orders: List[Order]):
         """ MQ interface
             batch create orders, discard market orders and IOC/FOK orders
         """
-        logger.debug(f"on_orders called with: {orders}")
+        logger.debug("on_orders called with: %s", orders)
         buy_orders = [order for order in orders if order.side == OrderSide.BUY]
         buy_orders.sort(key=lambda x: x.price, reverse=True)
 
@@ -530,17 +531,22 @@ class MatchingEngine:
         sell_orders.sort(key=lambda x: x.price)
  
         order_book = self.get_order_book(buy_orders[0].symbol if buy_orders else sell_orders[0].symbol)
+        # 同一批次使用同一个时间戳
+        timestamp = now_ms()
 
         total_trades = []
+        # 批量铺单的订单
+        batched = []
         for idx, order in enumerate(sell_orders):
             # Batch orders, simplified matching process
             best_bid = order_book.get_best_bid()
             if best_bid and best_bid.price >= order.price:
                 if order.time_in_force == OrderTimeInForce.GTC and order.is_selftrade:
-                    trades = self.process_order(order)
+                    trades = self.process_order(order, timestamp)
                     total_trades.extend(trades)
                 continue
 
+            batched.extend(sell_orders[idx:])
             order_book.batch_add_orders(OrderSide.SELL, sell_orders[idx:])
             break
 
@@ -549,14 +555,24 @@ class MatchingEngine:
             best_ask = order_book.get_best_ask()
             if best_ask and best_ask.price <= order.price:
                 if order.time_in_force == OrderTimeInForce.GTC and order.is_selftrade:
-                    trades = self.process_order(order)
+                    trades = self.process_order(order, timestamp)
                     total_trades.extend(trades)
                 continue
 
+            batched.extend(buy_orders[idx:])
             order_book.batch_add_orders(OrderSide.BUY, buy_orders[idx:])
             break
 
-        MATCH_FUNDING_MQ.produce(MMQTopic.SPOT_MATCH_OUT, json.dumps({'trades': [tr.to_dict() for tr in total_trades], 'orders': [order.to_dict() for order in buy_orders + sell_orders]}))
+        # 批量铺单成功的订单，order book拒绝的订单撤销
+        for order in batched:
+            if order.order_id in order_book.orders:
+                order.status = OrderStatus.NEW
+            else:
+                order.status = OrderStatus.CANCELLED
+        removed_orders = [order for order in buy_orders + sell_orders if order.status == OrderStatus.CANCELLED]
+        self.dirty_symbols.add(order_book.symbol)
+        self.out_mq.produce(MMQTopic.SPOT_MATCH_OUT, get_codec(self.out_mq.transport).encode_match_out(
+            trades=total_trades, orders=buy_orders + sell_orders, removed_orders=removed_orders or None))
 
     def on_cancel_orders(self, data: Dict):
         """ MQ interface
@@ -567,38 +583,48 @@ class MatchingEngine:
         order_ids = data['order_ids']
         order_book = self.get_order_book(symbol)
         removed_orders = order_book.batch_remove_orders(uid, order_ids)
-        logger.debug(f"MONITOR uid={uid} symbol={symbol} removed {len(removed_orders)}/{len(order_ids)}")
-        MATCH_FUNDING_MQ.produce(MMQTopic.SPOT_MATCH_OUT, json.dumps({'removed_orders': [order.to_dict() for order in removed_orders]}))
-
-    async def run_forever(self, topics: List[MMQTopic]):
+        self.dirty_symbols.add(symbol)
+        logger.debug("MONITOR uid=%s symbol=%s removed %s/%s", uid, symbol, len(removed_orders), len(order_ids))
+        self.out_mq.produce(MMQTopic.SPOT_MATCH_OUT, get_codec(self.out_mq.transport).encode_match_out(removed_orders=removed_orders))
+
+    def on_message(self, kind: int, data):
+        """ 处理一条解码后的输入消息 """
+        if kind == MSG_CANCEL:
+            self.on_cancel_orders(data)
+        elif kind == MSG_ORDERS:
+            self.on_orders(data)
+        else:
+            self.on_order(data)
+
+    def publish_snapshots(self) -> int:
+        """ 发布有变化的交易对的深度快照，返回发布的数量 """
+        if not self.snapshot_depth or not self.dirty_symbols:
+            return 0
+        encode_snapshot = get_codec(self.out_mq.transport).encode_snapshot
+        symbols, self.dirty_symbols = self.dirty_symbols, set()
+        for symbol in symbols:
+            ob = self.get_order_book(symbol).get_order_book(self.snapshot_depth)
+            self.out_mq.produce(MMQTopic.SPOT_SNAPSHOT, encode_snapshot(symbol, ob.timestamp, ob.bids, ob.asks))
+        return len(symbols)
+
+    async def run_forever(self, topics: List[MMQTopic], group: str = "matching"):
         """ Get messages from the MMQ and process them
+            drain all available messages as consumer group `group`, then wait until the next message is produced
         """
-        prev_topic_offsets = {
-            topic: 0 for topic in topics
-        }
+        self.in_mq.subscribe(group, topics)
+        decode_message = get_codec(self.in_mq.transport).decode_message
         while True:
-            has_message = False
             for topic in topics:
-                prev_offset = prev_topic_offsets[topic]
-                queue_offset, message = FUNDING_MATCH_MQ.consume(topic, prev_offset)
-                logger.debug(f"Consumed message from {topic} offset={queue_offset}: {message}")
-                if message:
-                    prev_topic_offsets[topic] = queue_offset + 1
-                    data = json.loads(message)
-                    if topic == MMQTopic.MATCH_IN_SPOT_CANCEL:
-                        self.on_cancel_orders(data)
-                        continue
-                    # topic == MMQTopic.SPOT_NEW
-                    if type(data) is list:
-                        self.on_orders([Order.from_dict(order) for order in data])
-                    else:
-                        self.on_order(Order.from_dict(data))
-                    has_message = True
-
-            if has_message:
-                await asyncio.sleep(0.05)
-            else:
-                await asyncio.sleep(0.1)
+                while True:
+                    messages = self.in_mq.poll(group, topic)
+                    if not messages:
+                        break
+                    logger.debug("Consumed %s messages from %s", len(messages), topic)
+                    for message in messages:
+                        self.on_message(*decode_message(message))
+
+            self.publish_snapshots()
+            await self.in_mq.wait(self.in_mq.committed(group, topics))
 
 # Global trading engine instance
 global_spot_engine = MatchingEngine()
@@ -0,0 +1,59 @@
+""" Matching shard routing
+    * MATCHING_SHARDS=0(默认)时不分片，所有交易对使用MATCH_IN_SPOT_NEW/MATCH_IN_SPOT_CANCEL
+    * 分片时每个分片有独立的输入topic，如spot_new.0/spot_cancel.0，同一交易对总是路由到同一个分片，
+      交易对内订单的先后顺序不变
+    * 交易对 -> 分片 默认按crc32取模(进程间稳定)，可以通过MATCHING_SHARD_CONFIG把一组交易对指定到同一分片，
+      如 {"90000001": 0, "90000002": 0, "90000003": 1}
+"""
+import json
+import os
+import zlib
+from typing import Dict, List
+
+from src.common.mmq import MMQTopic
+
+MATCHING_SHARDS = int(os.environ.get('MATCHING_SHARDS', 0))
+
+
+def shard_topic(topic: str, shard: int) -> str:
+    return f"{topic}.{shard}"
+
+
+class ShardRouter:
+    def __init__(self, num_shards: int = 0, assignments: Dict[str, int] = None):
+        if num_shards < 0:
+            raise ValueError(f"num_shards must be >= 0, got {num_shards}")
+        for symbol, shard in (assignments or {}).items():
+            if not 0 <= shard < num_shards:
+                raise ValueError(f"Shard {shard} of symbol {symbol} is out of range [0, {num_shards})")
+        self.num_shards = num_shards
+        self.assignments = dict(assignments or {})
+
+    @property
+    def sharded(self) -> bool:
+        return self.num_shards > 0
+
+    def shard(self, symbol: str) -> int:
+        shard = self.assignments.get(symbol)
+        if shard is None:
+            shard = zlib.crc32(symbol.encode()) % self.num_shards
+        return shard
+
+    def new_topic(self, symbol: str) -> str:
+        """ 交易对新订单的输入topic """
+        if not self.sharded:
+            return MMQTopic.MATCH_IN_SPOT_NEW
+        return shard_topic(MMQTopic.MATCH_IN_SPOT_NEW, self.shard(symbol))
+
+    def cancel_topic(self, symbol: str) -> str:
+        """ 交易对撤单的输入topic """
+        if not self.sharded:
+            return MMQTopic.MATCH_IN_SPOT_CANCEL
+        return shard_topic(MMQTopic.MATCH_IN_SPOT_CANCEL, self.shard(symbol))
+
+    def topics(self, shard: int) -> List[str]:
+        """ 分片消费的输入topic """
+        return [shard_topic(MMQTopic.MATCH_IN_SPOT_NEW, shard), shard_topic(MMQTopic.MATCH_IN_SPOT_CANCEL, shard)]
+
+
+SPOT_ROUTER = ShardRouter(MATCHING_SHARDS, json.loads(os.environ.get('MATCHING_SHARD_CONFIG', '{}')))
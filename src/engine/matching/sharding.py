@@ -0,0 +1,160 @@
+""" Sharded matching engine
+    * 每个分片是一个独立的撮合进程，拥有分片内交易对的order book，单线程撮合，引擎和order book都不加锁
+    * 撮合是CPU密集型的，多个分片进程绕开GIL，交易对数量增加时可以扩展到多核
+    * Funding.put_spot_order按交易对把订单路由到分片的输入topic(见router.py)
+    * 主进程为每个分片运行一个转发协程：以consumer group matching.<shard>消费分片topic，批量放入分片进程的输入队列；
+      收集线程把分片的撮合结果写回MATCH_FUNDING_MQ，资金、K线等消费者不需要改动
+    * 每个分片最多MAX_INFLIGHT_BATCHES个批次在途，分片处理不过来时消息留在MMQ中，lag超过高水位后
+      Funding拒绝新订单(back-pressure)
+    * 分片进程的成交ID使用节点号 ENGINE_NODE_ID + 1 + shard，与主进程和其他分片不重复
+    * snapshot_depth > 0时，分片每个批次处理完后发布有变化的交易对的深度快照，收集线程写入SPOT_SNAPSHOT
+
+    MATCHING_SHARDS=4 python src/app.py
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from typing import List
+
+from src.common.mmq import MMQ, FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, MMQTopic
+from src.engine.matching.matching import MatchingEngine
+from src.engine.matching.router import ShardRouter, SPOT_ROUTER
+from src.engine.types.codec import get_codec
+from src.engine.types.ids import SnowflakeIdGenerator, set_trade_id_generator
+
+logger = logging.getLogger(__name__)
+
+# 每个分片在途(已发送、未返回结果)的最大批次数
+MAX_INFLIGHT_BATCHES = 2
+
+
+def shard_node_id(shard: int) -> int:
+    return (int(os.environ.get('ENGINE_NODE_ID', 0)) + 1 + shard) % (SnowflakeIdGenerator.MAX_NODE + 1)
+
+
+def run_shard_worker(shard: int, in_transport: str, out_transport: str, in_queue, out_queue, snapshot_depth: int = 0):
+    """ 分片进程入口
+        输入为编码后的消息批次，每个批次处理完后把 (撮合结果, 深度快照) 作为一个批次返回，None表示退出
+    """
+    set_trade_id_generator(SnowflakeIdGenerator(shard_node_id(shard)))
+    decode_message = get_codec(in_transport).decode_message
+    out_mq = MMQ(transport=out_transport)
+    engine = MatchingEngine(out_mq=out_mq, lock_free=True, snapshot_depth=snapshot_depth)
+    offset = snapshot_offset = 0
+    while True:
+        batch = in_queue.get()
+        if batch is None:
+            break
+        for message in batch:
+            engine.on_message(*decode_message(message))
+        engine.publish_snapshots()
+        results, snapshots = [], []
+        while True:
+            offset, messages = out_mq.consume_batch(MMQTopic.SPOT_MATCH_OUT, offset)
+            if not messages:
+                break
+            results.extend(messages)
+        while True:
+            snapshot_offset, messages = out_mq.consume_batch(MMQTopic.SPOT_SNAPSHOT, snapshot_offset)
+            if not messages:
+                break
+            snapshots.extend(messages)
+        out_queue.put((shard, results, snapshots))
+
+
+class ShardedMatchingEngine:
+    """ 在主进程中管理分片进程，负责输入转发和结果收集 """
+
+    def __init__(self, router: ShardRouter = SPOT_ROUTER, in_mq: MMQ = FUNDING_MATCH_MQ, out_mq: MMQ = MATCH_FUNDING_MQ,
+                 start_method: str = 'spawn', snapshot_depth: int = 0):
+        if not router.sharded:
+            raise ValueError("ShardedMatchingEngine requires a router with at least one shard")
+        self.router = router
+        self.in_mq = in_mq
+        self.out_mq = out_mq
+        self.snapshot_depth = snapshot_depth
+        self.context = multiprocessing.get_context(start_method)
+        self.in_queues = []
+        self.out_queue = None
+        self.workers = []
+        self.collector = None
+        self.loop = None
+        self.inflight = [0] * router.num_shards
+        self.ready: List[asyncio.Event] = []
+
+    def start(self):
+        """ 启动分片进程和结果收集线程 """
+        self.out_queue = self.context.Queue()
+        for shard in range(self.router.num_shards):
+            in_queue = self.context.Queue()
+            worker = self.context.Process(
+                target=run_shard_worker,
+                args=(shard, self.in_mq.transport, self.out_mq.transport, in_queue, self.out_queue, self.snapshot_depth),
+                name=f"matching-shard-{shard}",
+                daemon=True,
+            )
+            worker.start()
+            self.in_queues.append(in_queue)
+            self.workers.append(worker)
+        self.collector = threading.Thread(target=self._collect, name="matching-shard-collector", daemon=True)
+        self.collector.start()
+
+    def stop(self, timeout: float = 5):
+        for in_queue in self.in_queues:
+            in_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        if self.collector:
+            self.out_queue.put(None)
+            self.collector.join(timeout)
+        self.in_queues, self.workers, self.collector = [], [], None
+
+    def _collect(self):
+        """ 收集线程：分片的撮合结果写回out_mq，并通知转发协程批次已完成 """
+        while True:
+            item = self.out_queue.get()
+            if item is None:
+                break
+            shard, messages, snapshots = item
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self._batch_done, shard)
+            for message in messages:
+                self.out_mq.produce(MMQTopic.SPOT_MATCH_OUT, message)
+            for message in snapshots:
+                self.out_mq.produce(MMQTopic.SPOT_SNAPSHOT, message)
+
+    def _batch_done(self, shard: int):
+        self.inflight[shard] -= 1
+        self.ready[shard].set()
+
+    async def _forward(self, shard: int, group: str):
+        topics = self.router.topics(shard)
+        self.in_mq.subscribe(group, topics)
+        in_queue = self.in_queues[shard]
+        ready = self.ready[shard]
+        while True:
+            if self.inflight[shard] >= MAX_INFLIGHT_BATCHES:
+                ready.clear()
+                await ready.wait()
+                continue
+            batch = []
+            for topic in topics:
+                batch.extend(self.in_mq.poll(group, topic))
+            if batch:
+                self.inflight[shard] += 1
+                in_queue.put(batch)
+                logger.debug("Forwarded %s messages to matching shard %s", len(batch), shard)
+            else:
+                await self.in_mq.wait(self.in_mq.committed(group, topics))
+
+    async def run_forever(self, group: str = "matching"):
+        """ 每个分片以consumer group <group>.<shard>消费自己的输入topic """
+        self.loop = asyncio.get_running_loop()
+        self.ready = [asyncio.Event() for _ in range(self.router.num_shards)]
+        if not self.workers:
+            self.start()
+        await asyncio.gather(*(self._forward(shard, f"{group}.{shard}") for shard in range(self.router.num_shards)))
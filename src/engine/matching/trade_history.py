@@ -0,0 +1,70 @@
+""" Recent trade history
+    * 每个交易对的最近成交保存在固定容量的RingBuffer中，写满后覆盖最旧的成交，不再复制整个列表
+    * 每个用户在每个交易对上的最近成交(taker和maker)单独索引，"my trades"查询不扫描公共成交
+    * 用户索引最多保留MAX_USER_RINGS个(uid, symbol)，超过时淘汰最久没有成交或查询的，
+      被淘汰的用户查询不到之前的成交，下一笔成交时重新建立索引
+    * 查询最近limit笔成交是O(limit)的切片，结果按时间从早到晚
+"""
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from src.common.mmq import RingBuffer
+from src.engine.types.types import Trade
+
+# 每个交易对保留的成交数
+SYMBOL_TRADES_CAPACITY = 1000
+# 每个用户在每个交易对上保留的成交数
+USER_TRADES_CAPACITY = 200
+# 最多保留的(uid, symbol)用户索引数
+MAX_USER_RINGS = 100_000
+
+
+def _latest(ring: RingBuffer, limit: int) -> List[Trade]:
+    start = max(ring.oldest, ring.head - limit)
+    return ring.read(start, limit)
+
+
+class TradeHistory:
+    """ 不加锁，由MatchingEngine.lock保护 """
+
+    def __init__(self, symbol_capacity: int = SYMBOL_TRADES_CAPACITY, user_capacity: int = USER_TRADES_CAPACITY,
+                 max_user_rings: int = MAX_USER_RINGS):
+        self.symbol_capacity = symbol_capacity
+        self.user_capacity = user_capacity
+        self.max_user_rings = max_user_rings
+        self.symbols: Dict[str, RingBuffer] = {}
+        # (uid, symbol) -> RingBuffer，按最近使用的顺序，最久没有使用的在最前面
+        self.users: OrderedDict[Tuple[str, str], RingBuffer] = OrderedDict()
+
+    def _user_ring(self, uid: str, symbol: str) -> RingBuffer:
+        key = (uid, symbol)
+        ring = self.users.get(key)
+        if ring is None:
+            ring = self.users[key] = RingBuffer(self.user_capacity)
+            if len(self.users) > self.max_user_rings:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(key)
+        return ring
+
+    def add(self, symbol: str, trades: List[Trade]):
+        ring = self.symbols.get(symbol)
+        if ring is None:
+            ring = self.symbols[symbol] = RingBuffer(self.symbol_capacity)
+        for trade in trades:
+            ring.append(trade)
+            self._user_ring(trade.taker_uid, symbol).append(trade)
+            # 自成交只记录一次
+            if trade.maker_uid != trade.taker_uid:
+                self._user_ring(trade.maker_uid, symbol).append(trade)
+
+    def recent(self, symbol: str, limit: int = 50) -> List[Trade]:
+        ring = self.symbols.get(symbol)
+        return _latest(ring, limit) if ring else []
+
+    def user_trades(self, uid: str, symbol: str, limit: int = 50) -> List[Trade]:
+        ring = self.users.get((uid, symbol))
+        if ring is None:
+            return []
+        self.users.move_to_end((uid, symbol))
+        return _latest(ring, limit)
@@ -0,0 +1,172 @@
+""" Read-only matching state for the API/WS process
+    * 多进程部署时撮合在独立的进程中，API/WS进程中的global_spot_engine没有真正的order book
+    * MatchingView以consumer group view消费撮合结果和深度快照，在本进程中维护只读副本:
+        深度        撮合进程发布的SPOT_SNAPSHOT，每轮撮合后更新一次
+        挂单        由撮合结果中的订单、maker成交、撤单重建，支持get_order/get_open_orders
+        最近成交    写入engine.trades，支持get_trades/get_user_trades
+    * BookView实现OrderBookInterface，安装到engine.order_books中，API/WS的查询接口不需要改动
+    * BookView只用于查询，不能用于撮合，get_best_bid/get_best_ask返回None
+"""
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from src.common.mmq import MMQ, MATCH_FUNDING_MQ, MMQTopic
+from src.engine.matching.matching import MatchingEngine, global_spot_engine
+from src.engine.orderbook.ob_interface import OrderBookInterface, OrderIndex
+from src.engine.types.codec import MSG_SNAPSHOT, get_codec
+from src.engine.types.types import Order, OrderBookModel, OrderStatus, OrderType, Trade
+
+logger = logging.getLogger(__name__)
+
+# 在对手方成交前仍然挂在order book上的订单状态
+RESTING_STATUSES = (OrderStatus.NEW, OrderStatus.PARTIALLY_FILLED)
+
+
+class BookView(OrderBookInterface):
+    """ 交易对的只读副本: 最新的深度快照 + 挂单索引 """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.lock = threading.Lock()
+        self.orders = OrderIndex()
+        self.depth = OrderBookModel(symbol)
+
+    def set_depth(self, timestamp: int, bids: list, asks: list):
+        depth = OrderBookModel(self.symbol)
+        depth.timestamp = timestamp
+        depth.bids = bids
+        depth.asks = asks
+        # 整体替换，读取方不需要加锁
+        self.depth = depth
+
+    def add_order(self, order: Order) -> Optional[Order]:
+        with self.lock:
+            self.orders[order.order_id] = order
+        return order
+
+    def remove_order(self, order_id: int) -> Optional[Order]:
+        with self.lock:
+            return self.orders.pop(order_id, None)
+
+    def batch_add_orders(self, side: str, orders: List[Order]) -> List[Order]:
+        for order in orders:
+            self.add_order(order)
+        return orders
+
+    def batch_remove_orders(self, uid: str, order_ids: List[int]) -> List[Order]:
+        removed = []
+        with self.lock:
+            for order_id in order_ids:
+                order = self.orders.get(order_id)
+                if order and order.uid == uid:
+                    removed.append(self.orders.pop(order_id))
+        return removed
+
+    def get_order(self, uid: str, order_id: int) -> Optional[Order]:
+        order = self.orders.get(order_id)
+        if order and order.uid == uid:
+            return order
+        return None
+
+    def get_order_book(self, depth: int = 10) -> OrderBookModel:
+        snapshot = self.depth
+        ob = OrderBookModel(self.symbol)
+        ob.bids = snapshot.bids[:depth]
+        ob.asks = snapshot.asks[:depth]
+        ob.timestamp = snapshot.timestamp
+        return ob
+
+    def get_best_bid(self) -> Optional[Order]:
+        return None
+
+    def get_best_ask(self) -> Optional[Order]:
+        return None
+
+    def update_order(self, order_id: int, filled_quantity: int) -> Optional[Order]:
+        """ maker成交，完全成交后删除 """
+        with self.lock:
+            order = self.orders.get(order_id)
+            if not order:
+                return None
+            order.filled_quantity = filled_quantity
+            if filled_quantity >= order.quantity:
+                order.status = OrderStatus.FILLED
+                del self.orders[order_id]
+            else:
+                order.status = OrderStatus.PARTIALLY_FILLED
+            return order
+
+    def pending_orders(self, uid: str) -> List[Order]:
+        with self.lock:
+            return self.orders.uid_orders(uid)
+
+
+class MatchingView:
+    """ 消费撮合结果和深度快照，维护engine中的BookView """
+
+    def __init__(self, engine: MatchingEngine = global_spot_engine, mq: MMQ = MATCH_FUNDING_MQ):
+        self.engine = engine
+        self.mq = mq
+
+    def get_book(self, symbol: str) -> BookView:
+        with self.engine.lock:
+            book = self.engine.order_books.get(symbol)
+            if not isinstance(book, BookView):
+                # 查询时创建的空order book替换为副本
+                book = self.engine.order_books[symbol] = BookView(symbol)
+            return book
+
+    def on_trades(self, trades: List[Trade]):
+        by_symbol: Dict[str, List[Trade]] = {}
+        for trade in trades:
+            by_symbol.setdefault(trade.symbol, []).append(trade)
+            maker_order_id = trade.sell_order_id if trade.is_taker_buyer else trade.buy_order_id
+            book = self.get_book(trade.symbol)
+            maker = book.orders.get(maker_order_id)
+            if maker:
+                book.update_order(maker_order_id, maker.filled_quantity + trade.quantity)
+        for symbol, symbol_trades in by_symbol.items():
+            self.engine._store_trades(symbol, symbol_trades)
+
+    def on_orders(self, orders: List[Order]):
+        for order in orders:
+            book = self.get_book(order.symbol)
+            if order.type == OrderType.LIMIT and order.status in RESTING_STATUSES:
+                book.add_order(order)
+            else:
+                book.remove_order(order.order_id)
+
+    def on_removed_orders(self, orders: List[Order]):
+        for order in orders:
+            self.get_book(order.symbol).remove_order(order.order_id)
+
+    def on_message(self, kind: int, data: dict):
+        if kind == MSG_SNAPSHOT:
+            self.get_book(data['symbol']).set_depth(data['timestamp'], data['bids'], data['asks'])
+            return
+        if 'trades' in data:
+            self.on_trades(data['trades'])
+        if 'order' in data:
+            self.on_orders([data['order']])
+        if 'orders' in data:
+            self.on_orders(data['orders'])
+        if 'removed_orders' in data:
+            self.on_removed_orders(data['removed_orders'])
+
+    async def run_forever(self, topics: List[str] = (MMQTopic.SPOT_MATCH_OUT, MMQTopic.SPOT_SNAPSHOT), group: str = "view"):
+        """ drain all available messages as consumer group `group`, then wait until the next message is produced """
+        topics = list(topics)
+        self.mq.subscribe(group, topics)
+        decode_message = get_codec(self.mq.transport).decode_message
+        while True:
+            for topic in topics:
+                while True:
+                    messages = self.mq.poll(group, topic)
+                    if not messages:
+                        break
+                    logger.debug("Consumed %s messages from %s", len(messages), topic)
+                    for message in messages:
+                        self.on_message(*decode_message(message))
+
+            await self.mq.wait(self.mq.committed(group, topics))
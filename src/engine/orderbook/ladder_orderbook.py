@@ -0,0 +1,408 @@
+""" Price Ladder Order Book
+    * 适用于tick固定、价格在中间价附近有界波动的交易对
+    * 价格挡位预分配在数组中，下标为 (price - base_price) / tick_size，插入、撤单、最优价查询均为O(1)
+    * 用两级位图记录非空挡位，最优挡位清空时通过位图查找下一个非空挡位
+    * 订单节点复用sll_orderbook的OrderPool/LevelOrder，相同价格的订单用链表按时间顺序存储
+    * 超出价格区间的订单拒绝加入(add_order返回None)，由撮合引擎撤销
+    * 未指定价格区间时使用metadata中交易对的价格范围；没有配置价格范围时使用DEFAULT_PRICE_LEVELS个挡位，
+      两侧都为空则以下一个订单价格为中心重新确定价格区间
+"""
+from src.common.config.metadata import get_symbol_price_range, price_to_ticks
+from src.engine.orderbook.ob_interface import OrderBookInterface, OrderIndex, new_lock
+from src.engine.orderbook.sll_orderbook import PriceLevel, LevelOrder, OrderPool
+from src.engine.types.types import Order, OrderSide, OrderBookModel
+from src.engine.types.clock import now_ms
+from typing import List, Optional, Tuple
+
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+# 没有配置价格范围的交易对的默认挡位数
+DEFAULT_PRICE_LEVELS = 10_000
+# 按价格范围计算的挡位数上限，挡位全部预分配
+MAX_PRICE_LEVELS = 2_000_000
+
+
+class OccupancyBitmap:
+    """ 两级位图，记录非空挡位
+        * words[i] 的第j位表示挡位 i * 64 + j 是否非空
+        * summary 的第i位表示 words[i] 是否非0
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.words = [0] * ((size + WORD_BITS - 1) // WORD_BITS)
+        self.summary = 0
+
+    def set(self, index: int):
+        w = index >> 6
+        self.words[w] |= 1 << (index & 63)
+        self.summary |= 1 << w
+
+    def clear(self, index: int):
+        w = index >> 6
+        word = self.words[w] & ~(1 << (index & 63))
+        self.words[w] = word
+        if not word:
+            self.summary &= ~(1 << w)
+
+    def next_set(self, index: int) -> int:
+        """ 查找 >= index 的第一个非空挡位，不存在返回-1
+        """
+        if index >= self.size:
+            return -1
+        w = index >> 6
+        word = self.words[w] & (WORD_MASK << (index & 63))
+        if not word:
+            rest = self.summary >> (w + 1)
+            if not rest:
+                return -1
+            w += (rest & -rest).bit_length()
+            word = self.words[w]
+        return (w << 6) + (word & -word).bit_length() - 1
+
+    def prev_set(self, index: int) -> int:
+        """ 查找 <= index 的最后一个非空挡位，不存在返回-1
+        """
+        if index < 0:
+            return -1
+        w = index >> 6
+        word = self.words[w] & (WORD_MASK >> (63 - (index & 63)))
+        if not word:
+            rest = self.summary & ((1 << w) - 1)
+            if not rest:
+                return -1
+            w = rest.bit_length() - 1
+            word = self.words[w]
+        return (w << 6) + word.bit_length() - 1
+
+
+class PriceLadder:
+    """ 单边价格阶梯，best指向最优非空挡位下标，为-1时表示该侧为空
+    """
+    def __init__(self, size: int, order_pool: OrderPool):
+        self.size = size
+        self.order_pool = order_pool
+        # 预分配全部价格挡位，PriceLevel不需要跳表指针，level_index即挡位下标
+        self.levels = [PriceLevel(0, 0, i) for i in range(size)]
+        self.bitmap = OccupancyBitmap(size)
+        self.best = -1
+        self.level_num = 0
+
+    def is_empty(self) -> bool:
+        return self.best < 0
+
+    def _better(self, a: int, b: int) -> bool:
+        raise NotImplementedError
+
+    def _next_level(self, index: int) -> int:
+        """ 查找比index差(含index)的下一个非空挡位
+        """
+        raise NotImplementedError
+
+    def _farest_level(self) -> int:
+        raise NotImplementedError
+
+    def insert_node(self, order: Order, index: int) -> Optional[LevelOrder]:
+        """ 插入订单到index挡位末尾，返回订单节点，失败返回None
+        """
+        new_order = self.order_pool.new(order)
+        if not new_order:
+            return None
+
+        price_level = self.levels[index]
+        if price_level.order_num == 0:
+            price_level.price = order.price
+            price_level.quantity = 0
+            self.bitmap.set(index)
+            self.level_num += 1
+            if self.best < 0 or self._better(index, self.best):
+                self.best = index
+
+        new_order.prev = price_level.level_tail
+        new_order.next = None
+        new_order.price_level = price_level
+        price_level.level_tail.next = new_order
+        price_level.level_tail = new_order
+        price_level.order_num += 1
+        price_level.quantity += order.quantity - order.filled_quantity
+        return new_order
+
+    def delete_node(self, node: LevelOrder) -> bool:
+        """ 根据订单节点直接删除订单，O(1)
+            最优挡位被清空时通过位图查找下一个非空挡位
+        """
+        price_level = node.price_level
+        if price_level is None:
+            return False
+
+        node.prev.next = node.next
+        if node.next:
+            node.next.prev = node.prev
+        if node is price_level.level_tail:
+            price_level.level_tail = node.prev
+
+        order = node.order
+        price_level.quantity -= order.quantity - order.filled_quantity
+        self.order_pool.free(node)
+        price_level.order_num -= 1
+        if price_level.order_num == 0:
+            self._clear_level(price_level.level_index)
+        return True
+
+    def fill_node(self, node: LevelOrder, quantity: float):
+        """ 订单部分成交，扣减所属挡位的未成交总量
+        """
+        node.price_level.quantity -= quantity
+
+    def _clear_level(self, index: int):
+        price_level = self.levels[index]
+        price_level.level_head.next = None
+        price_level.level_tail = price_level.level_head
+        price_level.quantity = 0
+        self.bitmap.clear(index)
+        self.level_num -= 1
+        if index == self.best:
+            self.best = self._next_level(index)
+
+    def delete_farest_level(self) -> List[Order]:
+        """删除最远挡位的全部订单，返回删除的订单列表
+        """
+        orders = []
+        index = self._farest_level()
+        if index < 0:
+            return orders
+
+        price_level = self.levels[index]
+        order_node = price_level.level_head.next
+        while order_node:
+            next_node = order_node.next
+            orders.append(order_node.order)
+            self.order_pool.free(order_node)
+            order_node = next_node
+
+        price_level.order_num = 0
+        self._clear_level(index)
+        return orders
+
+    def peek(self) -> Optional[Order]:
+        if self.best < 0:
+            return None
+        return self.levels[self.best].level_head.next.order
+
+    def peek_depth(self, depth: int) -> List[Tuple[float, float]]:
+        levels = []
+        index = self.best
+        while index >= 0 and len(levels) < depth:
+            price_level = self.levels[index]
+            levels.append((price_level.price, price_level.quantity))
+            index = self._next_level(index + self._step)
+        return levels
+
+
+class AskLadder(PriceLadder):
+    """ 卖方价格升序，下标越小越优
+    """
+    _step = 1
+
+    def _better(self, a: int, b: int) -> bool:
+        return a < b
+
+    def _next_level(self, index: int) -> int:
+        return self.bitmap.next_set(index)
+
+    def _farest_level(self) -> int:
+        return self.bitmap.prev_set(self.size - 1)
+
+
+class BidLadder(PriceLadder):
+    """ 买方价格降序，下标越大越优
+    """
+    _step = -1
+
+    def _better(self, a: int, b: int) -> bool:
+        return a > b
+
+    def _next_level(self, index: int) -> int:
+        return self.bitmap.prev_set(index)
+
+    def _farest_level(self) -> int:
+        return self.bitmap.next_set(0)
+
+
+class OrderBook(OrderBookInterface):
+    """ 单币对价格区间为 [base_price, base_price + max_price_level * tick_size)，最多支持max_orders个订单
+        * 价格为整数tick，tick_size为挡位间隔
+        * max_price_level为None时按metadata中交易对的价格范围确定价格区间，没有配置时为DEFAULT_PRICE_LEVELS
+        * base_price为None且没有按价格范围确定时，以第一个订单价格为中心确定价格区间，之后两侧都为空时重新确定
+        * 超出订单数限制则主动撤最远挡位的订单
+    """
+    def __init__(self, symbol, base_price=None, tick_size=1, max_price_level=None, max_orders=20_000, logger=None, lock_free=False):
+        self.symbol = symbol
+        if max_price_level is None:
+            price_range = get_symbol_price_range(symbol)
+            if price_range is None:
+                max_price_level = DEFAULT_PRICE_LEVELS
+            else:
+                low, high = (price_to_ticks(symbol, price) for price in price_range)
+                if base_price is None:
+                    base_price = low - low % tick_size
+                max_price_level = (high - base_price) // tick_size + 1
+                if not 0 < max_price_level <= MAX_PRICE_LEVELS:
+                    raise ValueError(f"Price range {price_range} of {symbol} needs {max_price_level} ladder levels, "
+                                     f"expected 1 to {MAX_PRICE_LEVELS}")
+        self.base_price = base_price
+        # 未指定base_price时价格区间跟随订单价格移动
+        self.auto_base = base_price is None
+        self.tick_size = tick_size
+        self.max_price_level = max_price_level
+        self.ask_order_pool = OrderPool(max_orders)
+        self.bid_order_pool = OrderPool(max_orders)
+
+        self.asks = AskLadder(max_price_level, self.ask_order_pool)
+        self.bids = BidLadder(max_price_level, self.bid_order_pool)
+        self.orders = OrderIndex()
+        # order_id -> LevelOrder，撤单时直接定位订单节点及所属挡位
+        self.order_nodes = {}
+        self.ask_lock = new_lock(lock_free)
+        self.bid_lock = new_lock(lock_free)
+
+        self.logger = logger
+
+    def _price_index(self, price) -> int:
+        """ 价格对应的挡位下标，不在价格区间内或不是tick整数倍时返回-1
+        """
+        if self.auto_base and self.asks.is_empty() and self.bids.is_empty():
+            # 两侧都为空，以当前价格为中心重新确定价格区间
+            self.base_price = price - (self.max_price_level // 2) * self.tick_size
+
+        offset = price - self.base_price
+        if offset % self.tick_size:
+            return -1
+        index = offset // self.tick_size
+        if index < 0 or index >= self.max_price_level:
+            return -1
+        return index
+
+    def add_order(self, order: Order) -> Optional[Order]:
+        """ 添加订单到order book
+        """
+        if order.order_id in self.orders:
+            return None
+
+        if order.side == OrderSide.BUY:
+            lock, ladder, order_pool = self.bid_lock, self.bids, self.bid_order_pool
+        else:
+            lock, ladder, order_pool = self.ask_lock, self.asks, self.ask_order_pool
+
+        with lock:
+            index = self._price_index(order.price)
+            if index < 0:
+                if self.logger:
+                    self.logger.warning("order %s price %s is out of ladder range of %s", order.order_id, order.price, self.symbol)
+                return None
+
+            if order_pool.is_full():
+                # 超过最大订单数限制，删除最远档位下所有订单
+                removed_orders = ladder.delete_farest_level()
+                for ro in removed_orders:
+                    if ro.order_id in self.orders:
+                        del self.orders[ro.order_id]
+                    self.order_nodes.pop(ro.order_id, None)
+
+            node = ladder.insert_node(order, index)
+            if not node:
+                return None
+
+        self.orders[order.order_id] = order
+        self.order_nodes[order.order_id] = node
+        return order
+
+    def remove_order(self, order_id: str) -> Optional[Order]:
+        """ 删除订单，通过order_nodes索引直接摘除订单节点
+        """
+        if order_id not in self.orders:
+            return None
+        order = self.orders.pop(order_id)
+        node = self.order_nodes.pop(order_id)
+
+        if order.side == OrderSide.BUY:
+            with self.bid_lock:
+                self.bids.delete_node(node)
+        else:
+            with self.ask_lock:
+                self.asks.delete_node(node)
+        return order
+
+    def batch_add_orders(self, side: str, orders: List[Order]) -> List[Order]:
+        """ 批量添加订单
+        """
+        results = []
+        for order in orders:
+            if self.add_order(order):
+                results.append(order)
+        return results
+
+    def batch_remove_orders(self, uid: str, order_ids: List[str]) -> List[Order]:
+        """ 批量删除订单
+        """
+        results = []
+        for order_id in order_ids:
+            order = self.orders.get(order_id)
+            if not order or order.uid != uid:
+                continue
+            if self.remove_order(order_id):
+                results.append(order)
+        return results
+
+    def get_order(self, uid: str, order_id: str) -> Optional[Order]:
+        """ 获取订单
+        """
+        order = self.orders.get(order_id)
+        if order and order.uid == uid:
+            return order
+        return None
+
+    def get_order_book(self, depth=30) -> OrderBookModel:
+        """ 获取订单薄
+        """
+        ob = OrderBookModel(self.symbol)
+        with self.ask_lock:
+            ob.asks = self.asks.peek_depth(depth)
+        with self.bid_lock:
+            ob.bids = self.bids.peek_depth(depth)
+        ob.timestamp = now_ms()
+        return ob
+
+    def get_best_bid(self) -> Optional[Order]:
+        with self.bid_lock:
+            return self.bids.peek()
+
+    def get_best_ask(self) -> Optional[Order]:
+        with self.ask_lock:
+            return self.asks.peek()
+
+    def update_order(self, order_id: str, filled_quantity: float) -> Optional[Order]:
+        """ 更新maker订单
+        """
+        order = self.orders.get(order_id)
+        if not order:
+            return None
+
+        node = self.order_nodes[order_id]
+        if order.side == OrderSide.BUY:
+            with self.bid_lock:
+                self.bids.fill_node(node, filled_quantity - order.filled_quantity)
+                order.filled_quantity = filled_quantity
+        else:
+            with self.ask_lock:
+                self.asks.fill_node(node, filled_quantity - order.filled_quantity)
+                order.filled_quantity = filled_quantity
+
+        if order.filled_quantity >= order.quantity:
+            self.remove_order(order.order_id)
+        return order
+
+    def pending_orders(self, uid):
+        """获取用户所有待处理订单"""
+        return self.orders.uid_orders(uid)
@@ -1,6 +1,18 @@
+from contextlib import nullcontext
 from typing import Optional, List
+import threading
 from src.engine.types.types import Order, OrderBookModel
 
+# 单线程独占的order book(如撮合分片)不需要加锁
+NO_LOCK = nullcontext()
+
+
+def new_lock(lock_free: bool = False, reentrant: bool = False):
+    """ order book使用的锁，lock_free为True时返回空操作的上下文 """
+    if lock_free:
+        return NO_LOCK
+    return threading.RLock() if reentrant else threading.Lock()
+
 
 class OrderBookInterface:
     """ Order book interface
@@ -54,3 +66,86 @@ class OrderBookInterface:
         """ 获取用户待成交订单
         """
         raise NotImplementedError
+
+
+class OrderIndex(dict):
+    """ order_id -> Order，同时维护 uid -> {order_id: Order} 索引
+        * order book的所有增删(挂单、撤单、完全成交、挤出)都经过__setitem__/__delitem__/pop，索引自动更新
+        * 按uid查询挂单不再扫描整个order book，结果保持挂单的先后顺序
+    """
+    __slots__ = ('by_uid',)
+
+    def __init__(self):
+        super().__init__()
+        self.by_uid = {}
+
+    def _unindex(self, order_id, uid):
+        orders = self.by_uid.get(uid)
+        if orders is not None:
+            orders.pop(order_id, None)
+            if not orders:
+                del self.by_uid[uid]
+
+    def __setitem__(self, order_id, order: Order):
+        previous = dict.get(self, order_id)
+        if previous is not None and previous.uid != order.uid:
+            self._unindex(order_id, previous.uid)
+        dict.__setitem__(self, order_id, order)
+        orders = self.by_uid.get(order.uid)
+        if orders is None:
+            orders = self.by_uid[order.uid] = {}
+        orders[order_id] = order
+
+    def __delitem__(self, order_id):
+        order = dict.pop(self, order_id)
+        self._unindex(order_id, order.uid)
+
+    def pop(self, order_id, *default):
+        if order_id not in self:
+            if default:
+                return default[0]
+            raise KeyError(order_id)
+        order = dict.pop(self, order_id)
+        self._unindex(order_id, order.uid)
+        return order
+
+    def clear(self):
+        dict.clear(self)
+        self.by_uid.clear()
+
+    def uid_orders(self, uid: str) -> List[Order]:
+        orders = self.by_uid.get(uid)
+        return list(orders.values()) if orders else []
+
+
+class LevelQuantity:
+    """ 按价格增量维护各挡位未成交总量，供没有价格挡位节点的order book计算深度
+        * 插入订单时累加，成交时扣减，删除订单时扣除剩余数量
+        * 挡位订单数量为0时删除该价格
+    """
+    def __init__(self):
+        # price -> [未成交总量, 订单数量]
+        self.levels = {}
+
+    def add(self, price: float, quantity: float):
+        level = self.levels.get(price)
+        if level is None:
+            self.levels[price] = [quantity, 1]
+        else:
+            level[0] += quantity
+            level[1] += 1
+
+    def fill(self, price: float, quantity: float):
+        self.levels[price][0] -= quantity
+
+    def remove(self, price: float, quantity: float):
+        level = self.levels[price]
+        level[1] -= 1
+        if level[1] == 0:
+            del self.levels[price]
+        else:
+            level[0] -= quantity
+
+    def get(self, price: float) -> float:
+        level = self.levels.get(price)
+        return level[0] if level else 0
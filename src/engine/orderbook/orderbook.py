@@ -1,7 +1,6 @@
-import time
 from src.engine.types.types import Order, OrderSide, OrderStatus, OrderBookModel
-import threading
-from src.engine.orderbook.ob_interface import OrderBookInterface
+from src.engine.types.clock import now_ms
+from src.engine.orderbook.ob_interface import OrderBookInterface, LevelQuantity, OrderIndex, new_lock
 from typing import List, Optional
 
 
@@ -39,252 +38,134 @@ class BaseSortedCircularArray:
                 break
         return orders[:size]
 
-    def peek_depth(self, size) -> list[tuple[float, float]]:
-        orders = []
-        head, tail = self.head, self.tail
-        while head != tail:
-            order = self.orders[head]
-            if order is None:
-                break
-            if not orders or order.price != orders[-1][0]:
-                orders.append((order.price, order.quantity - order.filled_quantity))
-            else:
-                orders[-1] = (order.price, orders[-1][1] + order.quantity - order.filled_quantity)
-            head = (head + 1) % self.max_size
-            if len(orders) >= size:
-                break
-        return orders[:size]
+    def peek_depth(self, size, levels: LevelQuantity) -> list[tuple[float, float]]:
+        # Same-price orders are contiguous, binary search the next price and read level quantity from levels
+        depth = []
+        count = len(self)
+        offset = 0
+        while offset < count and len(depth) < size:
+            price = self.orders[(self.head + offset) % self.max_size].price
+            depth.append((price, levels.get(price)))
+            start, end = offset + 1, count
+            while start < end:
+                mid = (start + end) // 2
+                if self.orders[(self.head + mid) % self.max_size].price == price:
+                    start = mid + 1
+                else:
+                    end = mid
+            offset = start
+        return depth
+
+    def is_full(self):
+        return (self.tail + 1) % self.max_size == self.head
+
+    def peek_tail(self):
+        # Get the worst order (tail of queue)
+        if self.head == self.tail:
+            return None
+        return self.orders[self.tail - 1]
 
     def remove(self, order_id):
-        # Linear search and remove order by order_id
-        head, tail = self.head, self.tail
-        if head == tail:
-            # Queue is empty
-            return False
-
-        if head < tail:
-            for i in range(head, tail):
-                if self.orders[i].order_id == order_id:
-                    for j in range(i+1, tail):
-                        self.orders[j-1] = self.orders[j]
-                    self.tail -= 1
-                    self.orders[tail] = None
-                    return True
-        else:
-            # Process in two segments: first from head to max_size-1, second from 0 to tail-1
-            for i in range(head, self.max_size):
-                if self.orders[i].order_id == order_id:
-                    for j in range(i+1, self.max_size):
-                        self.orders[j-1] = self.orders[j]
-                    self.orders[self.max_size-1] = self.orders[0]
-
-                    for j in range(0, tail - 1):
-                        self.orders[j] = self.orders[j+1]
-                    if tail == 0:
-                        tail = self.max_size - 1
-                    else:
-                        tail -= 1
-                    self.orders[tail] = None
-                    self.tail = tail
-                    return True
-
-            # Search and remove order in the second segment
-            for i in range(0, tail):
-                if self.orders[i].order_id == order_id:
-                    for j in range(i+1, tail):
-                        self.orders[j-1] = self.orders[j]
-                    self.orders[tail-1] = None
-                    self.tail -= 1
-                    return True
+        # Linear search by order_id, shift the following orders forward
+        count = len(self)
+        for offset in range(count):
+            if self.orders[(self.head + offset) % self.max_size].order_id == order_id:
+                for k in range(offset, count - 1):
+                    self.orders[(self.head + k) % self.max_size] = self.orders[(self.head + k + 1) % self.max_size]
+                self.tail = (self.tail - 1) % self.max_size
+                self.orders[self.tail] = None
+                return True
         return False
 
-    def __len__(self):
-        return (self.tail - self.head + self.max_size) % self.max_size
+    def _better(self, a, b) -> bool:
+        """ price a is strictly better than price b """
+        raise NotImplementedError
 
-class BidSortedCircularArray(BaseSortedCircularArray):
     def push(self, order):
-        # Buy orders sorted by price descending, same price by time ascending
-        head, tail = self.head, self.tail
-        if head == tail:
-            # Queue is empty, insert directly
-            self.orders[self.tail] = order
-            self.tail = (self.tail + 1) % self.max_size
-            return
-
+        # Same price by time ascending: insert after all orders whose price is not worse
+        count = len(self)
         order_price = order.price
-        if (tail + 1) % self.max_size == head:
-            # Queue is full, remove lowest price order
-            if order_price <= self.orders[tail - 1].price:
-                # New order price is not higher than tail order, discard new order
+        if self.is_full():
+            # Queue is full, remove the worst order
+            worst = self.orders[(self.tail - 1) % self.max_size]
+            if not self._better(order_price, worst.price):
+                # New order price is not better than tail order, discard new order
                 order.status = OrderStatus.CANCELLED
                 return
-            else:
-                # Remove tail order
-                self.orders[tail - 1].status = OrderStatus.CANCELLED
-                self.orders[tail - 1] = None
-                tail = (tail - 1 + self.max_size) % self.max_size
-
-        if head < tail:
-            insert_idx = tail - 1
-            while insert_idx != head:
-                existing_order = self.orders[insert_idx]
-                if order_price <= existing_order.price:
-                    break
-
-                self.orders[insert_idx + 1] = self.orders[insert_idx]
-                insert_idx -= 1
-            # Insert order
-            self.orders[insert_idx + 1] = order
-            self.tail = (self.tail + 1) % self.max_size
-        else:
-            # Process in two segments: first from 0 to tail-1, second from head to max_size-1
-            if tail == 0:
-                if order_price <= self.orders[self.max_size - 1].price:
-                    self.orders[0] = order
-                    self.tail += 1
-                    return
-            else:
-                insert_idx = tail - 1
-                while insert_idx >= 0:
-                    existing_order = self.orders[insert_idx]
-                    if order_price <= existing_order.price:
-                        break
-                    self.orders[insert_idx + 1] = self.orders[insert_idx]
-                    insert_idx -= 1
-
-                # Insert order
-                if insert_idx >= 0:
-                    self.orders[insert_idx] = order
-                    self.tail += 1
-                    return
-                
-                if self.orders[self.max_size - 1].price >= order_price:
-                    self.orders[0] = order
-                    self.tail += 1
-                    return
-
-                self.orders[0] = self.orders[self.max_size - 1]
-                # Find insertion position in the second segment
-                insert_idx = self.max_size - 2
-                while insert_idx != head:
-                    existing_order = self.orders[insert_idx]
-                    if order_price <= existing_order.price:
-                        break
-                    self.orders[insert_idx + 1] = self.orders[insert_idx]
-                    insert_idx -= 1
-
-                # Insert order
-                self.orders[insert_idx + 1] = order
-                self.tail += 1
-                return
+            # Remove tail order
+            worst.status = OrderStatus.CANCELLED
+            self.tail = (self.tail - 1) % self.max_size
+            self.orders[self.tail] = None
+            count -= 1
+
+        pos = count
+        while pos > 0 and self._better(order_price, self.orders[(self.head + pos - 1) % self.max_size].price):
+            pos -= 1
+        for k in range(count, pos, -1):
+            self.orders[(self.head + k) % self.max_size] = self.orders[(self.head + k - 1) % self.max_size]
+        self.orders[(self.head + pos) % self.max_size] = order
+        self.tail = (self.tail + 1) % self.max_size
 
+    def __len__(self):
+        return (self.tail - self.head + self.max_size) % self.max_size
 
-class AskSortedCircularArray(BaseSortedCircularArray):
-    def push(self, order):
-        # Sell orders sorted by price ascending, same price by time ascending
-        head, tail = self.head, self.tail
-        if head == tail:
-            # Queue is empty, insert directly
-            self.orders[self.tail] = order
-            self.tail = (self.tail + 1) % self.max_size
-            return
+class BidSortedCircularArray(BaseSortedCircularArray):
+    # Buy orders sorted by price descending, same price by time ascending
+    def _better(self, a, b) -> bool:
+        return a > b
 
-        order_price = order.price
-        if (tail + 1) % self.max_size == head:
-            # Queue is full, remove highest price order
-            if order_price >= self.orders[tail - 1].price:
-                # New order price is not lower than head order, discard new order
-                order.status = OrderStatus.CANCELLED
-                return
-            else:
-                # Remove tail order
-                self.orders[tail - 1].status = OrderStatus.CANCELLED
-                self.orders[tail - 1] = None
-                tail = (tail - 1 + self.max_size) % self.max_size
-
-        if head < tail:
-            insert_idx = tail - 1
-            while insert_idx != head:
-                existing_order = self.orders[insert_idx]
-                if order_price >= existing_order.price:
-                    break
-
-                self.orders[insert_idx + 1] = self.orders[insert_idx]
-                insert_idx -= 1
-            # Insert order
-            self.orders[insert_idx + 1] = order
-            self.tail = (self.tail + 1) % self.max_size
-        else:
-            # Process in two segments: first from 0 to tail-1, second from head to max_size-1
-            if tail == 0:
-                if order_price >= self.orders[self.max_size - 1].price:
-                    self.orders[0] = order
-                    self.tail += 1
-                    return
-            else:
-                insert_idx = tail - 1
-                while insert_idx >= 0:
-                    existing_order = self.orders[insert_idx]
-                    if order_price >= existing_order.price:
-                        break
-                    self.orders[insert_idx + 1] = self.orders[insert_idx]
-                    insert_idx -= 1
-
-                # Insert order
-                if insert_idx >= 0:
-                    self.orders[insert_idx] = order
-                    self.tail += 1
-                    return
-
-                if self.orders[self.max_size - 1].price <= order_price:
-                    self.orders[0] = order
-                    self.tail += 1
-                    return
-
-                self.orders[0] = self.orders[self.max_size - 1]
-                # Find insertion position in the second segment
-                insert_idx = self.max_size - 2
-                while insert_idx != head:
-                    existing_order = self.orders[insert_idx]
-                    if order_price >= existing_order.price:
-                        break
-                    self.orders[insert_idx + 1] = self.orders[insert_idx]
-                    insert_idx -= 1
-                
-                # Insert order
-                self.orders[insert_idx + 1] = order
-                self.tail += 1
-                return
 
+class AskSortedCircularArray(BaseSortedCircularArray):
+    # Sell orders sorted by price ascending, same price by time ascending
+    def _better(self, a, b) -> bool:
+        return a < b
 
 
 class OrderBook(OrderBookInterface):
-    def __init__(self, symbol="BTCUSDT"):
+    def __init__(self, symbol="BTCUSDT", lock_free=False):
         self.symbol = symbol
         self.bids = BidSortedCircularArray()
         self.asks = AskSortedCircularArray()
-        self.orders = {}
-        self.lock = threading.RLock()
+        self.orders = OrderIndex()
+        # Open quantity per price level
+        self.bid_levels = LevelQuantity()
+        self.ask_levels = LevelQuantity()
+        self.lock = new_lock(lock_free, reentrant=True)
 
-    def add_order(self, order):
+    def add_order(self, order) -> Optional[Order]:
         with self.lock:
-            self.orders[order.order_id] = order
+            if order.order_id in self.orders:
+                return None
             if order.side == OrderSide.BUY:
-                self.bids.push(order)
+                book, levels = self.bids, self.bid_levels
             else:
-                self.asks.push(order)
+                book, levels = self.asks, self.ask_levels
+
+            # Full queue evicts the worst order or discards the new one
+            evicted = book.peek_tail() if book.is_full() else None
+            book.push(order)
+            if evicted is not None and evicted.status == OrderStatus.CANCELLED:
+                levels.remove(evicted.price, evicted.quantity - evicted.filled_quantity)
+                self.orders.pop(evicted.order_id, None)
+            if order.status == OrderStatus.CANCELLED:
+                return None
+            levels.add(order.price, order.quantity - order.filled_quantity)
+            self.orders[order.order_id] = order
+            return order
 
-    def remove_order(self, uid: str, order_id) -> Optional[Order]:
+    def remove_order(self, order_id) -> Optional[Order]:
         with self.lock:
             order = self.orders.get(order_id)
-            if not order or order.uid != uid:
+            if not order:
                 return None
 
             # Remove from order book
             if order.side == OrderSide.BUY:
-                self.bids.remove(order_id)
+                if self.bids.remove(order_id):
+                    self.bid_levels.remove(order.price, order.quantity - order.filled_quantity)
             else:
-                self.asks.remove(order_id)
+                if self.asks.remove(order_id):
+                    self.ask_levels.remove(order.price, order.quantity - order.filled_quantity)
             
             del self.orders[order_id]
             return order
@@ -293,9 +174,7 @@ class OrderBook(OrderBookInterface):
         """ 批量添加订单
         """
         with self.lock:
-            for order in orders:
-                self.add_order(order)
-            return orders
+            return [order for order in orders if self.add_order(order)]
 
     def batch_remove_orders(self, uid: str, order_ids: List[str]) -> List[Order]:
         """ 批量删除订单
@@ -303,7 +182,9 @@ class OrderBook(OrderBookInterface):
         removed = []
         with self.lock:
             for order_id in order_ids:
-                removed.append(self.remove_order(uid, order_id))
+                order = self.orders.get(order_id)
+                if order and order.uid == uid and self.remove_order(order_id):
+                    removed.append(order)
             return removed
 
     def get_order(self, uid: str, order_id: str) -> Optional[Order]:
@@ -320,12 +201,12 @@ class OrderBook(OrderBookInterface):
             order_book = OrderBookModel(self.symbol)
 
             # Build buy price levels
-            order_book.bids = self.bids.peek_depth(depth)
+            order_book.bids = self.bids.peek_depth(depth, self.bid_levels)
 
             # Build sell price levels
-            order_book.asks = self.asks.peek_depth(depth)
+            order_book.asks = self.asks.peek_depth(depth, self.ask_levels)
 
-            order_book.timestamp = int(time.time() * 1000)
+            order_book.timestamp = now_ms()
             return order_book
 
     def get_best_bid(self) -> Optional[Order]:
@@ -340,22 +221,24 @@ class OrderBook(OrderBookInterface):
         with self.lock:
             return self.asks.peek()
 
-    def update_order(self, uid: str, order_id: str, filled_quantity: float):
+    def update_order(self, order_id: str, filled_quantity: float):
         """更新订单成交数量
         """
         with self.lock:
             order = self.orders.get(order_id)
-            if not order or order.uid != uid:
+            if not order:
                 return None
 
+            levels = self.bid_levels if order.side == OrderSide.BUY else self.ask_levels
+            levels.fill(order.price, filled_quantity - order.filled_quantity)
             order.filled_quantity = filled_quantity
             if order.filled_quantity >= order.quantity:
-                self.remove_order(uid, order_id)
+                self.remove_order(order_id)
             return order
 
     def pending_orders(self, uid: str) -> List[Order]:
         """ 获取用户待成交订单
         """
         with self.lock:
-            return [order for order in self.orders.values() if order.uid == uid]
+            return self.orders.uid_orders(uid)
         
\ No newline at end of file
@@ -1,7 +1,6 @@
-import time
 from src.engine.types.types import Order, OrderSide, OrderStatus, OrderBookModel
-import threading
-from src.engine.orderbook.ob_interface import OrderBookInterface
+from src.engine.types.clock import now_ms
+from src.engine.orderbook.ob_interface import OrderBookInterface, LevelQuantity, OrderIndex, new_lock
 from typing import List, Optional, Tuple
 
 
@@ -81,6 +80,10 @@ class RedBlackTree:
         self.NIL.right = self.NIL
         self.root = self.NIL
         self.reverse = reverse  # 是否反转排序顺序（用于买单降序/卖单升序）
+        # 插入序号，同价订单按插入顺序排列（时间优先），不依赖毫秒时间戳或order_id
+        self.seq = 0
+        # order_id -> 树中的键
+        self.keys = {}
 
     def _compare(self, key1, key2):
         """
@@ -457,109 +460,118 @@ class RedBlackTree:
         if self._compare(node.key, end_key) < 0:
             self._range_query(node.right, start_key, end_key, result)
 
-    def __len__(self):
-        return len(self.get_all())
+    def _price_after(self, price1, price2) -> bool:
+        """
+        按排序方向判断 price1 是否位于 price2 之后
+        """
+        if self.reverse:
+            return price1 < price2
+        return price1 > price2
 
-    def is_empty(self):
-        return self.root == self.NIL
+    def _first_after_price(self, price):
+        """
+        查找排序上第一个价格位于 price 之后的节点，O(log n)
 
+        节点的键为 (price, ...)，同价节点在中序遍历中连续
+        """
+        result = self.NIL
+        node = self.root
+        while node != self.NIL:
+            if self._price_after(node.key[0], price):
+                result = node
+                node = node.left
+            else:
+                node = node.right
+        return result
 
-class BidRedBlackTree(RedBlackTree):
-    """
-    买单红黑树
-    
-    买单按价格降序排列，最高价格在前（最佳买单）
-    使用 (price, order_id) 作为键，价格相同时按订单创建时间升序排列（先进先出）
-    """
+    def peek_depth(self, size, levels: LevelQuantity):
+        """
+        获取订单簿深度
 
-    def __init__(self):
-        super().__init__(reverse=True)
+        每个价格只访问一次：读取挡位数量后直接查找下一个价格，
+        不再遍历同价订单
+
+        参数:
+            size: 挡位数量
+            levels: 各挡位未成交总量
+        """
+        depth = []
+        if self.root == self.NIL:
+            return depth
+        node = self._minimum(self.root)
+        while node != self.NIL and len(depth) < size:
+            price = node.key[0]
+            depth.append((price, levels.get(price)))
+            node = self._first_after_price(price)
+        return depth
+
+    def _new_key(self, order: Order, seq: int):
+        """生成订单在树中的键"""
+        raise NotImplementedError
 
     def push(self, order: Order):
         """添加订单"""
-        key = (order.price, order.timestamp)
+        self.seq += 1
+        key = self.keys[order.order_id] = self._new_key(order, self.seq)
         self.insert(key, order)
 
     def pop(self):
-        """弹出最佳买单（最高价）"""
+        """弹出最佳订单"""
         order = self.get_min()
         if order:
-            key = (order.price, order.order_id)
-            self.delete(key)
+            self.remove(order)
         return order
 
     def peek(self):
-        """查看最佳买单但不移除"""
+        """查看最佳订单但不移除"""
         return self.get_min()
 
     def peek_order(self, size) -> list[Order]:
-        """获取最佳买单但不移除"""
+        """获取最佳订单但不移除"""
         return self.get_all()[:size]
 
-    def peek_depth(self, size):
-        """获取订单簿深度（聚合相同价格）"""
-        orders = self.get_all()
-        depth = []
-        for order in orders[:size]:
-            qty = order.quantity - order.filled_quantity
-            if qty <= 0:
-                continue
-            if depth and depth[-1][0] == order.price:
-                depth[-1] = (depth[-1][0], depth[-1][1] + qty)
-            else:
-                depth.append((order.price, qty))
-            if len(depth) >= size:
-                break
-        return depth
+    def remove(self, order) -> bool:
+        """删除订单"""
+        key = self.keys.pop(order.order_id, None)
+        if key is None:
+            return False
+        return self.delete(key)
 
+    def __len__(self):
+        return len(self.get_all())
 
-class AskRedBlackTree(RedBlackTree):
+    def is_empty(self):
+        return self.root == self.NIL
+
+
+class BidRedBlackTree(RedBlackTree):
     """
-    卖单红黑树
+    买单红黑树
     
-    卖单按价格升序排列，最低价格在前（最佳卖单）
-    使用 (price, order_id) 作为键，价格相同时按订单ID升序排列（先进先出）
+    买单按价格降序排列，最高价格在前（最佳买单）
+    使用 (price, -seq) 作为键，树按键降序排列，价格相同时按插入顺序排列（先进先出）
     """
 
     def __init__(self):
-        super().__init__(reverse=False)
+        super().__init__(reverse=True)
 
-    def push(self, order):
-        """添加订单"""
-        key = (order.price, order.order_id)
-        self.insert(key, order)
+    def _new_key(self, order: Order, seq: int):
+        return (order.price, -seq)
 
-    def pop(self):
-        """弹出最佳卖单（最低价）"""
-        order = self.get_min()
-        if order:
-            key = (order.price, order.order_id)
-            self.delete(key)
-        return order
 
-    def peek(self):
-        """查看最佳卖单但不移除"""
-        return self.get_min()
+class AskRedBlackTree(RedBlackTree):
+    """
+    卖单红黑树
+    
+    卖单按价格升序排列，最低价格在前（最佳卖单）
+    使用 (price, seq) 作为键，价格相同时按插入顺序排列（先进先出）
+    """
 
-    def peek_order(self, size) -> list[Order]:
-        """获取最佳卖单但不移除"""
-        return self.get_all()[:size]
+    def __init__(self):
+        super().__init__(reverse=False)
 
-    def peek_depth(self, size):
-        """获取订单簿深度（聚合相同价格）"""
-        orders = self.get_all()
-        depth = []
-        for order in orders:
-            qty = order.quantity - order.filled_quantity
-            if qty <= 0:
-                continue
-            if depth and depth[-1][0] == order.price:
-                depth[-1] = (depth[-1][0], depth[-1][1] + qty)
-            else:
-                depth.append((order.price, qty))
-            if len(depth) >= size:
-                break
-        return depth
+    def _new_key(self, order: Order, seq: int):
+        return (order.price, seq)
 
 
 class OrderBook(OrderBookInterface):
@@ -577,36 +589,43 @@ class OrderBook(OrderBookInterface):
     - 线程安全（使用 RLock）
     """
     
-    def __init__(self, symbol="BTCUSDT"):
+    def __init__(self, symbol="BTCUSDT", lock_free=False):
         self.symbol = symbol
         self.bids = BidRedBlackTree()
         self.asks = AskRedBlackTree()
-        self.orders = {}
-        self.lock = threading.RLock()
+        self.orders = OrderIndex()
+        # 各挡位未成交总量
+        self.bid_levels = LevelQuantity()
+        self.ask_levels = LevelQuantity()
+        self.lock = new_lock(lock_free, reentrant=True)
 
-    def add_order(self, order):
+    def add_order(self, order) -> Optional[Order]:
         """添加订单到订单簿"""
         with self.lock:
             if order.order_id in self.orders:
-                return False
+                return None
             self.orders[order.order_id] = order
             if order.side == OrderSide.BUY:
                 self.bids.push(order)
+                self.bid_levels.add(order.price, order.quantity - order.filled_quantity)
             else:
                 self.asks.push(order)
+                self.ask_levels.add(order.price, order.quantity - order.filled_quantity)
+            return order
 
-    def remove_order(self, uid: str, order_id: str) -> Optional[Order]:
+    def remove_order(self, order_id: str) -> Optional[Order]:
         """从订单簿移除订单"""
         with self.lock:
             order = self.orders.get(order_id)
-            if not order or order.uid != uid:
+            if not order:
                 return None
 
-            key = (order.price, order.timestamp)
             if order.side == OrderSide.BUY:
-                self.bids.delete(key)
+                self.bids.remove(order)
+                self.bid_levels.remove(order.price, order.quantity - order.filled_quantity)
             else:
-                self.asks.delete(key)
+                self.asks.remove(order)
+                self.ask_levels.remove(order.price, order.quantity - order.filled_quantity)
 
             del self.orders[order_id]
             return order
@@ -614,16 +633,16 @@ class OrderBook(OrderBookInterface):
     def batch_add_orders(self, side, orders):
         """批量添加订单"""
         with self.lock:
-            for order in orders:
-                self.add_order(order)
-            return orders
+            return [order for order in orders if self.add_order(order)]
 
     def batch_remove_orders(self, uid, order_ids):
         """批量删除订单"""
         with self.lock:
             removed = []
             for order_id in order_ids:
-                removed.append(self.remove_order(uid, order_id))
+                order = self.orders.get(order_id)
+                if order and order.uid == uid and self.remove_order(order_id):
+                    removed.append(order)
             return removed
 
     def get_order(self, uid: str, order_id: str) -> Optional[Order]:
@@ -638,9 +657,9 @@ class OrderBook(OrderBookInterface):
         """获取订单簿数据"""
         with self.lock:
             order_book = OrderBookModel(self.symbol)
-            order_book.bids = self.bids.peek_depth(depth)
-            order_book.asks = self.asks.peek_depth(depth)
-            order_book.timestamp = int(time.time() * 1000)
+            order_book.bids = self.bids.peek_depth(depth, self.bid_levels)
+            order_book.asks = self.asks.peek_depth(depth, self.ask_levels)
+            order_book.timestamp = now_ms()
             return order_book
 
     def get_best_bid(self) -> Optional[Order]:
@@ -659,12 +678,14 @@ class OrderBook(OrderBookInterface):
             order = self.orders.get(order_id)
             if not order:
                 return None
+            levels = self.bid_levels if order.side == OrderSide.BUY else self.ask_levels
+            levels.fill(order.price, filled_quantity - order.filled_quantity)
             order.filled_quantity = filled_quantity
             if order.filled_quantity >= order.quantity:
-                self.remove_order(order.uid, order_id)
+                self.remove_order(order_id)
             return order
 
     def pending_orders(self, uid) -> list[Order]:
         """获取用户所有待处理订单"""
         with self.lock:
-            return [order for order in self.orders.values() if order.uid == uid]
\ No newline at end of file
+            return self.orders.uid_orders(uid)
\ No newline at end of file
@@ -0,0 +1,53 @@
+""" Order book backend registry
+    * 所有backend实现OrderBookInterface，构造函数第一个参数为symbol，其余为backend自己的参数
+    * backend按名字注册，首次使用时才import，未使用的backend不会加载
+    * 交易对使用的backend及参数由metadata.get_order_book_config配置
+"""
+import importlib
+from typing import Dict, List, Type
+
+from src.engine.orderbook.ob_interface import OrderBookInterface
+from src.common.config.metadata import get_order_book_config
+
+# name -> 模块路径，模块内的OrderBook类即backend实现
+# rsl_orderbook尚未完成，不注册
+ORDER_BOOK_BACKENDS: Dict[str, str] = {
+    'array': 'src.engine.orderbook.orderbook',
+    'sl': 'src.engine.orderbook.sl_orderbook',
+    'sll': 'src.engine.orderbook.sll_orderbook',
+    'rb': 'src.engine.orderbook.rb_orderbook',
+    'ladder': 'src.engine.orderbook.ladder_orderbook',
+}
+
+# name -> OrderBook类，已加载或手动注册的backend
+_BACKEND_CLASSES: Dict[str, Type[OrderBookInterface]] = {}
+
+
+def register_order_book(name: str, cls: Type[OrderBookInterface]):
+    """ 注册自定义order book backend """
+    _BACKEND_CLASSES[name] = cls
+
+
+def available_order_books() -> List[str]:
+    """ 所有可用的backend名字 """
+    return sorted(set(ORDER_BOOK_BACKENDS) | set(_BACKEND_CLASSES))
+
+
+def get_order_book_class(name: str) -> Type[OrderBookInterface]:
+    """ 根据名字获取backend的OrderBook类 """
+    cls = _BACKEND_CLASSES.get(name)
+    if cls is None:
+        if name not in ORDER_BOOK_BACKENDS:
+            raise ValueError(f"Unknown order book backend {name}, available: {available_order_books()}")
+        cls = _BACKEND_CLASSES[name] = importlib.import_module(ORDER_BOOK_BACKENDS[name]).OrderBook
+    return cls
+
+
+def create_order_book(symbol: str, backend: str = None, **params) -> OrderBookInterface:
+    """ 创建交易对的order book
+        backend为None时使用metadata中该交易对的配置
+    """
+    if backend is None:
+        backend, config_params = get_order_book_config(symbol)
+        params = {**config_params, **params}
+    return get_order_book_class(backend)(symbol, **params)
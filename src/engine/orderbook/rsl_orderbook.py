@@ -6,11 +6,12 @@
     * 注意：skip list的最大层数max_index_level必须满足pow(2, max_index_level) <= max_orders（最大订单数量）
 """
 from src.engine.orderbook.orderbook import OrderBookInterface
+from src.engine.orderbook.ob_interface import OrderIndex
 from src.engine.types.types import Order, OrderSide, OrderBookModel
+from src.engine.types.clock import now_ms
 from typing import List, Optional, Tuple
 import threading
 import random
-import time
 
 class OrderNode:
     def __init__(self, pool_index: int):
@@ -353,7 +354,7 @@ class OrderBook(OrderBookInterface):
         
         self.asks = AskSkipList(max_level=max_index_level, order_pool=self.ask_order_pool)
         self.bids = BidSkipList(max_level=max_index_level, order_pool=self.bid_order_pool)
-        self.orders = {}
+        self.orders = OrderIndex()
         self.ask_lock = threading.Lock()
         self.bid_lock = threading.Lock()
 
@@ -444,7 +445,7 @@ class OrderBook(OrderBookInterface):
             ob.asks = self.asks.peek_depth(depth)
         with self.bid_lock:
             ob.bids = self.bids.peek_depth(depth)
-        ob.timestamp = int(time.time() * 1000)
+        ob.timestamp = now_ms()
         return ob
 
     def get_best_bid(self) -> Optional[Order]:
@@ -469,4 +470,4 @@ class OrderBook(OrderBookInterface):
 
     def pending_orders(self, uid):
         """获取用户所有待处理订单"""
-        return [order for order in self.orders.values() if order.uid == uid]
+        return self.orders.uid_orders(uid)
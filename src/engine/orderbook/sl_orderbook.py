@@ -3,15 +3,14 @@
     2. 远盘使用基于多维数组的链表+跳表
     3. 使用HashMap存储订单详情
 """
-import time
 import random
-import threading
 import logging
 from typing import Tuple, List, Optional, Dict
 from functools import cmp_to_key
 
 from src.engine.types.types import Order, OrderSide, OrderStatus, OrderBookModel
-from src.engine.orderbook.ob_interface import OrderBookInterface
+from src.engine.types.clock import now_ms
+from src.engine.orderbook.ob_interface import OrderBookInterface, LevelQuantity, OrderIndex, new_lock
 
 MAX_NEAR_SIZE = 1_000
 
@@ -291,29 +290,25 @@ class SortedBaseArray:
             return None
         return self._values[0][0] # order id, price, timestamp
 
-    def peek_depth(self, depth: int, order_info: Dict[str, Order]) -> List[Tuple[float, float]]:
-        """ peek the first depth orders in the array
+    def peek_depth(self, depth: int, levels: LevelQuantity) -> List[Tuple[float, float]]:
+        """ peek the first depth price levels in the array
+            同价订单在数组中连续，二分查找跳到下一个价格，挡位数量从levels中读取
         """
-        if self._capacity == 0:
-            return []
-
-        level = 0
-        levels = []
-        oid, price, _ = self._values[0]
-        curr_price, curr_qty = price, order_info[oid].quantity - order_info[oid].filled_quantity
-        for i in range(1, self._capacity):
-            oid, price, _ = self._values[i]
-            if price != curr_price:
-                levels.append((curr_price, curr_qty))
-                level += 1
-                if level > depth:
-                    break
-                curr_price, curr_qty = price, order_info[oid].quantity - order_info[oid].filled_quantity
-            curr_qty += order_info[oid].quantity - order_info[oid].filled_quantity
-
-        if level <= depth:
-            levels.append((curr_price, curr_qty))
-        return levels
+        result = []
+        idx = 0
+        while idx < self._capacity and len(result) < depth:
+            price = self._values[idx][1]
+            result.append((price, levels.get(price)))
+            # 二分查找第一个价格不同的订单
+            start, end = idx + 1, self._capacity
+            while start < end:
+                mid = (start + end) // 2
+                if self._values[mid][1] == price:
+                    start = mid + 1
+                else:
+                    end = mid
+            idx = start
+        return result
 
 
 class SortedAskArray(SortedBaseArray):
@@ -552,44 +547,45 @@ class SkipList:
         self._free_node(node)
         return order
 
-    def peek_depth(self, depth: int) -> List[Tuple[float, float]]:
-        """ peek the first depth orders in the array
+    def _price_after(self, a: float, b: float) -> bool:
+        """ 价格a在排序上是否位于价格b之后
         """
-        if self.capacity == 0:
-            return []
+        raise NotImplementedError
 
-        level = 0
-        levels = []
+    def peek_depth(self, depth: int, levels: LevelQuantity) -> List[Tuple[float, float]]:
+        """ peek the first depth price levels in the skip list
+            每个挡位通过跳表索引跳到下一个价格，挡位数量从levels中读取
+        """
+        result = []
         current = self.head.forward[0]
-        curr_price, curr_qty = current.order.price, current.order.quantity - current.order.filled_quantity
-        while current.forward[0]:
-            current = current.forward[0]
-            price, qty = current.order.price, current.order.quantity - current.order.filled_quantity
-            if price != curr_price:
-                levels.append((curr_price, curr_qty))
-                level += 1
-                if level > depth:
-                    break
-
-                curr_price = price
-                curr_qty = qty
-            else:
-                curr_qty += qty
-        if level <= depth:
-            levels.append((curr_price, curr_qty))
-        return levels
+        while current and len(result) < depth:
+            price = current.order.price
+            result.append((price, levels.get(price)))
+            # 从最高层开始查找最后一个价格不在price之后的节点
+            node = self.head
+            for lvl in range(self.level - 1, -1, -1):
+                while node.forward[lvl] and not self._price_after(node.forward[lvl].order.price, price):
+                    node = node.forward[lvl]
+            current = node.forward[0]
+        return result
 
 class AskSkipList(SkipList):
     def __init__(self, max_level=16, pN=4, max_nodes=100_000):
         super().__init__(max_level, pN, max_nodes)
         self._compare = compare_ask_order
 
+    def _price_after(self, a: float, b: float) -> bool:
+        return a > b
+
 
 class BidSkipList(SkipList):
     def __init__(self, max_level=16, pN=4, max_nodes=100_000):
         super().__init__(max_level, pN, max_nodes)
         self._compare = compare_bid_order
 
+    def _price_after(self, a: float, b: float) -> bool:
+        return a < b
+
 
 class OrderBook(OrderBookInterface):
     """
@@ -611,39 +607,52 @@ class OrderBook(OrderBookInterface):
         - 远盘O(1)
     """
 
-    def __init__(self, symbol="BTCUSDT", max_nodes=100_000, logger=None):
+    def __init__(self, symbol="BTCUSDT", max_nodes=100_000, logger=None, lock_free=False):
         self.symbol = symbol
         self.near_bids = SortedBidArray(MAX_NEAR_SIZE, logger)
         self.far_bids = BidSkipList(max_level=16, pN=4, max_nodes=max_nodes)
         self.near_asks = SortedAskArray(MAX_NEAR_SIZE, logger)
         self.far_asks = AskSkipList(max_level=16, pN=4, max_nodes=max_nodes)
-        self.orders = {}
-        self.ask_lock = threading.RLock()
-        self.bid_lock = threading.RLock()
+        self.orders = OrderIndex()
+        # 各挡位未成交总量，近盘和远盘共用
+        self.bid_levels = LevelQuantity()
+        self.ask_levels = LevelQuantity()
+        self.ask_lock = new_lock(lock_free, reentrant=True)
+        self.bid_lock = new_lock(lock_free, reentrant=True)
         self.logger = logger or logging.getLogger(__name__)
 
-    def add_order(self, order):
+    def add_order(self, order) -> Optional[Order]:
         """添加订单到订单簿"""
-        self.orders[order.order_id] = order
+        if order.order_id in self.orders:
+            return None
 
         if order.side == OrderSide.BUY:
             with self.bid_lock:
                 if self.near_bids.is_full():
-                    self.far_bids.insert(order)
+                    inserted = self.far_bids.insert(order)
                 else:
-                    self.near_bids.insert(order)
+                    inserted = self.near_bids.insert(order)
+                if inserted:
+                    self.bid_levels.add(order.price, order.quantity - order.filled_quantity)
         else:
             with self.ask_lock:
                 if self.near_asks.is_full():
-                    self.far_asks.insert(order)
+                    inserted = self.far_asks.insert(order)
                 else:
-                    self.near_asks.insert(order)
+                    inserted = self.near_asks.insert(order)
+                if inserted:
+                    self.ask_levels.add(order.price, order.quantity - order.filled_quantity)
+
+        if not inserted:
+            return None
+        self.orders[order.order_id] = order
+        return order
 
     def remove_order(self, order_id):
         """从订单簿移除订单"""
         order = self.orders.get(order_id)
         if not order:
-            self.logger.error(f"[remove order] cannot find order {order_id}")
+            self.logger.error("[remove order] cannot find order %s", order_id)
             return None
 
         result = False
@@ -663,6 +672,8 @@ class OrderBook(OrderBookInterface):
                     self.near_bids.batch_insert(move_in_orders)
                 else:
                     result = self.far_bids.delete(order)
+                if result:
+                    self.bid_levels.remove(order.price, order.quantity - order.filled_quantity)
         else:
             with self.ask_lock:
                 if self.far_asks.size() == 0 or compare_ask_order(order, self.far_asks.peek()) < 0:
@@ -678,16 +689,19 @@ class OrderBook(OrderBookInterface):
                     self.near_asks.batch_insert(move_in_orders)
                 else:
                     result = self.far_asks.delete(order)
+                if result:
+                    self.ask_levels.remove(order.price, order.quantity - order.filled_quantity)
 
         if result:
             del self.orders[order_id]
             return order
 
-        self.logger.error(f"[remove order] cannot find order {order_id}")
+        self.logger.error("[remove order] cannot find order %s", order_id)
         return None
 
-    def batch_add_orders(self, side: str, orders: List[Order]):
-        """批量添加订单"""
+    def batch_add_orders(self, side: str, orders: List[Order]) -> List[Order]:
+        """批量添加订单，返回新加入的订单"""
+        existing_ids = set(order.order_id for order in orders if order.order_id in self.orders)
         if side == OrderSide.BUY:
             with self.bid_lock:
                 result, move_out_ids, remain_orders = self.near_bids.batch_insert(orders)
@@ -704,6 +718,9 @@ class OrderBook(OrderBookInterface):
                         far_added = self.far_bids.batch_insert(remain_orders)
                         for far_order in far_added:
                             self.orders[far_order.order_id] = far_order
+                    for order in orders:
+                        if order.order_id in self.orders and order.order_id not in existing_ids:
+                            self.bid_levels.add(order.price, order.quantity - order.filled_quantity)
         else:
             with self.ask_lock:
                 result, move_out_ids, remain_orders = self.near_asks.batch_insert(orders)
@@ -720,6 +737,11 @@ class OrderBook(OrderBookInterface):
                         far_added = self.far_asks.batch_insert(remain_orders)
                         for far_order in far_added:
                             self.orders[far_order.order_id] = far_order
+                    for order in orders:
+                        if order.order_id in self.orders and order.order_id not in existing_ids:
+                            self.ask_levels.add(order.price, order.quantity - order.filled_quantity)
+
+        return [order for order in orders if order.order_id in self.orders and order.order_id not in existing_ids]
 
     def batch_remove_orders(self, uid: str, order_ids: List[str]) -> List[Order]:
         """批量移除订单"""
@@ -743,6 +765,7 @@ class OrderBook(OrderBookInterface):
                     if order.order_id in removed_ids:
                         order.status = OrderStatus.CANCELLED
                         total_removed_orders.append(order)
+                        self.bid_levels.remove(order.price, order.quantity - order.filled_quantity)
                     else:
                         remain_orders.append(order)
                 for order_id in removed_ids:
@@ -754,6 +777,7 @@ class OrderBook(OrderBookInterface):
                         if order.order_id in far_removed_ids:
                             order.status = OrderStatus.CANCELLED
                             total_removed_orders.append(order)
+                            self.bid_levels.remove(order.price, order.quantity - order.filled_quantity)
                     for order_id in far_removed_ids:
                         del self.orders[order_id]
 
@@ -765,6 +789,7 @@ class OrderBook(OrderBookInterface):
                     if order.order_id in removed_ids:
                         order.status = OrderStatus.CANCELLED
                         total_removed_orders.append(order)
+                        self.ask_levels.remove(order.price, order.quantity - order.filled_quantity)
                     else:
                         remain_orders.append(order)
                 for order_id in removed_ids:
@@ -776,6 +801,7 @@ class OrderBook(OrderBookInterface):
                         if order.order_id in far_removed_ids:
                             order.status = OrderStatus.CANCELLED
                             total_removed_orders.append(order)
+                            self.ask_levels.remove(order.price, order.quantity - order.filled_quantity)
                     for order_id in far_removed_ids:
                         del self.orders[order_id]
 
@@ -793,33 +819,24 @@ class OrderBook(OrderBookInterface):
         """获取订单簿数据"""
         order_book = OrderBookModel(self.symbol)
         with self.ask_lock:
-            asks = self.near_asks.peek_depth(depth, self.orders)
-            if len(asks) >= depth:
-                best_far_ask = self.far_asks.peek()
-                if best_far_ask and best_far_ask.price == asks[-1][0]:
-                    far_asks = self.far_asks.peek_depth(1)
-                    asks[-1] = (asks[-1][0], asks[-1][1] + far_asks[0][1])
-            else:
-                far_asks = self.far_asks.peek_depth(depth - len(asks) + 1)
-                if far_asks and far_asks[0][0] == asks[-1][0]:
-                    asks[-1] = (asks[-1][0], asks[-1][1] + far_asks[0][1])
-                    asks.extend(far_asks[1:])
+            asks = self.near_asks.peek_depth(depth, self.ask_levels)
+            if len(asks) < depth:
+                # 远盘第一个挡位可能与近盘最后一个挡位同价，挡位数量已合并在ask_levels中
+                far_asks = self.far_asks.peek_depth(depth - len(asks) + 1, self.ask_levels)
+                if asks and far_asks and far_asks[0][0] == asks[-1][0]:
+                    far_asks = far_asks[1:]
+                asks.extend(far_asks[:depth - len(asks)])
             order_book.asks = asks
         with self.bid_lock:
-            bids = self.near_bids.peek_depth(depth, self.orders)
-            if len(bids) >= depth:
-                best_far_bid = self.far_bids.peek()
-                if best_far_bid and best_far_bid.price == bids[-1][0]:
-                    far_bids = self.far_bids.peek_depth(1)
-                    bids[-1] = (bids[-1][0], bids[-1][1] + far_bids[0][1])
-            else:
-                far_bids = self.far_bids.peek_depth(depth - len(bids) + 1)
-                if far_bids and far_bids[0][0] == bids[-1][0]:
-                    bids[-1] = (bids[-1][0], bids[-1][1] + far_bids[0][1])
-                    bids.extend(far_bids[1:])
+            bids = self.near_bids.peek_depth(depth, self.bid_levels)
+            if len(bids) < depth:
+                far_bids = self.far_bids.peek_depth(depth - len(bids) + 1, self.bid_levels)
+                if bids and far_bids and far_bids[0][0] == bids[-1][0]:
+                    far_bids = far_bids[1:]
+                bids.extend(far_bids[:depth - len(bids)])
             order_book.bids = bids
 
-        order_book.timestamp = int(time.time() * 1000)
+        order_book.timestamp = now_ms()
         return order_book
 
     def get_best_bid(self) -> Optional[Order]:
@@ -847,11 +864,19 @@ class OrderBook(OrderBookInterface):
         if not order:
             return None
 
-        order.filled_quantity = filled_quantity
+        if order.side == OrderSide.BUY:
+            with self.bid_lock:
+                self.bid_levels.fill(order.price, filled_quantity - order.filled_quantity)
+                order.filled_quantity = filled_quantity
+        else:
+            with self.ask_lock:
+                self.ask_levels.fill(order.price, filled_quantity - order.filled_quantity)
+                order.filled_quantity = filled_quantity
+
         if order.filled_quantity >= order.quantity:
             self.remove_order(order_id)
         return order
 
     def pending_orders(self, uid):
         """获取用户所有待处理订单"""
-        return [order for order in self.orders.values() if order.uid == uid]
\ No newline at end of file
+        return self.orders.uid_orders(uid)
\ No newline at end of file
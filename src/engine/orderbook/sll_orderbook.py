@@ -6,11 +6,11 @@
     * 新加入订单首先查询跳表，找到相同价格的PriceLevel，然后插入到该挡位orders的末尾
 """
 from src.engine.orderbook.orderbook import OrderBookInterface
+from src.engine.orderbook.ob_interface import OrderIndex, new_lock
 from src.engine.types.types import Order, OrderSide, OrderBookModel
+from src.engine.types.clock import now_ms
 from typing import List, Optional, Tuple
-import threading
 import random
-import time
 
 
 
@@ -24,6 +24,7 @@ class PriceLevel:
         self.price = price
         self.level = level  # 本节点跳表层数
         self.order_num = 0  # 订单数量
+        self.quantity = 0  # 挡位未成交总量，插入、成交、删除时增量维护
         self.level_head = LevelOrder(-1)
         self.level_tail = self.level_head
 
@@ -36,6 +37,8 @@ class LevelOrder:
         # 指向OrderPool.orders数组的索引
         self.order_index = order_index
         self.order = order  # 订单对象
+        # 所属价格挡位，撤单时直接定位，无需再查找跳表
+        self.price_level = None
 
 class OrderPool:
     """ 订单池，用于存储所有订单，预分配内存避免GC
@@ -70,6 +73,7 @@ class OrderPool:
         self.free_orders_ptr[node.order_index] = self.free_ptr_head
         self.free_ptr_head = node.order_index
         node.order = None
+        node.price_level = None
         self.capacity -= 1
 
 
@@ -101,6 +105,7 @@ class PriceLevelPool:
         node.level_head.next = None
         node.level_tail = node.level_head
         node.order_num = 0
+        node.quantity = 0
         node.level = level
         for i in range(len(node.forward)):
             node.forward[i] = None
@@ -192,6 +197,11 @@ class SkipList:
         return orders
 
     def insert(self, order: Order) -> bool:
+        return self.insert_node(order) is not None
+
+    def insert_node(self, order: Order) -> Optional[LevelOrder]:
+        """ 插入订单，返回订单节点，失败返回None
+        """
         # update 数组用于记录每一层插入位置的前驱节点
         update = [None] * self.max_index_level
         current = self.head
@@ -208,13 +218,15 @@ class SkipList:
             # 找到当前价格挡位，首先申请订单对象，再将新订单插入PriceLevel的order列表末尾
             new_order = self.order_pool.new(order)
             if not new_order:
-                return False
+                return None
             new_order.prev = price_level.level_tail
             new_order.next = None
+            new_order.price_level = price_level
             price_level.level_tail.next = new_order
             price_level.level_tail = new_order
             price_level.order_num += 1
-            return True
+            price_level.quantity += order.quantity - order.filled_quantity
+            return new_order
 
         # 生成新price level
         rand_level = self._random_level()
@@ -226,11 +238,11 @@ class SkipList:
 
         new_price_level = self.price_level_pool.new(order.price, rand_level)
         if not new_price_level:
-            return False
+            return None
         new_order = self.order_pool.new(order)
         if not new_order:
             self.price_level_pool.free(new_price_level)
-            return False
+            return None
 
         # 将新PriceLevel节点插入到跳表各层链表中
         for lvl in range(rand_level):
@@ -240,10 +252,12 @@ class SkipList:
         # 将新订单插入到price level的order列表末尾
         new_order.prev = new_price_level.level_tail
         new_order.next = None
+        new_order.price_level = new_price_level
         new_price_level.level_tail.next = new_order
         new_price_level.level_tail = new_order
         new_price_level.order_num += 1
-        return True
+        new_price_level.quantity += order.quantity - order.filled_quantity
+        return new_order
 
     def delete(self, order: Order) -> bool:
         """删除指定订单, 返回 True 表示成功, False 表示键不存在"""
@@ -278,11 +292,55 @@ class SkipList:
 
         self.order_pool.free(current_order)
         price_level.order_num -= 1
+        price_level.quantity -= order.quantity - order.filled_quantity
         if price_level.order_num == 0:
             # 当前价格挡位已经没有订单，删除该挡位
             self._free_price_level(price_level, update)
         return True
 
+    def delete_node(self, node: LevelOrder) -> bool:
+        """ 根据订单节点直接删除订单，O(1)
+            只有当价格挡位被清空时，才需要查找跳表前驱并删除该挡位
+        """
+        price_level = node.price_level
+        if price_level is None:
+            return False
+
+        node.prev.next = node.next
+        if node.next:
+            node.next.prev = node.prev
+        if node is price_level.level_tail:
+            price_level.level_tail = node.prev
+
+        order = node.order
+        price_level.quantity -= order.quantity - order.filled_quantity
+        self.order_pool.free(node)
+        price_level.order_num -= 1
+        if price_level.order_num == 0:
+            self._delete_price_level(price_level)
+        return True
+
+    def fill_node(self, node: LevelOrder, quantity: float):
+        """ 订单部分成交，扣减所属挡位的未成交总量
+        """
+        node.price_level.quantity -= quantity
+
+    def _delete_price_level(self, price_level: PriceLevel):
+        """ 从跳表中删除已清空的价格挡位
+        """
+        update = [None] * self.max_index_level
+        if self.head.forward[0] is price_level:
+            # 最优挡位（撮合成交时最常见），各层前驱都是头节点
+            for lvl in range(price_level.level):
+                update[lvl] = self.head
+        else:
+            current = self.head
+            for lvl in range(self.level - 1, -1, -1):
+                while current.forward[lvl] and self._compare(current.forward[lvl].price, price_level.price) < 0:
+                    current = current.forward[lvl]
+                update[lvl] = current
+        self._free_price_level(price_level, update)
+
     def peek(self) -> Optional[Order]:
         """ peek the first order in the array
         """
@@ -309,12 +367,7 @@ class SkipList:
         for _ in range(depth):
             if not current_level:
                 break
-            level_qty = 0
-            curr_order = current_level.level_head.next
-            while curr_order:
-                level_qty += curr_order.order.quantity - curr_order.order.filled_quantity
-                curr_order = curr_order.next
-            levels.append((current_level.price, level_qty))
+            levels.append((current_level.price, current_level.quantity))
             current_level = current_level.forward[0]
 
         return levels
@@ -353,7 +406,7 @@ class BidSkipList(SkipList):
 class OrderBook(OrderBookInterface):
     """ 单币对最多支持max_nodes个订单，超出限制则主动撤最远的订单
     """
-    def __init__(self, symbol, max_index_level=16, max_price_level=1_000, max_orders=20_000, logger=None):
+    def __init__(self, symbol, max_index_level=16, max_price_level=1_000, max_orders=20_000, logger=None, lock_free=False):
         self.symbol = symbol
         self.ask_price_level_pool = PriceLevelPool(max_index_level, max_price_level)
         self.ask_order_pool = OrderPool(max_orders)
@@ -362,9 +415,11 @@ class OrderBook(OrderBookInterface):
 
         self.asks = AskSkipList(max_level=max_index_level, price_level_pool=self.ask_price_level_pool, order_pool=self.ask_order_pool)
         self.bids = BidSkipList(max_level=max_index_level, price_level_pool=self.bid_price_level_pool, order_pool=self.bid_order_pool)
-        self.orders = {}
-        self.ask_lock = threading.Lock()
-        self.bid_lock = threading.Lock()
+        self.orders = OrderIndex()
+        # order_id -> LevelOrder，撤单时直接定位订单节点及所属挡位
+        self.order_nodes = {}
+        self.ask_lock = new_lock(lock_free)
+        self.bid_lock = new_lock(lock_free)
 
         self.logger = logger
 
@@ -382,8 +437,10 @@ class OrderBook(OrderBookInterface):
                     for ro in removed_orders:
                         if ro.order_id in self.orders:
                             del self.orders[ro.order_id]
+                        self.order_nodes.pop(ro.order_id, None)
 
-                if not self.bids.insert(order):
+                node = self.bids.insert_node(order)
+                if not node:
                     return None
         else:
             with self.ask_lock:
@@ -393,27 +450,30 @@ class OrderBook(OrderBookInterface):
                     for ro in removed_orders:
                         if ro.order_id in self.orders:
                             del self.orders[ro.order_id]
+                        self.order_nodes.pop(ro.order_id, None)
 
-                if not self.asks.insert(order):
+                node = self.asks.insert_node(order)
+                if not node:
                     return None
 
         self.orders[order.order_id] = order
+        self.order_nodes[order.order_id] = node
         return order
 
     def remove_order(self, order_id: str) -> Optional[Order]:
-        """ 删除订单
+        """ 删除订单，通过order_nodes索引直接摘除订单节点
         """
         if order_id not in self.orders:
             return None
-        order = self.orders[order_id]
+        order = self.orders.pop(order_id)
+        node = self.order_nodes.pop(order_id)
 
         if order.side == OrderSide.BUY:
             with self.bid_lock:
-                self.bids.delete(order)
+                self.bids.delete_node(node)
         else:
             with self.ask_lock:
-                self.asks.delete(order)
-        del self.orders[order_id]
+                self.asks.delete_node(node)
         return order
 
     def batch_add_orders(self, side: str, orders: List[Order]) -> List[Order]:
@@ -453,7 +513,7 @@ class OrderBook(OrderBookInterface):
             ob.asks = self.asks.peek_depth(depth)
         with self.bid_lock:
             ob.bids = self.bids.peek_depth(depth)
-        ob.timestamp = int(time.time() * 1000)
+        ob.timestamp = now_ms()
         return ob
 
     def get_best_bid(self) -> Optional[Order]:
@@ -471,11 +531,20 @@ class OrderBook(OrderBookInterface):
         if not order:
             return None
 
-        order.filled_quantity = filled_quantity
+        node = self.order_nodes[order_id]
+        if order.side == OrderSide.BUY:
+            with self.bid_lock:
+                self.bids.fill_node(node, filled_quantity - order.filled_quantity)
+                order.filled_quantity = filled_quantity
+        else:
+            with self.ask_lock:
+                self.asks.fill_node(node, filled_quantity - order.filled_quantity)
+                order.filled_quantity = filled_quantity
+
         if order.filled_quantity >= order.quantity:
             self.remove_order(order.order_id)
         return order
 
     def pending_orders(self, uid):
         """获取用户所有待处理订单"""
-        return [order for order in self.orders.values() if order.uid == uid]
+        return self.orders.uid_orders(uid)
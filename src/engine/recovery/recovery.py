@@ -0,0 +1,131 @@
+""" Crash recovery from the MMQ write-ahead journal
+    * journal记录撮合的输入(spot_new/spot_cancel)和撮合结果(spot_match_out)，记录顺序即produce的顺序
+    * 启动时按journal顺序重放到新的MatchingEngine和Funding:
+        输入    Funding重新冻结/解冻资产(与put_spot_order/cancel_spot_orders一致)，杠杆订单重新借款
+                (与put_leverage_spot_order一致)，撮合引擎重新撮合，重建order book
+        结果    Funding按原始的成交结算、记录订单ID(exist_order_ids)，K线按原始的成交更新
+      撮合引擎重放时的输出写入临时MMQ，与journal中的撮合结果按顺序一一对应，有原始结果时丢弃重放的输出，
+      账户只由journal中的原始成交结算，成交ID与崩溃前一致，最近成交和K线(及其history)同样只使用原始成交
+    * 崩溃时输入已经写入journal而撮合结果还没有写入时，这些输入之后没有原始结果，按重放的撮合结果结算，
+      recover把这些结果追加到journal，下次重放时输入和结果仍然一一对应
+    * 重放完成后journal继续追加，新的消息写在已有记录之后
+    * 给出快照目录时先加载最新的快照(见snapshot.py)，只重放快照之后的记录
+    * 只适用于单进程部署(src/app.py)，分片和多进程部署中撮合状态在其他进程中
+
+    JOURNAL_PATH=/data/spot.journal python src/app.py
+    JOURNAL_PATH=/data/spot.journal SNAPSHOT_DIR=/data/snapshots python src/app.py
+"""
+import logging
+import os
+from collections import deque
+from typing import List, Tuple
+
+from src.common.mmq import MMQ, MMQTopic, FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, TRANSPORT_INPROC
+from src.common.mmq.journal import Journal, read_records
+from src.engine.funding.funding import Funding
+from src.engine.matching.matching import MatchingEngine
+from src.engine.matching.trade_history import TradeHistory
+from src.engine.recovery.snapshot import load_latest
+from src.engine.types.codec import (
+    MSG_CANCEL, MSG_LEVERAGE_ORDER, MSG_ORDER, MSG_ORDERS, decode_message, encode_message, get_codec
+)
+
+logger = logging.getLogger(__name__)
+
+INPUT_TOPICS = (MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL)
+OUTPUT_TOPICS = (MMQTopic.SPOT_MATCH_OUT,)
+
+
+def _settle(engine: MatchingEngine, funding: Funding, trades: TradeHistory, data: dict):
+    """ 结算撮合结果，更新最近成交和K线 """
+    funding.on_match_out(data)
+    if data.get('trades'):
+        with engine.lock:
+            trades.add(data['trades'][0].symbol, data['trades'])
+        engine.klines.on_trades(data['trades'])
+
+
+def replay(path: str, engine: MatchingEngine, funding: Funding, start: int = 0,
+           recovered: List = None) -> Tuple[int, int]:
+    """ 把journal中start之后的记录重放到engine和funding，返回 (重放到的文件位置, 记录数)
+        journal中没有撮合结果的输入按重放的撮合结果结算，recovered不为None时把这些结果
+        (engine.out_mq的transport)追加到recovered
+    """
+    out_mq, trades = engine.out_mq, engine.trades
+    # 重放产生的撮合结果不直接发送给消费者，重新撮合产生的成交(新的成交ID)不保存
+    replay_mq = engine.out_mq = MMQ(transport=out_mq.transport)
+    engine.trades = TradeHistory()
+    # 重放产生、还没有对应到journal中撮合结果的输出
+    pending = deque()
+    offset = 0
+    position, count = start, 0
+    try:
+        for position, topic, payload in read_records(path, start):
+            kind, data = decode_message(payload)
+            if topic in INPUT_TOPICS:
+                if kind == MSG_ORDER:
+                    funding.replay_spot_new(data)
+                elif kind == MSG_LEVERAGE_ORDER:
+                    funding.replay_leverage_new(data)
+                elif kind == MSG_CANCEL:
+                    funding.replay_spot_cancel(data['uid'], data['symbol'], data['order_ids'])
+                if kind in (MSG_ORDER, MSG_LEVERAGE_ORDER, MSG_ORDERS, MSG_CANCEL):
+                    engine.on_message(kind, data)
+                    while True:
+                        offset, messages = replay_mq.consume_batch(MMQTopic.SPOT_MATCH_OUT, offset)
+                        if not messages:
+                            break
+                        pending.extend(messages)
+            elif topic in OUTPUT_TOPICS:
+                # 撮合是确定的，journal中的撮合结果对应最早的重放输出
+                if pending:
+                    pending.popleft()
+                _settle(engine, funding, trades, data)
+            count += 1
+    finally:
+        engine.out_mq, engine.trades = out_mq, trades
+
+    if pending:
+        logger.warning("%s match results of %s were not journaled, settle them from the replay", len(pending), path)
+        decode_replayed = get_codec(replay_mq.transport).decode_message
+        for message in pending:
+            _settle(engine, funding, trades, decode_replayed(message)[1])
+        if recovered is not None:
+            recovered.extend(pending)
+    logger.info("Replayed %s journal records of %s", count, path)
+    return position, count
+
+
+def _encoder(mq: MMQ):
+    # inproc消息为 (消息类型, 消息体)，编码后写入journal
+    if mq.transport == TRANSPORT_INPROC:
+        return lambda message: encode_message(*message)
+    return None
+
+
+def attach_journal(journal: Journal, in_mq: MMQ = FUNDING_MATCH_MQ, out_mq: MMQ = MATCH_FUNDING_MQ):
+    """ 撮合的输入和输出写入journal，journal为None时取消 """
+    in_mq.set_journal(journal, INPUT_TOPICS, _encoder(in_mq))
+    out_mq.set_journal(journal, OUTPUT_TOPICS, _encoder(out_mq))
+
+
+def recover(path: str, engine: MatchingEngine, funding: Funding,
+            in_mq: MMQ = FUNDING_MATCH_MQ, out_mq: MMQ = MATCH_FUNDING_MQ, snapshot_dir: str = None, **kwargs) -> Journal:
+    """ 加载snapshot_dir中最新的快照并重放之后的journal，然后把撮合的输入和输出继续写入journal，
+        返回打开的Journal，退出时调用close
+    """
+    start = load_latest(snapshot_dir, engine, funding) if snapshot_dir else 0
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if start > size:
+        raise ValueError(f"Snapshot at journal position {start} is newer than journal {path} of {size} bytes")
+    recovered = []
+    position, _ = replay(path, engine, funding, start, recovered)
+    journal = Journal(path, start=position, **kwargs)
+    # 按重放结算的撮合结果补写到journal，之后的输入和结果继续一一对应
+    encode = _encoder(engine.out_mq)
+    for message in recovered:
+        journal.append(MMQTopic.SPOT_MATCH_OUT, message, encode)
+    if recovered:
+        journal.sync()
+    attach_journal(journal, in_mq, out_mq)
+    return journal
@@ -0,0 +1,348 @@
+""" Periodic snapshots of order books and accounts
+    * 快照包括每个交易对的挂单(按价格-时间优先的顺序)、账户(余额、冻结资产、杠杆状态)、手续费账户和K线，
+      以及快照对应的journal位置；恢复时加载最新的快照，只重放journal中该位置之后的记录(见recovery.py)
+    * 快照在event loop中两轮处理之间获取，不停止撮合:
+        1. 关闭Funding的gate(Funding.pause_producing)，API线程新的下单/撤单(冻结资产 + 写入MMQ)等待，
+           不持有Funding.lock，等待期间event loop中的其他协程照常运行
+        2. 等待撮合、资金、K线的consumer group消费完journal中的消息，此时内存状态即重放journal到末尾的结果
+        3. journal落盘，记录journal位置，把状态编码为bytes(即状态的副本)后打开gate
+        4. 在线程池中写临时文件、fsync、rename，只保留最新的KEEP_SNAPSHOTS个
+    * 加载时挂单按价格-时间顺序通过batch_add_orders批量加入order book
+    * exist_order_ids(布隆过滤器)不能序列化，由快照中的挂单重建；最近成交(TradeHistory)不包括在快照中
+
+    文件格式(小端): MAGIC + 4字节版本号 + 8字节journal位置 + 8字节时间戳 + 挂单 + 账户 + 手续费账户 + K线 + 4字节crc32
+        挂单    4字节交易对数 + (symbol, 买单, 卖单)，订单按codec.pack_order编码
+        账户    4字节账户数 + (uid, 字段)，字段为带1字节类型的值(int/float/str/bool/None/dict)
+        K线     4字节交易对数 + (symbol, 4字节周期数 + (周期, 4字节K线数, 各列array('q')))
+
+    JOURNAL_PATH=/data/spot.journal SNAPSHOT_DIR=/data/snapshots python src/app.py
+
+    SNAPSHOT_INTERVAL   快照间隔(秒)，默认60
+"""
+import asyncio
+import logging
+import os
+import struct
+import zlib
+from array import array
+from typing import List, Optional, Tuple
+
+from src.common.mmq import MMQ, FUNDING_MATCH_MQ, MATCH_FUNDING_MQ
+from src.common.mmq.journal import Journal
+from src.engine.funding.funding import Funding, FEE_ACCOUNT
+from src.engine.kline.kline import COLUMNS
+from src.engine.matching.matching import MatchingEngine
+from src.engine.types.account_types import UniMarginAccount
+from src.engine.types.clock import now_ms
+from src.engine.types.codec import pack_order, unpack_order
+from src.engine.types.types import Order, OrderSide
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MMQS"
+VERSION = 1
+# magic, version, journal position, timestamp
+_HEADER = struct.Struct('<4sIqq')
+_COUNT = struct.Struct('<I')
+_STR = struct.Struct('<H')
+_TAG = struct.Struct('<B')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_CRC = struct.Struct('<I')
+
+_NONE, _INT_TAG, _FLOAT_TAG, _STR_TAG, _DICT, _TRUE, _FALSE = range(7)
+
+# 快照中保存的UniMarginAccount字段
+ACCOUNT_FIELDS = ('is_inner_maker', 'version', 'uptime', 'balances', 'frozen_balances',
+                  'spot_margin_mode', 'spot_leverage', 'leverage_balance', 'leverage_position')
+
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 60))
+KEEP_SNAPSHOTS = 2
+# 等待consumer消费完消息的最长时间(秒)，超时则跳过本次快照
+DRAIN_TIMEOUT = 1.0
+DRAIN_POLL_INTERVAL = 0.001
+
+
+### encoding
+def _pack_str(value: str) -> bytes:
+    data = value.encode()
+    return _STR.pack(len(data)) + data
+
+
+def _unpack_str(buf: bytes, pos: int) -> Tuple[str, int]:
+    (size,) = _STR.unpack_from(buf, pos)
+    pos += _STR.size
+    return buf[pos:pos + size].decode(), pos + size
+
+
+def _pack_value(value) -> bytes:
+    if value is None:
+        return _TAG.pack(_NONE)
+    if value is True or value is False:
+        return _TAG.pack(_TRUE if value else _FALSE)
+    if isinstance(value, int):
+        return _TAG.pack(_INT_TAG) + _INT.pack(value)
+    if isinstance(value, float):
+        return _TAG.pack(_FLOAT_TAG) + _FLOAT.pack(value)
+    if isinstance(value, str):
+        return _TAG.pack(_STR_TAG) + _pack_str(value)
+    if isinstance(value, dict):
+        return _TAG.pack(_DICT) + _COUNT.pack(len(value)) + b''.join(
+            [_pack_value(k) + _pack_value(v) for k, v in value.items()])
+    raise TypeError(f"Can not snapshot value {value!r} of type {type(value).__name__}")
+
+
+def _unpack_value(buf: bytes, pos: int):
+    (tag,) = _TAG.unpack_from(buf, pos)
+    pos += _TAG.size
+    if tag == _INT_TAG:
+        return _INT.unpack_from(buf, pos)[0], pos + _INT.size
+    if tag == _FLOAT_TAG:
+        return _FLOAT.unpack_from(buf, pos)[0], pos + _FLOAT.size
+    if tag == _STR_TAG:
+        return _unpack_str(buf, pos)
+    if tag == _DICT:
+        (count,) = _COUNT.unpack_from(buf, pos)
+        pos += _COUNT.size
+        value = {}
+        for _ in range(count):
+            k, pos = _unpack_value(buf, pos)
+            value[k], pos = _unpack_value(buf, pos)
+        return value, pos
+    if tag == _NONE:
+        return None, pos
+    if tag in (_TRUE, _FALSE):
+        return tag == _TRUE, pos
+    raise ValueError(f"Unknown value tag {tag} at {pos - _TAG.size}")
+
+
+def _pack_orders(orders: List[Order]) -> bytes:
+    return _COUNT.pack(len(orders)) + b''.join([pack_order(order) for order in orders])
+
+
+def _unpack_orders(buf: bytes, pos: int) -> Tuple[List[Order], int]:
+    (count,) = _COUNT.unpack_from(buf, pos)
+    pos += _COUNT.size
+    orders = [None] * count
+    for i in range(count):
+        orders[i], pos = unpack_order(buf, pos)
+    return orders, pos
+
+
+def _pack_account(account: UniMarginAccount) -> bytes:
+    with account.lock:
+        return _pack_str(account.uid) + _pack_value({name: getattr(account, name) for name in ACCOUNT_FIELDS})
+
+
+def _pack_book(symbol: str, orders: List[Order]) -> bytes:
+    # orders按加入order book的顺序保存，按价格稳定排序即为价格-时间优先的顺序
+    bids = sorted((o for o in orders if o.side == OrderSide.BUY), key=lambda o: -o.price)
+    asks = sorted((o for o in orders if o.side == OrderSide.SELL), key=lambda o: o.price)
+    return _pack_str(symbol) + _pack_orders(bids) + _pack_orders(asks)
+
+
+def dump(position: int, engine: MatchingEngine, funding: Funding, fee_account: UniMarginAccount = FEE_ACCOUNT) -> bytes:
+    """ 把engine和funding的状态编码为快照，position为状态对应的journal位置
+        调用方保证编码期间状态不变(见Snapshotter)
+    """
+    parts = [_HEADER.pack(MAGIC, VERSION, position, now_ms())]
+
+    books = [(symbol, list(book.orders.values())) for symbol, book in list(engine.order_books.items())]
+    parts.append(_COUNT.pack(len(books)))
+    parts.extend(_pack_book(symbol, orders) for symbol, orders in books)
+
+    accounts = list(funding.accounts.values())
+    parts.append(_COUNT.pack(len(accounts)))
+    parts.extend(_pack_account(account) for account in accounts)
+    parts.append(_pack_account(fee_account))
+
+    klines = engine.klines
+    with klines.lock:
+        parts.append(_COUNT.pack(len(klines.series)))
+        for symbol, series in klines.series.items():
+            parts.append(_pack_str(symbol) + _COUNT.pack(len(series)))
+            for name, s in series.items():
+                columns = s.columns()
+                parts.append(_pack_str(name) + _COUNT.pack(len(columns[0])))
+                parts.extend(column.tobytes() for column in columns)
+
+    data = b''.join(parts)
+    return data + _CRC.pack(zlib.crc32(data))
+
+
+def load(data: bytes, engine: MatchingEngine, funding: Funding, fee_account: UniMarginAccount = FEE_ACCOUNT) -> int:
+    """ 把快照加载到新的engine和funding，返回快照对应的journal位置 """
+    if len(data) < _HEADER.size + _CRC.size:
+        raise ValueError("Snapshot is truncated")
+    (crc,) = _CRC.unpack_from(data, len(data) - _CRC.size)
+    data = memoryview(data)[:len(data) - _CRC.size]
+    if zlib.crc32(data) != crc:
+        raise ValueError("Snapshot is corrupted")
+    magic, version, position, _ = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a snapshot of version {VERSION}")
+    buf = bytes(data)
+    pos = _HEADER.size
+
+    (count,) = _COUNT.unpack_from(buf, pos)
+    pos += _COUNT.size
+    for _ in range(count):
+        symbol, pos = _unpack_str(buf, pos)
+        bids, pos = _unpack_orders(buf, pos)
+        asks, pos = _unpack_orders(buf, pos)
+        book = engine.get_order_book(symbol)
+        book.batch_add_orders(OrderSide.BUY, bids)
+        book.batch_add_orders(OrderSide.SELL, asks)
+        for order in bids + asks:
+            funding.exist_order_ids.add(order.order_id)
+
+    (count,) = _COUNT.unpack_from(buf, pos)
+    pos += _COUNT.size
+    for i in range(count + 1):
+        uid, pos = _unpack_str(buf, pos)
+        fields, pos = _unpack_value(buf, pos)
+        if i == count:
+            account = fee_account
+        else:
+            account = funding.accounts.get(uid)
+            if account is None:
+                account = funding.accounts[uid] = UniMarginAccount(uid, fields['is_inner_maker'])
+        for name, value in fields.items():
+            setattr(account, name, value)
+
+    klines = engine.klines
+    (count,) = _COUNT.unpack_from(buf, pos)
+    pos += _COUNT.size
+    with klines.lock:
+        for _ in range(count):
+            symbol, pos = _unpack_str(buf, pos)
+            series = klines._get_series(symbol)
+            (intervals,) = _COUNT.unpack_from(buf, pos)
+            pos += _COUNT.size
+            for _ in range(intervals):
+                name, pos = _unpack_str(buf, pos)
+                (n,) = _COUNT.unpack_from(buf, pos)
+                pos += _COUNT.size
+                columns = []
+                for _ in COLUMNS:
+                    column = array('q')
+                    column.frombytes(buf[pos:pos + 8 * n])
+                    columns.append(column)
+                    pos += 8 * n
+                # 只恢复当前配置中的周期
+                if name in series:
+                    series[name].load_columns(columns)
+    return position
+
+
+### files
+def _snapshot_files(directory: str) -> List[str]:
+    """ 快照文件，按journal位置从旧到新 """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.startswith('snapshot-') and name.endswith('.bin'))
+
+
+def write_snapshot(directory: str, position: int, data: bytes, keep: int = KEEP_SNAPSHOTS) -> str:
+    """ 原子地写入快照文件，删除keep个之前的旧快照，返回文件路径 """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"snapshot-{position:020d}.bin")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+    for name in _snapshot_files(directory)[:-keep]:
+        os.remove(os.path.join(directory, name))
+    logger.info("Wrote snapshot %s of %s bytes", path, len(data))
+    return path
+
+
+def load_latest(directory: str, engine: MatchingEngine, funding: Funding) -> int:
+    """ 加载最新的有效快照，返回快照对应的journal位置，没有快照时返回0
+        损坏的快照(如写入时崩溃)被忽略，使用更早的快照
+    """
+    for name in reversed(_snapshot_files(directory)):
+        path = os.path.join(directory, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            # 先校验再加载，校验失败时engine和funding不变
+            position = load(data, engine, funding)
+        except (ValueError, struct.error) as e:
+            logger.warning("Ignore snapshot %s: %s", path, e)
+            continue
+        logger.info("Loaded snapshot %s at journal position %s", path, position)
+        return position
+    return 0
+
+
+class Snapshotter:
+    """ 在event loop中定期获取快照，与撮合、资金、K线的consumer运行在同一个event loop """
+
+    def __init__(self, directory: str, engine: MatchingEngine, funding: Funding, journal: Journal,
+                 consumers: List[Tuple[MMQ, str]] = ((FUNDING_MATCH_MQ, "matching"), (MATCH_FUNDING_MQ, "funding"), (MATCH_FUNDING_MQ, "kline")),
+                 interval: float = SNAPSHOT_INTERVAL, keep: int = KEEP_SNAPSHOTS):
+        """ consumers为 (MMQ, consumer group)，快照前等待它们消费完MMQ中写入journal的topic """
+        self.directory = directory
+        self.engine = engine
+        self.funding = funding
+        self.journal = journal
+        self.consumers = consumers
+        self.interval = interval
+        self.keep = keep
+        # 上一次快照的journal位置
+        self.position = None
+
+    def drained(self) -> bool:
+        for mq, group in self.consumers:
+            for topic in mq.journal_topics:
+                try:
+                    if mq.lag(group, topic):
+                        return False
+                except KeyError:
+                    # consumer还没有订阅
+                    return False
+        return True
+
+    async def snapshot(self) -> Optional[str]:
+        """ 获取一次快照，返回快照文件路径，consumer没有及时消费完或者状态没有变化时返回None """
+        loop = asyncio.get_running_loop()
+        # 同一线程中的consumer不受gate影响，只有API线程的下单/撤单等待
+        self.funding.pause_producing()
+        try:
+            deadline = loop.time() + DRAIN_TIMEOUT
+            while not self.drained():
+                if loop.time() >= deadline:
+                    logger.warning("Consumers did not catch up in %ss, skip the snapshot", DRAIN_TIMEOUT)
+                    return None
+                await asyncio.sleep(DRAIN_POLL_INTERVAL)
+            # 等待writer线程fsync时不阻塞event loop中的consumer和WS
+            await loop.run_in_executor(None, self.journal.sync)
+            if self.journal.synced < self.journal.appended:
+                logger.error("Journal %s is closed, skip the snapshot", self.journal.path)
+                return None
+            position = self.journal.position
+            if position == self.position:
+                return None
+            data = dump(position, self.engine, self.funding)
+        finally:
+            self.funding.resume_producing()
+        path = await loop.run_in_executor(None, write_snapshot, self.directory, position, data, self.keep)
+        self.position = position
+        return path
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.snapshot()
+            except Exception:
+                logger.exception("Failed to take snapshot in %s", self.directory)
@@ -53,15 +53,18 @@ class UniMarginAccount:
         else:
             self.spot_leverage['ACCOUNT'] = leverage
 
-    def max_borrow_amount(self, symbol_price: dict, collateral_rate: dict) -> float:
+    def max_borrow_amount(self, symbol_price: dict, collateral_rate: dict, symbol: str = None) -> float:
         """ 计算最大可借款金额
             :param symbol_price: 所有币对的最新价格(指数价格)，逐仓则只有一个symbol
             :param collateral_rate: 所有币对的折算率(haircut / collateral rate)
+            :param symbol: 逐仓的币对，默认为symbol_price中唯一的币对
             :return: 最大可借款金额
         """
         max_borrow_amount = 0
         if self.spot_margin_mode == MarginMode.ISOLATED:
             # 逐仓：最大可借 = 逐仓净资产 × (该档最大杠杆倍数 n − 1) − 已借未还
+            if symbol is None:
+                symbol = next(iter(symbol_price), None)
             last_price = symbol_price.get(symbol, 0)
             # symbolUSDT代表每个symbol逐仓独立的USDT资产
             total_equity = self.leverage_balance.get(f'{symbol}USDT', 0) + last_price * self.leverage_balance.get(symbol, 0)
@@ -96,11 +99,11 @@ class UniMarginAccount:
             self.spot_leverage = leverage
 
     def get_margin_mode(self) -> MarginMode:
-        return self.margin_mode
+        return self.spot_margin_mode
 
     def set_margin_mode(self, margin_mode: MarginMode):
         with self.lock:
-            self.margin_mode = margin_mode
+            self.spot_margin_mode = margin_mode
 
     def add_balance(self, asset: str, amount: float):
         with self.lock:
@@ -120,7 +123,7 @@ class UniMarginAccount:
                 self.frozen_balances[order_id] = {
                     'settle_num': 0
                 }
-            self.frozen_balances[order_id][asset] += amount
+            self.frozen_balances[order_id][asset] = self.frozen_balances[order_id].get(asset, 0) + amount
             self.balances[asset] -= amount
     
     def sub_frozen_balance(self, order_id: str, asset: str, amount: float) -> bool:
@@ -144,7 +147,7 @@ class UniMarginAccount:
             :param amount: 借款金额
         """
         if side == 'BUY':
-            key = f'{symbol}USDT' if self.margin_mode == MarginMode.ISATED else 'BUY'
+            key = f'{symbol}USDT' if self.spot_margin_mode == MarginMode.ISOLATED else 'BUY'
         else:
             key = symbol
 
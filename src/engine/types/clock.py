@@ -0,0 +1,46 @@
+""" Engine clock
+    * 引擎内所有时间戳(毫秒)都从这里获取，替换time.time()的分散调用
+    * 撮合引擎每条消息/每个批次只取一次时间，传给process_order、成交和K线更新，
+      同一taker订单产生的所有成交时间戳一致
+    * 回放和测试时通过set_clock注入ManualClock，得到确定的时间戳
+"""
+import time
+
+
+class SystemClock:
+    """ 系统时间 """
+    def now_ms(self) -> int:
+        return int(time.time() * 1000)
+
+
+class ManualClock:
+    """ 手动推进的时钟，用于回放和测试 """
+    def __init__(self, start_ms: int = 0):
+        self.current_ms = start_ms
+
+    def now_ms(self) -> int:
+        return self.current_ms
+
+    def set(self, ms: int):
+        self.current_ms = ms
+
+    def advance(self, ms: int):
+        self.current_ms += ms
+
+
+_clock = SystemClock()
+
+
+def set_clock(clock):
+    """ 替换全局时钟，返回原来的时钟 """
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def get_clock():
+    return _clock
+
+
+def now_ms() -> int:
+    return _clock.now_ms()
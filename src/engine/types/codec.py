@@ -0,0 +1,387 @@
+""" Codecs for MMQ payloads
+    * 订单、成交、撤单请求按struct紧凑编码，取代json.dumps(to_dict()) / from_dict(json.loads())
+    * 枚举字段(side/type/time_in_force/status)编码为1字节下标，字符串为2字节长度前缀 + utf-8
+    * 解码不经过Order.__init__/Trade.__init__，避免重复生成uuid和时间戳
+    * price/quantity等为整数tick/lot，None的price用标志位表示
+    * order_id/trade_id为64位整数(见ids.py)，直接按8字节编码
+
+    * BinaryCodec用于跨进程的MMQ；InProcessCodec用于同一进程，消息为 (消息类型, 对象) 元组，
+      订单发送时复制一份快照，避免撮合引擎继续修改订单时消费者看到之后的状态，成交创建后不再修改，直接传引用
+      通过get_codec(mq.transport)选择，run_forever的处理逻辑与编码方式无关
+
+    消息格式: 1字节消息类型 + 消息体
+        MSG_ORDER       单个订单
+        MSG_LEVERAGE_ORDER  单个杠杆订单，格式与MSG_ORDER相同，撮合时与普通订单相同，恢复时按杠杆订单重放资金
+        MSG_ORDERS      4字节数量 + 订单
+        MSG_CANCEL      uid, symbol, 4字节数量 + 8字节order_id
+        MSG_MATCH_OUT   1字节flags + trades / order / orders / removed_orders
+        MSG_SNAPSHOT    symbol, 8字节timestamp, 4字节档位数 + (price, quantity) * 2 (bids, asks)
+"""
+import struct
+from typing import List, Tuple
+
+from src.engine.types.types import Order, Trade, OrderSide, OrderType, OrderStatus, OrderTimeInForce
+from src.common.mmq import TRANSPORT_BINARY, TRANSPORT_INPROC
+
+
+MSG_ORDER = 1
+MSG_ORDERS = 2
+MSG_CANCEL = 3
+MSG_MATCH_OUT = 4
+MSG_SNAPSHOT = 5
+MSG_LEVERAGE_ORDER = 6
+
+# 下标即编码值，空字符串用于未设置的字段，新增取值只能追加到末尾
+SIDES = ('', OrderSide.BUY, OrderSide.SELL)
+ORDER_TYPES = ('', OrderType.LIMIT, OrderType.MARKET, OrderType.DELETE)
+TIME_IN_FORCES = ('', OrderTimeInForce.GTC, OrderTimeInForce.IOC, OrderTimeInForce.FOK, OrderTimeInForce.BAIT, OrderTimeInForce.GTX)
+ORDER_STATUSES = ('', OrderStatus.UNKNOWN, OrderStatus.PENDING, OrderStatus.NEW, OrderStatus.FILLED,
+                  OrderStatus.CANCELLING, OrderStatus.CANCELLED, OrderStatus.PARTIALLY_FILLED)
+
+_SIDE_INDEX = {v: i for i, v in enumerate(SIDES)}
+_ORDER_TYPE_INDEX = {v: i for i, v in enumerate(ORDER_TYPES)}
+_TIME_IN_FORCE_INDEX = {v: i for i, v in enumerate(TIME_IN_FORCES)}
+_ORDER_STATUS_INDEX = {v: i for i, v in enumerate(ORDER_STATUSES)}
+
+# side, type, time_in_force, status, flags(is_futures|is_selftrade|has_price),
+# order_id, price, quantity, filled_quantity, filled_amount, timestamp, update_timestamp, trade_num,
+# len(uid), len(client_order_id), len(symbol)
+_ORDER = struct.Struct('<BBBBBqqqqqqqIHHH')
+# trade_id, buy_order_id, sell_order_id, price, quantity, timestamp, is_taker_buyer,
+# len(taker_uid), len(maker_uid), len(symbol)
+_TRADE = struct.Struct('<qqqqqq?HHH')
+_HEAD = struct.Struct('<B')
+_COUNT = struct.Struct('<I')
+_STR = struct.Struct('<H')
+_TIMESTAMP = struct.Struct('<q')
+
+_IS_FUTURES = 1
+_IS_SELFTRADE = 2
+_HAS_PRICE = 4
+
+# MSG_MATCH_OUT flags
+_HAS_TRADES = 1
+_HAS_ORDER = 2
+_HAS_ORDERS = 4
+_HAS_REMOVED_ORDERS = 8
+
+_new = object.__new__
+
+
+def _encode_str(value: str) -> bytes:
+    data = value.encode()
+    return _STR.pack(len(data)) + data
+
+
+def _decode_str(buf: bytes, pos: int) -> Tuple[str, int]:
+    (size,) = _STR.unpack_from(buf, pos)
+    pos += _STR.size
+    return buf[pos:pos + size].decode(), pos + size
+
+
+### Order
+def pack_order(order: Order) -> bytes:
+    uid = order.uid.encode()
+    client_order_id = order.client_order_id.encode()
+    symbol = order.symbol.encode()
+    flags = (_IS_FUTURES if order.is_futures else 0) | (_IS_SELFTRADE if order.is_selftrade else 0)
+    if order.price is not None:
+        flags |= _HAS_PRICE
+    return _ORDER.pack(
+        _SIDE_INDEX[order.side], _ORDER_TYPE_INDEX[order.type],
+        _TIME_IN_FORCE_INDEX[order.time_in_force], _ORDER_STATUS_INDEX[order.status], flags,
+        order.order_id, order.price or 0, order.quantity, order.filled_quantity, order.filled_amount,
+        order.timestamp, order.update_timestamp, order.trade_num,
+        len(uid), len(client_order_id), len(symbol),
+    ) + uid + client_order_id + symbol
+
+
+def unpack_order(buf: bytes, pos: int = 0) -> Tuple[Order, int]:
+    """ 从pos处解码一个订单，返回 (订单, 下一个字段的位置) """
+    (side, order_type, time_in_force, status, flags,
+     order_id, price, quantity, filled_quantity, filled_amount, timestamp, update_timestamp, trade_num,
+     uid_len, client_order_id_len, symbol_len) = _ORDER.unpack_from(buf, pos)
+    pos += _ORDER.size
+
+    order = _new(Order)
+    order.order_id = order_id
+    order.uid = buf[pos:pos + uid_len].decode()
+    pos += uid_len
+    order.client_order_id = buf[pos:pos + client_order_id_len].decode()
+    pos += client_order_id_len
+    order.symbol = buf[pos:pos + symbol_len].decode()
+    pos += symbol_len
+
+    order.side = SIDES[side]
+    order.type = ORDER_TYPES[order_type]
+    order.price = price if flags & _HAS_PRICE else None
+    order.quantity = quantity
+    order.filled_quantity = filled_quantity
+    order.filled_amount = filled_amount
+    order.time_in_force = TIME_IN_FORCES[time_in_force]
+    order.is_futures = bool(flags & _IS_FUTURES)
+    order.status = ORDER_STATUSES[status]
+    order.timestamp = timestamp
+    order.update_timestamp = update_timestamp
+    order.is_selftrade = bool(flags & _IS_SELFTRADE)
+    order.trade_num = trade_num
+    return order, pos
+
+
+def _pack_orders(orders: List[Order]) -> bytes:
+    return _COUNT.pack(len(orders)) + b''.join([pack_order(order) for order in orders])
+
+
+def _unpack_orders(buf: bytes, pos: int) -> Tuple[List[Order], int]:
+    (count,) = _COUNT.unpack_from(buf, pos)
+    pos += _COUNT.size
+    orders = [None] * count
+    for i in range(count):
+        orders[i], pos = unpack_order(buf, pos)
+    return orders, pos
+
+
+### Trade
+def pack_trade(trade: Trade) -> bytes:
+    taker_uid = trade.taker_uid.encode()
+    maker_uid = trade.maker_uid.encode()
+    symbol = trade.symbol.encode()
+    return _TRADE.pack(
+        trade.trade_id, trade.buy_order_id, trade.sell_order_id, trade.price, trade.quantity, trade.timestamp, trade.is_taker_buyer,
+        len(taker_uid), len(maker_uid), len(symbol),
+    ) + taker_uid + maker_uid + symbol
+
+
+def unpack_trade(buf: bytes, pos: int = 0) -> Tuple[Trade, int]:
+    """ 从pos处解码一笔成交，返回 (成交, 下一个字段的位置) """
+    (trade_id, buy_order_id, sell_order_id, price, quantity, timestamp, is_taker_buyer,
+     taker_uid_len, maker_uid_len, symbol_len) = _TRADE.unpack_from(buf, pos)
+    pos += _TRADE.size
+
+    trade = _new(Trade)
+    trade.trade_id = trade_id
+    trade.taker_uid = buf[pos:pos + taker_uid_len].decode()
+    pos += taker_uid_len
+    trade.maker_uid = buf[pos:pos + maker_uid_len].decode()
+    pos += maker_uid_len
+    trade.symbol = buf[pos:pos + symbol_len].decode()
+    pos += symbol_len
+
+    trade.buy_order_id = buy_order_id
+    trade.sell_order_id = sell_order_id
+    trade.price = price
+    trade.quantity = quantity
+    trade.is_taker_buyer = is_taker_buyer
+    trade.timestamp = timestamp
+    return trade, pos
+
+
+### Messages
+def encode_order(order: Order) -> bytes:
+    return _HEAD.pack(MSG_ORDER) + pack_order(order)
+
+
+def encode_leverage_order(order: Order) -> bytes:
+    return _HEAD.pack(MSG_LEVERAGE_ORDER) + pack_order(order)
+
+
+def encode_orders(orders: List[Order]) -> bytes:
+    return _HEAD.pack(MSG_ORDERS) + _pack_orders(orders)
+
+
+def encode_cancel(uid: str, symbol: str, order_ids: List[int]) -> bytes:
+    return b''.join([
+        _HEAD.pack(MSG_CANCEL), _encode_str(uid), _encode_str(symbol), _COUNT.pack(len(order_ids)),
+        struct.pack(f'<{len(order_ids)}q', *order_ids),
+    ])
+
+
+def encode_match_out(trades: List[Trade] = None, order: Order = None, orders: List[Order] = None, removed_orders: List[Order] = None) -> bytes:
+    """ 撮合结果，字段与原JSON消息一致: trades, order, orders, removed_orders """
+    flags = 0
+    parts = [b'']
+    if trades is not None:
+        flags |= _HAS_TRADES
+        parts.append(_COUNT.pack(len(trades)))
+        parts.extend([pack_trade(trade) for trade in trades])
+    if order is not None:
+        flags |= _HAS_ORDER
+        parts.append(pack_order(order))
+    if orders is not None:
+        flags |= _HAS_ORDERS
+        parts.append(_pack_orders(orders))
+    if removed_orders is not None:
+        flags |= _HAS_REMOVED_ORDERS
+        parts.append(_pack_orders(removed_orders))
+    parts[0] = _HEAD.pack(MSG_MATCH_OUT) + _HEAD.pack(flags)
+    return b''.join(parts)
+
+
+def _pack_levels(levels: List[Tuple[int, int]]) -> bytes:
+    return _COUNT.pack(len(levels)) + struct.pack(f'<{2 * len(levels)}q', *[v for level in levels for v in level])
+
+
+def _unpack_levels(buf: bytes, pos: int) -> Tuple[List[Tuple[int, int]], int]:
+    (count,) = _COUNT.unpack_from(buf, pos)
+    pos += _COUNT.size
+    values = struct.unpack_from(f'<{2 * count}q', buf, pos)
+    return list(zip(values[::2], values[1::2])), pos + 16 * count
+
+
+def encode_snapshot(symbol: str, timestamp: int, bids: List[Tuple[int, int]], asks: List[Tuple[int, int]]) -> bytes:
+    """ 交易对的深度快照，档位为 (price, quantity) """
+    return b''.join([
+        _HEAD.pack(MSG_SNAPSHOT), _encode_str(symbol), _TIMESTAMP.pack(timestamp), _pack_levels(bids), _pack_levels(asks),
+    ])
+
+
+def encode_message(kind: int, data) -> bytes:
+    """ decode_message的逆操作，把 (消息类型, 消息体) 编码为bytes，用于把inproc消息写入journal """
+    if kind == MSG_ORDER:
+        return encode_order(data)
+    if kind == MSG_LEVERAGE_ORDER:
+        return encode_leverage_order(data)
+    if kind == MSG_ORDERS:
+        return encode_orders(data)
+    if kind == MSG_CANCEL:
+        return encode_cancel(data['uid'], data['symbol'], data['order_ids'])
+    if kind == MSG_MATCH_OUT:
+        return encode_match_out(**data)
+    if kind == MSG_SNAPSHOT:
+        return encode_snapshot(data['symbol'], data['timestamp'], data['bids'], data['asks'])
+    raise ValueError(f"Unknown message type {kind}")
+
+
+def decode_message(buf: bytes) -> Tuple[int, object]:
+    """ 返回 (消息类型, 消息体)
+        MSG_ORDER / MSG_LEVERAGE_ORDER -> Order
+        MSG_ORDERS -> List[Order]
+        MSG_CANCEL -> {'uid', 'symbol', 'order_ids'}
+        MSG_MATCH_OUT -> {'trades', 'order', 'orders', 'removed_orders'}，只包含编码时给出的字段
+        MSG_SNAPSHOT -> {'symbol', 'timestamp', 'bids', 'asks'}
+    """
+    (kind,) = _HEAD.unpack_from(buf, 0)
+    pos = _HEAD.size
+    if kind == MSG_ORDER or kind == MSG_LEVERAGE_ORDER:
+        return kind, unpack_order(buf, pos)[0]
+    if kind == MSG_ORDERS:
+        return kind, _unpack_orders(buf, pos)[0]
+    if kind == MSG_CANCEL:
+        uid, pos = _decode_str(buf, pos)
+        symbol, pos = _decode_str(buf, pos)
+        (count,) = _COUNT.unpack_from(buf, pos)
+        pos += _COUNT.size
+        order_ids = list(struct.unpack_from(f'<{count}q', buf, pos))
+        return kind, {'uid': uid, 'symbol': symbol, 'order_ids': order_ids}
+    if kind == MSG_MATCH_OUT:
+        (flags,) = _HEAD.unpack_from(buf, pos)
+        pos += _HEAD.size
+        data = {}
+        if flags & _HAS_TRADES:
+            (count,) = _COUNT.unpack_from(buf, pos)
+            pos += _COUNT.size
+            trades = [None] * count
+            for i in range(count):
+                trades[i], pos = unpack_trade(buf, pos)
+            data['trades'] = trades
+        if flags & _HAS_ORDER:
+            data['order'], pos = unpack_order(buf, pos)
+        if flags & _HAS_ORDERS:
+            data['orders'], pos = _unpack_orders(buf, pos)
+        if flags & _HAS_REMOVED_ORDERS:
+            data['removed_orders'], pos = _unpack_orders(buf, pos)
+        return kind, data
+    if kind == MSG_SNAPSHOT:
+        symbol, pos = _decode_str(buf, pos)
+        (timestamp,) = _TIMESTAMP.unpack_from(buf, pos)
+        bids, pos = _unpack_levels(buf, pos + _TIMESTAMP.size)
+        asks, pos = _unpack_levels(buf, pos)
+        return kind, {'symbol': symbol, 'timestamp': timestamp, 'bids': bids, 'asks': asks}
+    raise ValueError(f"Unknown message type {kind}")
+
+
+### Codecs
+class BinaryCodec:
+    """ 跨进程: 消息编码为bytes """
+    encode_order = staticmethod(encode_order)
+    encode_leverage_order = staticmethod(encode_leverage_order)
+    encode_orders = staticmethod(encode_orders)
+    encode_cancel = staticmethod(encode_cancel)
+    encode_match_out = staticmethod(encode_match_out)
+    encode_snapshot = staticmethod(encode_snapshot)
+    decode_message = staticmethod(decode_message)
+
+
+def copy_order(order: Order) -> Order:
+    """ 订单的浅拷贝，所有字段都是不可变值 """
+    copied = _new(Order)
+    copied.order_id = order.order_id
+    copied.uid = order.uid
+    copied.client_order_id = order.client_order_id
+    copied.symbol = order.symbol
+    copied.side = order.side
+    copied.type = order.type
+    copied.price = order.price
+    copied.quantity = order.quantity
+    copied.filled_quantity = order.filled_quantity
+    copied.filled_amount = order.filled_amount
+    copied.time_in_force = order.time_in_force
+    copied.is_futures = order.is_futures
+    copied.status = order.status
+    copied.timestamp = order.timestamp
+    copied.update_timestamp = order.update_timestamp
+    copied.is_selftrade = order.is_selftrade
+    copied.trade_num = order.trade_num
+    return copied
+
+
+class InProcessCodec:
+    """ 同一进程: 消息为 (消息类型, 对象)，与decode_message的返回值相同 """
+    @staticmethod
+    def encode_order(order: Order) -> tuple:
+        return MSG_ORDER, copy_order(order)
+
+    @staticmethod
+    def encode_leverage_order(order: Order) -> tuple:
+        return MSG_LEVERAGE_ORDER, copy_order(order)
+
+    @staticmethod
+    def encode_orders(orders: List[Order]) -> tuple:
+        return MSG_ORDERS, [copy_order(order) for order in orders]
+
+    @staticmethod
+    def encode_cancel(uid: str, symbol: str, order_ids: List[int]) -> tuple:
+        return MSG_CANCEL, {'uid': uid, 'symbol': symbol, 'order_ids': list(order_ids)}
+
+    @staticmethod
+    def encode_match_out(trades: List[Trade] = None, order: Order = None, orders: List[Order] = None, removed_orders: List[Order] = None) -> tuple:
+        data = {}
+        if trades is not None:
+            data['trades'] = list(trades)
+        if order is not None:
+            data['order'] = copy_order(order)
+        if orders is not None:
+            data['orders'] = [copy_order(o) for o in orders]
+        if removed_orders is not None:
+            data['removed_orders'] = [copy_order(o) for o in removed_orders]
+        return MSG_MATCH_OUT, data
+
+    @staticmethod
+    def encode_snapshot(symbol: str, timestamp: int, bids: List[Tuple[int, int]], asks: List[Tuple[int, int]]) -> tuple:
+        return MSG_SNAPSHOT, {'symbol': symbol, 'timestamp': timestamp, 'bids': list(bids), 'asks': list(asks)}
+
+    @staticmethod
+    def decode_message(message: tuple) -> Tuple[int, object]:
+        return message
+
+
+CODECS = {
+    TRANSPORT_BINARY: BinaryCodec,
+    TRANSPORT_INPROC: InProcessCodec,
+}
+
+
+def get_codec(transport: str):
+    if transport not in CODECS:
+        raise ValueError(f"Unknown MMQ transport {transport}, available: {sorted(CODECS)}")
+    return CODECS[transport]
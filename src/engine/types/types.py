@@ -1,5 +1,5 @@
-import time
-import uuid
+from src.engine.types.clock import now_ms
+from src.engine.types.ids import next_order_id, next_trade_id
 
 # Market types
 class Market:
@@ -40,10 +40,18 @@ class OrderTimeInForce:
 
 # Order model
 class Order:
-    def __init__(self, uid, symbol, side, order_type, time_in_force, quantity, price=None, client_order_id=None, is_futures=False, is_selftrade=False):
-        self.order_id = str(uuid.uuid4())
+    # __slots__: 常驻订单簿的订单数量很大，去掉每个实例的__dict__以减少内存和属性访问开销
+    __slots__ = (
+        'order_id', 'uid', 'client_order_id', 'symbol', 'side', 'type', 'price', 'quantity',
+        'filled_quantity', 'filled_amount', 'time_in_force', 'is_futures', 'status',
+        'timestamp', 'update_timestamp', 'is_selftrade', 'trade_num',
+    )
+
+    def __init__(self, uid, symbol, side, order_type, time_in_force, quantity, price=None, client_order_id=None, is_futures=False, is_selftrade=False, order_id=None):
+        # order_id为64位整数，见ids.py
+        self.order_id = next_order_id() if order_id is None else order_id
         self.uid = uid
-        self.client_order_id = client_order_id or str(uuid.uuid4())
+        self.client_order_id = client_order_id or str(self.order_id)
         self.symbol = symbol
         self.side = side
         self.type = order_type
@@ -53,15 +61,13 @@ class Order:
         self.filled_amount = 0    # 已成交金额
         self.time_in_force = time_in_force
         self.is_futures = is_futures
-        self.filled_quantity = 0
         self.status = OrderStatus.PENDING
-        self.timestamp = int(time.time() * 1000)
-        self.update_timestamp = int(time.time() * 1000)
+        self.timestamp = self.update_timestamp = now_ms()
         self.is_selftrade = is_selftrade
         self.trade_num = 0  # 分笔成交次数
 
     def __repr__(self) -> str:
-        return self.order_id
+        return str(self.order_id)
 
     def to_dict(self):
         return {
@@ -98,8 +104,8 @@ class Order:
             client_order_id=data["clientOrderId"],
             is_futures=data["isFutures"],
             is_selftrade=data["isSelfTrade"],
+            order_id=data["orderId"],
         )
-        order.order_id = data["orderId"]
         order.filled_quantity = data["filled_quantity"]
         order.filled_amount = data["filled_amount"]
         order.status = data["status"]
@@ -119,7 +125,12 @@ class Order:
 
 # Trade model
 class Trade:
-    def __init__(self, trade_id, taker_uid, maker_uid, symbol, price, quantity, buy_order_id, sell_order_id, is_taker_buyer=True):
+    __slots__ = (
+        'trade_id', 'taker_uid', 'maker_uid', 'symbol', 'price', 'quantity',
+        'buy_order_id', 'sell_order_id', 'is_taker_buyer', 'timestamp',
+    )
+
+    def __init__(self, trade_id, taker_uid, maker_uid, symbol, price, quantity, buy_order_id, sell_order_id, is_taker_buyer=True, timestamp=None):
         self.trade_id = trade_id
         self.taker_uid = taker_uid
         self.maker_uid = maker_uid
@@ -129,7 +140,8 @@ class Trade:
         self.buy_order_id = buy_order_id
         self.sell_order_id = sell_order_id
         self.is_taker_buyer = is_taker_buyer
-        self.timestamp = int(time.time() * 1000)
+        # 撮合引擎传入消息的时间戳，同一taker订单的成交时间一致
+        self.timestamp = now_ms() if timestamp is None else timestamp
 
     def to_dict(self):
         return {
@@ -163,6 +175,8 @@ class Trade:
 
 # Order price level
 class OrderLevel:
+    __slots__ = ('price', 'quantity')
+
     def __init__(self, price, quantity):
         self.price = price
         self.quantity = quantity
@@ -179,7 +193,7 @@ class OrderBookModel:
         self.symbol = symbol
         self.bids = []
         self.asks = []
-        self.timestamp = int(time.time() * 1000)
+        self.timestamp = now_ms()
 
     def to_dict(self):
         return {
@@ -191,11 +205,13 @@ class OrderBookModel:
 
 # Ticker model
 class Ticker:
+    __slots__ = ('symbol', 'price', 'quantity', 'timestamp')
+
     def __init__(self, symbol, price, quantity):
         self.symbol = symbol
         self.price = price
         self.quantity = quantity
-        self.timestamp = int(time.time() * 1000)
+        self.timestamp = now_ms()
 
     def to_dict(self):
         return {
@@ -211,15 +227,13 @@ def new_order(uid, symbol, side, order_type, time_in_force, quantity, price):
 
 # Create empty order, i.e., order not in order book
 def empty_order(uid, order_id, symbol):
-    order = Order(uid, symbol, "BUY", "LIMIT", OrderTimeInForce.GTC, 0)
-    order.order_id = order_id
+    order = Order(uid, symbol, "BUY", "LIMIT", OrderTimeInForce.GTC, 0, order_id=order_id)
     order.status = OrderStatus.CANCELLED
     return order
 
 # Create new trade
-def new_trade(taker_uid, maker_uid, symbol, price, quantity, buy_order_id, sell_order_id, is_taker_buyer):
-    trade_id = str(uuid.uuid4())
-    return Trade(trade_id, taker_uid, maker_uid, symbol, price, quantity, buy_order_id, sell_order_id, is_taker_buyer)
+def new_trade(taker_uid, maker_uid, symbol, price, quantity, buy_order_id, sell_order_id, is_taker_buyer, timestamp=None):
+    return Trade(next_trade_id(), taker_uid, maker_uid, symbol, price, quantity, buy_order_id, sell_order_id, is_taker_buyer, timestamp)
 
 # Create new order book
 def new_order_book(symbol):
@@ -6,6 +6,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 from src.engine.matching.matching import global_spot_engine, global_futures_engine
+from src.common.config.metadata import ticks_to_price, lots_to_qty, depth_to_float
+from src.engine.types.ids import format_id
 
 class WebSocketHandler:
     def __init__(self, symbols):
@@ -100,8 +102,8 @@ class WebSocketHandler:
                                 "e": "depthUpdate",
                                 "E": int(time.time() * 1000),
                                 "s": symbol,
-                                "b": depth.bids,
-                                "a": depth.asks
+                                "b": depth_to_float(symbol, depth.bids),
+                                "a": depth_to_float(symbol, depth.asks)
                             }
                             cached_order_book[symbol] = update
                         update = cached_order_book[symbol]
@@ -124,10 +126,10 @@ class WebSocketHandler:
                             updates = [{
                                 "e": "trade",
                                 "E": int(time.time() * 1000), # event timestamp
-                                "id": trade.trade_id,
+                                "id": format_id(trade.trade_id),
                                 "s": symbol,     # symbol
-                                "p": str(trade.price),         # price
-                                "q": str(trade.quantity),      # quantity
+                                "p": str(ticks_to_price(symbol, trade.price)),         # price
+                                "q": str(lots_to_qty(symbol, trade.quantity)),      # quantity
                                 "C": trade.timestamp,          # trade timestamp
                             } for trade in trades if trade.timestamp > last_trade_update_ts]
                             cached_trade[symbol] = updates
@@ -155,8 +157,8 @@ class WebSocketHandler:
                                 "e": "depthUpdate",
                                 "E": int(time.time() * 1000),
                                 "s": symbol,
-                                "b": depth.bids,
-                                "a": depth.asks
+                                "b": depth_to_float(symbol, depth.bids),
+                                "a": depth_to_float(symbol, depth.asks)
                             }
                             cached_order_book[symbol] = update
                         update = cached_order_book[symbol]
@@ -179,10 +181,10 @@ class WebSocketHandler:
                             updates = [{
                                 "e": "trade",
                                 "E": int(time.time() * 1000), # event timestamp
-                                "id": trade.trade_id,
+                                "id": format_id(trade.trade_id),
                                 "s": symbol,     # symbol
-                                "p": str(trade.price),         # price
-                                "q": str(trade.quantity),      # quantity
+                                "p": str(ticks_to_price(symbol, trade.price)),         # price
+                                "q": str(lots_to_qty(symbol, trade.quantity)),      # quantity
                                 "C": trade.timestamp,          # trade timestamp
                             } for trade in trades if trade.timestamp > last_trade_update_ts]
                             cached_trade[symbol] = updates
@@ -0,0 +1,72 @@
+"""Unit tests for src/engine/types/clock and its use on the matching path"""
+import pytest
+
+from src.engine.matching.matching import MatchingEngine
+from src.engine.types.clock import ManualClock, SystemClock, get_clock, now_ms, set_clock
+from src.engine.types.types import Order, OrderSide, OrderTimeInForce, OrderType
+
+SYMBOL = "90000001"
+# 整分钟
+BASE_MS = 1_800_000_000_000
+
+
+@pytest.fixture
+def clock():
+    manual = ManualClock(BASE_MS)
+    previous = set_clock(manual)
+    yield manual
+    set_clock(previous)
+
+
+def limit_order(uid, side, quantity, price):
+    return Order(uid, SYMBOL, side, OrderType.LIMIT, OrderTimeInForce.GTC, quantity, price)
+
+
+class TestClock:
+
+    def test_manual_clock(self, clock):
+        assert now_ms() == 1_800_000_000_000
+        clock.advance(5)
+        assert now_ms() == 1_800_000_000_005
+        assert get_clock() is clock
+
+    def test_system_clock(self):
+        assert isinstance(get_clock(), SystemClock)
+        assert now_ms() > 1_700_000_000_000
+
+    def test_models_use_clock(self, clock):
+        order = limit_order("u", OrderSide.BUY, 1, 1)
+        assert order.timestamp == order.update_timestamp == clock.now_ms()
+
+
+class TestEngineTimestamp:
+
+    def test_trades_of_one_taker_share_timestamp(self, clock):
+        engine = MatchingEngine()
+        for i in range(3):
+            engine.process_order(limit_order("maker", OrderSide.SELL, 10, 100 + i))
+            clock.advance(1_000)
+        taker = limit_order("taker", OrderSide.BUY, 30, 102)
+        trades = engine.process_order(taker, timestamp=BASE_MS + 42 * 60_000 + 7)
+        assert len(trades) == 3
+        assert {trade.timestamp for trade in trades} == {BASE_MS + 42 * 60_000 + 7}
+
+        engine.klines.on_trades(trades)
+        kline = engine.get_klines(SYMBOL, '1m')
+        assert len(kline) == 1
+        # 开盘时间按周期对齐
+        assert kline[0][0] == BASE_MS + 42 * 60_000
+        assert kline[0][5] == 30
+
+    def test_klines_follow_injected_clock(self, clock):
+        engine = MatchingEngine()
+        clock.set(BASE_MS + 10 * 60_000)
+        engine.process_order(limit_order("maker", OrderSide.SELL, 10, 100))
+        engine.klines.on_trades(engine.process_order(limit_order("taker", OrderSide.BUY, 1, 100)))
+        clock.advance(30_000)
+        engine.klines.on_trades(engine.process_order(limit_order("taker", OrderSide.BUY, 1, 100)))
+        assert len(engine.get_klines(SYMBOL, '1m')) == 1
+        clock.advance(30_000)
+        engine.klines.on_trades(engine.process_order(limit_order("taker", OrderSide.BUY, 1, 100)))
+        bars = engine.get_klines(SYMBOL, '1m')
+        assert [bar[0] for bar in bars] == [BASE_MS + 10 * 60_000, BASE_MS + 11 * 60_000]
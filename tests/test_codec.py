@@ -0,0 +1,100 @@
+"""Unit tests for src/engine/types/codec (MMQ payload codecs)"""
+import pytest
+
+from src.engine.types.codec import (
+    MSG_CANCEL, MSG_MATCH_OUT, MSG_ORDER, MSG_ORDERS, MSG_SNAPSHOT,
+    InProcessCodec, copy_order, decode_message, encode_cancel, encode_match_out, encode_order, encode_orders, encode_snapshot,
+    get_codec,
+)
+from src.engine.types.types import Order, OrderSide, OrderStatus, OrderTimeInForce, OrderType, new_trade
+
+
+def make_order(**kwargs) -> Order:
+    params = dict(uid="10000001", symbol="90000001", side=OrderSide.BUY, order_type=OrderType.LIMIT,
+                  time_in_force=OrderTimeInForce.GTC, quantity=1_000, price=500_000)
+    params.update(kwargs)
+    return Order(**params)
+
+
+class TestCodec:
+
+    def test_order_round_trip(self):
+        order = make_order(client_order_id="客户端-1", is_futures=True)
+        order.filled_quantity = 300
+        order.filled_amount = 150_000_000
+        order.status = OrderStatus.PARTIALLY_FILLED
+        order.trade_num = 2
+        kind, decoded = decode_message(encode_order(order))
+        assert kind == MSG_ORDER
+        assert type(decoded) is Order
+        assert decoded.to_dict() == order.to_dict()
+
+    def test_market_order_without_price(self):
+        order = make_order(order_type=OrderType.MARKET, time_in_force=OrderTimeInForce.IOC, price=None)
+        _, decoded = decode_message(encode_order(order))
+        assert decoded.price is None
+        _, decoded = decode_message(encode_order(make_order(price=0)))
+        assert decoded.price == 0
+
+    def test_orders(self):
+        orders = [make_order(side=OrderSide.SELL, price=500_000 + i) for i in range(3)]
+        kind, decoded = decode_message(encode_orders(orders))
+        assert kind == MSG_ORDERS
+        assert [o.to_dict() for o in decoded] == [o.to_dict() for o in orders]
+        assert decode_message(encode_orders([])) == (MSG_ORDERS, [])
+
+    def test_cancel(self):
+        kind, data = decode_message(encode_cancel("10000001", "90000001", [1, 2**62]))
+        assert kind == MSG_CANCEL
+        assert data == {"uid": "10000001", "symbol": "90000001", "order_ids": [1, 2**62]}
+
+    def test_match_out(self):
+        order = make_order()
+        trades = [new_trade("10000001", "10000002", "90000001", 500_000, 10, order.order_id, 7, True)]
+        kind, data = decode_message(encode_match_out(trades=trades, order=order))
+        assert kind == MSG_MATCH_OUT
+        assert set(data) == {"trades", "order"}
+        assert [t.to_dict() for t in data["trades"]] == [t.to_dict() for t in trades]
+        assert data["order"].to_dict() == order.to_dict()
+
+        _, data = decode_message(encode_match_out(removed_orders=[order]))
+        assert set(data) == {"removed_orders"}
+        assert data["removed_orders"][0].order_id == order.order_id
+
+    def test_snapshot(self):
+        bids, asks = [(500_000, 3), (499_999, 10)], []
+        kind, data = decode_message(encode_snapshot("90000001", 1_700_000_000_000, bids, asks))
+        assert kind == MSG_SNAPSHOT
+        assert data == {'symbol': "90000001", 'timestamp': 1_700_000_000_000, 'bids': bids, 'asks': asks}
+
+
+class TestInProcessCodec:
+
+    def test_get_codec(self):
+        assert get_codec("inproc") is InProcessCodec
+        with pytest.raises(ValueError):
+            get_codec("unknown")
+
+    def test_copy_order_copies_all_fields(self):
+        order = make_order(price=None, is_futures=True)
+        copied = copy_order(order)
+        assert all(getattr(copied, name) == getattr(order, name) for name in Order.__slots__)
+
+    def test_orders_are_snapshots(self):
+        order = make_order()
+        kind, decoded = InProcessCodec.decode_message(InProcessCodec.encode_order(order))
+        assert kind == MSG_ORDER
+        assert decoded is not order
+        assert decoded.to_dict() == order.to_dict()
+        # 撮合引擎之后修改订单不影响已经发送的消息
+        order.filled_quantity = 500
+        assert decoded.filled_quantity == 0
+
+    def test_match_out_passes_trades_by_reference(self):
+        order = make_order()
+        trades = [new_trade("10000001", "10000002", "90000001", 500_000, 10, order.order_id, 7, True)]
+        kind, data = InProcessCodec.decode_message(InProcessCodec.encode_match_out(trades=trades, orders=[order]))
+        assert kind == MSG_MATCH_OUT
+        assert set(data) == {"trades", "orders"}
+        assert data["trades"][0] is trades[0]
+        assert data["orders"][0] is not order
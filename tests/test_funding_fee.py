@@ -0,0 +1,55 @@
+""" 现货成交手续费：按资产数量四舍五入(half-up)到FEE_DECIMAL位小数 """
+import pytest
+
+from src.common.config.metadata import FEE_DECIMAL
+from src.engine.funding.funding import FEE_ACCOUNT, Funding, split_fee
+from src.engine.types.account_types import UniMarginAccount
+from src.engine.types.types import new_trade
+
+SYMBOL = '90000003'  # JPM/USDT，价格和数量都是2位小数
+
+
+@pytest.fixture
+def funding(monkeypatch):
+    monkeypatch.setattr(FEE_ACCOUNT, 'balances', {})
+    # 内部做市商下单不冻结资产，成交时直接从余额扣减
+    accounts = [UniMarginAccount("fee_taker", is_inner_maker=True), UniMarginAccount("fee_maker", is_inner_maker=True)]
+    for account in accounts:
+        account.balances = {'JPM': 100.0, 'USDT': 10_000.0}
+    return Funding(accounts)
+
+
+def _balances(account):
+    return {asset: account.balances.get(asset, 0) for asset in ('JPM', 'USDT')}
+
+
+def _settle(funding, is_taker_buyer):
+    """ 价格100.00成交1 lot(0.01 JPM，金额1.00 USDT)，返回taker、maker和手续费账户的余额变化 """
+    accounts = (funding.accounts["fee_taker"], funding.accounts["fee_maker"], FEE_ACCOUNT)
+    before = [_balances(account) for account in accounts]
+    trade = new_trade("fee_taker", "fee_maker", SYMBOL, 10_000, 1, "fee_buy", "fee_sell", is_taker_buyer)
+    assert funding._settlement_spot_trade(trade)
+    return [{asset: _balances(account)[asset] - old[asset] for asset in old}
+            for account, old in zip(accounts, before)]
+
+
+class TestSpotFee:
+
+    def test_split_fee_rounds_half_up(self):
+        assert split_fee(0.001, 0.005, FEE_DECIMAL) == (0.00099, 0.00001)
+        assert split_fee(0.0009, 0.005, FEE_DECIMAL) == (0.0009, 0.0)
+        assert split_fee(1.0, 0.002, FEE_DECIMAL) == (0.998, 0.002)
+
+    def test_one_lot_taker_buy(self, funding):
+        taker, maker, fee = _settle(funding, True)
+        # taker手续费0.01 * 0.005 = 0.00005 JPM，maker手续费1.00 * 0.002 = 0.002 USDT
+        assert taker == pytest.approx({'JPM': 0.00995, 'USDT': -1.0})
+        assert maker == pytest.approx({'JPM': -0.01, 'USDT': 0.998})
+        assert fee == pytest.approx({'JPM': 0.00005, 'USDT': 0.002})
+
+    def test_one_lot_taker_sell(self, funding):
+        taker, maker, fee = _settle(funding, False)
+        # taker手续费1.00 * 0.005 = 0.005 USDT，maker手续费0.01 * 0.002 = 0.00002 JPM
+        assert taker == pytest.approx({'JPM': -0.01, 'USDT': 0.995})
+        assert maker == pytest.approx({'JPM': 0.00998, 'USDT': -1.0})
+        assert fee == pytest.approx({'JPM': 0.00002, 'USDT': 0.005})
@@ -0,0 +1,141 @@
+"""Unit tests for src/engine/history (mmap market data history store)"""
+import os
+import random
+
+from src.engine.history.history import ColumnTable, HistoryStore
+from src.engine.kline.kline import KlineAggregator
+from src.engine.matching.matching import MatchingEngine
+from src.engine.matching.trade_history import TradeHistory
+from src.engine.types.types import new_trade
+
+SYMBOL = "90000001"
+# 2027-01-15 08:00:00 UTC
+BASE_MS = 1_800_000_000_000
+
+
+def make_trades(count, max_gap_ms, seed=11):
+    rng = random.Random(seed)
+    timestamp = BASE_MS
+    trades = []
+    for _ in range(count):
+        timestamp += rng.randint(0, max_gap_ms)
+        trades.append(new_trade("taker", "maker", SYMBOL, rng.randint(90, 110), rng.randint(1, 20), 1, 2,
+                                rng.random() < 0.5, timestamp=timestamp))
+    return trades
+
+
+class TestColumnTable:
+
+    def test_append_search_and_reopen(self, tmp_path):
+        table = ColumnTable(str(tmp_path), "t", ("time", "value"))
+        assert table.search(5) == 0 and table.read(0, 10) == [] and table.last() is None
+        table.append([(10, 1), (20, 2)])
+        table.append([(20, 3), (30, 4)])
+        assert table.search(20) == 1
+        assert table.search(21) == 3
+        assert table.range(2) == [(20, 3), (30, 4)]
+        assert table.range(2, start=15) == [(20, 2), (20, 3)]
+        assert table.range(10, start=15, end=20) == [(20, 2), (20, 3)]
+        assert table.range(10, stop=1) == [(10, 1)]
+        assert table.last(1) == 4
+        table.close()
+
+        # 写了一半的行在重新打开时截断
+        with open(os.path.join(str(tmp_path), "t.time"), "ab") as f:
+            f.write((40).to_bytes(8, "little"))
+        table = ColumnTable(str(tmp_path), "t", ("time", "value"))
+        assert len(table) == 4
+        assert os.path.getsize(os.path.join(str(tmp_path), "t.time")) == 32
+        table.close()
+
+
+class TestHistoryStore:
+
+    def test_trades(self, tmp_path):
+        store = HistoryStore(str(tmp_path))
+        trades = make_trades(100, 2_000)
+        store.append_trades(trades[:60])
+        # 重放时已经写入的成交被跳过
+        store.append_trades(trades[50:])
+        store.close()
+
+        store = HistoryStore(str(tmp_path))
+        store.append_trades(trades[90:])
+        expected = [(t.trade_id, t.price, t.quantity, t.timestamp, t.is_taker_buyer) for t in trades]
+        as_tuples = lambda result: [(t.trade_id, t.price, t.quantity, t.timestamp, t.is_taker_buyer) for t in result]
+        assert as_tuples(store.get_trades(SYMBOL, 1000)) == expected
+        assert as_tuples(store.get_trades(SYMBOL, 5)) == expected[-5:]
+        assert as_tuples(store.get_trades(SYMBOL, 5, before_id=trades[30].trade_id)) == expected[25:30]
+        start, end = trades[10].timestamp, trades[20].timestamp
+        in_range = [t for t in expected if start <= t[3] <= end]
+        assert as_tuples(store.get_trades(SYMBOL, 1000, start_time=start, end_time=end)) == in_range
+        assert as_tuples(store.get_trades(SYMBOL, 3, start_time=start)) == in_range[:3]
+        assert store.get_trades("unknown") == []
+        store.close()
+
+
+class TestEngineHistory:
+
+    def test_klines_fall_through_to_history(self, tmp_path):
+        trades = make_trades(3_000, 20_000)
+        reference = KlineAggregator(['1m', '5m', '1h'])
+        reference.on_trades(trades)
+
+        # 内存中每个周期只保留4根K线
+        engine = MatchingEngine()
+        engine.klines = KlineAggregator(['1m', '5m', '1h'], capacity=4)
+        engine.set_history(HistoryStore(str(tmp_path)))
+        for i in range(0, len(trades), 7):
+            engine.klines.on_trades(trades[i:i + 7])
+
+        for interval in ('1m', '5m', '1h'):
+            expected = reference.get_klines(SYMBOL, interval, limit=1000)
+            assert len(expected) > 4
+            assert engine.get_klines(SYMBOL, interval, limit=1000) == expected
+            assert engine.get_klines(SYMBOL, interval, limit=10) == expected[-10:]
+            start, end = expected[1][0], expected[-3][0]
+            assert engine.get_klines(SYMBOL, interval, limit=1000, start_time=start, end_time=end) == expected[1:-2]
+            assert engine.get_klines(SYMBOL, interval, limit=3, start_time=start) == expected[1:4]
+            assert engine.get_klines(SYMBOL, interval, limit=3, end_time=end) == expected[-5:-2]
+
+        # 重启后内存中没有K线，全部从history查询已经结束的K线
+        engine = MatchingEngine()
+        engine.set_history(HistoryStore(str(tmp_path)))
+        assert engine.get_klines(SYMBOL, '1m', limit=1000) == reference.get_klines(SYMBOL, '1m', limit=1000)[:-1]
+
+    def test_trades_fall_through_to_history(self, tmp_path):
+        trades = make_trades(50, 1_000)
+        engine = MatchingEngine()
+        engine.trades = TradeHistory(symbol_capacity=8)
+        engine.set_history(HistoryStore(str(tmp_path)))
+        engine._store_trades(SYMBOL, trades)
+        engine.klines.on_trades(trades)
+
+        result = engine.get_trades(SYMBOL, 20)
+        assert [t.trade_id for t in result] == [t.trade_id for t in trades[-20:]]
+        # 内存中的成交保留uid
+        assert result[-1] is trades[-1]
+        assert result[0].price == trades[-20].price and result[0].timestamp == trades[-20].timestamp
+        assert engine.get_trades(SYMBOL, 5) == trades[-5:]
+
+    def test_rebuild_klines_from_history(self, tmp_path):
+        trades = make_trades(3_000, 20_000)
+        reference = KlineAggregator(['1m', '5m', '15m', '1h'])
+        reference.on_trades(trades)
+
+        engine = MatchingEngine()
+        engine.klines = KlineAggregator(['1m', '1h'])
+        engine.set_history(HistoryStore(str(tmp_path)))
+        engine.klines.on_trades(trades)
+
+        # 重启后新增15m周期，内存中的K线从history中的成交重建
+        engine = MatchingEngine()
+        engine.klines = KlineAggregator(['1m', '15m', '1h'])
+        engine.set_history(HistoryStore(str(tmp_path)))
+        written = engine.rebuild_klines(SYMBOL, ['1m', '5m', '15m', '1h'])
+        assert written['1m'] == 0 and written['5m'] == len(reference.get_klines(SYMBOL, '5m', limit=1000)) - 1
+        for interval in ('1m', '5m', '15m', '1h'):
+            expected = reference.get_klines(SYMBOL, interval, limit=1000)
+            assert engine.get_klines(SYMBOL, interval, limit=1000) == expected[:-1 if interval == '5m' else None], interval
+            assert engine.history.get_klines(SYMBOL, interval, limit=1000) == expected[:-1], interval
+        assert engine.rebuild_klines(SYMBOL, ['5m', '15m']) == {'5m': 0, '15m': 0}
@@ -0,0 +1,83 @@
+"""Unit tests for src/engine/types/ids (order / trade ID generation)"""
+import threading
+
+import pytest
+
+from src.engine.types import ids
+from src.engine.types.ids import MonotonicIdGenerator, SnowflakeIdGenerator, format_id, parse_id
+from src.engine.types.types import Order, OrderSide, OrderTimeInForce, OrderType, empty_order, new_trade
+
+
+class TestSnowflakeIdGenerator:
+
+    def test_monotonic_within_same_millisecond(self):
+        gen = SnowflakeIdGenerator(node_id=3, clock=lambda: 1_800_000_000.0)
+        values = [gen.next_id() for _ in range(5_000)]
+        assert values == sorted(values)
+        assert len(set(values)) == len(values)
+        # 序号用完后借用下一毫秒
+        assert gen.timestamp_ms(values[-1]) == 1_800_000_000_001
+        assert (values[0] >> SnowflakeIdGenerator.SEQUENCE_BITS) & SnowflakeIdGenerator.MAX_NODE == 3
+
+    def test_clock_going_backwards(self):
+        now = [1_800_000_000.0]
+        gen = SnowflakeIdGenerator(clock=lambda: now[0])
+        first = gen.next_id()
+        now[0] -= 1
+        assert gen.next_id() > first
+
+    def test_nodes_do_not_collide(self):
+        clock = lambda: 1_800_000_000.0
+        a, b = SnowflakeIdGenerator(1, clock), SnowflakeIdGenerator(2, clock)
+        assert not {a.next_id() for _ in range(100)} & {b.next_id() for _ in range(100)}
+
+    def test_invalid_node(self):
+        with pytest.raises(ValueError):
+            SnowflakeIdGenerator(node_id=SnowflakeIdGenerator.MAX_NODE + 1)
+
+    def test_thread_safe(self):
+        gen = SnowflakeIdGenerator()
+        results = []
+
+        def worker():
+            results.extend(gen.next_id() for _ in range(2_000))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(set(results)) == 8_000
+
+
+class TestPluggableGenerator:
+
+    @pytest.fixture
+    def monotonic(self):
+        order_gen, trade_gen = ids._order_id_generator, ids._trade_id_generator
+        ids.set_order_id_generator(MonotonicIdGenerator(100))
+        ids.set_trade_id_generator(MonotonicIdGenerator(1))
+        yield
+        ids.set_order_id_generator(order_gen)
+        ids.set_trade_id_generator(trade_gen)
+
+    def test_models_use_generator(self, monotonic):
+        order = Order("u", "90000001", OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 1, 1)
+        assert order.order_id == 100
+        assert order.client_order_id == "100"
+        trade = new_trade("u", "m", "90000001", 1, 1, order.order_id, 5, True)
+        assert trade.trade_id == 1
+        # empty_order不消耗ID
+        assert empty_order("u", 42, "90000001").order_id == 42
+        assert Order("u", "90000001", OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 1, 1).order_id == 101
+
+
+class TestFormatting:
+
+    def test_round_trip(self):
+        assert parse_id(format_id(2**62 + 5)) == 2**62 + 5
+
+    @pytest.mark.parametrize("value", ["abc", "", "0", "-1", None])
+    def test_invalid(self, value):
+        with pytest.raises((ValueError, TypeError)):
+            parse_id(value)
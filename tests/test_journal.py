@@ -0,0 +1,219 @@
+"""Unit tests for src/common/mmq/journal (write-ahead journal) and src/engine/recovery (journal replay)"""
+import os
+import threading
+
+import pytest
+
+from src.common.mmq import FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, MMQ, MMQTopic, TRANSPORT_INPROC
+from src.common.mmq import journal as journal_module
+from src.common.mmq.journal import Journal, read_records
+from src.engine.funding.funding import Funding
+from src.engine.matching.matching import MatchingEngine
+from src.engine.recovery.recovery import recover, replay
+from src.engine.types.account_types import UniMarginAccount
+from src.engine.types.codec import MSG_LEVERAGE_ORDER, MSG_ORDER, decode_message, encode_message, get_codec
+from src.engine.types.types import Order, OrderSide, OrderTimeInForce, OrderType
+
+SYMBOL = "90000001"
+
+
+class TestJournal:
+
+    def test_append_and_read(self, tmp_path):
+        path = str(tmp_path / "mmq.journal")
+        journal = Journal(path)
+        assert journal.append("a", b"first") == 1
+        assert journal.append("bb", b"") == 2
+        journal.sync()
+        assert journal.synced == 2
+        journal.close()
+        records = list(read_records(path))
+        assert [(topic, payload) for _, topic, payload in records] == [("a", b"first"), ("bb", b"")]
+        assert records[-1][0] == os.path.getsize(path)
+        # 从已读取的位置继续
+        assert [payload for _, _, payload in read_records(path, records[0][0])] == [b""]
+
+    def test_torn_tail_is_truncated(self, tmp_path):
+        path = str(tmp_path / "mmq.journal")
+        journal = Journal(path)
+        journal.append("a", b"complete")
+        journal.close()
+        with open(path, "ab") as f:
+            f.write(journal_module.encode_record("a", b"torn")[:-2])
+
+        assert [payload for _, _, payload in read_records(path)] == [b"complete"]
+        journal = Journal(path)
+        journal.append("a", b"after restart")
+        journal.close()
+        assert [payload for _, _, payload in read_records(path)] == [b"complete", b"after restart"]
+
+    def test_group_commit(self, tmp_path, monkeypatch):
+        fsyncs = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(journal_module.os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd))
+        journal = Journal(str(tmp_path / "mmq.journal"), flush_interval=0.01)
+
+        def produce(n):
+            for i in range(500):
+                journal.append(f"t{n}", i.to_bytes(4, "little"))
+
+        threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        journal.sync()
+        journal.close()
+        records = list(read_records(journal.path))
+        assert len(records) == 2000
+        # 每个topic内部保持顺序
+        assert [payload for _, topic, payload in records if topic == "t0"] == [i.to_bytes(4, "little") for i in range(500)]
+        # 一次fsync提交一批记录
+        assert len(fsyncs) < 100
+
+    def test_mmq_journal_encodes_inproc_messages(self, tmp_path):
+        journal = Journal(str(tmp_path / "mmq.journal"))
+        mq = MMQ(transport=TRANSPORT_INPROC)
+        mq.set_journal(journal, [MMQTopic.MATCH_IN_SPOT_NEW], lambda message: encode_message(*message))
+        order = Order("u", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 1, 100)
+        mq.produce(MMQTopic.MATCH_IN_SPOT_NEW, get_codec(TRANSPORT_INPROC).encode_order(order))
+        mq.produce(MMQTopic.MATCH_IN_SPOT_CANCEL, get_codec(TRANSPORT_INPROC).encode_cancel("u", SYMBOL, [order.order_id]))
+        journal.close()
+        records = list(read_records(journal.path))
+        assert len(records) == 1
+        kind, decoded = decode_message(records[0][2])
+        assert kind == MSG_ORDER and decoded.to_dict() == order.to_dict()
+
+
+class TestRecovery:
+
+    @pytest.fixture
+    def journal_path(self, tmp_path):
+        yield str(tmp_path / "spot.journal")
+        FUNDING_MATCH_MQ.set_journal(None, [])
+
+    @staticmethod
+    def make_funding():
+        return Funding([UniMarginAccount("recovery_maker", is_inner_maker=True), UniMarginAccount("recovery_user")])
+
+    @staticmethod
+    def run(engine, funding, group):
+        """ 同步处理MMQ中的撮合输入和撮合结果，撮合结果写入engine自己的out_mq，不影响其他测试 """
+        for topic in (MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL):
+            for message in FUNDING_MATCH_MQ.poll(group, topic):
+                engine.on_message(*get_codec(FUNDING_MATCH_MQ.transport).decode_message(message))
+        for message in engine.out_mq.poll(group, MMQTopic.SPOT_MATCH_OUT):
+            data = get_codec(engine.out_mq.transport).decode_message(message)[1]
+            funding.on_match_out(data)
+            engine.klines.on_trades(data.get('trades', []))
+
+    def test_replay_restores_books_and_accounts(self, journal_path):
+        group = "recovery_test"
+        FUNDING_MATCH_MQ.subscribe(group, [MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL], from_latest=True)
+        engine, funding = MatchingEngine(out_mq=MMQ(transport=MATCH_FUNDING_MQ.transport)), self.make_funding()
+        engine.out_mq.subscribe(group, [MMQTopic.SPOT_MATCH_OUT])
+        journal = recover(journal_path, engine, funding, out_mq=engine.out_mq)
+
+        orders = [{"symbol": SYMBOL, "side": OrderSide.SELL, "type": OrderType.LIMIT, "time_in_force": OrderTimeInForce.GTC,
+                   "quantity": 100, "price": price} for price in (5_000_000, 5_100_000)]
+        assert funding.put_spot_orders("recovery_maker", orders)[0]
+        self.run(engine, funding, group)
+        result, taker = funding.put_spot_order("recovery_user", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 150, 5_100_000)
+        assert result
+        result, resting = funding.put_spot_order("recovery_user", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 10, 4_000_000)
+        assert result
+        self.run(engine, funding, group)
+        result, cancelled = funding.put_spot_order("recovery_user", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 20, 3_000_000)
+        self.run(engine, funding, group)
+        assert funding.cancel_spot_orders("recovery_user", SYMBOL, [cancelled.order_id])[0]
+        self.run(engine, funding, group)
+        journal.close()
+        FUNDING_MATCH_MQ.unsubscribe(group)
+
+        recovered_engine, recovered_funding = MatchingEngine(), self.make_funding()
+        position, count = replay(journal_path, recovered_engine, recovered_funding)
+        assert position == os.path.getsize(journal_path)
+        assert count == 10
+
+        depth, recovered_depth = engine.get_order_book_data(SYMBOL), recovered_engine.get_order_book_data(SYMBOL)
+        assert (recovered_depth.bids, recovered_depth.asks) == (depth.bids, depth.asks) == ([(4_000_000, 10)], [(5_100_000, 50)])
+        assert [o.order_id for o in recovered_engine.get_open_orders("recovery_user")] == [resting.order_id]
+        for uid, account in funding.accounts.items():
+            recovered = recovered_funding.accounts[uid]
+            assert recovered.balances == account.balances
+            assert recovered.frozen_balances == account.frozen_balances
+        assert resting.order_id in recovered_funding.exist_order_ids
+        assert recovered_engine.get_klines(SYMBOL, '1m') == engine.get_klines(SYMBOL, '1m')
+
+    def test_recover_settles_input_without_journaled_output(self, journal_path):
+        group = "recovery_cut_test"
+        FUNDING_MATCH_MQ.subscribe(group, [MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL], from_latest=True)
+        engine, funding = MatchingEngine(out_mq=MMQ(transport=MATCH_FUNDING_MQ.transport)), self.make_funding()
+        engine.out_mq.subscribe(group, [MMQTopic.SPOT_MATCH_OUT])
+        journal = recover(journal_path, engine, funding, out_mq=engine.out_mq)
+
+        orders = [{"symbol": SYMBOL, "side": OrderSide.SELL, "type": OrderType.LIMIT, "time_in_force": OrderTimeInForce.GTC,
+                   "quantity": 100, "price": 5_000_000}]
+        assert funding.put_spot_orders("recovery_maker", orders)[0]
+        self.run(engine, funding, group)
+        assert funding.put_spot_order("recovery_user", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 100, 5_000_000)[0]
+        # 输入已经写入journal，撮合结果写入journal之前崩溃
+        journal.close()
+        engine.out_mq.set_journal(None, [])
+        self.run(engine, funding, group)
+        FUNDING_MATCH_MQ.unsubscribe(group)
+        topics = [topic for _, topic, _ in read_records(journal_path)]
+        assert topics == [MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.SPOT_MATCH_OUT, MMQTopic.MATCH_IN_SPOT_NEW]
+
+        recovered_engine, recovered_funding = MatchingEngine(), self.make_funding()
+        recover(journal_path, recovered_engine, recovered_funding, out_mq=MMQ(transport=MATCH_FUNDING_MQ.transport)).close()
+        depth = recovered_engine.get_order_book_data(SYMBOL)
+        assert (depth.bids, depth.asks) == ([], [])
+        for uid, account in funding.accounts.items():
+            recovered = recovered_funding.accounts[uid]
+            assert recovered.balances == account.balances
+            assert recovered.frozen_balances == account.frozen_balances
+        assert recovered_funding.accounts["recovery_user"].frozen_balances == {}
+        assert [t.quantity for t in recovered_engine.get_user_trades("recovery_maker", SYMBOL)] == [100]
+
+        # 按重放结算的撮合结果补写到journal，再次恢复时不重复结算
+        topics = [topic for _, topic, _ in read_records(journal_path)]
+        assert topics[-2:] == [MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.SPOT_MATCH_OUT]
+        again_engine, again_funding = MatchingEngine(), self.make_funding()
+        replay(journal_path, again_engine, again_funding)
+        for uid, account in recovered_funding.accounts.items():
+            assert again_funding.accounts[uid].balances == account.balances
+            assert again_funding.accounts[uid].frozen_balances == account.frozen_balances
+        trade_ids = [t.trade_id for t in recovered_engine.get_user_trades("recovery_maker", SYMBOL)]
+        assert [t.trade_id for t in again_engine.get_user_trades("recovery_maker", SYMBOL)] == trade_ids
+
+    def test_replay_leverage_order(self, journal_path):
+        group = "recovery_leverage_test"
+        FUNDING_MATCH_MQ.subscribe(group, [MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL], from_latest=True)
+        engine, funding = MatchingEngine(out_mq=MMQ(transport=MATCH_FUNDING_MQ.transport)), self.make_funding()
+        engine.out_mq.subscribe(group, [MMQTopic.SPOT_MATCH_OUT])
+        # 逐仓杠杆账户中的保证金不在journal中，恢复前的初始状态
+        margin = {f"{SYMBOL}USDT": 10_000}
+        funding.accounts["recovery_user"].leverage_balance = dict(margin)
+        journal = recover(journal_path, engine, funding, out_mq=engine.out_mq)
+
+        result, order = funding.put_leverage_spot_order("recovery_user", SYMBOL, OrderSide.BUY, OrderType.LIMIT,
+                                                        OrderTimeInForce.GTC, 100, 4_000_000, "leverage")
+        assert result
+        self.run(engine, funding, group)
+        journal.close()
+        FUNDING_MATCH_MQ.unsubscribe(group)
+        account = funding.accounts["recovery_user"]
+        assert account.leverage_balance == {f"{SYMBOL}USDT": 10_004}
+
+        kinds = [decode_message(payload)[0] for _, topic, payload in read_records(journal_path) if topic == MMQTopic.MATCH_IN_SPOT_NEW]
+        assert kinds == [MSG_LEVERAGE_ORDER]
+        recovered_engine, recovered_funding = MatchingEngine(), self.make_funding()
+        recovered = recovered_funding.accounts["recovery_user"]
+        recovered.leverage_balance = dict(margin)
+        replay(journal_path, recovered_engine, recovered_funding)
+        # 按杠杆订单重新借款，不冻结现货余额
+        assert recovered.leverage_balance == account.leverage_balance
+        assert recovered.balances == account.balances
+        assert recovered.frozen_balances == account.frozen_balances == {}
+        assert [o.order_id for o in recovered_engine.get_open_orders("recovery_user")] == [order.order_id]
@@ -0,0 +1,191 @@
+"""Unit tests for src/engine/kline (kline aggregation)"""
+import asyncio
+import random
+
+import pytest
+
+from src.common.mmq import MATCH_FUNDING_MQ, MMQTopic
+from src.engine.kline import rebuild
+from src.engine.kline.kline import KLINE_INTERVALS, KLINE_OFFSETS, KlineAggregator, KlineSeries
+from src.engine.types.codec import get_codec
+from src.engine.types.types import new_trade
+
+SYMBOL = "90000001"
+# 2027-01-15 08:00:00 UTC
+BASE_MS = 1_800_000_000_000
+
+
+def reference_klines(trades, interval):
+    """ 逐笔直接聚合的K线 """
+    ms, offset = KLINE_INTERVALS[interval], KLINE_OFFSETS.get(interval, 0)
+    bars = []
+    for price, quantity, timestamp in trades:
+        open_time = (timestamp - offset) // ms * ms + offset
+        if bars and bars[-1][0] == open_time:
+            bar = bars[-1]
+            bar[2], bar[3], bar[4] = max(bar[2], price), min(bar[3], price), price
+            bar[5] += quantity
+            bar[7] += price * quantity
+        else:
+            bars.append([open_time, price, price, price, price, quantity, open_time + ms, price * quantity])
+    return bars
+
+
+def random_trades(count, max_gap_ms, seed=7):
+    rng = random.Random(seed)
+    timestamp = BASE_MS
+    trades = []
+    for _ in range(count):
+        timestamp += rng.randint(0, max_gap_ms)
+        trades.append((rng.randint(90, 110), rng.randint(1, 20), timestamp))
+    return trades
+
+
+class TestKlineSeries:
+
+    def test_ring_buffer(self):
+        series = KlineSeries(1000, capacity=4)
+        for i in range(6):
+            series.append(i * 1000, 1, 1, 1, 1, 1, 1)
+        assert series.first == 2
+        assert [series.bar(i)[0] for i in range(series.first, series.count)] == [2000, 3000, 4000, 5000]
+        assert series.search(3500) == 4
+        assert series.search(0) == 2
+        assert series.search(9000) == 6
+
+    def test_week_starts_on_monday(self):
+        series = KlineSeries(KLINE_INTERVALS['1w'], KLINE_OFFSETS['1w'])
+        # 2027-01-11是周一
+        monday = 1_799_625_600_000
+        assert series.align(BASE_MS) == monday
+
+
+class TestKlineAggregator:
+
+    def test_derivation_chain(self):
+        aggregator = KlineAggregator()
+        assert aggregator.base == '1s'
+        assert aggregator.sources['1m'] == '1s'
+        assert aggregator.sources['15m'] == '5m'
+        assert aggregator.sources['4h'] == '2h'
+        assert aggregator.sources['1w'] == '1d'
+        assert aggregator.sources['3d'] == '1d'
+        with pytest.raises(ValueError):
+            KlineAggregator(['1m', '2s'])
+
+    @pytest.mark.parametrize("max_gap_ms", [50, 40_000, 4 * 3600_000])
+    def test_matches_reference(self, max_gap_ms):
+        trades = random_trades(3_000, max_gap_ms)
+        aggregator = KlineAggregator(capacity=5_000)
+        for price, quantity, timestamp in trades:
+            aggregator.add_trade(SYMBOL, price, quantity, timestamp)
+        for interval in KLINE_INTERVALS:
+            expected = reference_klines(trades, interval)
+            assert aggregator.get_klines(SYMBOL, interval, limit=5_000) == expected, interval
+            assert aggregator.get_klines(SYMBOL, interval, limit=3) == expected[-3:], interval
+
+    def test_custom_intervals(self):
+        trades = random_trades(500, 20_000)
+        aggregator = KlineAggregator(['1m', '15m', '4h'])
+        assert aggregator.sources == {'1m': None, '15m': '1m', '4h': '15m'}
+        for price, quantity, timestamp in trades:
+            aggregator.add_trade(SYMBOL, price, quantity, timestamp)
+        assert aggregator.get_klines(SYMBOL, '4h') == reference_klines(trades, '4h')
+        with pytest.raises(ValueError):
+            aggregator.get_klines(SYMBOL, '1d')
+
+    def test_capacity_keeps_latest_bars(self):
+        trades = random_trades(1_000, 3_000)
+        aggregator = KlineAggregator(capacity=10)
+        for price, quantity, timestamp in trades:
+            aggregator.add_trade(SYMBOL, price, quantity, timestamp)
+        assert aggregator.get_klines(SYMBOL, '1m', limit=100) == reference_klines(trades, '1m')[-10:]
+        assert aggregator.get_klines(SYMBOL, '1h', limit=100) == reference_klines(trades, '1h')
+
+    def test_time_range(self):
+        trades = random_trades(2_000, 5_000)
+        aggregator = KlineAggregator()
+        for price, quantity, timestamp in trades:
+            aggregator.add_trade(SYMBOL, price, quantity, timestamp)
+        expected = reference_klines(trades, '5m')
+        start, end = expected[3][0], expected[10][0]
+        assert aggregator.get_klines(SYMBOL, '5m', limit=100, start_time=start, end_time=end) == expected[3:11]
+        assert aggregator.get_klines(SYMBOL, '5m', limit=2, start_time=start + 1) == expected[4:6]
+        assert aggregator.get_klines(SYMBOL, '5m', limit=2, end_time=end) == expected[9:11]
+        # 最新的K线还有未合并的成交
+        assert aggregator.get_klines(SYMBOL, '5m', limit=1, start_time=expected[-1][0]) == expected[-1:]
+        assert aggregator.get_klines("unknown", '5m') == []
+
+    def test_late_trade_joins_current_bar(self):
+        aggregator = KlineAggregator(['1m'])
+        aggregator.add_trade(SYMBOL, 100, 1, BASE_MS + 61_000)
+        aggregator.add_trade(SYMBOL, 90, 1, BASE_MS + 1_000)
+        assert aggregator.get_klines(SYMBOL, '1m') == [[BASE_MS + 60_000, 100, 100, 90, 90, 2, BASE_MS + 120_000, 190]]
+
+    def test_consumes_trade_stream(self):
+        aggregator = KlineAggregator(['1m', '1h'])
+        codec = get_codec(MATCH_FUNDING_MQ.transport)
+        trades = [new_trade("1", "2", SYMBOL, 100 + i, 1, i + 1, i + 2, True, timestamp=BASE_MS + i * 30_000) for i in range(4)]
+
+        async def main():
+            task = asyncio.create_task(aggregator.run_forever([MMQTopic.SPOT_MATCH_OUT], group="test_kline"))
+            MATCH_FUNDING_MQ.produce(MMQTopic.SPOT_MATCH_OUT, codec.encode_match_out(trades=trades[:2]))
+            MATCH_FUNDING_MQ.produce(MMQTopic.SPOT_MATCH_OUT, codec.encode_match_out(removed_orders=[]))
+            MATCH_FUNDING_MQ.produce(MMQTopic.SPOT_MATCH_OUT, codec.encode_match_out(trades=trades[2:]))
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        try:
+            asyncio.run(main())
+        finally:
+            MATCH_FUNDING_MQ.unsubscribe("test_kline")
+        assert aggregator.get_klines(SYMBOL, '1m') == [
+            [BASE_MS, 100, 101, 100, 101, 2, BASE_MS + 60_000, 201],
+            [BASE_MS + 60_000, 102, 103, 102, 103, 2, BASE_MS + 120_000, 205],
+        ]
+        assert aggregator.get_klines(SYMBOL, '1h')[0][5] == 4
+
+
+@pytest.fixture(params=["numpy", "python"])
+def rebuild_backend(request, monkeypatch):
+    """ 分别使用numpy和纯Python实现批量重建 """
+    if request.param == "numpy":
+        if rebuild.np is None:
+            pytest.skip("numpy is not installed")
+    else:
+        monkeypatch.setattr(rebuild, "np", None)
+    return request.param
+
+
+class TestRebuild:
+
+    def test_trade_bars_match_reference(self, rebuild_backend):
+        trades = random_trades(3_000, 40_000)
+        # 时间回拨的成交计入当前K线
+        trades.insert(1_000, (95, 3, trades[999][2] - 120_000))
+        prices, quantities, timestamps = zip(*trades)
+        clamped = [(price, quantity, max(timestamp for _, _, timestamp in trades[:i + 1]))
+                   for i, (price, quantity, _) in enumerate(trades)]
+        for interval in ('1s', '1m', '1h', '1w'):
+            columns = rebuild.trade_bars(timestamps, prices, quantities, interval)
+            bars = [[t, o, h, l, c, v, t + KLINE_INTERVALS[interval], q] for t, o, h, l, c, v, q in zip(*columns)]
+            assert bars == reference_klines(clamped, interval), interval
+        assert [len(column) for column in rebuild.trade_bars([], [], [], '1m')] == [0] * 7
+
+    def test_rebuild_series_matches_incremental(self, rebuild_backend):
+        trades = random_trades(4_000, 20_000)
+        incremental, rebuilt = KlineAggregator(capacity=50), KlineAggregator(capacity=50)
+        for price, quantity, timestamp in trades[:3_000]:
+            incremental.add_trade(SYMBOL, price, quantity, timestamp)
+        prices, quantities, timestamps = zip(*trades[:3_000])
+        with rebuilt.lock:
+            rebuild.rebuild_series(rebuilt, SYMBOL, timestamps, prices, quantities)
+        for interval in KLINE_INTERVALS:
+            assert rebuilt.get_klines(SYMBOL, interval, limit=100) == incremental.get_klines(SYMBOL, interval, limit=100), interval
+
+        # 重建之后继续逐笔更新，结果一致
+        for price, quantity, timestamp in trades[3_000:]:
+            incremental.add_trade(SYMBOL, price, quantity, timestamp)
+            rebuilt.add_trade(SYMBOL, price, quantity, timestamp)
+        for interval in KLINE_INTERVALS:
+            assert rebuilt.get_klines(SYMBOL, interval, limit=100) == incremental.get_klines(SYMBOL, interval, limit=100), interval
@@ -0,0 +1,247 @@
+"""Unit tests for ladder_orderbook.py (Price Ladder Order Book)"""
+import pytest
+import random
+
+from src.common.config import metadata
+from src.engine.orderbook.ladder_orderbook import (
+    OccupancyBitmap,
+    AskLadder,
+    BidLadder,
+    OrderBook,
+)
+from src.engine.orderbook.sll_orderbook import OrderPool
+from src.engine.types.types import Order, OrderSide, OrderType, OrderTimeInForce
+
+
+# ============================================================
+# Helpers
+# ============================================================
+
+def make_order(uid="user1", price=10000, quantity=100, side=OrderSide.BUY, order_id=None) -> Order:
+    order = Order(uid, "BTCUSDT", side, OrderType.LIMIT, OrderTimeInForce.GTC,
+                  quantity, price)
+    if order_id:
+        order.order_id = order_id
+    return order
+
+
+def make_buy(price=10000, qty=100, uid="user1", oid=None):
+    return make_order(uid, price, qty, OrderSide.BUY, oid)
+
+
+def make_sell(price=10000, qty=100, uid="user1", oid=None):
+    return make_order(uid, price, qty, OrderSide.SELL, oid)
+
+
+# ============================================================
+# Test OccupancyBitmap
+# ============================================================
+
+class TestOccupancyBitmap:
+
+    def test_empty(self):
+        bm = OccupancyBitmap(1000)
+        assert bm.next_set(0) == -1
+        assert bm.prev_set(999) == -1
+
+    def test_next_prev_within_word(self):
+        bm = OccupancyBitmap(1000)
+        bm.set(3)
+        bm.set(10)
+        assert bm.next_set(0) == 3
+        assert bm.next_set(4) == 10
+        assert bm.prev_set(9) == 3
+        assert bm.prev_set(10) == 10
+
+    def test_next_prev_across_words(self):
+        bm = OccupancyBitmap(1000)
+        bm.set(5)
+        bm.set(700)
+        assert bm.next_set(6) == 700
+        assert bm.prev_set(699) == 5
+        bm.clear(700)
+        assert bm.next_set(6) == -1
+        assert bm.summary == 1
+
+    def test_bounds(self):
+        bm = OccupancyBitmap(130)
+        bm.set(0)
+        bm.set(129)
+        assert bm.next_set(130) == -1
+        assert bm.prev_set(-1) == -1
+        assert bm.next_set(1) == 129
+        assert bm.prev_set(128) == 0
+
+    def test_random_against_set(self):
+        rng = random.Random(7)
+        bm = OccupancyBitmap(500)
+        occupied = set()
+        for _ in range(2000):
+            i = rng.randrange(500)
+            if i in occupied:
+                bm.clear(i)
+                occupied.discard(i)
+            else:
+                bm.set(i)
+                occupied.add(i)
+            q = rng.randrange(500)
+            above = [x for x in occupied if x >= q]
+            below = [x for x in occupied if x <= q]
+            assert bm.next_set(q) == (min(above) if above else -1)
+            assert bm.prev_set(q) == (max(below) if below else -1)
+
+
+# ============================================================
+# Test PriceLadder
+# ============================================================
+
+class TestPriceLadder:
+
+    def test_ask_best_pointer(self):
+        ladder = AskLadder(100, OrderPool(100))
+        n1 = ladder.insert_node(make_sell(price=50), 50)
+        ladder.insert_node(make_sell(price=60), 60)
+        assert ladder.best == 50
+        ladder.delete_node(n1)
+        assert ladder.best == 60
+
+    def test_bid_best_pointer(self):
+        ladder = BidLadder(100, OrderPool(100))
+        ladder.insert_node(make_buy(price=50), 50)
+        n2 = ladder.insert_node(make_buy(price=60), 60)
+        assert ladder.best == 60
+        ladder.delete_node(n2)
+        assert ladder.best == 50
+
+    def test_delete_farest_level(self):
+        pool = OrderPool(100)
+        ladder = BidLadder(100, pool)
+        ladder.insert_node(make_buy(price=50), 50)
+        ladder.insert_node(make_buy(price=10, oid="far1"), 10)
+        ladder.insert_node(make_buy(price=10, oid="far2"), 10)
+        removed = ladder.delete_farest_level()
+        assert [o.order_id for o in removed] == ["far1", "far2"]
+        assert pool.capacity == 1
+        assert ladder.peek_depth(10) == [(50, 100)]
+
+
+# ============================================================
+# Test OrderBook
+# ============================================================
+
+class TestLadderOrderBook:
+
+    def test_base_price_centered_on_first_order(self):
+        ob = OrderBook("BTCUSDT", max_price_level=1000)
+        ob.add_order(make_buy(price=10000))
+        assert ob.base_price == 10000 - 500
+
+    def test_out_of_range_rejected(self):
+        ob = OrderBook("BTCUSDT", base_price=10000, max_price_level=100)
+        assert ob.add_order(make_buy(price=9999)) is None
+        assert ob.add_order(make_sell(price=10100)) is None
+        assert ob.add_order(make_sell(price=10099)) is not None
+
+    def test_band_from_symbol_price_range(self, monkeypatch):
+        # 价格小数位为2，100.00 ~ 200.00 对应 10000 ~ 20000 tick
+        monkeypatch.setitem(metadata.SYMBOL_PRICE_RANGE, "BTCUSDT", (100.0, 200.0))
+        ob = OrderBook("BTCUSDT")
+        assert (ob.base_price, ob.max_price_level, ob.auto_base) == (10000, 10001, False)
+        assert ob.add_order(make_buy(price=10000)) is not None
+        assert ob.add_order(make_sell(price=20000)) is not None
+        assert ob.add_order(make_sell(price=20001)) is None
+        assert ob.add_order(make_buy(price=9999)) is None
+
+        monkeypatch.setitem(metadata.SYMBOL_PRICE_RANGE, "BTCUSDT", (0.01, 1_000_000.0))
+        with pytest.raises(ValueError):
+            OrderBook("BTCUSDT")
+
+    def test_tick_size(self):
+        ob = OrderBook("BTCUSDT", base_price=10000, tick_size=5, max_price_level=100)
+        assert ob.add_order(make_buy(price=10003)) is None
+        assert ob.add_order(make_buy(price=10005)) is not None
+        assert ob.get_order_book(5).bids == [(10005, 100)]
+
+    def test_rebase_when_empty(self):
+        ob = OrderBook("BTCUSDT", max_price_level=100)
+        buy = make_buy(price=10000)
+        ob.add_order(buy)
+        ob.remove_order(buy.order_id)
+        assert ob.add_order(make_buy(price=20000)) is not None
+        assert ob.base_price == 20000 - 50
+
+    def test_best_prices_and_depth(self):
+        ob = OrderBook("BTCUSDT", base_price=9000, max_price_level=2000)
+        for price in [9990, 9995, 9980]:
+            ob.add_order(make_buy(price=price))
+        for price in [10010, 10005, 10005]:
+            ob.add_order(make_sell(price=price))
+        assert ob.get_best_bid().price == 9995
+        assert ob.get_best_ask().price == 10005
+        depth = ob.get_order_book(2)
+        assert depth.bids == [(9995, 100), (9990, 100)]
+        assert depth.asks == [(10005, 200), (10010, 100)]
+
+    def test_time_priority_within_level(self):
+        ob = OrderBook("BTCUSDT", base_price=9000, max_price_level=2000)
+        first = make_sell(price=10005, oid="first")
+        second = make_sell(price=10005, oid="second")
+        ob.add_order(first)
+        ob.add_order(second)
+        assert ob.get_best_ask() is first
+        ob.remove_order("first")
+        assert ob.get_best_ask() is second
+
+    def test_update_order_fills_and_removes(self):
+        ob = OrderBook("BTCUSDT", base_price=9000, max_price_level=2000)
+        sell = make_sell(price=10005, qty=100)
+        ob.add_order(sell)
+        ob.update_order(sell.order_id, 40)
+        assert ob.get_order_book(1).asks == [(10005, 60)]
+        ob.update_order(sell.order_id, 100)
+        assert ob.get_best_ask() is None
+        assert sell.order_id not in ob.orders
+
+    def test_evict_farest_when_pool_full(self):
+        ob = OrderBook("BTCUSDT", base_price=9000, max_price_level=2000, max_orders=2)
+        ob.add_order(make_buy(price=9990, oid="near"))
+        ob.add_order(make_buy(price=9900, oid="far"))
+        assert ob.add_order(make_buy(price=9995, oid="new")) is not None
+        assert "far" not in ob.orders
+        assert "far" not in ob.order_nodes
+        assert [o.order_id for o in ob.pending_orders("user1")] == ["near", "new"]
+
+    def test_batch_remove_checks_uid(self):
+        ob = OrderBook("BTCUSDT", base_price=9000, max_price_level=2000)
+        ob.add_order(make_buy(price=9990, uid="a", oid="o1"))
+        ob.add_order(make_buy(price=9991, uid="b", oid="o2"))
+        removed = ob.batch_remove_orders("a", ["o1", "o2"])
+        assert [o.order_id for o in removed] == ["o1"]
+        assert ob.get_order("b", "o2") is not None
+
+    def test_random_matches_brute_force_depth(self):
+        rng = random.Random(11)
+        ob = OrderBook("BTCUSDT", base_price=0, max_price_level=300)
+        live = {}
+        for i in range(3000):
+            if live and rng.random() < 0.4:
+                oid = rng.choice(list(live))
+                ob.remove_order(oid)
+                del live[oid]
+            else:
+                side = OrderSide.BUY if rng.random() < 0.5 else OrderSide.SELL
+                price = rng.randrange(0, 150) if side == OrderSide.BUY else rng.randrange(150, 300)
+                order = make_order(price=price, quantity=rng.randint(1, 50), side=side, order_id=f"o{i}")
+                ob.add_order(order)
+                live[order.order_id] = order
+
+            for side, reverse, got in [
+                (OrderSide.BUY, True, ob.get_order_book(10).bids),
+                (OrderSide.SELL, False, ob.get_order_book(10).asks),
+            ]:
+                levels = {}
+                for o in live.values():
+                    if o.side == side:
+                        levels[o.price] = levels.get(o.price, 0) + o.quantity
+                expected = sorted(levels.items(), reverse=reverse)[:10]
+                assert got == expected
@@ -0,0 +1,59 @@
+"""Unit tests for src/common/utils/log (queue based logging setup)"""
+import logging
+import threading
+from logging.handlers import QueueHandler
+
+import pytest
+
+from src.common.utils.log import HOT_PATH_LOGGERS, setup_logging
+
+
+@pytest.fixture
+def restore_logging():
+    root_logger = logging.getLogger()
+    handlers, level = list(root_logger.handlers), root_logger.level
+    hot_levels = {name: logging.getLogger(name).level for name in HOT_PATH_LOGGERS}
+    yield
+    root_logger.handlers[:] = handlers
+    root_logger.setLevel(level)
+    for name, hot_level in hot_levels.items():
+        logging.getLogger(name).setLevel(hot_level)
+
+
+class TestSetupLogging:
+
+    def test_file_io_runs_on_listener_thread(self, tmp_path, restore_logging):
+        log_file = tmp_path / "app.log"
+        listener = setup_logging(str(log_file), level="DEBUG", hot_path_level="INFO")
+        try:
+            root_logger = logging.getLogger()
+            assert isinstance(root_logger.handlers[-1], QueueHandler)
+
+            written_by = []
+            file_handler = listener.handlers[0]
+            emit = file_handler.emit
+            file_handler.emit = lambda record: (written_by.append(threading.current_thread()), emit(record))
+
+            logging.getLogger("src.api").info("hello %s", "world")
+        finally:
+            listener.stop()
+
+        assert written_by and threading.current_thread() not in written_by
+        content = log_file.read_text()
+        assert "src.api - INFO - hello world" in content
+
+    def test_hot_path_level(self, tmp_path, restore_logging):
+        listener = setup_logging(str(tmp_path / "app.log"), level="DEBUG", hot_path_level="WARNING")
+        listener.stop()
+        for name in HOT_PATH_LOGGERS:
+            assert logging.getLogger(name).getEffectiveLevel() == logging.WARNING
+        assert not logging.getLogger("src.engine.matching.matching").isEnabledFor(logging.DEBUG)
+        assert logging.getLogger("src.api").isEnabledFor(logging.DEBUG)
+
+    def test_stop_is_idempotent(self, tmp_path, restore_logging):
+        listener = setup_logging(str(tmp_path / "app.log"))
+        assert listener.started
+        listener.stop()
+        # 进程退出时atexit再次stop
+        listener.stop()
+        assert not listener.started
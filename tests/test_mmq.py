@@ -0,0 +1,193 @@
+"""Unit tests for src/common/mmq (Memory Message Queue)"""
+import asyncio
+import threading
+import time
+
+from src.common.mmq import MMQ, MAX_MESSAGES
+
+
+class TestMMQWait:
+
+    def test_has_message(self):
+        mq = MMQ()
+        assert not mq.has_message("t", 0)
+        mq.produce("t", "m0")
+        assert mq.has_message("t", 0)
+        _, message = mq.consume("t", 0)
+        assert message == "m0"
+        assert not mq.has_message("t", 1)
+
+    def test_wait_returns_when_message_available(self):
+        mq = MMQ()
+        mq.produce("t", "m0")
+
+        async def main():
+            await asyncio.wait_for(mq.wait({"t": 0}), 1)
+
+        asyncio.run(main())
+
+    def test_wait_woken_by_produce_in_same_loop(self):
+        mq = MMQ()
+
+        async def main():
+            waiter = asyncio.create_task(mq.wait({"a": 0, "b": 0}))
+            await asyncio.sleep(0.01)
+            assert not waiter.done()
+            mq.produce("b", "m0")
+            await asyncio.wait_for(waiter, 1)
+
+        asyncio.run(main())
+
+    def test_wait_woken_by_produce_in_other_thread(self):
+        mq = MMQ()
+
+        async def main():
+            thread = threading.Timer(0.05, mq.produce, args=("t", "m0"))
+            start = time.perf_counter()
+            thread.start()
+            await asyncio.wait_for(mq.wait({"t": 0}), 1)
+            thread.join()
+            return time.perf_counter() - start
+
+        assert asyncio.run(main()) < 0.5
+
+    def test_wait_ignores_other_topics(self):
+        mq = MMQ()
+
+        async def main():
+            mq.produce("other", "m0")
+            start = time.perf_counter()
+            await mq.wait({"t": 0}, timeout=0.05)
+            return time.perf_counter() - start
+
+        assert asyncio.run(main()) >= 0.04
+        assert mq.waiters == []
+
+    def test_consumer_drains_all_messages(self):
+        mq = MMQ()
+        received = []
+
+        async def consumer():
+            offsets = {"t": 0}
+            while True:
+                while True:
+                    offset, message = mq.consume("t", offsets["t"])
+                    if not message:
+                        break
+                    offsets["t"] = offset + 1
+                    received.append(message)
+                if len(received) == 100:
+                    return
+                await mq.wait(offsets)
+
+        async def main():
+            task = asyncio.create_task(consumer())
+            for i in range(100):
+                mq.produce("t", str(i))
+                if i % 10 == 0:
+                    await asyncio.sleep(0)
+            await asyncio.wait_for(task, 1)
+
+        asyncio.run(main())
+        assert received == [str(i) for i in range(100)]
+
+
+class TestMMQConsumeBatch:
+
+    def test_unknown_topic(self):
+        mq = MMQ()
+        assert mq.consume_batch("t", 5) == (5, [])
+
+    def test_batch_and_next_offset(self):
+        mq = MMQ()
+        for i in range(10):
+            mq.produce("t", str(i))
+        offset, messages = mq.consume_batch("t", 0, 4)
+        assert (offset, messages) == (4, ["0", "1", "2", "3"])
+        offset, messages = mq.consume_batch("t", offset, 100)
+        assert (offset, messages) == (10, [str(i) for i in range(4, 10)])
+        assert mq.consume_batch("t", offset) == (10, [])
+
+    def test_offset_before_retained_messages(self):
+        mq = MMQ()
+        for i in range(MAX_MESSAGES + 10):
+            mq.produce("t", str(i))
+        base = mq.oldest_offset("t")
+        assert base > 0
+        offset, messages = mq.consume_batch("t", 0, 2)
+        assert messages == [str(base), str(base + 1)]
+        assert offset == base + 2
+        assert mq.has_message("t", offset)
+        assert not mq.has_message("t", MAX_MESSAGES + 10)
+
+
+class TestMMQRingBuffer:
+
+    def test_wrap_around(self):
+        mq = MMQ(capacity=4)
+        for i in range(6):
+            assert mq.produce("t", str(i)) == i
+        assert mq.oldest_offset("t") == 2
+        assert mq.consume_batch("t", 0) == (6, ["2", "3", "4", "5"])
+        assert mq.consume_batch("t", 3, 2) == (5, ["3", "4"])
+        assert mq.consume("t", 5) == (5, "5")
+        assert mq.consume("t", 6) == (6, "")
+
+    def test_capacity_is_fixed(self):
+        mq = MMQ(capacity=8)
+        for i in range(100):
+            mq.produce("t", str(i))
+        assert len(mq.topics["t"].slots) == 8
+        assert mq.consume_batch("t", 0)[1] == [str(i) for i in range(92, 100)]
+
+
+class TestMMQConsumerGroup:
+
+    def test_groups_have_independent_offsets(self):
+        mq = MMQ()
+        mq.subscribe("a", ["t"])
+        for i in range(5):
+            mq.produce("t", str(i))
+        mq.subscribe("b", ["t"])
+        assert mq.poll("a", "t", 3) == ["0", "1", "2"]
+        assert mq.poll("b", "t") == [str(i) for i in range(5)]
+        assert mq.poll("a", "t") == ["3", "4"]
+        assert mq.poll("a", "t") == []
+        assert mq.committed("a", ["t"]) == mq.committed("b", ["t"]) == {"t": 5}
+
+    def test_subscribe_from_latest(self):
+        mq = MMQ()
+        mq.produce("t", "old")
+        assert mq.subscribe("g", ["t"], from_latest=True) == {"t": 1}
+        mq.produce("t", "new")
+        assert mq.poll("g", "t") == ["new"]
+
+    def test_lag_and_dropped_messages(self):
+        mq = MMQ(capacity=10, high_watermark=0.5)
+        mq.subscribe("slow", ["t"])
+        for i in range(4):
+            mq.produce("t", str(i))
+        assert mq.lag("slow", "t") == 4
+        assert not mq.is_backpressured("t")
+
+        for i in range(4, 15):
+            mq.produce("t", str(i))
+        assert mq.is_backpressured("t")
+        metrics = mq.metrics()["t"]
+        assert metrics["backpressure"]
+        assert metrics["groups"]["slow"]["overrun"] == 5
+
+        # 被覆盖的消息计入dropped，而不是静默丢弃
+        assert mq.poll("slow", "t") == [str(i) for i in range(5, 15)]
+        metrics = mq.metrics()["t"]
+        assert metrics["groups"]["slow"] == {"offset": 15, "lag": 0, "overrun": 0, "dropped": 5}
+        assert not metrics["backpressure"]
+
+    def test_unsubscribe_releases_backpressure(self):
+        mq = MMQ(capacity=4, high_watermark=0.5)
+        mq.subscribe("g", ["t"])
+        mq.produce("t", "0")
+        mq.produce("t", "1")
+        assert mq.is_backpressured("t")
+        mq.unsubscribe("g")
+        assert not mq.is_backpressured("t")
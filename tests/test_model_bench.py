@@ -0,0 +1,26 @@
+"""Smoke tests for bench/model_bench.py"""
+from bench.model_bench import MODELS, run, without_slots
+from src.engine.types.types import Order
+
+
+class TestModelBench:
+
+    def test_models_use_slots(self):
+        for cls, make_args, _ in MODELS.values():
+            instance = cls(*make_args(0))
+            assert not hasattr(instance, '__dict__')
+            assert hasattr(without_slots(cls)(*make_args(0)), '__dict__')
+
+    def test_dict_version_has_same_behavior(self):
+        args = MODELS['Order'][1](0)
+        order, dict_order = Order(*args), without_slots(Order)(*args)
+        dict_order.order_id, dict_order.client_order_id, dict_order.timestamp, dict_order.update_timestamp = (
+            order.order_id, order.client_order_id, order.timestamp, order.update_timestamp)
+        assert order.to_dict() == dict_order.to_dict()
+
+    def test_report_schema(self):
+        report = run(list(MODELS), count=200)
+        assert [r['model'] for r in report['results']] == list(MODELS)
+        for r in report['results']:
+            assert r['slots']['bytes_per_instance'] < r['dict']['bytes_per_instance']
+            assert r['slots']['construct_per_sec'] > 0
@@ -0,0 +1,78 @@
+"""Unit tests for order price/quantity validation at the API boundary"""
+import pytest
+from flask import Flask
+
+from src.api.handlers.futures import FuturesHandler
+from src.api.handlers.spot import SpotHandler
+from src.common.config.metadata import parse_order_values
+from src.engine.types.types import OrderSide, OrderType
+
+# 价格2位小数，数量6位小数
+SYMBOL = "90000001"
+
+
+class TestParseOrderValues:
+
+    def test_exact_values(self):
+        assert parse_order_values(SYMBOL, OrderType.LIMIT, OrderSide.BUY, "0.000001", "50000.01") == (1, 5_000_001)
+        # float的二进制误差不影响整数倍的判断
+        assert parse_order_values(SYMBOL, OrderType.LIMIT, OrderSide.SELL, 0.1, 0.3) == (100_000, 30)
+        assert parse_order_values(SYMBOL, OrderType.MARKET, OrderSide.SELL, "2", None) == (2_000_000, None)
+        # 市价买单的数量是报价货币金额，单位为 tick * lot
+        assert parse_order_values(SYMBOL, OrderType.MARKET, OrderSide.BUY, "0.00000001", None) == (1, None)
+
+    @pytest.mark.parametrize("quantity, price", [
+        ("0.0000001", "50000"),   # 不是整数个lot
+        ("1", "50000.001"),       # 不是整数个tick
+        ("0", "50000"),
+        ("-1", "50000"),
+        ("1", "0"),
+        ("1", "-0.01"),
+        ("abc", "50000"),
+        ("nan", "50000"),
+        (None, "50000"),
+        ("1", None),              # 限价单没有价格
+    ])
+    def test_rejected_values(self, quantity, price):
+        with pytest.raises(ValueError):
+            parse_order_values(SYMBOL, OrderType.LIMIT, OrderSide.BUY, quantity, price)
+
+    def test_market_buy_amount_off_grid(self):
+        with pytest.raises(ValueError):
+            parse_order_values(SYMBOL, OrderType.MARKET, OrderSide.BUY, "0.000000001", None)
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['ALLOWED_SYMBOLS'] = [SYMBOL]
+    with app.app_context():
+        yield app
+
+
+def new_order(**overrides):
+    data = {"uid": "60000002", "symbol": SYMBOL, "side": OrderSide.BUY, "type": OrderType.LIMIT,
+            "time_in_force": "GTC", "quantity": "0.001", "price": "100.00"}
+    data.update(overrides)
+    return data
+
+
+class TestHandlers:
+
+    @pytest.mark.parametrize("handler", [SpotHandler, FuturesHandler])
+    @pytest.mark.parametrize("overrides", [
+        {"price": "100.005"},
+        {"quantity": "0.0000005"},
+        {"quantity": "0.0000004"},
+        {"price": "0"},
+        {"quantity": "-0.001"},
+    ])
+    def test_new_order_rejects_off_grid_values(self, app, handler, overrides):
+        response, status = handler().new_order(new_order(**overrides))
+        assert status == 400 and response.get_json()["code"] == 400
+
+    @pytest.mark.parametrize("handler", [SpotHandler, FuturesHandler])
+    def test_batch_order_rejects_off_grid_values(self, app, handler):
+        data = {"uid": "60000001", "batchOrders": [new_order(), new_order(price="100.001")]}
+        response, status = handler().new_batch_order(data)
+        assert status == 400 and "batchOrders[1]" in response.get_json()["msg"]
@@ -0,0 +1,31 @@
+"""Smoke tests for bench/orderbook_bench.py"""
+import json
+
+from bench.orderbook_bench import WORKLOADS, main, run
+
+
+class TestOrderBookBench:
+
+    def test_report_schema(self):
+        report = run(['sll', 'ladder'], list(WORKLOADS), scale=0.01)
+        assert report['benchmark'] == 'orderbook'
+        assert len(report['results']) == 2 * len(WORKLOADS)
+        for r in report['results']:
+            assert 'error' not in r, r
+            assert r['ops'] > 0
+            assert r['ops_per_sec'] > 0
+            assert r['p50_us'] <= r['p99_us'] <= r['max_us']
+            assert r['peak_memory_bytes'] >= r['ops_peak_memory_bytes'] >= 0
+        # 峰值内存包括setup挂好的整个order book
+        sweep = [r for r in report['results'] if r['workload'] == 'sweep']
+        assert all(r['peak_memory_bytes'] > 100 * 100 for r in sweep)
+
+    def test_broken_backend_reports_error(self):
+        report = run(['rsl'], ['mm_churn'], scale=0.01)
+        assert 'error' in report['results'][0]
+
+    def test_output_file(self, tmp_path):
+        output = tmp_path / 'bench.json'
+        main(['--backends', 'rb', '--workloads', 'sweep', '--scale', '0.01', '--output', str(output)])
+        report = json.loads(output.read_text())
+        assert report['results'][0]['backend'] == 'rb'
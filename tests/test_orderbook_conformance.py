@@ -0,0 +1,311 @@
+"""Conformance tests shared by all order book backends in the registry
+
+Every backend must behave identically through OrderBookInterface.
+"""
+import pytest
+import random
+
+from src.engine.orderbook import registry
+from src.engine.orderbook.registry import (
+    ORDER_BOOK_BACKENDS,
+    available_order_books,
+    create_order_book,
+    get_order_book_class,
+    register_order_book,
+)
+from src.common.mmq import MATCH_FUNDING_MQ, MMQ, MMQTopic
+from src.engine.funding.funding import Funding
+from src.engine.orderbook.sll_orderbook import OrderBook as SllOrderBook
+from src.engine.matching.matching import MatchingEngine
+from src.engine.types.account_types import UniMarginAccount
+from src.engine.types.codec import get_codec
+from src.engine.types.types import Order, OrderSide, OrderType, OrderTimeInForce, OrderStatus
+
+
+# ============================================================
+# Helpers
+# ============================================================
+
+def make_order(uid="user1", price=10000, quantity=100, side=OrderSide.BUY, order_id=None) -> Order:
+    order = Order(uid, "BTCUSDT", side, OrderType.LIMIT, OrderTimeInForce.GTC,
+                  quantity, price)
+    if order_id:
+        order.order_id = order_id
+    return order
+
+
+def make_buy(price=10000, qty=100, uid="user1", oid=None):
+    return make_order(uid, price, qty, OrderSide.BUY, oid)
+
+
+def make_sell(price=10000, qty=100, uid="user1", oid=None):
+    return make_order(uid, price, qty, OrderSide.SELL, oid)
+
+
+@pytest.fixture(params=sorted(ORDER_BOOK_BACKENDS))
+def book(request):
+    return create_order_book("BTCUSDT", request.param)
+
+
+# ============================================================
+# Test registry
+# ============================================================
+
+class TestRegistry:
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            get_order_book_class("no_such_backend")
+
+    def test_register_custom_backend(self, monkeypatch):
+        # 注册到副本中，不影响其他测试
+        monkeypatch.setattr(registry, "_BACKEND_CLASSES", dict(registry._BACKEND_CLASSES))
+        register_order_book("custom_sll", SllOrderBook)
+        assert "custom_sll" in available_order_books()
+        assert isinstance(create_order_book("BTCUSDT", "custom_sll"), SllOrderBook)
+        monkeypatch.undo()
+        assert "custom_sll" not in available_order_books()
+
+    def test_default_backend_from_config(self):
+        assert isinstance(create_order_book("NOT_CONFIGURED"), SllOrderBook)
+
+    def test_switch_order_book_keeps_resting_orders(self):
+        engine = MatchingEngine()
+        book = engine.get_order_book("BTCUSDT")
+        first = make_sell(price=10001, oid="first")
+        second = make_sell(price=10001, oid="second")
+        book.add_order(first)
+        book.add_order(second)
+        book.add_order(make_buy(price=9999, oid="bid"))
+
+        new_book = engine.switch_order_book("BTCUSDT", "ladder")
+        assert engine.get_order_book("BTCUSDT") is new_book
+        assert new_book.get_best_ask() is first
+        assert new_book.get_best_bid().order_id == "bid"
+        assert new_book.get_order_book(5).asks == [(10001, 200)]
+
+    def test_switch_order_book_refuses_to_drop_orders(self):
+        engine = MatchingEngine()
+        book = engine.get_order_book("BTCUSDT")
+        book.add_order(make_sell(price=10001, oid="inside"))
+        book.add_order(make_buy(price=9000, oid="outside"))
+
+        # 新的价格区间 [10000, 10100) 容纳不了9000的买单
+        with pytest.raises(ValueError):
+            engine.switch_order_book("BTCUSDT", "ladder", base_price=10000, max_price_level=100)
+        assert engine.get_order_book("BTCUSDT") is book
+        assert sorted(book.orders) == ["inside", "outside"]
+        assert book.get_best_bid().order_id == "outside"
+
+
+class TestOrderBookRejects:
+    """ order book拒绝加入的订单(ladder价格区间之外)被撤销，冻结的资产解冻 """
+    SYMBOL = "90000001"
+
+    def setup_engine(self):
+        engine = MatchingEngine(out_mq=MMQ(transport=MATCH_FUNDING_MQ.transport))
+        engine.order_books[self.SYMBOL] = create_order_book(self.SYMBOL, "ladder", base_price=10000, max_price_level=100)
+        engine.out_mq.subscribe("reject_test", [MMQTopic.SPOT_MATCH_OUT])
+        funding = Funding([UniMarginAccount("user", is_inner_maker=False)])
+        return engine, funding, funding.accounts["user"]
+
+    def settle(self, engine, funding):
+        results = []
+        for message in engine.out_mq.poll("reject_test", MMQTopic.SPOT_MATCH_OUT):
+            data = get_codec(engine.out_mq.transport).decode_message(message)[1]
+            funding.on_match_out(data)
+            results.append(data)
+        return results
+
+    def new_order(self, funding, account, price, side=OrderSide.BUY):
+        order = Order("user", self.SYMBOL, side, OrderType.LIMIT, OrderTimeInForce.GTC, 100, price)
+        assert funding._settlement_spot_new(account, order)[0]
+        return order
+
+    def test_single_order_out_of_band(self):
+        engine, funding, account = self.setup_engine()
+        balances = dict(account.balances)
+        order = self.new_order(funding, account, 20000)
+        engine.on_order(order)
+        [data] = self.settle(engine, funding)
+        assert [o.order_id for o in data['removed_orders']] == [order.order_id]
+        assert data['order'].status == OrderStatus.CANCELLED
+        assert engine.get_order_book(self.SYMBOL).get_best_bid() is None
+        assert account.frozen_balances == {} and account.balances == balances
+
+    def test_batch_orders_out_of_band(self):
+        engine, funding, account = self.setup_engine()
+        inside, outside = self.new_order(funding, account, 10050), self.new_order(funding, account, 9000)
+        engine.on_orders([inside, outside])
+        [data] = self.settle(engine, funding)
+        assert [o.order_id for o in data['removed_orders']] == [outside.order_id]
+        assert {o.order_id: o.status for o in data['orders']} == {inside.order_id: OrderStatus.NEW, outside.order_id: OrderStatus.CANCELLED}
+        assert list(account.frozen_balances) == [inside.order_id]
+
+
+# ============================================================
+# Test backends through OrderBookInterface
+# ============================================================
+
+class TestConformance:
+
+    def test_empty_book(self, book):
+        assert book.get_best_bid() is None
+        assert book.get_best_ask() is None
+        depth = book.get_order_book(5)
+        assert depth.bids == []
+        assert depth.asks == []
+
+    def test_add_and_duplicate(self, book):
+        order = make_buy()
+        assert book.add_order(order) is order
+        assert book.add_order(order) is None
+        assert book.get_order_book(5).bids == [(10000, 100)]
+
+    def test_price_time_priority(self, book):
+        b1 = make_buy(price=9990, oid="b1")
+        b2 = make_buy(price=9995, oid="b2")
+        b3 = make_buy(price=9995, oid="b3")
+        s1 = make_sell(price=10010, oid="s1")
+        s2 = make_sell(price=10005, oid="s2")
+        s3 = make_sell(price=10005, oid="s3")
+        for order in [b1, b2, b3, s1, s2, s3]:
+            book.add_order(order)
+        assert book.get_best_bid() is b2
+        assert book.get_best_ask() is s2
+        book.remove_order("b2")
+        book.remove_order("s2")
+        assert book.get_best_bid() is b3
+        assert book.get_best_ask() is s3
+
+    def test_depth_aggregation(self, book):
+        for price in [9990, 9995, 9995, 9980]:
+            book.add_order(make_buy(price=price))
+        for price in [10010, 10005, 10005]:
+            book.add_order(make_sell(price=price, qty=50))
+        depth = book.get_order_book(2)
+        assert depth.bids == [(9995, 200), (9990, 100)]
+        assert depth.asks == [(10005, 100), (10010, 50)]
+
+    def test_remove_order(self, book):
+        order = make_sell(oid="s1")
+        book.add_order(order)
+        assert book.remove_order("s1") is order
+        assert book.remove_order("s1") is None
+        assert book.remove_order("unknown") is None
+        assert book.get_best_ask() is None
+        assert book.get_order_book(5).asks == []
+
+    def test_get_order_checks_uid(self, book):
+        book.add_order(make_buy(uid="a", oid="o1"))
+        assert book.get_order("a", "o1") is not None
+        assert book.get_order("b", "o1") is None
+
+    def test_batch_add_orders(self, book):
+        orders = [make_sell(price=10000 + i, oid=f"s{i}") for i in range(5)]
+        added = book.batch_add_orders(OrderSide.SELL, orders)
+        assert [o.order_id for o in added] == [f"s{i}" for i in range(5)]
+        assert book.get_best_ask().order_id == "s0"
+
+    def test_batch_remove_orders_checks_uid(self, book):
+        book.add_order(make_buy(price=9990, uid="a", oid="o1"))
+        book.add_order(make_buy(price=9991, uid="b", oid="o2"))
+        removed = book.batch_remove_orders("a", ["o1", "o2", "missing"])
+        assert [o.order_id for o in removed] == ["o1"]
+        assert book.get_order("b", "o2") is not None
+
+    def test_update_order(self, book):
+        sell = make_sell(price=10005, qty=100, oid="s1")
+        book.add_order(sell)
+        assert book.update_order("s1", 40) is sell
+        assert sell.filled_quantity == 40
+        assert book.get_order_book(1).asks == [(10005, 60)]
+        book.update_order("s1", 100)
+        assert book.get_best_ask() is None
+        assert book.get_order("user1", "s1") is None
+        assert book.update_order("s1", 100) is None
+
+    def test_pending_orders(self, book):
+        book.add_order(make_buy(uid="a", oid="o1"))
+        book.add_order(make_sell(price=10010, uid="a", oid="o2"))
+        book.add_order(make_sell(price=10010, uid="b", oid="o3"))
+        assert sorted(o.order_id for o in book.pending_orders("a")) == ["o1", "o2"]
+
+    def test_pending_orders_follow_fills_and_cancels(self, book):
+        book.add_order(make_buy(uid="a", oid="o1"))
+        book.add_order(make_sell(price=10010, qty=50, uid="a", oid="o2"))
+        book.add_order(make_sell(price=10010, uid="b", oid="o3"))
+        book.add_order(make_buy(price=9990, uid="a", oid="o4"))
+        book.update_order("o2", 20)
+        assert [o.order_id for o in book.pending_orders("a")] == ["o1", "o2", "o4"]
+        book.update_order("o2", 50)
+        book.remove_order("o1")
+        assert [o.order_id for o in book.pending_orders("a")] == ["o4"]
+        book.batch_remove_orders("a", ["o4"])
+        assert book.pending_orders("a") == []
+        assert [o.order_id for o in book.pending_orders("b")] == ["o3"]
+        assert book.pending_orders("c") == []
+
+    def test_random_matches_brute_force(self, book):
+        rng = random.Random(5)
+        live = {}
+        for i in range(1500):
+            if live and (rng.random() < 0.45 or len(live) >= 150):
+                oid = rng.choice(list(live))
+                order = live[oid]
+                if rng.random() < 0.3:
+                    filled = rng.randint(order.filled_quantity, order.quantity)
+                    book.update_order(oid, filled)
+                    if filled >= order.quantity:
+                        del live[oid]
+                else:
+                    assert book.remove_order(oid) is order
+                    del live[oid]
+            else:
+                side = OrderSide.BUY if rng.random() < 0.5 else OrderSide.SELL
+                price = rng.randrange(9900, 10000) if side == OrderSide.BUY else rng.randrange(10000, 10100)
+                order = make_order(price=price, quantity=rng.randint(1, 50), side=side, order_id=f"o{i}")
+                assert book.add_order(order) is order
+                live[order.order_id] = order
+
+            depth = book.get_order_book(10)
+            for side, reverse, got, best in [
+                (OrderSide.BUY, True, depth.bids, book.get_best_bid()),
+                (OrderSide.SELL, False, depth.asks, book.get_best_ask()),
+            ]:
+                side_orders = [o for o in live.values() if o.side == side]
+                levels = {}
+                for o in side_orders:
+                    levels[o.price] = levels.get(o.price, 0) + o.quantity - o.filled_quantity
+                assert got == sorted(levels.items(), reverse=reverse)[:10]
+                if side_orders:
+                    best_price = max(levels) if reverse else min(levels)
+                    # 同价格按加入顺序
+                    assert best is next(o for o in side_orders if o.price == best_price)
+                else:
+                    assert best is None
+            assert sorted(o.order_id for o in book.pending_orders("user1")) == sorted(live)
+
+    def test_matching_engine_cancel(self, book):
+        engine = MatchingEngine()
+        engine.order_books["BTCUSDT"] = book
+        sell = make_sell(uid="maker", oid="s1")
+        book.add_order(sell)
+        # 其他用户不能撤单
+        assert engine.cancel_order("taker", "BTCUSDT", "s1") is not sell
+        assert book.get_order("maker", "s1") is sell
+        cancelled = engine.cancel_order("maker", "BTCUSDT", "s1")
+        assert cancelled is sell
+        assert cancelled.status == OrderStatus.CANCELLED
+        assert book.get_best_ask() is None
+
+    def test_matching_engine_open_orders_across_symbols(self, book, request):
+        engine = MatchingEngine()
+        engine.order_books["BTCUSDT"] = book
+        other = engine.order_books["ETHUSDT"] = create_order_book("ETHUSDT", request.node.callspec.params["book"])
+        book.add_order(make_buy(uid="a", oid="o1"))
+        eth = Order("a", "ETHUSDT", OrderSide.SELL, OrderType.LIMIT, OrderTimeInForce.GTC, 10, 10010)
+        other.add_order(eth)
+        assert [o.order_id for o in engine.get_open_orders("a", "BTCUSDT")] == ["o1"]
+        assert sorted(o.symbol for o in engine.get_open_orders("a")) == ["BTCUSDT", "ETHUSDT"]
+        assert engine.get_open_orders("b") == []
@@ -0,0 +1,25 @@
+"""Smoke tests for bench/pipeline_bench.py"""
+import pytest
+
+from bench.pipeline_bench import latency_summary, run
+
+
+class TestPipelineBench:
+
+    def test_latency_summary(self):
+        summary = latency_summary([1_000, 2_000, 3_000, 100_000])
+        assert summary['count'] == 4
+        assert summary['p50_us'] == 3
+        assert summary['max_us'] == 100
+        assert sum(summary['histogram_us'].values()) == 4
+
+    @pytest.mark.parametrize("transport", ["inproc", "binary"])
+    def test_all_orders_settled(self, transport):
+        report = run(orders=6, maker_levels=2, timeout=10, transport=transport)
+        assert report['transport'] == transport
+        assert report['rejected'] == 0
+        assert report['settled'] == report['submitted'] == 6
+        assert report['submit_to_settled']['count'] == 6
+        assert report['submit_to_matched']['p50_us'] <= report['submit_to_settled']['p50_us']
+        for groups in report['mq']['match_funding'].values():
+            assert groups['groups']['funding']['dropped'] == 0
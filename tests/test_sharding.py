@@ -0,0 +1,137 @@
+"""Unit tests for src/engine/matching/router and sharding (sharded matching engine)"""
+import asyncio
+
+import pytest
+
+from src.common.mmq import FUNDING_MATCH_MQ, MMQ, MMQTopic, TRANSPORT_BINARY
+from src.engine.funding.funding import Funding
+from src.engine.matching.matching import MatchingEngine
+from src.engine.matching.router import ShardRouter
+from src.engine.matching.sharding import ShardedMatchingEngine, shard_node_id
+from src.engine.matching.view import BookView, MatchingView
+from src.engine.orderbook.ob_interface import NO_LOCK
+from src.engine.types.account_types import UniMarginAccount
+from src.engine.types.codec import get_codec
+from src.engine.types.ids import SnowflakeIdGenerator
+from src.engine.types.types import Order, OrderSide, OrderTimeInForce, OrderType
+
+SYMBOLS = ["90000001", "90000002"]
+
+
+def limit_order(uid, symbol, side, quantity, price):
+    return Order(uid, symbol, side, OrderType.LIMIT, OrderTimeInForce.GTC, quantity, price)
+
+
+class TestShardRouter:
+
+    def test_unsharded(self):
+        router = ShardRouter()
+        assert not router.sharded
+        assert router.new_topic(SYMBOLS[0]) == MMQTopic.MATCH_IN_SPOT_NEW
+        assert router.cancel_topic(SYMBOLS[0]) == MMQTopic.MATCH_IN_SPOT_CANCEL
+
+    def test_sharded(self):
+        router = ShardRouter(4, {SYMBOLS[0]: 3})
+        assert router.new_topic(SYMBOLS[0]) == "spot_new.3"
+        assert router.cancel_topic(SYMBOLS[0]) == "spot_cancel.3"
+        shard = router.shard(SYMBOLS[1])
+        assert 0 <= shard < 4
+        assert ShardRouter(4).shard(SYMBOLS[1]) == shard
+        assert router.topics(1) == ["spot_new.1", "spot_cancel.1"]
+        with pytest.raises(ValueError):
+            ShardRouter(2, {SYMBOLS[0]: 2})
+
+    def test_funding_routes_by_symbol(self):
+        router = ShardRouter(2, {SYMBOLS[0]: 0, SYMBOLS[1]: 1})
+        funding = Funding([UniMarginAccount("shard_maker", is_inner_maker=True)], router=router)
+        heads = {topic: FUNDING_MATCH_MQ._get_topic(topic).head for topic in router.topics(0) + router.topics(1)}
+
+        result, order = funding.put_spot_order("shard_maker", SYMBOLS[1], OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 1, 100)
+        assert result
+        result, orders = funding.put_spot_orders("shard_maker", [
+            {"symbol": symbol, "side": OrderSide.SELL, "type": OrderType.LIMIT, "time_in_force": OrderTimeInForce.GTC,
+             "quantity": 1, "price": 200}
+            for symbol in SYMBOLS
+        ])
+        assert result
+        # 撮合确认后才能撤单
+        funding.on_spot_orders(orders)
+        funding.cancel_spot_orders("shard_maker", SYMBOLS[0], [orders[0].order_id])
+
+        grown = {topic: FUNDING_MATCH_MQ._get_topic(topic).head - head for topic, head in heads.items()}
+        assert grown == {"spot_new.0": 1, "spot_cancel.0": 1, "spot_new.1": 2, "spot_cancel.1": 0}
+
+
+class TestShardedMatchingEngine:
+
+    def test_lock_free_engine(self):
+        engine = MatchingEngine(lock_free=True)
+        assert engine.lock is NO_LOCK
+        assert engine.get_order_book(SYMBOLS[0]).bid_lock is NO_LOCK
+
+    def test_matches_in_worker_processes(self):
+        router = ShardRouter(2, {SYMBOLS[0]: 0, SYMBOLS[1]: 1})
+        in_mq, out_mq = MMQ(transport=TRANSPORT_BINARY), MMQ(transport=TRANSPORT_BINARY)
+        codec = get_codec(TRANSPORT_BINARY)
+        engine = ShardedMatchingEngine(router, in_mq, out_mq)
+        for symbol in SYMBOLS:
+            in_mq.produce(router.new_topic(symbol), codec.encode_order(limit_order("maker", symbol, OrderSide.SELL, 10, 100)))
+            in_mq.produce(router.new_topic(symbol), codec.encode_order(limit_order("taker", symbol, OrderSide.BUY, 4, 100)))
+
+        async def main():
+            task = asyncio.create_task(engine.run_forever())
+            out_mq.subscribe("test", [MMQTopic.SPOT_MATCH_OUT])
+            messages = []
+            while len(messages) < 4:
+                await asyncio.wait_for(out_mq.wait(out_mq.committed("test", [MMQTopic.SPOT_MATCH_OUT])), 30)
+                messages.extend(out_mq.poll("test", MMQTopic.SPOT_MATCH_OUT))
+            task.cancel()
+            return messages
+
+        try:
+            messages = asyncio.run(main())
+        finally:
+            engine.stop()
+
+        trades = [trade for message in messages for trade in codec.decode_message(message)[1].get("trades", [])]
+        assert sorted(trade.symbol for trade in trades) == SYMBOLS
+        assert all(trade.quantity == 4 and trade.maker_uid == "maker" for trade in trades)
+        nodes = {(trade.trade_id >> SnowflakeIdGenerator.SEQUENCE_BITS) & SnowflakeIdGenerator.MAX_NODE for trade in trades}
+        assert nodes == {shard_node_id(0), shard_node_id(1)}
+        assert engine.inflight == [0, 0]
+
+    def test_view_follows_shards(self):
+        """ MATCHING_SHARDS>0的单进程部署(src/app.py): 分片发布深度快照，本进程的MatchingView维护只读副本 """
+        router = ShardRouter(2, {SYMBOLS[0]: 0, SYMBOLS[1]: 1})
+        in_mq, out_mq = MMQ(transport=TRANSPORT_BINARY), MMQ(transport=TRANSPORT_BINARY)
+        codec = get_codec(TRANSPORT_BINARY)
+        engine = ShardedMatchingEngine(router, in_mq, out_mq, snapshot_depth=5)
+        gateway = MatchingEngine(in_mq=in_mq, out_mq=out_mq)
+        for symbol in SYMBOLS:
+            in_mq.produce(router.new_topic(symbol), codec.encode_order(limit_order("maker", symbol, OrderSide.SELL, 10, 100)))
+            in_mq.produce(router.new_topic(symbol), codec.encode_order(limit_order("taker", symbol, OrderSide.BUY, 4, 100)))
+
+        def synced():
+            books = [gateway.order_books.get(symbol) for symbol in SYMBOLS]
+            return all(isinstance(book, BookView) and book.get_order_book(5).asks == [(100, 6)] for book in books)
+
+        async def main():
+            tasks = [asyncio.create_task(engine.run_forever()), asyncio.create_task(MatchingView(gateway, out_mq).run_forever())]
+            try:
+                for _ in range(3000):
+                    if synced():
+                        return
+                    await asyncio.sleep(0.01)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        try:
+            asyncio.run(main())
+        finally:
+            engine.stop()
+
+        assert synced()
+        for symbol in SYMBOLS:
+            assert [o.quantity - o.filled_quantity for o in gateway.get_open_orders("maker", symbol)] == [6]
+            assert [t.quantity for t in gateway.get_user_trades("taker", symbol)] == [4]
@@ -0,0 +1,135 @@
+"""Unit tests for src/common/mmq/shm (shared-memory MMQ) and src/engine/matching/view (multi-process deployment)"""
+import asyncio
+import multiprocessing
+import os
+
+import pytest
+
+from src.common.mmq import MMQ, MMQTopic, TRANSPORT_BINARY
+from src.common.mmq.shm import SharedMMQ
+from src.engine.matching.matching import MatchingEngine
+from src.engine.matching.view import BookView, MatchingView
+from src.engine.types.codec import get_codec
+from src.engine.types.types import Order, OrderSide, OrderStatus, OrderTimeInForce, OrderType
+
+SYMBOL = "90000001"
+
+
+@pytest.fixture
+def shm_name(request):
+    return f"test_mmq_{os.getpid()}_{request.node.name[:40]}"
+
+
+def produce_in_child(name, count):
+    mq = SharedMMQ.attach(name)
+    for i in range(count):
+        mq.produce("a", f"message-{i}".encode())
+    mq.close()
+
+
+class TestSharedMMQ:
+
+    def test_produce_and_poll(self, shm_name):
+        mq = SharedMMQ.create(shm_name, ["a", "b"], ["g1", "g2"], capacity=8, data_size=1024)
+        try:
+            reader = SharedMMQ.attach(shm_name)
+            assert reader.subscribe("g1", ["a"]) == {"a": 0}
+            assert mq.produce("a", b"x") == 0
+            assert mq.produce("a", b"yy") == 1
+            assert reader.poll("g1", "a") == [b"x", b"yy"]
+            assert reader.poll("g1", "a") == []
+            assert mq.committed("g1", ["a"]) == {"a": 2}
+            # 已订阅的group重新订阅时保留offset
+            mq.produce("a", b"z")
+            assert reader.subscribe("g1", ["a"]) == {"a": 2}
+            assert mq.consume_batch("a", 0, 2) == (2, [b"x", b"yy"])
+            assert not mq.has_message("b")
+            with pytest.raises(ValueError):
+                mq.produce("c", b"x")
+            with pytest.raises(ValueError):
+                mq.subscribe("g3", ["a"])
+            reader.close()
+        finally:
+            mq.close()
+
+    def test_overwrite_counts_dropped(self, shm_name):
+        # 索引环4条，数据环32字节，每条10字节时数据环先写满
+        mq = SharedMMQ.create(shm_name, ["a"], ["g"], capacity=4, data_size=32)
+        try:
+            mq.subscribe("g", ["a"])
+            for i in range(6):
+                mq.produce("a", bytes([i]) * 10)
+            assert mq.oldest_offset("a") == 3
+            assert mq.is_backpressured("a")
+            assert mq.poll("g", "a") == [bytes([i]) * 10 for i in range(3, 6)]
+            metrics = mq.metrics()["a"]
+            assert metrics["groups"]["g"] == {"offset": 6, "lag": 0, "overrun": 0, "dropped": 3}
+            assert not metrics["backpressure"]
+            with pytest.raises(ValueError):
+                mq.produce("a", bytes(33))
+        finally:
+            mq.close()
+
+    def test_cross_process(self, shm_name):
+        mq = SharedMMQ.create(shm_name, ["a"], ["g"], capacity=128, data_size=4096)
+        try:
+            mq.subscribe("g", ["a"])
+            process = multiprocessing.get_context("spawn").Process(target=produce_in_child, args=(shm_name, 100))
+            process.start()
+
+            async def consume():
+                messages = []
+                while len(messages) < 100:
+                    await asyncio.wait_for(mq.wait(mq.committed("g", ["a"])), 30)
+                    messages.extend(mq.poll("g", "a"))
+                return messages
+
+            messages = asyncio.run(consume())
+            process.join(30)
+            assert process.exitcode == 0
+            assert messages == [f"message-{i}".encode() for i in range(100)]
+        finally:
+            mq.close()
+
+
+class TestMatchingView:
+
+    def test_view_follows_engine(self):
+        out_mq = MMQ(transport=TRANSPORT_BINARY)
+        engine = MatchingEngine(in_mq=MMQ(transport=TRANSPORT_BINARY), out_mq=out_mq, snapshot_depth=5)
+        gateway = MatchingEngine()
+        view = MatchingView(gateway, out_mq)
+        out_mq.subscribe("view", [MMQTopic.SPOT_MATCH_OUT, MMQTopic.SPOT_SNAPSHOT])
+        decode_message = get_codec(TRANSPORT_BINARY).decode_message
+
+        def sync():
+            engine.publish_snapshots()
+            for topic in (MMQTopic.SPOT_MATCH_OUT, MMQTopic.SPOT_SNAPSHOT):
+                for message in out_mq.poll("view", topic):
+                    view.on_message(*decode_message(message))
+
+        maker = Order("maker", SYMBOL, OrderSide.SELL, OrderType.LIMIT, OrderTimeInForce.GTC, 10, 100)
+        engine.on_orders([maker, Order("maker", SYMBOL, OrderSide.SELL, OrderType.LIMIT, OrderTimeInForce.GTC, 5, 101)])
+        engine.on_order(Order("taker", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 4, 99))
+        sync()
+
+        book = gateway.get_order_book(SYMBOL)
+        assert isinstance(book, BookView)
+        assert book.get_order_book(5).asks == [(100, 10), (101, 5)]
+        assert book.get_order_book(1).bids == [(99, 4)]
+        assert [o.quantity for o in gateway.get_open_orders("maker")] == [10, 5]
+
+        taker = Order("taker", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 4, 100)
+        engine.on_order(taker)
+        sync()
+        assert gateway.get_order("maker", SYMBOL, maker.order_id).filled_quantity == 4
+        assert gateway.get_order("maker", SYMBOL, maker.order_id).status == OrderStatus.PARTIALLY_FILLED
+        assert gateway.get_order("taker", SYMBOL, taker.order_id) is None
+        assert [t.quantity for t in gateway.get_user_trades("maker", SYMBOL)] == [4]
+        assert book.get_order_book(5).asks == [(100, 6), (101, 5)]
+
+        engine.on_cancel_orders({'uid': "maker", 'symbol': SYMBOL, 'order_ids': [maker.order_id]})
+        sync()
+        assert [o.price for o in gateway.get_open_orders("maker", SYMBOL)] == [101]
+        assert book.get_order_book(5).asks == [(101, 5)]
+        assert not engine.dirty_symbols
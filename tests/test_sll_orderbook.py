@@ -607,6 +607,120 @@ class TestOrderBook:
         assert len(result) == 2
 
 
+# ============================================================
+# Test PriceLevel running open quantity
+# ============================================================
+
+class TestLevelQuantity:
+    """PriceLevel.quantity is maintained on insert, fill and removal."""
+
+    def test_insert_accumulates(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        ob.add_order(make_sell(price=100.0, qty=1.5, oid="s1"))
+        ob.add_order(make_sell(price=100.0, qty=2.0, oid="s2"))
+        assert ob.order_nodes["s1"].price_level.quantity == 3.5
+        assert ob.get_order_book(5).asks == [(100.0, 3.5)]
+
+    def test_partial_fill_reduces_level(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        ob.add_order(make_buy(price=100.0, qty=2.0, oid="b1"))
+        ob.add_order(make_buy(price=100.0, qty=3.0, oid="b2"))
+        ob.update_order("b1", 0.5)
+        assert ob.get_order_book(5).bids == [(100.0, 4.5)]
+
+        ob.update_order("b1", 2.0)  # fully filled, removed from book
+        assert ob.get_order("user1", "b1") is None
+        assert ob.get_order_book(5).bids == [(100.0, 3.0)]
+
+    def test_remove_partially_filled_order(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        ob.add_order(make_sell(price=100.0, qty=2.0, oid="s1"))
+        ob.add_order(make_sell(price=100.0, qty=3.0, oid="s2"))
+        ob.update_order("s1", 1.5)
+        ob.remove_order("s1")
+        assert ob.get_order_book(5).asks == [(100.0, 3.0)]
+
+    def test_reused_level_starts_empty(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        ob.add_order(make_sell(price=100.0, qty=2.0, oid="s1"))
+        ob.remove_order("s1")
+        ob.add_order(make_sell(price=101.0, qty=1.0, oid="s2"))
+        assert ob.get_order_book(5).asks == [(101.0, 1.0)]
+
+
+# ============================================================
+# Test OrderBook order_id index
+# ============================================================
+
+class TestOrderIndex:
+    """Tests for the order_id -> LevelOrder index used by cancels."""
+
+    def test_add_registers_node(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        ob.add_order(make_sell(price=100.0, oid="s1"))
+        node = ob.order_nodes["s1"]
+        assert node.order.order_id == "s1"
+        assert node.price_level.price == 100.0
+
+    def test_remove_middle_of_crowded_level(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        for i in range(5):
+            ob.add_order(make_sell(price=100.0, oid=f"s{i}"))
+        level = ob.order_nodes["s2"].price_level
+
+        assert ob.remove_order("s2").order_id == "s2"
+        assert "s2" not in ob.order_nodes
+        assert level.order_num == 4
+        ids = []
+        node = level.level_head.next
+        while node:
+            ids.append(node.order.order_id)
+            node = node.next
+        assert ids == ["s0", "s1", "s3", "s4"]
+
+    def test_remove_tail_then_insert_keeps_fifo(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        ob.add_order(make_buy(price=100.0, oid="b1"))
+        ob.add_order(make_buy(price=100.0, oid="b2"))
+        ob.remove_order("b2")
+        ob.add_order(make_buy(price=100.0, oid="b3"))
+        level = ob.order_nodes["b1"].price_level
+        assert level.level_tail.order.order_id == "b3"
+        assert ob.get_order_book(5).bids == [(100.0, 2.0)]
+
+    def test_remove_last_order_frees_level(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        ob.add_order(make_sell(price=100.0, oid="s1"))
+        ob.add_order(make_sell(price=101.0, oid="s2"))
+        ob.add_order(make_sell(price=102.0, oid="s3"))
+
+        ob.remove_order("s2")
+        assert ob.asks.peek_depth(5) == [(100.0, 1.0), (102.0, 1.0)]
+        assert ob.ask_price_level_pool.level_capacity == 2
+
+        ob.remove_order("s1")
+        assert ob.get_best_ask().order_id == "s3"
+        assert ob.ask_price_level_pool.level_capacity == 1
+
+    def test_batch_remove_orders_uses_index(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=100, max_orders=1000)
+        for i in range(10):
+            ob.add_order(make_buy(price=100.0 - i % 3, oid=f"b{i}"))
+        removed = ob.batch_remove_orders("user1", [f"b{i}" for i in range(0, 10, 2)])
+        assert len(removed) == 5
+        assert sorted(ob.order_nodes) == sorted(f"b{i}" for i in range(1, 10, 2))
+        assert ob.bid_order_pool.capacity == 5
+
+    def test_evicted_orders_dropped_from_index(self):
+        ob = OrderBook(symbol="BTCUSDT", max_price_level=2, max_orders=1000)
+        ob.add_order(make_sell(price=100.0, oid="s1"))
+        ob.add_order(make_sell(price=101.0, oid="s2"))
+        ob.add_order(make_sell(price=99.0, oid="s3"))  # evicts the farest level (101)
+        assert "s2" not in ob.order_nodes
+        assert "s2" not in ob.orders
+        assert ob.remove_order("s2") is None
+
+
 # ============================================================
 # Bug Summary
 # ============================================================
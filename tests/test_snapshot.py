@@ -0,0 +1,190 @@
+"""Unit tests for src/engine/recovery/snapshot (order book and account snapshots)"""
+import asyncio
+import os
+import threading
+
+import pytest
+
+from src.common.mmq import FUNDING_MATCH_MQ, MATCH_FUNDING_MQ, MMQ, MMQTopic
+from src.common.mmq.journal import read_records
+from src.engine.funding.funding import FEE_ACCOUNT, Funding
+from src.engine.matching.matching import MatchingEngine
+from src.engine.recovery import snapshot
+from src.engine.recovery.recovery import recover, replay
+from src.engine.recovery.snapshot import Snapshotter, dump, load, load_latest
+from src.engine.types.account_types import UniMarginAccount
+from src.engine.types.codec import get_codec
+from src.engine.types.types import OrderSide, OrderTimeInForce, OrderType
+
+SYMBOL = "90000001"
+GROUP = "snapshot_test"
+
+
+def make_engine():
+    # 撮合结果写入engine自己的out_mq，不影响其他测试
+    return MatchingEngine(out_mq=MMQ(transport=MATCH_FUNDING_MQ.transport))
+
+
+def make_funding():
+    return Funding([UniMarginAccount("snapshot_maker", is_inner_maker=True), UniMarginAccount("snapshot_user")])
+
+
+def run(engine, funding):
+    """ 同步处理MMQ中的撮合输入和撮合结果 """
+    for topic in (MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL):
+        for message in FUNDING_MATCH_MQ.poll(GROUP, topic):
+            engine.on_message(*get_codec(FUNDING_MATCH_MQ.transport).decode_message(message))
+    for message in engine.out_mq.poll(GROUP, MMQTopic.SPOT_MATCH_OUT):
+        data = get_codec(engine.out_mq.transport).decode_message(message)[1]
+        funding.on_match_out(data)
+        engine.klines.on_trades(data.get('trades', []))
+
+
+def buy(funding, quantity, price):
+    result, order = funding.put_spot_order("snapshot_user", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, quantity, price)
+    assert result
+    return order
+
+
+def sell_orders(funding, *prices):
+    orders = [{"symbol": SYMBOL, "side": OrderSide.SELL, "type": OrderType.LIMIT, "time_in_force": OrderTimeInForce.GTC,
+               "quantity": 100, "price": price} for price in prices]
+    assert funding.put_spot_orders("snapshot_maker", orders)[0]
+
+
+def assert_same_state(engine, funding, other_engine, other_funding):
+    depth, other_depth = engine.get_order_book_data(SYMBOL), other_engine.get_order_book_data(SYMBOL)
+    assert (other_depth.bids, other_depth.asks) == (depth.bids, depth.asks)
+    for uid, account in funding.accounts.items():
+        other = other_funding.accounts[uid]
+        # 快照中的挂单按价格-时间顺序加入order book，不比较用户挂单的先后顺序
+        orders = {o.order_id: o.to_dict() for o in engine.get_open_orders(uid)}
+        assert {o.order_id: o.to_dict() for o in other_engine.get_open_orders(uid)} == orders
+        assert other.balances == account.balances
+        assert other.frozen_balances == account.frozen_balances
+    for interval in ('1s', '1m', '1d'):
+        assert other_engine.get_klines(SYMBOL, interval) == engine.get_klines(SYMBOL, interval)
+
+
+@pytest.fixture
+def subscribed():
+    FUNDING_MATCH_MQ.subscribe(GROUP, [MMQTopic.MATCH_IN_SPOT_NEW, MMQTopic.MATCH_IN_SPOT_CANCEL], from_latest=True)
+    yield
+    FUNDING_MATCH_MQ.unsubscribe(GROUP)
+    FUNDING_MATCH_MQ.set_journal(None, [])
+
+
+class TestSnapshot:
+
+    def test_dump_and_load(self, subscribed):
+        engine, funding = make_engine(), make_funding()
+        engine.out_mq.subscribe(GROUP, [MMQTopic.SPOT_MATCH_OUT])
+        sell_orders(funding, 5_100_000, 5_000_000, 5_000_000)
+        run(engine, funding)
+        buy(funding, 150, 5_000_000)
+        resting = [buy(funding, 10, 4_000_000), buy(funding, 20, 4_000_000), buy(funding, 5, 4_100_000)]
+        run(engine, funding)
+        funding.accounts["snapshot_user"].set_leverage(SYMBOL, 3)
+
+        data = dump(42, engine, funding)
+        recovered_engine, recovered_funding, fee_account = MatchingEngine(), make_funding(), UniMarginAccount("fee")
+        assert load(data, recovered_engine, recovered_funding, fee_account) == 42
+
+        assert_same_state(engine, funding, recovered_engine, recovered_funding)
+        # 价格-时间优先: 同价格的挂单保持原来的先后顺序
+        assert recovered_engine.get_order_book_data(SYMBOL).asks == [(5_000_000, 50), (5_100_000, 100)]
+        book = recovered_engine.get_order_book(SYMBOL)
+        assert book.get_best_bid().order_id == resting[2].order_id
+        assert [o.order_id for o in recovered_engine.get_open_orders("snapshot_user")] == [resting[2].order_id, resting[0].order_id, resting[1].order_id]
+        assert all(o.order_id in recovered_funding.exist_order_ids for o in resting)
+        assert recovered_funding.accounts["snapshot_user"].spot_leverage == {SYMBOL: 3}
+        assert fee_account.balances == FEE_ACCOUNT.balances
+
+        with pytest.raises(ValueError):
+            load(data[:-1] + bytes([data[-1] ^ 1]), MatchingEngine(), make_funding())
+
+    def test_orders_wait_for_snapshot(self, subscribed, tmp_path):
+        journal_path, snapshot_dir = str(tmp_path / "spot.journal"), str(tmp_path / "snapshots")
+        engine, funding = make_engine(), make_funding()
+        engine.out_mq.subscribe(GROUP, [MMQTopic.SPOT_MATCH_OUT])
+        journal = recover(journal_path, engine, funding, out_mq=engine.out_mq)
+        snapshotter = Snapshotter(snapshot_dir, engine, funding, journal,
+                                  consumers=[(FUNDING_MATCH_MQ, GROUP), (engine.out_mq, GROUP)])
+        sell_orders(funding, 5_000_000)
+        api = threading.Thread(target=buy, args=(funding, 10, 4_000_000))
+
+        async def main():
+            task = asyncio.create_task(snapshotter.snapshot())
+            await asyncio.sleep(0.01)
+            # 快照等待consumer时API线程的下单在gate前等待，event loop没有被阻塞
+            api.start()
+            await asyncio.sleep(0.05)
+            assert api.is_alive()
+            run(engine, funding)
+            return await task
+
+        assert asyncio.run(main())
+        api.join(5)
+        assert not api.is_alive()
+        run(engine, funding)
+        journal.close()
+
+        recovered_engine, recovered_funding = MatchingEngine(), make_funding()
+        position = load_latest(snapshot_dir, recovered_engine, recovered_funding)
+        assert recovered_engine.get_open_orders("snapshot_user") == []
+        # 等待的订单在快照之后写入journal
+        assert replay(journal_path, recovered_engine, recovered_funding, position) == (os.path.getsize(journal_path), 2)
+        assert_same_state(engine, funding, recovered_engine, recovered_funding)
+
+    def test_recover_replays_tail_after_snapshot(self, subscribed, tmp_path, monkeypatch):
+        journal_path, snapshot_dir = str(tmp_path / "spot.journal"), str(tmp_path / "snapshots")
+        engine, funding = make_engine(), make_funding()
+        engine.out_mq.subscribe(GROUP, [MMQTopic.SPOT_MATCH_OUT])
+        journal = recover(journal_path, engine, funding, out_mq=engine.out_mq, snapshot_dir=snapshot_dir)
+        snapshotter = Snapshotter(snapshot_dir, engine, funding, journal,
+                                  consumers=[(FUNDING_MATCH_MQ, GROUP), (engine.out_mq, GROUP)], keep=2)
+
+        sell_orders(funding, 5_000_000, 5_100_000)
+        buy(funding, 150, 5_100_000)
+        # consumer没有消费完时等待，超时跳过快照
+        monkeypatch.setattr(snapshot, "DRAIN_TIMEOUT", 0.01)
+        assert asyncio.run(snapshotter.snapshot()) is None
+        run(engine, funding)
+        first = asyncio.run(snapshotter.snapshot())
+        # 状态没有变化时不重复快照
+        assert asyncio.run(snapshotter.snapshot()) is None
+
+        cancelled = buy(funding, 20, 3_000_000)
+        run(engine, funding)
+        second = asyncio.run(snapshotter.snapshot())
+        assert funding.cancel_spot_orders("snapshot_user", SYMBOL, [cancelled.order_id])[0]
+        buy(funding, 10, 4_000_000)
+        sell_orders(funding, 5_200_000)
+        run(engine, funding)
+        third = asyncio.run(snapshotter.snapshot())
+        buy(funding, 60, 5_100_000)
+        run(engine, funding)
+        journal.close()
+
+        # 只保留最新的两个快照
+        assert first != second
+        assert sorted(os.listdir(snapshot_dir)) == [os.path.basename(second), os.path.basename(third)]
+
+        recovered_engine, recovered_funding = MatchingEngine(), make_funding()
+        position = load_latest(snapshot_dir, recovered_engine, recovered_funding)
+        assert position == snapshotter.position
+        # 快照之后只有一个新订单和它的撮合结果
+        assert replay(journal_path, recovered_engine, recovered_funding, position) == (os.path.getsize(journal_path), 2)
+        assert_same_state(engine, funding, recovered_engine, recovered_funding)
+        assert len(list(read_records(journal_path))) > 2
+
+        # 最新的快照损坏时使用更早的快照
+        with open(third, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)[0]
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last ^ 1]))
+        recovered_engine, recovered_funding = MatchingEngine(), make_funding()
+        position = load_latest(snapshot_dir, recovered_engine, recovered_funding)
+        assert replay(journal_path, recovered_engine, recovered_funding, position)[1] > 2
+        assert_same_state(engine, funding, recovered_engine, recovered_funding)
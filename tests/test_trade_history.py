@@ -0,0 +1,63 @@
+"""Unit tests for src/engine/matching/trade_history"""
+from src.engine.matching.matching import MatchingEngine
+from src.engine.matching.trade_history import TradeHistory
+from src.engine.types.types import Order, OrderSide, OrderTimeInForce, OrderType, new_trade
+
+SYMBOL = "90000001"
+
+
+def make_trade(taker, maker, price=100, symbol=SYMBOL):
+    return new_trade(taker, maker, symbol, price, 1, 1, 2, True)
+
+
+class TestTradeHistory:
+
+    def test_recent_keeps_latest(self):
+        history = TradeHistory(symbol_capacity=5)
+        trades = [make_trade("a", "b", price=i) for i in range(12)]
+        history.add(SYMBOL, trades[:7])
+        history.add(SYMBOL, trades[7:])
+        assert history.recent(SYMBOL, 3) == trades[-3:]
+        assert history.recent(SYMBOL, 50) == trades[-5:]
+        assert history.recent("unknown") == []
+
+    def test_user_index(self):
+        history = TradeHistory(user_capacity=3)
+        trades = [make_trade("a", "b"), make_trade("c", "a"), make_trade("b", "c"), make_trade("a", "a")]
+        history.add(SYMBOL, trades)
+        history.add("90000002", [make_trade("a", "b", symbol="90000002")])
+        assert history.user_trades("a", SYMBOL) == [trades[0], trades[1], trades[3]]
+        assert history.user_trades("b", SYMBOL) == [trades[0], trades[2]]
+        assert history.user_trades("c", SYMBOL, 1) == [trades[2]]
+        assert history.user_trades("d", SYMBOL) == []
+        history.add(SYMBOL, [make_trade("a", "d")])
+        assert len(history.user_trades("a", SYMBOL)) == 3
+
+
+    def test_user_index_evicts_least_recently_used(self):
+        history = TradeHistory(max_user_rings=3)
+        history.add(SYMBOL, [make_trade("a", "b"), make_trade("c", "c")])
+        # 查询同样算作使用，b成为最久没有使用的
+        history.user_trades("a", SYMBOL)
+        history.add(SYMBOL, [make_trade("d", "c")])
+        assert list(history.users) == [("a", SYMBOL), ("d", SYMBOL), ("c", SYMBOL)]
+        assert history.user_trades("b", SYMBOL) == []
+        assert len(history.user_trades("c", SYMBOL)) == 2
+        # 被淘汰的用户下一笔成交时重新建立索引
+        trade = make_trade("b", "a")
+        history.add(SYMBOL, [trade])
+        assert history.user_trades("b", SYMBOL) == [trade]
+        assert len(history.users) == 3
+
+
+class TestEngineTrades:
+
+    def test_engine_stores_trades(self):
+        engine = MatchingEngine()
+        engine.process_order(Order("maker", SYMBOL, OrderSide.SELL, OrderType.LIMIT, OrderTimeInForce.GTC, 10, 100))
+        trades = engine.process_order(Order("taker", SYMBOL, OrderSide.BUY, OrderType.LIMIT, OrderTimeInForce.GTC, 4, 100))
+        assert engine.get_trades(SYMBOL) == trades
+        assert engine.get_user_trades("maker", SYMBOL) == trades
+        assert engine.get_user_trades("taker", SYMBOL, 1) == trades
+        engine.append_trade("mock", SYMBOL, 100, 1)
+        assert engine.get_trades(SYMBOL, 1)[0].taker_uid == "mock"